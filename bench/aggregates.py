@@ -0,0 +1,126 @@
+"""Benchmark of the aggregate paths: numpy-vectorized against row at a time.
+
+Generates rows shaped like those a table scan yields and runs the same
+aggregate queries over them on both paths, reporting the best of a few
+runs of each. With --table the rows are first loaded into a table (COPY
+into database bench_aggregates) and the queries run end to end, scan
+included:
+
+    python bench/aggregates.py --rows 1000000
+    python bench/aggregates.py --rows 1000000 --table
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from db_core import aggregate_manager
+from db_core.aggregate_manager import AggregateManager, aggregate_rows
+from db_core.parser import Parser
+from db_core.where_clause import Aggregate
+
+DATABASE = "bench_aggregates"
+TABLE = "facts"
+COLUMNS = {"id": "INT", "region": "TEXT", "bucket": "INT", "qty": "INT", "price": "FLOAT", "paid": "BOOL"}
+REGIONS = [f"region{i}" for i in range(100)]
+BUCKETS = 10000
+AGGREGATES = [Aggregate.of("COUNT"), Aggregate.of("SUM", "qty"), Aggregate.of("AVG", "price"),
+              Aggregate.of("MIN", "qty"), Aggregate.of("MAX", "price"), Aggregate.of("SUM", "paid")]
+QUERIES = [
+    ("no GROUP BY", []),
+    ("GROUP BY region (100 groups)", ["region"]),
+    (f"GROUP BY bucket ({BUCKETS} groups)", ["bucket"]),
+]
+
+
+def make_rows(count, seed=0):
+    # Tuples in the order of COLUMNS, as a scan yields them
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        rows.append((
+            i,
+            rng.choice(REGIONS),
+            rng.randrange(BUCKETS),
+            rng.randrange(1000) if rng.random() > 0.05 else None,
+            rng.random() * 100,
+            rng.random() < 0.7,
+        ))
+    return rows
+
+
+def best_of(repeat, run):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def load_table(rows):
+    parser = Parser()
+    parser.route(f"CREATE DATABASE {DATABASE};")
+    parser.route(f"USE {DATABASE};")
+    if parser.route(f"SELECT COUNT(*) FROM {TABLE};").get("data") == [{"COUNT(*)": len(rows)}]:
+        return  # loaded by an earlier run
+    columns = ", ".join(f"{name} {col_type}" + (" PRIMARY KEY" if name == "id" else "")
+                        for name, col_type in COLUMNS.items())
+    result = parser.route(f"CREATE TABLE {TABLE} ({columns});")
+    if "error" in result:
+        raise SystemExit(f"{result['error']} (drop data/{DATABASE} to reload it)")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "facts.csv")
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            for row in rows:
+                writer.writerow(["" if value is None else value for value in row])
+        result = parser.route(f"COPY {TABLE} FROM '{path}' FORMAT CSV;")
+    if "error" in result:
+        raise SystemExit(result["error"])
+    parser.route(f"CHECKPOINT {TABLE};")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MiniDB aggregate benchmark")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--table", action="store_true", help="run the queries on a table, scan included")
+    args = parser.parse_args(argv)
+
+    if aggregate_manager.np is None:
+        raise SystemExit("numpy is not installed; only the row-at-a-time path is available")
+
+    start = time.perf_counter()
+    rows = make_rows(args.rows)
+    print(f"rows:        {args.rows} generated in {time.perf_counter() - start:.2f} s")
+    if args.table:
+        start = time.perf_counter()
+        load_table(rows)
+        del rows
+        print(f"table:       {DATABASE}.{TABLE} ready in {time.perf_counter() - start:.2f} s")
+    names = ", ".join(aggregate.name for aggregate in AGGREGATES)
+    print(f"aggregates:  {names}")
+    print(f"{'query':<34}{'row at a time':>15}{'vectorized':>13}{'speedup':>9}")
+
+    for title, group_by in QUERIES:
+        timings = []
+        for vectorized in (False, True):
+            if args.table:
+                manager = AggregateManager(DATABASE, TABLE, group_by, vectorized=vectorized)
+                columns = group_by + AGGREGATES
+                run = lambda: manager.select(columns, None)
+            else:
+                run = lambda: aggregate_rows(rows, group_by, AGGREGATES, COLUMNS, vectorized)
+            timings.append(best_of(args.repeat, run))
+        slow, fast = timings
+        print(f"{title:<34}{slow * 1000:>12.0f} ms{fast * 1000:>10.0f} ms{slow / fast:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Benchmark of JOIN against joining two SELECTs' rows in the client.
+
+Loads --rows orders and a tenth as many customers into database
+bench_joins (kept between runs), then runs each query both ways: as one
+SELECT ... JOIN, and as the SELECTs of each table a client would have
+sent before, joined with a dict. Reports the best of --repeat runs of
+each, and the join's plan stage. The hash join is run again with a
+memory budget of --spill-kb, small enough that it spills to disk:
+
+    python bench/joins.py --rows 200000
+    python bench/joins.py --rows 200000 --spill-kb 512
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from db_core import join_manager
+from db_core.parser import Parser
+
+DATABASE = "bench_joins"
+CITIES = [f"city{i}" for i in range(50)]
+# (label, JOIN, the two SELECTs a client would send, the columns joined on in their rows)
+QUERIES = [
+    ("hash join, all orders",
+     "SELECT o.id, o.amount, c.name FROM orders o JOIN customers c ON o.customer_id = c.id NOCACHE;",
+     ("SELECT id, amount, customer_id FROM orders NOCACHE;", "SELECT id, name FROM customers NOCACHE;"),
+     ("customer_id", "id")),
+    ("hash join, filtered both sides",
+     "SELECT o.id, c.name FROM orders o JOIN customers c ON o.customer_id = c.id "
+     "WHERE o.amount > 90 AND c.city = 'city7' NOCACHE;",
+     ("SELECT id, customer_id FROM orders WHERE amount > 90 NOCACHE;",
+      "SELECT id, name FROM customers WHERE city = 'city7' NOCACHE;"),
+     ("customer_id", "id")),
+    ("index nested loop, 50 orders",
+     "SELECT o.id, c.name FROM orders o JOIN customers c ON o.customer_id = c.id "
+     "WHERE o.id IN ({ids}) NOCACHE;",
+     ("SELECT id, customer_id FROM orders WHERE id IN ({ids}) NOCACHE;", "SELECT id, name FROM customers NOCACHE;"),
+     ("customer_id", "id")),
+    ("LEFT JOIN, all customers",
+     "SELECT c.id, o.id FROM customers c LEFT JOIN orders o ON c.id = o.customer_id NOCACHE;",
+     ("SELECT id FROM customers NOCACHE;", "SELECT id, customer_id FROM orders NOCACHE;"),
+     ("id", "customer_id")),
+]
+
+
+def load_tables(parser, rows):
+    parser.route(f"CREATE DATABASE {DATABASE};")
+    parser.route(f"USE {DATABASE};")
+    customers = max(rows // 10, 1)
+    if parser.route("SELECT COUNT(*) FROM orders NOCACHE;").get("data") == [{"COUNT(*)": rows}] \
+            and parser.route("SELECT COUNT(*) FROM customers NOCACHE;").get("data") == [{"COUNT(*)": customers}]:
+        return  # loaded by an earlier run
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        for table, columns, count, make in (
+                ("customers", "id INT PRIMARY KEY, name TEXT, city TEXT", customers,
+                 lambda i: [i, f"customer{i}", rng.choice(CITIES)]),
+                ("orders", "id INT PRIMARY KEY, customer_id INT, amount FLOAT", rows,
+                 lambda i: [i, rng.randrange(customers + customers // 10), round(rng.random() * 100, 2)])):
+            parser.route(f"DROP TABLE {table};")
+            result = parser.route(f"CREATE TABLE {table} ({columns});")
+            if "error" in result:
+                raise SystemExit(f"{result['error']} (drop data/{DATABASE} to reload it)")
+            path = os.path.join(tmp, f"{table}.csv")
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                for i in range(count):
+                    writer.writerow(make(i))
+            result = parser.route(f"COPY {table} FROM '{path}' FORMAT CSV;")
+            if "error" in result:
+                raise SystemExit(result["error"])
+            parser.route(f"CHECKPOINT {table};")
+
+
+def client_join(parser, selects, on, left_join):
+    # What a client did without JOIN: both tables' rows, joined in a dict
+    left, right = (parser.route(select)["data"] for select in selects)
+    by_key = {}
+    for row in right:
+        by_key.setdefault(row[on[1]], []).append(row)
+    joined = []
+    for row in left:
+        matches = by_key.get(row[on[0]])
+        if matches:
+            joined.extend({**row, **match} for match in matches)
+        elif left_join:
+            joined.append(row)
+    return joined
+
+
+def best(repeat, run):
+    # (fewest seconds of `repeat` runs, the last result)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MiniDB JOIN benchmark")
+    parser.add_argument("--rows", type=int, default=200000, help="orders; customers are a tenth of that")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--spill-kb", type=int, default=1024)
+    args = parser.parse_args(argv)
+
+    session = Parser()
+    start = time.perf_counter()
+    load_tables(session, args.rows)
+    print(f"tables:      {DATABASE}.orders ({args.rows} rows), customers ({max(args.rows // 10, 1)} rows), "
+          f"ready in {time.perf_counter() - start:.1f} s")
+    ids = ", ".join(str(i) for i in random.Random(1).sample(range(args.rows), min(50, args.rows)))
+    print(f"{'query':<38}{'JOIN ms':>10}{'client ms':>11}{'rows':>9}  plan")
+    budgets = [("", join_manager.JOIN_MEMORY_BYTES), (f", {args.spill_kb} KB budget", args.spill_kb * 1024)]
+    for label, join, selects, on in QUERIES:
+        join, selects = join.format(ids=ids), [select.format(ids=ids) for select in selects]
+        for suffix, budget in budgets if label.startswith("hash join, all") else budgets[:1]:
+            join_manager.JOIN_MEMORY_BYTES = budget
+            seconds, result = best(args.repeat, lambda: session.route(join))
+            if "error" in result:
+                raise SystemExit(result["error"])
+            client_seconds, _ = best(args.repeat, lambda: client_join(session, selects, on, "LEFT" in join))
+            plan = session.route("EXPLAIN ANALYZE " + join)["data"]
+            stages = [stage["stage"] for stage in plan if stage["stage"] in ("hash_join", "index_nested_loop", "spill")]
+            print(f"{label + suffix:<38}{seconds * 1000:>10.1f}{client_seconds * 1000:>11.1f}"
+                  f"{len(result['data']):>9}  {', '.join(stages)}")
+        join_manager.JOIN_MEMORY_BYTES = budgets[0][1]
+    session.close()
+
+
+if __name__ == "__main__":
+    main()
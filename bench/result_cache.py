@@ -0,0 +1,108 @@
+"""Benchmark of the result cache on a dashboard-like workload.
+
+Loads --rows rows into table events of database bench_result_cache (kept
+between runs), then runs the same few dashboard SELECTs round after
+round, with an INSERT every --write-every queries, first with the result
+cache off and then with it on, and reports ms per query and the cache's
+hit, miss and eviction counts:
+
+    python bench/result_cache.py --rows 200000
+    python bench/result_cache.py --rows 200000 --write-every 10 --cache-mb 16
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from db_core.parser import Parser
+from db_core.result_cache import ResultCache
+
+DATABASE = "bench_result_cache"
+TABLE = "events"
+KINDS = ["click", "view", "purchase", "signup", "logout"]
+QUERIES = [
+    f"SELECT kind, COUNT(*), SUM(amount) FROM {TABLE} GROUP BY kind;",
+    f"SELECT COUNT(*), AVG(amount) FROM {TABLE} WHERE kind = 'purchase';",
+    f"SELECT id, user_id, amount FROM {TABLE} WHERE amount > 99.9;",
+    f"SELECT MAX(ts) FROM {TABLE};",
+]
+
+
+def load_table(parser, rows):
+    parser.route(f"CREATE DATABASE {DATABASE};")
+    parser.route(f"USE {DATABASE};")
+    if parser.route(f"SELECT COUNT(*) FROM {TABLE} NOCACHE;").get("data") == [{"COUNT(*)": rows}]:
+        return  # loaded by an earlier run
+    parser.route(f"DROP TABLE {TABLE};")
+    result = parser.route(f"CREATE TABLE {TABLE} (id INT PRIMARY KEY, ts INT, kind TEXT, user_id INT, "
+                          f"amount FLOAT);")
+    if "error" in result:
+        raise SystemExit(f"{result['error']} (drop data/{DATABASE} to reload it)")
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "events.csv")
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            for i in range(rows):
+                writer.writerow([i, 1700000000 + i, rng.choice(KINDS), rng.randrange(100000),
+                                 round(rng.random() * 100, 2)])
+        result = parser.route(f"COPY {TABLE} FROM '{path}' FORMAT CSV;")
+    if "error" in result:
+        raise SystemExit(result["error"])
+    parser.route(f"CHECKPOINT {TABLE};")
+
+
+def run(parser, rounds, write_every, next_id):
+    # Seconds per SELECT over `rounds` rounds of QUERIES
+    count = 0
+    seconds = 0.0
+    for _ in range(rounds):
+        for query in QUERIES:
+            start = time.perf_counter()
+            result = parser.route(query)
+            seconds += time.perf_counter() - start
+            if "error" in result:
+                raise SystemExit(result["error"])
+            count += 1
+            if write_every and count % write_every == 0:
+                parser.route(f"INSERT INTO {TABLE} VALUES ({next_id}, {1800000000 + next_id}, 'view', 1, 1.0);")
+                next_id += 1
+    return seconds / count, next_id
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MiniDB result cache benchmark")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--write-every", type=int, default=0, help="an INSERT after every n SELECTs; 0 for none")
+    parser.add_argument("--cache-mb", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    session = Parser()
+    start = time.perf_counter()
+    load_table(session, args.rows)
+    print(f"table:       {DATABASE}.{TABLE}, {args.rows} rows, ready in {time.perf_counter() - start:.1f} s")
+    # Rows inserted by the run are deleted after it, so every run starts
+    # from the same table
+    first_id = next_id = 10 ** 9
+    cache = ResultCache.instance()
+    print(f"{'cache':<8}{'ms/query':>12}{'hits':>8}{'misses':>8}{'evictions':>11}")
+    for budget in (0, args.cache_mb * 1024 * 1024):
+        cache.configure(budget)
+        before = cache.stats()
+        seconds, next_id = run(session, args.rounds, args.write_every, next_id)
+        counts = {name: value - before[name] for name, value in cache.stats().items()}
+        print(f"{'on' if budget else 'off':<8}{seconds * 1000:>12.2f}{counts['hits']:>8}{counts['misses']:>8}"
+              f"{counts['evictions']:>11}")
+    session.route(f"DELETE FROM {TABLE} WHERE id >= {first_id};")
+    session.route(f"CHECKPOINT {TABLE};")
+    session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Benchmark of the row model: scan time and peak memory of table reads.
+
+Loads --rows rows into table events of database bench_row_model (kept
+between runs), then runs each query in a fresh process, so its peak RSS
+is its own, and reports the best time of a few runs and the process's
+peak RSS over what it held with the table open:
+
+    python bench/row_model.py --rows 1000000
+
+Queries:
+
+    scan       every row read through the scan pipeline, none kept
+    filter     a WHERE matching half the rows, projected to two columns
+    select     SELECT *, every row returned as a dict
+    stream     SELECT * through a DB-API cursor, rows read one at a time
+    aggregate  SUM, MIN and MAX of a FLOAT column over the whole table
+    group_by   the same per kind (5 groups)
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from db_core import dbapi
+from db_core.parallel_scan import ScanPool
+from db_core.parser import Parser
+from db_core.select_manager import SelectManager
+
+DATABASE = "bench_row_model"
+TABLE = "events"
+KINDS = ["click", "view", "purchase", "signup", "logout"]
+QUERIES = {
+    "scan": None,
+    "filter": f"SELECT id, amount FROM {TABLE} WHERE amount >= 50;",
+    "select": f"SELECT * FROM {TABLE};",
+    "stream": f"SELECT * FROM {TABLE};",
+    "aggregate": f"SELECT SUM(amount), MIN(amount), MAX(amount) FROM {TABLE};",
+    "group_by": f"SELECT kind, SUM(amount), MIN(amount), MAX(amount) FROM {TABLE} GROUP BY kind;",
+}
+
+
+def load_table(rows):
+    parser = Parser()
+    parser.route(f"CREATE DATABASE {DATABASE};")
+    parser.route(f"USE {DATABASE};")
+    if parser.route(f"SELECT COUNT(*) FROM {TABLE};").get("data") == [{"COUNT(*)": rows}]:
+        return  # loaded by an earlier run
+    parser.route(f"DROP TABLE {TABLE};")
+    result = parser.route(f"CREATE TABLE {TABLE} (id INT PRIMARY KEY, ts INT, kind TEXT, user_id INT, "
+                          f"amount FLOAT);")
+    if "error" in result:
+        raise SystemExit(f"{result['error']} (drop data/{DATABASE} to reload it)")
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "events.csv")
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            for i in range(rows):
+                writer.writerow([i, 1700000000 + i, rng.choice(KINDS), rng.randrange(100000),
+                                 round(rng.random() * 100, 2)])
+        result = parser.route(f"COPY {TABLE} FROM '{path}' FORMAT CSV;")
+    if "error" in result:
+        raise SystemExit(result["error"])
+    parser.route(f"CHECKPOINT {TABLE};")
+    parser.close()
+
+
+def peak_rss():
+    # Peak resident set size of this process so far, in bytes. VmHWM, not
+    # getrusage(): its ru_maxrss carries the loading parent's peak over exec
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_query(name, repeat):
+    # Runs in its own process: the best time of `repeat` runs and the peak
+    # RSS they took over the process with the table open and scanned once
+    ScanPool.configure(1)
+    parser = Parser()
+    parser.route(f"USE {DATABASE};")
+    select = SelectManager(DATABASE, TABLE)
+    select.scan(None, lambda rows: sum(1 for _ in rows))  # the pages into the buffer pool
+    base = peak_rss()
+
+    if name == "scan":
+        run = lambda: select.scan(None, lambda rows: sum(1 for _ in rows))
+    elif name == "stream":
+        conn = dbapi.connect(DATABASE)
+
+        def run():
+            cursor = conn.cursor()
+            cursor.execute(QUERIES[name])
+            for _ in cursor:
+                pass
+            cursor.close()
+    else:
+        def run():
+            result = parser.route(QUERIES[name])
+            if "error" in result:
+                raise SystemExit(result["error"])
+            return result
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return {"seconds": min(times), "peak_bytes": peak_rss() - base}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MiniDB row model benchmark")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--query", choices=list(QUERIES), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.query:
+        print(json.dumps(run_query(args.query, args.repeat)))
+        return
+
+    start = time.perf_counter()
+    load_table(args.rows)
+    print(f"table:       {DATABASE}.{TABLE}, {args.rows} rows, ready in {time.perf_counter() - start:.1f} s")
+    print(f"{'query':<12}{'time':>12}{'rows/s':>14}{'peak RSS':>14}")
+    for name in QUERIES:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--rows", str(args.rows),
+                              "--repeat", str(args.repeat), "--query", name],
+                             check=True, capture_output=True, text=True).stdout
+        result = json.loads(out.splitlines()[-1])
+        seconds = result["seconds"]
+        print(f"{name:<12}{seconds * 1000:>9.0f} ms{args.rows / seconds:>14.0f}"
+              f"{result['peak_bytes'] / 2 ** 20:>11.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
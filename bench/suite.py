@@ -0,0 +1,369 @@
+"""Benchmark suite: the engine in-process, or a server over TCP.
+
+Runs each workload with a number of concurrent clients and reports, per
+workload, ops/sec and latency percentiles as JSON, so runs on different
+commits can be compared:
+
+    python bench/suite.py --out before.json
+    python bench/suite.py --target server --server asyncio --clients 16
+    python bench/suite.py --baseline before.json
+
+With --target engine every client is a thread with its own Parser; with
+--target server a server is started in a subprocess and every client is a
+thread with its own connection to it. Each workload gets a fresh table in
+database bench_suite, which is dropped before the run, preloaded with
+--rows rows and checkpointed. Workloads:
+
+    single_insert  one row per INSERT
+    bulk_insert    BULK_ROWS rows per INSERT (rows/sec is reported too)
+    point_select   SELECT by primary key
+    full_scan      SELECT with a WHERE no index can answer
+    update_delete  UPDATE and DELETE by primary key, logged to the WAL
+    wal_replay     full SELECTs while those changes are still in the WAL,
+                   merged into every read; then the CHECKPOINT that folds them
+    mixed          point selects with --write-ratio of single inserts
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from db_core.db_manager import DBManager
+from db_core.parser import Parser
+from server.client import Connection
+
+DATABASE = "bench_suite"
+HOST = "127.0.0.1"
+SERVERS = {
+    "threaded": lambda port: [sys.executable, os.path.join(ROOT, "server", "server.py"), str(port)],
+    "asyncio": lambda port: [sys.executable, os.path.join(ROOT, "server", "async_server.py"), "--port", str(port)],
+}
+BULK_ROWS = 1000
+# Full scans are much slower than the other operations; each client runs
+# this fraction of --ops of them
+SCAN_FRACTION = 0.05
+PERCENTILES = (50, 95, 99)
+
+
+def values(start, count):
+    return ", ".join(f"({i}, 'name{i}', {i % 1000}.5, {'TRUE' if i % 2 else 'FALSE'})"
+                     for i in range(start, start + count))
+
+
+class EngineSession:
+    def __init__(self):
+        self.parser = Parser()
+
+    def execute(self, sql):
+        return self.parser.route(sql)
+
+    def close(self):
+        self.parser.close()
+
+
+class EngineTarget:
+    name = "engine"
+
+    def session(self):
+        return EngineSession()
+
+    def close(self):
+        pass
+
+
+class ServerTarget:
+    def __init__(self, kind, binary=False):
+        self.name = f"server:{kind}"
+        self.binary = binary
+        with socket.socket() as s:
+            s.bind((HOST, 0))
+            self.port = s.getsockname()[1]
+        self.process = subprocess.Popen(SERVERS[kind](self.port), cwd=ROOT,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection((HOST, self.port), timeout=1).close()
+                return
+            except OSError:
+                if time.monotonic() > deadline or self.process.poll() is not None:
+                    self.close()
+                    raise SystemExit("server did not start")
+                time.sleep(0.1)
+
+    def session(self):
+        return Connection(HOST, self.port, self.binary)
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+class Workload:
+    """A table to set up, and the statement each client runs for its i-th op."""
+
+    name = None
+    ops_fraction = 1.0
+
+    def __init__(self, args):
+        self.args = args
+        self.table = f"bench_{self.name}"
+
+    def setup(self, session):
+        session.execute(f"CREATE TABLE {self.table} (id INT PRIMARY KEY, name TEXT, score FLOAT, active BOOL);")
+        for start in range(0, self.args.rows, BULK_ROWS):
+            session.execute(f"INSERT INTO {self.table} VALUES {values(start, min(BULK_ROWS, self.args.rows - start))};")
+        session.execute(f"CHECKPOINT {self.table};")
+
+    def ops(self):
+        return max(1, int(self.args.ops * self.ops_fraction))
+
+    def statement(self, client, i, rng):
+        raise NotImplementedError
+
+    def rows_per_op(self):
+        return 1
+
+
+class SingleInsert(Workload):
+    name = "single_insert"
+
+    def statement(self, client, i, rng):
+        row = self.args.rows + client * self.ops() + i
+        return f"INSERT INTO {self.table} VALUES {values(row, 1)};"
+
+
+class BulkInsert(Workload):
+    name = "bulk_insert"
+    ops_fraction = 0.1
+
+    def statement(self, client, i, rng):
+        start = self.args.rows + (client * self.ops() + i) * BULK_ROWS
+        return f"INSERT INTO {self.table} VALUES {values(start, BULK_ROWS)};"
+
+    def rows_per_op(self):
+        return BULK_ROWS
+
+
+class PointSelect(Workload):
+    name = "point_select"
+
+    def statement(self, client, i, rng):
+        return f"SELECT * FROM {self.table} WHERE id = {rng.randrange(self.args.rows)};"
+
+
+class FullScan(Workload):
+    name = "full_scan"
+    ops_fraction = SCAN_FRACTION
+
+    def statement(self, client, i, rng):
+        return f"SELECT id, score FROM {self.table} WHERE name LIKE '%{rng.randrange(1000)}';"
+
+
+class UpdateDelete(Workload):
+    name = "update_delete"
+
+    def statement(self, client, i, rng):
+        # Each client works on its own rows, so every statement finds one
+        row = (client * self.ops() + i) % self.args.rows
+        if i % 2:
+            return f"DELETE FROM {self.table} WHERE id = {row};"
+        return f"UPDATE {self.table} SET score = {i}.25 WHERE id = {row};"
+
+
+class WALReplay(Workload):
+    name = "wal_replay"
+    ops_fraction = SCAN_FRACTION
+
+    def setup(self, session):
+        # The table's WAL is left holding --ops updates and deletes
+        super().setup(session)
+        for i in range(self.args.ops):
+            row = (i * 7) % self.args.rows
+            if i % 2:
+                session.execute(f"DELETE FROM {self.table} WHERE id = {row};")
+            else:
+                session.execute(f"UPDATE {self.table} SET score = {i}.25 WHERE id = {row};")
+
+    def statement(self, client, i, rng):
+        return f"SELECT COUNT(*), SUM(score) FROM {self.table};"
+
+    def finish(self, session):
+        start = time.perf_counter()
+        result = session.execute(f"CHECKPOINT {self.table};")
+        return {"checkpoint_ms": round((time.perf_counter() - start) * 1000, 3),
+                "checkpoint_error": result.get("error") if isinstance(result, dict) else None}
+
+
+class Mixed(Workload):
+    name = "mixed"
+
+    def statement(self, client, i, rng):
+        if rng.random() < self.args.write_ratio:
+            row = self.args.rows + client * self.ops() + i
+            return f"INSERT INTO {self.table} VALUES {values(row, 1)};"
+        return f"SELECT * FROM {self.table} WHERE id = {rng.randrange(self.args.rows)};"
+
+
+WORKLOADS = {workload.name: workload for workload in
+             (SingleInsert, BulkInsert, PointSelect, FullScan, UpdateDelete, WALReplay, Mixed)}
+
+
+def percentile(latencies, p):
+    # Nearest rank, on sorted latencies
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+
+def run_workload(target, workload, clients, seed):
+    setup_session = target.session()
+    setup_session.execute(f"USE {DATABASE};")
+    workload.setup(setup_session)
+
+    sessions = []
+    for _ in range(clients):
+        session = target.session()
+        session.execute(f"USE {DATABASE};")
+        sessions.append(session)
+    latencies = [[] for _ in range(clients)]
+    errors = [[] for _ in range(clients)]
+    ops = workload.ops()
+    start_line = threading.Barrier(clients + 1)
+
+    def client(number):
+        session = sessions[number]
+        rng = random.Random(seed * 1000 + number)
+        timings = latencies[number]
+        start_line.wait()
+        for i in range(ops):
+            sql = workload.statement(number, i, rng)
+            start = time.perf_counter()
+            result = session.execute(sql)
+            timings.append(time.perf_counter() - start)
+            if not isinstance(result, dict) or "error" in result:
+                errors[number].append(result.get("error") if isinstance(result, dict) else result)
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    start_line.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    extra = workload.finish(setup_session) if hasattr(workload, "finish") else {}
+    for session in sessions + [setup_session]:
+        session.close()
+
+    all_latencies = sorted(t for timings in latencies for t in timings)
+    all_errors = [e for client_errors in errors for e in client_errors]
+    result = {
+        "clients": clients,
+        "ops": len(all_latencies),
+        "seconds": round(elapsed, 4),
+        "ops_per_sec": round(len(all_latencies) / elapsed, 2),
+        "latency_ms": {f"p{p}": round(percentile(all_latencies, p) * 1000, 3) for p in PERCENTILES},
+        "errors": len(all_errors),
+    }
+    result["latency_ms"]["max"] = round(all_latencies[-1] * 1000, 3)
+    if workload.rows_per_op() != 1:
+        result["rows_per_sec"] = round(len(all_latencies) * workload.rows_per_op() / elapsed, 2)
+    if all_errors:
+        result["first_error"] = str(all_errors[0])
+    result.update(extra)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results, baseline_path):
+    # Adds the baseline's ops/sec and the speedup over it to each workload
+    with open(baseline_path) as f:
+        baseline = json.load(f).get("results", {})
+    for name, result in results.items():
+        before = baseline.get(name, {}).get("ops_per_sec")
+        if before:
+            result["baseline_ops_per_sec"] = before
+            result["speedup"] = round(result["ops_per_sec"] / before, 3)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MiniDB benchmark suite")
+    parser.add_argument("--target", choices=["engine", "server"], default="engine")
+    parser.add_argument("--server", choices=sorted(SERVERS), default="asyncio", help="with --target server")
+    parser.add_argument("--binary", action="store_true", help="use the framed binary protocol")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent clients")
+    parser.add_argument("--ops", type=int, default=500, help="operations per client")
+    parser.add_argument("--rows", type=int, default=10000, help="rows preloaded into each table")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="share of inserts in the mixed workload")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS),
+                        help=f"comma-separated, from: {', '.join(WORKLOADS)}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    parser.add_argument("--baseline", help="a report from an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.workloads.split(",") if name.strip()]
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(unknown)}")
+
+    # Dropped before a server is started, so it doesn't load the old tables
+    DBManager(DATABASE).delete_db()
+    started = time.strftime("%Y-%m-%dT%H:%M:%S")
+    target = ServerTarget(args.server, args.binary) if args.target == "server" else EngineTarget()
+    results = {}
+    try:
+        session = target.session()
+        session.execute(f"CREATE DATABASE {DATABASE};")
+        session.close()
+        for name in names:
+            results[name] = run_workload(target, WORKLOADS[name](args), args.clients, args.seed)
+            print(f"{name:<15}{results[name]['ops_per_sec']:>12.1f} ops/s   "
+                  f"p50 {results[name]['latency_ms']['p50']:.2f} ms   "
+                  f"p99 {results[name]['latency_ms']['p99']:.2f} ms", file=sys.stderr)
+    finally:
+        target.close()
+    if args.baseline:
+        compare(results, args.baseline)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "target": target.name,
+            "binary": args.binary,
+            "clients": args.clients,
+            "ops_per_client": args.ops,
+            "rows": args.rows,
+            "write_ratio": args.write_ratio,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "started": started,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Benchmark of table compression and zone-map block skipping.
+
+Loads the same append-only event rows (increasing id and ts) into one
+table per compression (none, zlib, lzma) in database bench_zone_maps,
+reports the disk footprint of each, then runs range queries on ts with
+and without skipping blocks by their zone maps, reporting the best of a
+few runs of each as ms per query and table rows covered per second:
+
+    python bench/zone_maps.py --rows 1000000
+    python bench/zone_maps.py --rows 1000000 --pool-mb 8
+
+A small --pool-mb keeps the tables out of the buffer pool, so every scan
+reads (and decompresses) its pages again.
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from db_core.buffer_pool import BufferPool
+from db_core.db_manager import DBManager
+from db_core.parser import Parser
+from db_core.select_manager import SelectManager
+from db_core.storage_manager import TableStorage
+
+DATABASE = "bench_zone_maps"
+COMPRESSIONS = ["none", "zlib", "lzma"]
+KINDS = ["click", "view", "purchase", "signup", "logout"]
+# Fractions of the ts range the queries select
+SELECTIVITIES = [0.001, 0.01, 0.1]
+
+
+def write_rows(path, count, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        ts = 1700000000
+        for i in range(count):
+            ts += rng.randrange(3)
+            writer.writerow([i, ts, rng.choice(KINDS), rng.randrange(100000), round(rng.random() * 100, 2)])
+    return ts
+
+
+def best_of(repeat, run):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def load_table(parser, table, compression, path):
+    result = parser.route(f"CREATE TABLE {table} (id INT PRIMARY KEY, ts INT, kind TEXT, user_id INT, "
+                          f"amount FLOAT) COMPRESSION {compression};")
+    if "error" in result:
+        raise SystemExit(result["error"])
+    result = parser.route(f"COPY {table} FROM '{path}' FORMAT CSV;")
+    if "error" in result:
+        raise SystemExit(result["error"])
+    parser.route(f"CHECKPOINT {table};")
+
+
+def data_bytes(table):
+    # The table's pages and strings, compressed or not
+    base = TableStorage.for_table(DATABASE, table).base_path
+    return sum(path.stat().st_size for path in base.iterdir() if path.name.startswith("data."))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MiniDB compression and zone map benchmark")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--pool-mb", type=int, default=None, help="buffer pool size for the queries")
+    args = parser.parse_args(argv)
+
+    DBManager(DATABASE).delete_db()
+    session = Parser()
+    session.route(f"CREATE DATABASE {DATABASE};")
+    session.route(f"USE {DATABASE};")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "events.csv")
+        last_ts = write_rows(path, args.rows)
+        print(f"rows:        {args.rows}")
+        print(f"{'table':<16}{'load':>10}{'data bytes':>14}{'ratio':>8}")
+        plain = None
+        for compression in COMPRESSIONS:
+            table = f"events_{compression}"
+            start = time.perf_counter()
+            load_table(session, table, compression, path)
+            elapsed = time.perf_counter() - start
+            size = data_bytes(table)
+            plain = plain or size
+            print(f"{table:<16}{elapsed:>8.1f} s{size:>14}{plain / size:>7.1f}x")
+
+    if args.pool_mb is not None:
+        BufferPool.instance().configure(args.pool_mb * 1024 * 1024)
+    first_ts = 1700000000
+    span = last_ts - first_ts
+    print(f"{'query':<28}{'table':<16}{'full scan':>12}{'zone maps':>12}{'rows/s full':>14}"
+          f"{'rows/s zones':>14}{'speedup':>9}")
+    for selectivity in SELECTIVITIES:
+        low = first_ts + span // 2
+        where = f"ts BETWEEN {low} AND {low + int(span * selectivity)}"
+        for compression in COMPRESSIONS:
+            table = f"events_{compression}"
+            timings = [best_of(args.repeat, lambda: SelectManager(DATABASE, table, zone_maps=zone_maps)
+                               .select(["*"], where)) for zone_maps in (False, True)]
+            slow, fast = timings
+            print(f"{f'ts range {selectivity:.1%}':<28}{table:<16}{slow * 1000:>9.1f} ms{fast * 1000:>9.1f} ms"
+                  f"{args.rows / slow:>14.0f}{args.rows / fast:>14.0f}{slow / fast:>8.1f}x")
+    session.close()
+
+
+if __name__ == "__main__":
+    main()
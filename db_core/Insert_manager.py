@@ -1,69 +1,155 @@
-import json
-from pathlib import Path
+from db_core.catalog import Catalog
+from db_core.checkpoint_manager import Checkpointer
 from db_core.primary_key_manager import PrimaryKeyManager
+from db_core.schema_manager import Schema_Manager
+from db_core.wal_manager import WALManager
+
+PYTHON_TYPES = {"INT": int, "FLOAT": (float, int), "TEXT": str, "BOOL": bool}
+
 
 class InsertManager:
     def __init__(self, db_name, table_name):
         self.db_name = db_name
         self.table_name = table_name
-        self.base_path = Path("data") / db_name / table_name
-        self.schema_path = self.base_path / "schema.json"
-        self.data_path = self.base_path / "data.json"
-        self.wal_path = self.base_path / "log.wal"
-        self.pk_manager = PrimaryKeyManager(db_name, table_name)
+        self.pk_manager = PrimaryKeyManager.for_table(db_name, table_name)
+        self.wal = WALManager(db_name, table_name)
+        self.schema = None
 
     def insert_values(self, values: list):
-        if not self.base_path.exists() or not self.base_path.is_dir():
+        return self.insert_rows([values])
+
+    def insert_rows(self, rows: list, first_row=None):
+        # All rows are validated before any is logged, and they go to the WAL
+        # as one record, so a multi-row INSERT is applied whole or not at all.
+        catalog = Catalog.instance()
+        if not catalog.table_exists(self.db_name, self.table_name):
             return {"error": f"No Table '{self.table_name}' is present in '{self.db_name}'"}
 
+        if self.schema is None:
+            try:
+                self.schema = catalog.schema(self.db_name, self.table_name)
+            except Exception as e:
+                return {"error": f"Error reading schema: {e}"}
+
+        columns = [col["name"] for col in self.schema.get("columns", [])]
         try:
-            with open(self.schema_path, "r") as f:
-                schema = json.load(f)
-        except Exception as e:
-            return {"error": f"Error reading schema: {e}"}
-
-        columns = schema.get("columns", [])
-        primary_key = schema.get("primary_key")
-
-        if len(columns) != len(values):
-            return {"error": f"Column count mismatch. Expected {len(columns)} values, got {len(values)}."}
-
-        row_data = {}
-        for col, val in zip(columns, values):
-            col_name = col["name"]
-            col_type = col.get("type", "TEXT")
-
-            # Type validation and data assignment
-            if col_type == "INT" and not isinstance(val, int):
-                return {"error": f"Column '{col_name}' expects INT but got {type(val).__name__}."}
-            elif col_type == "FLOAT" and not isinstance(val, (float, int)):
-                return {"error": f"Column '{col_name}' expects FLOAT but got {type(val).__name__}."}
-            elif col_type == "TEXT" and not isinstance(val, str):
-                return {"error": f"Column '{col_name}' expects TEXT but got {type(val).__name__}."}
-            elif col_type == "BOOL" and not isinstance(val, bool):
-                return {"error": f"Column '{col_name}' expects BOOL but got {type(val).__name__}."}
-            
-            row_data[col_name] = val
-
-        # Primary key validation using PrimaryKeyManager
-        if primary_key:
-            pk_value = row_data.get(primary_key)
-            if pk_value is None:
-                return {"error": f"Primary key '{primary_key}' cannot be null."}
-            
-            if not self.pk_manager.check_pk_uniqueness(pk_value):
-                return {"error": f"Primary key violation: '{pk_value}' already exists."}
-
-        # Write-Ahead Logging (WAL)
+            validated = self.validate_rows(rows, first_row)
+        except ValueError as e:
+            return {"error": str(e)}
+        if not validated:
+            return {"success": f"No rows inserted into table '{self.table_name}'."}
+
+        primary_key = self.schema.get("primary_key")
+        pk_index = columns.index(primary_key) if primary_key in columns else None
+        keys = [row[pk_index] for row in validated] if pk_index is not None else []
+        if len(set(keys)) != len(keys):
+            seen = set()
+            for key in keys:
+                if key in seen:
+                    return {"error": f"Primary key violation: '{key}' appears more than once."}
+                seen.add(key)
+
+        # Primary key validation using PrimaryKeyManager. The check, the WAL
+        # append and the cache update happen under the table lock so two
+        # sessions can't both insert the same key.
+        while True:
+            self.pk_manager.ensure_loaded()
+            with self.pk_manager.lock:
+                if not self.pk_manager.is_loaded():
+                    continue  # a concurrent UPDATE/DELETE invalidated the index; load it again
+
+                if keys:
+                    taken = self.pk_manager.existing_keys(keys)
+                    if taken:
+                        return {"error": f"Primary key violation: '{taken[0]}' already exists."}
+
+                # Write-Ahead Logging (WAL): one record for the whole batch,
+                # its rows as value lists in column order
+                try:
+                    log_entry = {"operation": "insert", "columns": columns, "rows": validated}
+                    lsn = self.wal.append(log_entry)
+                except Exception as e:
+                    return {"error": f"Failed to write to WAL: {e}"}
+
+                # Update PK cache after successful insertion
+                if keys:
+                    self.pk_manager.add_pks_to_cache(keys)
+            break
+
+        # Waiting for the fsync outside the table lock lets concurrent
+        # sessions share it
         try:
-            log_entry = {"operation": "insert", "data": row_data}
-            with open(self.wal_path, "a") as f:
-                f.write(json.dumps(log_entry) + "\n")
-        except Exception as e:
+            self.wal.commit(lsn)
+        except OSError as e:
             return {"error": f"Failed to write to WAL: {e}"}
+        Checkpointer.instance().notify_write(self.db_name, self.table_name)
+        if len(validated) == 1:
+            return {"success": f"Insert operation logged for table '{self.table_name}'."}
+        return {"success": f"{len(validated)} rows inserted into table '{self.table_name}'.",
+                "rows": len(validated)}
+
+    def validate_rows(self, rows, first_row=None):
+        return validate_rows(self.schema, rows, first_row)
+
+
+def validate_rows(schema, rows, first_row=None):
+    # Checks and converts the rows column by column: each column's values
+    # are run through that column's type check in one pass. Returns lists
+    # of typed values in schema order. Raises ValueError, naming the row
+    # (counted from first_row) unless a single row was given.
+    if first_row is None and len(rows) > 1:
+        first_row = 1
+
+    def error(number, message):
+        return ValueError(message if first_row is None else f"Row {first_row + number}: {message}")
+
+    columns = schema.get("columns", [])
+    for number, values in enumerate(rows):
+        if len(values) != len(columns):
+            raise error(number, f"Column count mismatch. Expected {len(columns)} values, got {len(values)}.")
+
+    validated = [list(values) for values in rows]
+    for i, col in enumerate(columns):
+        col_name = col["name"]
+        col_type = col.get("type", "TEXT")
+        expected = PYTHON_TYPES.get(col_type, str)
+        not_null = "NOT" in col.get("constraints", [])
+        # Values are logged as they will be stored: INTs that fit in int64,
+        # FLOATs as floats even when written as integers
+        is_int = col_type == "INT"
+        is_float = col_type == "FLOAT"
+        for number, row in enumerate(validated):
+            val = row[i]
+            if not isinstance(val, expected):
+                if val is None:
+                    if not_null:
+                        raise error(number, f"Column '{col_name}' cannot be null.")
+                    continue
+
+                # A quoted literal can be any type, as long as it converts: '42' for an INT
+                if isinstance(val, str) and col_type != "TEXT":
+                    try:
+                        val = Schema_Manager.coerce(col_type, val)
+                    except ValueError:
+                        pass
+
+                if not isinstance(val, expected):
+                    raise error(number, f"Column '{col_name}' expects {col_type} but got {type(val).__name__}.")
+                row[i] = val
 
-        # Update PK cache after successful insertion
-        if primary_key:
-            self.pk_manager.add_pk_to_cache(row_data[primary_key])
+            if is_int:
+                if not Schema_Manager.INT_MIN <= val <= Schema_Manager.INT_MAX:
+                    raise error(number, f"Column '{col_name}' value {val} is out of range for INT.")
+            elif is_float and type(val) is not float:
+                try:
+                    row[i] = float(val)
+                except OverflowError:
+                    raise error(number, f"Column '{col_name}' value {val} is out of range for FLOAT.") from None
 
-        return {"success": f"Insert operation logged for table '{self.table_name}'."}
+    primary_key = schema.get("primary_key")
+    if primary_key:
+        i = [col["name"] for col in columns].index(primary_key)
+        for number, row in enumerate(validated):
+            if row[i] is None:
+                raise error(number, f"Primary key '{primary_key}' cannot be null.")
+    return validated
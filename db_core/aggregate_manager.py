@@ -0,0 +1,539 @@
+from itertools import chain, islice
+from operator import itemgetter
+
+try:
+    import numpy as np
+except ImportError:  # optional: without it every query aggregates row at a time
+    np = None
+
+from db_core import stats
+from db_core.parallel_scan import ScanTask
+from db_core.rows import ARRAY_CODES, ColumnBatch, projector
+from db_core.select_manager import SelectManager, limit_text
+from db_core.where_clause import Aggregate, WhereClause, WhereError, aggregates_of
+
+# Rows turned into column arrays at a time on the vectorized and batched paths
+BATCH_ROWS = 65536
+# Column types the vectorized path aggregates, and their array types
+VECTOR_TYPES = {"INT": "int64", "FLOAT": "float64", "BOOL": "bool"}
+
+
+class AggregateError(ValueError):
+    pass
+
+
+def result_type(aggregate, column_types):
+    if aggregate.func == "COUNT":
+        return "INT"
+    if aggregate.func == "AVG":
+        return "FLOAT"
+    col_type = column_types[aggregate.column]
+    if aggregate.func == "SUM" and col_type == "BOOL":
+        return "INT"  # the number of TRUE values
+    return col_type
+
+
+def key_getter(positions):
+    # Returns a function giving a row's group key: the value at the one
+    # position, or the values at several as a tuple
+    if not positions:
+        return lambda row: ()
+    return itemgetter(*positions)
+
+
+def group_columns(group_by, aggregates):
+    # The names of the values of a group row, in order
+    return list(group_by) + [aggregate.name for aggregate in aggregates]
+
+
+def aggregate_rows(rows, group_by, aggregates, column_types, vectorized=None):
+    """Reduces `rows`, tuples laid out as `column_types`, to one tuple per
+    group, in order of each group's first row: the GROUP BY columns, then
+    each aggregate (see group_columns()). Without GROUP BY there is exactly
+    one, even for no rows.
+
+    The vectorized path (numpy, and only INT/FLOAT/BOOL columns to sum or
+    compare) is used unless vectorized=False; with True it must apply.
+    Without it, a query with no GROUP BY over INT and FLOAT columns is
+    reduced a ColumnBatch at a time, and any other row at a time.
+    """
+    if vectorized is None:
+        vectorized = can_vectorize(aggregates, column_types)
+    elif vectorized and not can_vectorize(aggregates, column_types):
+        raise AggregateError("These aggregates can't be vectorized" if np else "numpy is not installed")
+    positions = {name: i for i, name in enumerate(column_types)}
+    keys = [positions[column] for column in group_by]
+    if vectorized:
+        groups = _vectorized(rows, keys, aggregates, column_types, positions)
+    elif not group_by and can_batch(aggregates, column_types):
+        groups = _batched(rows, aggregates, column_types, positions)
+    else:
+        groups = _row_at_a_time(rows, keys, aggregates, positions)
+    if len(group_by) == 1:
+        return [(key, *values) for key, values in groups]
+    return [(*key, *values) for key, values in groups]
+
+
+def can_vectorize(aggregates, column_types):
+    return np is not None and all(aggregate.func == "COUNT" or column_types[aggregate.column] in VECTOR_TYPES
+                                  for aggregate in aggregates)
+
+
+def can_batch(aggregates, column_types):
+    return all(aggregate.func == "COUNT" or column_types[aggregate.column] in ARRAY_CODES
+               for aggregate in aggregates)
+
+
+# -- row at a time: one accumulator per aggregate and group, fed each row
+
+class CountRows:
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+
+    def add_batch(self, batch, position):
+        self.count += batch.size
+
+    def result(self):
+        return self.count
+
+
+class Count(CountRows):
+    __slots__ = ()
+
+    def add(self, value):
+        if value is not None:
+            self.count += 1
+
+    def add_batch(self, batch, position):
+        nulls = batch.nulls(position)
+        self.count += batch.size - (nulls.count(1) if nulls else 0)
+
+
+class Sum:
+    __slots__ = ("total", "count")
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def add(self, value):
+        if value is not None:
+            self.total += value
+            self.count += 1
+
+    def add_batch(self, batch, position):
+        values = batch.present(position)
+        self.total = sum(values, self.total)
+        self.count += len(values)
+
+    def result(self):
+        return self.total if self.count else None
+
+
+class Avg(Sum):
+    __slots__ = ()
+
+    def result(self):
+        return self.total / self.count if self.count else None
+
+
+class Min:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = None
+
+    def add(self, value):
+        if value is not None and (self.value is None or value < self.value):
+            self.value = value
+
+    def add_batch(self, batch, position):
+        values = batch.present(position)
+        if len(values):
+            self.value = min(values if self.value is None else chain((self.value,), values))
+
+    def result(self):
+        return self.value
+
+
+class Max(Min):
+    __slots__ = ()
+
+    def add(self, value):
+        if value is not None and (self.value is None or value > self.value):
+            self.value = value
+
+    def add_batch(self, batch, position):
+        values = batch.present(position)
+        if len(values):
+            self.value = max(values if self.value is None else chain((self.value,), values))
+
+
+ACCUMULATORS = {"SUM": Sum, "AVG": Avg, "MIN": Min, "MAX": Max}
+
+
+def _makers(aggregates):
+    return [CountRows if a.column is None else ACCUMULATORS.get(a.func, Count) for a in aggregates]
+
+
+def _row_at_a_time(rows, keys, aggregates, positions):
+    key_of = key_getter(keys)
+    makers = _makers(aggregates)
+    # COUNT(*) ignores the value it is given, so it can be any column's
+    columns = [0 if a.column is None else positions[a.column] for a in aggregates]
+    groups = {}
+    for row in rows:
+        key = key_of(row)
+        state = groups.get(key)
+        if state is None:
+            state = groups[key] = [make() for make in makers]
+        for accumulator, column in zip(state, columns):
+            accumulator.add(row[column])
+    if not keys and not groups:
+        groups[()] = [make() for make in makers]
+    return [(key, [accumulator.result() for accumulator in state]) for key, state in groups.items()]
+
+
+# -- batched: without GROUP BY, each batch of rows becomes a ColumnBatch
+# and every accumulator takes in a whole column of it at once
+
+def _batched(rows, aggregates, column_types, positions):
+    state = [make() for make in _makers(aggregates)]
+    columns = [None if a.column is None else positions[a.column] for a in aggregates]
+    wanted = [(positions[a.column], column_types[a.column]) for a in aggregates if a.column is not None]
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, BATCH_ROWS))
+        if not batch:
+            break
+        batch = ColumnBatch(batch, [position for position, _ in wanted], [col_type for _, col_type in wanted])
+        for accumulator, column in zip(state, columns):
+            accumulator.add_batch(batch, column)
+    return [((), [accumulator.result() for accumulator in state])]
+
+
+# -- vectorized: each batch of rows becomes one array per column, reduced
+# into per-group arrays indexed by group number
+
+class VectorAggregate:
+    def __init__(self, aggregate, col_type):
+        self.func = aggregate.func
+        self.column = aggregate.column
+        self.counts = np.zeros(0, "int64")  # non-NULL values per group
+        self.values = None  # running SUM, MIN or MAX per group
+        if self.func != "COUNT":
+            dtype = np.dtype(VECTOR_TYPES[col_type])
+            if self.func in ("SUM", "AVG"):
+                dtype = np.dtype("float64" if col_type == "FLOAT" else "int64")
+            self.values = np.zeros(0, dtype)
+            if self.func in ("MIN", "MAX"):
+                self.start = _extreme(dtype, self.func == "MIN")
+
+    def grow(self, size):
+        added = size - len(self.counts)
+        if added:
+            self.counts = np.concatenate([self.counts, np.zeros(added, "int64")])
+            if self.values is not None:
+                start = 0 if self.func in ("SUM", "AVG") else self.start
+                self.values = np.concatenate([self.values, np.full(added, start, self.values.dtype)])
+
+    def add(self, ids, values, valid):
+        # ids: the group number of each row of the batch; values and valid:
+        # the column as an array, and which of its rows aren't NULL (None
+        # if all are)
+        if valid is not None:
+            ids = ids[valid]
+            if values is not None:
+                values = values[valid]
+        size = len(self.counts)
+        if size == 1:
+            # A single group (no GROUP BY, say): plain reductions
+            self.counts[0] += len(ids)
+            if self.values is not None and len(values):
+                if self.func in ("SUM", "AVG"):
+                    self.values[0] += values.sum(dtype=self.values.dtype)
+                elif self.func == "MIN":
+                    self.values[0] = min(self.values[0], values.min())
+                else:
+                    self.values[0] = max(self.values[0], values.max())
+            return
+        self.counts += np.bincount(ids, minlength=size)
+        if self.values is None:
+            return
+        if self.func in ("SUM", "AVG"):
+            if self.values.dtype.kind == "f":
+                self.values += np.bincount(ids, weights=values, minlength=size)
+            else:
+                np.add.at(self.values, ids, values.astype(self.values.dtype, copy=False))
+        elif self.func == "MIN":
+            np.minimum.at(self.values, ids, values)
+        else:
+            np.maximum.at(self.values, ids, values)
+
+    def results(self):
+        counts = self.counts.tolist()
+        if self.func == "COUNT":
+            return counts
+        values = self.values.tolist()
+        if self.func == "AVG":
+            return [total / count if count else None for total, count in zip(values, counts)]
+        return [value if count else None for value, count in zip(values, counts)]
+
+
+def _extreme(dtype, largest):
+    # The starting value of a running MIN (the largest) or MAX (the smallest)
+    if dtype.kind == "b":
+        return largest
+    if dtype.kind == "f":
+        return np.inf if largest else -np.inf
+    info = np.iinfo(dtype)
+    return info.max if largest else info.min
+
+
+def _vectorized(rows, keys, aggregates, column_types, positions):
+    key_of = key_getter(keys)
+    states = [VectorAggregate(a, column_types.get(a.column)) for a in aggregates]
+    # Columns summed or compared need their values; those only counted,
+    # just where they are NULL
+    columns = {}
+    for a in aggregates:
+        if a.column is not None:
+            columns[a.column] = columns.get(a.column, False) or a.func != "COUNT"
+
+    index = {}  # group key -> group number
+    if not keys:
+        index[()] = 0
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, BATCH_ROWS))
+        if not batch:
+            break
+        if keys:
+            # setdefault() numbers each key the first time it is seen
+            ids = np.fromiter((index.setdefault(key, len(index)) for key in map(key_of, batch)),
+                              np.intp, len(batch))
+        else:
+            ids = np.zeros(len(batch), np.intp)
+
+        arrays = {}
+        column_batch = ColumnBatch(batch, [positions[column] for column in columns],
+                                    [column_types[column] for column in columns])
+        for column, need_values in columns.items():
+            position = positions[column]
+            nulls = column_batch.nulls(position)
+            valid = None if nulls is None else np.frombuffer(nulls, bool) == 0
+            values = None
+            if need_values:
+                # INT and FLOAT arrays are taken over as they are, NULLs as 0
+                values = np.asarray(column_batch.values(position), VECTOR_TYPES[column_types[column]])
+            arrays[column] = (values, valid)
+
+        for state in states:
+            state.grow(len(index))
+            values, valid = arrays.get(state.column, (None, None))
+            state.add(ids, values, valid)
+
+    for state in states:
+        state.grow(len(index))
+    results = [state.results() for state in states]
+    return [(key, [column[number] for column in results]) for key, number in index.items()]
+
+
+def partial_aggregates(aggregates):
+    # What each part of a table (a partition, a segment) is reduced to for
+    # combine_groups() to merge: AVG as SUM and COUNT, the others as they are
+    partials = []
+    for aggregate in aggregates:
+        if aggregate.func == "AVG":
+            partials += [Aggregate.of("SUM", aggregate.column), Aggregate.of("COUNT", aggregate.column)]
+        else:
+            partials.append(aggregate)
+    return list(dict.fromkeys(partials))
+
+
+def combine_groups(parts, group_by, aggregates):
+    """Merges the groups of the parts of a table, each a list of
+    aggregate_rows() of partial_aggregates(aggregates), into one tuple per
+    group as aggregate_rows() would give for the whole table."""
+    partials = partial_aggregates(aggregates)
+    width = len(group_by)
+    key_of = key_getter(range(width))
+    funcs = [aggregate.func for aggregate in partials]
+    groups = {}
+    for part in parts:
+        for row in part:
+            key = key_of(row)
+            merged = groups.get(key)
+            if merged is None:
+                groups[key] = list(row)
+                continue
+            for i, func in enumerate(funcs, width):
+                merged[i] = _combine(func, merged[i], row[i])
+    if not group_by and not groups:
+        groups[()] = [0 if func == "COUNT" else None for func in funcs]
+    # Each aggregate from its partials; AVG from its SUM and COUNT
+    places = {aggregate.name: i for i, aggregate in enumerate(partials, width)}
+    rows = []
+    for merged in groups.values():
+        values = []
+        for aggregate in aggregates:
+            if aggregate.func == "AVG":
+                count = merged[places[f"COUNT({aggregate.column})"]]
+                values.append(merged[places[f"SUM({aggregate.column})"]] / count if count else None)
+            else:
+                values.append(merged[places[aggregate.name]])
+        rows.append((*merged[:width], *values))
+    return rows
+
+
+def _combine(func, a, b):
+    # Two partial aggregates of a group, as one
+    if func == "COUNT":
+        return a + b
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if func == "SUM":
+        return a + b
+    return min(a, b) if func == "MIN" else max(a, b)
+
+
+def plan_aggregates(columns, group_by, having_clause, having_tree, column_types):
+    """Checks a grouped query against the table's `column_types`; returns
+    the aggregates to compute, those of the select list and then HAVING's,
+    and the compiled HAVING clause. Raises AggregateError."""
+    if "*" in columns:
+        raise AggregateError("SELECT * cannot be used with GROUP BY or aggregates")
+    for column in group_by:
+        if column not in column_types:
+            raise AggregateError(f"Column '{column}' does not exist")
+
+    aggregates = [column for column in columns if isinstance(column, Aggregate)]
+    if having_tree is not None:
+        aggregates += aggregates_of(having_tree)
+    aggregates = list(dict.fromkeys(aggregates))
+    for aggregate in aggregates:
+        if aggregate.column is not None and aggregate.column not in column_types:
+            raise AggregateError(f"Column '{aggregate.column}' does not exist")
+        if aggregate.func in ("SUM", "AVG") and column_types[aggregate.column] == "TEXT":
+            raise AggregateError(f"Cannot take {aggregate.func} of TEXT column '{aggregate.column}'")
+    for column in columns:
+        if not isinstance(column, Aggregate) and column not in group_by:
+            raise AggregateError(f"Column '{column}' must appear in GROUP BY or be used in an aggregate")
+
+    having = None
+    if having_clause:
+        # Laid out as the group rows of aggregate_rows()
+        group_types = {column: column_types[column] for column in group_by}
+        group_types.update((a.name, result_type(a, column_types)) for a in aggregates)
+        try:
+            having = WhereClause.compile(having_clause, group_types, having_tree)
+        except WhereError as e:
+            raise AggregateError(f"Invalid HAVING clause: {e}") from None
+    return aggregates, having
+
+
+class AggregateManager:
+    """Runs a SELECT with aggregates, GROUP BY or HAVING: the rows the WHERE
+    clause matches are scanned once and reduced to one row per group."""
+
+    def __init__(self, db_name, table_name, group_by=None, having_clause=None, having_tree=None,
+                 vectorized=None, parallel=None):
+        self.db_name = db_name
+        self.table_name = table_name
+        self.selects = SelectManager(db_name, table_name, parallel)
+        self.group_by = list(group_by or [])
+        self.having_clause = having_clause
+        self.having_tree = having_tree
+        self.vectorized = vectorized
+
+    def select(self, columns, where_clause, where_tree=None, limit=None, offset=None):
+        # Raises WhereError for a bad WHERE clause, AggregateError for a
+        # select list, GROUP BY or HAVING that doesn't fit the table
+        aggregates, having = self._plan(columns)
+        where = self.selects.compile_where(where_clause, where_tree) if where_clause else None
+        column_types = self._column_types()
+
+        def query(rows):
+            with stats.stage("aggregate", self._describe_plan(aggregates, column_types), consumes=True) as stage:
+                groups = aggregate_rows(rows, self.group_by, aggregates, column_types, self.vectorized)
+                if stage is not None:
+                    stage.rows = len(groups)
+            return groups
+
+        scanned = [0]
+        groups = self._groups_parallel(where, aggregates, column_types, scanned)
+        if groups is None:
+            groups = self.selects.scan(where, query, scanned)
+        if having is not None:
+            groups = stats.pipe("having", having.filter(groups), self.having_clause)
+        names = [column.name if isinstance(column, Aggregate) else column for column in columns]
+        rows = map(projector(group_columns(self.group_by, aggregates), names), groups)
+        if limit is not None or offset:
+            start = offset or 0
+            rows = stats.pipe("limit", islice(rows, start, None if limit is None else start + limit),
+                              limit_text(limit, offset))
+        rows = list(rows)
+        stats.Stats.instance().add(self.db_name, self.table_name, rows_scanned=scanned[0], rows_returned=len(rows))
+        return rows
+
+    def _groups_parallel(self, where, aggregates, column_types, scanned):
+        # The groups, from partial ones computed by the scan pool's processes
+        # for their segments; None if the scan is better run here
+        partials = partial_aggregates(aggregates)
+        task = ScanTask(group_by=self.group_by, aggregates=partials)
+        found = self.selects.scan_parallel(where, task, scanned)
+        if found is None:
+            return None
+        parts, logged = found
+        parts.append(aggregate_rows(logged, self.group_by, partials, column_types, self.vectorized))
+        with stats.stage("merge", f"groups of {len(parts) - 1} processes and the WAL") as stage:
+            groups = combine_groups(parts, self.group_by, aggregates)
+            if stage is not None:
+                stage.rows = len(groups)
+        return groups
+
+    def explain(self, columns, where_clause, where_tree=None, limit=None, offset=None):
+        aggregates, having = self._plan(columns)
+        where = self.selects.compile_where(where_clause, where_tree) if where_clause else None
+        plan = self.selects.plan_scan(where, grouped=True)
+        plan.append(stats.plan_row("aggregate", self._describe_plan(aggregates, self._column_types())))
+        if having is not None:
+            plan.append(stats.plan_row("having", self.having_clause))
+        if limit is not None or offset:
+            plan.append(stats.plan_row("limit", limit_text(limit, offset)))
+        return plan
+
+    def _describe_plan(self, aggregates, column_types):
+        vectorized = self.vectorized
+        if vectorized is None:
+            vectorized = can_vectorize(aggregates, column_types)
+        parts = [", ".join(aggregate.name for aggregate in aggregates) or "no aggregates"]
+        if self.group_by:
+            parts.append("GROUP BY " + ", ".join(self.group_by))
+        parts.append("vectorized" if vectorized else "row at a time")
+        return "; ".join(parts)
+
+    def stream(self, columns, where_clause, where_tree=None, limit=None, offset=None):
+        # The groups can't be known before the whole scan, so this runs the
+        # query first, then streams its result
+        rows = self.select(columns, where_clause, where_tree, limit, offset)
+        return (row for row in rows)
+
+    def describe(self, columns):
+        column_types = self._column_types()
+        return [(column.name, result_type(column, column_types)) if isinstance(column, Aggregate)
+                else (column, column_types[column]) for column in columns]
+
+    def _column_types(self):
+        codec = self.selects.storage.open().codec
+        return dict(zip(codec.columns, codec.types))
+
+    def _plan(self, columns):
+        return plan_aggregates(columns, self.group_by, self.having_clause, self.having_tree, self._column_types())
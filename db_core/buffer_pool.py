@@ -0,0 +1,299 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+PAGE_SIZE = 8192
+# Memory budget shared by every table in the process
+BUFFER_POOL_BYTES = int(os.environ.get("TINYDBX_BUFFER_POOL_MB", "64")) * 1024 * 1024
+# Where a held directory's evicted dirty pages wait for their flush
+SPILL_FILE = "pages.spill"
+
+
+class Frame:
+    __slots__ = ("data", "dirty", "pins")
+
+    def __init__(self, data):
+        self.data = data
+        self.dirty = False
+        self.pins = 0
+
+
+class BufferPool:
+    """Process-wide cache of fixed-size file pages with LRU eviction.
+
+    Callers pin a page while they read or modify it and unpin it afterwards,
+    marking it dirty if they changed it. Dirty pages are written back when
+    they are evicted or when their file is flushed, except that those of
+    files in a held directory (see hold()) are only written by a flush:
+    evicted, they are spilled to a side file in the directory and read back
+    from there, so holding any number of them stays within the budget.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self, max_bytes=BUFFER_POOL_BYTES, page_size=PAGE_SIZE):
+        self.page_size = page_size
+        self.max_pages = max(8, max_bytes // page_size)
+        self.frames = OrderedDict()  # (path, page_no) -> Frame, least recently used first
+        self.files = {}  # path -> file descriptor
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.pages_written = 0
+        self.writes = 0  # pages written back and files discarded, ever
+        self.file_io = {}  # path -> [bytes read, bytes written]
+        self.held = {}  # directory prefix -> holds; see hold()
+        self.spills = {}  # held directory prefix -> [spill file path, slots used]
+        self.spilled = {}  # (path, page_no) -> (spill file path, slot) of an evicted held page
+        self.pages_spilled = 0
+
+    def configure(self, max_bytes):
+        with self.lock:
+            self.max_pages = max(8, max_bytes // self.page_size)
+            self._make_room(0)
+
+    def _fd(self, path):
+        fd = self.files.get(path)
+        if fd is None:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            self.files[path] = fd
+        return fd
+
+    def _write_frame(self, key, frame):
+        path, page_no = key
+        os.pwrite(self._fd(path), frame.data, page_no * self.page_size)
+        frame.dirty = False
+        self.spilled.pop(key, None)
+        self.pages_written += 1
+        self.writes += 1
+        self._count_io(path, 1, self.page_size)
+
+    def _spill(self, key, frame, prefix):
+        # Writes an evicted page of a held directory to the directory's
+        # spill file, in the slot it had if it was spilled before
+        spilled = self.spilled.get(key)
+        if spilled is None:
+            spill = self.spills.get(prefix)
+            if spill is None:
+                spill = self.spills[prefix] = [os.path.join(prefix, SPILL_FILE), 0]
+            spilled = self.spilled[key] = (spill[0], spill[1])
+            spill[1] += 1
+        os.pwrite(self._fd(spilled[0]), frame.data, spilled[1] * self.page_size)
+        self.pages_spilled += 1
+        self.writes += 1
+
+    def _make_room(self, needed=1):
+        # Evict least recently used unpinned frames; if everything is pinned
+        # the pool temporarily grows past its budget rather than deadlocking.
+        # Only pinned frames are passed over, which are few.
+        while len(self.frames) + needed > self.max_pages:
+            for key, frame in self.frames.items():
+                if frame.pins == 0:
+                    break
+            else:
+                return
+            if frame.dirty:
+                prefix = self._held(key[0])
+                if prefix is None:
+                    self._write_frame(key, frame)
+                else:
+                    self._spill(key, frame, prefix)
+            del self.frames[key]
+            self.evictions += 1
+
+    def _held(self, path):
+        # The held directory prefix `path` is under, if any
+        for prefix in self.held:
+            if path.startswith(prefix):
+                return prefix
+        return None
+
+    @contextmanager
+    def hold(self, directory):
+        # Keeps the dirty pages of the files in `directory` from being
+        # written back by eviction until the block ends, so none reach disk
+        # before the caller flushes them (or discards them, after a failure).
+        # Pages still spilled when it ends are written back then, as their
+        # eviction would have, and the spill file is removed.
+        prefix = os.path.join(str(directory), "")
+        with self.lock:
+            self.held[prefix] = self.held.get(prefix, 0) + 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.held[prefix] -= 1
+                if not self.held[prefix]:
+                    del self.held[prefix]
+                    self._end_spill(prefix)
+
+    def _end_spill(self, prefix):
+        spill = self.spills.pop(prefix, None)
+        if spill is None:
+            return
+        # A page read back since is dirty in the pool, and written from there
+        for key in [key for key, (path, _) in self.spilled.items() if path == spill[0]]:
+            if key in self.frames:
+                del self.spilled[key]
+            else:
+                self._write_back_spilled(key)
+        fd = self.files.pop(spill[0], None)
+        if fd is not None:
+            os.close(fd)
+        self.writes += 1
+        try:
+            os.unlink(spill[0])
+        except FileNotFoundError:
+            pass
+
+    def _write_back_spilled(self, key):
+        # Copies a spilled page to its own file
+        spill_path, slot = self.spilled.pop(key)
+        data = os.pread(self._fd(spill_path), self.page_size, slot * self.page_size)
+        path, page_no = key
+        os.pwrite(self._fd(path), data, page_no * self.page_size)
+        self.pages_written += 1
+        self.writes += 1
+        self._count_io(path, 1, self.page_size)
+
+    def pin(self, path, page_no, loader=None):
+        # A missed page is read without holding the lock, so threads reading
+        # other pages don't wait on the I/O. If a page was written back or
+        # its file discarded meanwhile, what was read may be stale: read again.
+        # `loader(page_no)`, if given, returns the page instead of a read of
+        # the file, and counts its own I/O (see count_read()).
+        key = (str(path), page_no)
+        while True:
+            with self.lock:
+                frame = self.frames.get(key)
+                if frame is not None:
+                    self.hits += 1
+                    self.frames.move_to_end(key)
+                    frame.pins += 1
+                    return frame.data
+                writes = self.writes
+                # A spilled page is read back from the spill file, and stays
+                # dirty: its own file doesn't have it yet
+                spilled = self.spilled.get(key)
+                if spilled is not None:
+                    fd, offset = self._fd(spilled[0]), spilled[1] * self.page_size
+                else:
+                    fd, offset = (self._fd(key[0]) if loader is None else None), page_no * self.page_size
+            try:
+                if loader is None or spilled is not None:
+                    data = os.pread(fd, self.page_size, offset)
+                else:
+                    data = loader(page_no)
+            except OSError:
+                if writes == self.writes:
+                    raise
+                continue  # the file was closed under us
+            with self.lock:
+                frame = self.frames.get(key)
+                if frame is None:
+                    if writes != self.writes:
+                        continue
+                    self.misses += 1
+                    if loader is None and spilled is None:
+                        self._count_io(key[0], 0, len(data))
+                    self._make_room()
+                    frame = Frame(bytearray(data.ljust(self.page_size, b"\0")))
+                    frame.dirty = spilled is not None
+                    self.frames[key] = frame
+                else:
+                    self.hits += 1  # another thread loaded it first
+                    self.frames.move_to_end(key)
+                frame.pins += 1
+                return frame.data
+
+    def _count_io(self, path, which, size):
+        io = self.file_io.get(path)
+        if io is None:
+            io = self.file_io[path] = [0, 0]
+        io[which] += size
+
+    def count_read(self, path, size):
+        with self.lock:
+            self._count_io(str(path), 0, size)
+
+    def io_under(self, directory):
+        # (bytes read, bytes written) for the files in `directory`
+        prefix = os.path.join(str(directory), "")
+        with self.lock:
+            read = written = 0
+            for path, (r, w) in self.file_io.items():
+                if path.startswith(prefix):
+                    read += r
+                    written += w
+            return read, written
+
+    def unpin(self, path, page_no, dirty=False):
+        with self.lock:
+            frame = self.frames[(str(path), page_no)]
+            frame.pins -= 1
+            if dirty:
+                frame.dirty = True
+
+    @contextmanager
+    def page(self, path, page_no, dirty=False, loader=None):
+        data = self.pin(path, page_no, loader)
+        try:
+            yield data
+        finally:
+            self.unpin(path, page_no, dirty)
+
+    def flush_file(self, path, sync=True):
+        path = str(path)
+        with self.lock:
+            for key, frame in self.frames.items():
+                if key[0] == path and frame.dirty:
+                    self._write_frame(key, frame)
+            for key in [key for key in self.spilled if key[0] == path]:
+                self._write_back_spilled(key)
+            if sync and path in self.files:
+                os.fsync(self.files[path])
+
+    def discard_file(self, path):
+        # Forget a file's pages without writing them, e.g. after it was replaced
+        path = str(path)
+        with self.lock:
+            for key in [k for k in self.frames if k[0] == path]:
+                del self.frames[key]
+            for key in [k for k in self.spilled if k[0] == path]:
+                del self.spilled[key]
+            fd = self.files.pop(path, None)
+            if fd is not None:
+                os.close(fd)
+            self.writes += 1
+
+    def close(self):
+        # Forgets every page, written back or not, and closes the files
+        with self.lock:
+            self.frames.clear()
+            for fd in self.files.values():
+                os.close(fd)
+            self.files.clear()
+            self.writes += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "capacity_pages": self.max_pages,
+                "cached_pages": len(self.frames),
+                "dirty_pages": sum(1 for f in self.frames.values() if f.dirty),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "pages_written": self.pages_written,
+                "pages_spilled": self.pages_spilled,
+            }
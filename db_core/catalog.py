@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+from db_core.result_cache import ResultCache
+
+# Where the databases are kept: data/ next to db_core, or TINYDBX_DATA_DIR
+DATA_DIR = Path(os.environ.get("TINYDBX_DATA_DIR") or Path(__file__).resolve().parent.parent / "data").resolve()
+
+
+class TableInfo:
+    """A table's schema.json, with the lookups statements need from it."""
+
+    def __init__(self, schema):
+        self.schema = schema  # shared: copy before changing it
+        columns = schema.get("columns", [])
+        self.columns = [col["name"] for col in columns]
+        self.column_types = {col["name"]: col.get("type", "TEXT") for col in columns}
+        self.primary_key = schema.get("primary_key")
+        self.indexes = schema.get("indexes", [])
+        # {"column": ..., "count": n} for a table hash-partitioned on a column
+        self.partition = schema.get("partition")
+
+
+def partition_name(table_name, number):
+    # A partition is stored like a table of its own, in a subdirectory of
+    # its table's, and is named by that path
+    return f"{table_name}/p{number}"
+
+
+class Catalog:
+    """Process-wide cache of the databases, tables and schemas under data/.
+
+    Everything is read from disk once, when the catalog is first used, and
+    from then on changed only by our own DDL, which calls add_*/drop_* and
+    set_schema() after writing to disk. Statements get their metadata from
+    here without any file access. Changes replace the dicts rather than
+    modify them, so readers need no lock. reload() picks up changes made to
+    data/ by anything else; it is called by a lookup of a database or table
+    the catalog doesn't have but data/ does.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = Path(data_dir)
+        self.lock = threading.Lock()
+        self.databases = {}  # db -> {table -> TableInfo, or None if its schema didn't load}
+        self.reload()
+
+    def reload(self):
+        databases = {}
+        if self.data_dir.is_dir():
+            for db_path in sorted(self.data_dir.iterdir()):
+                if db_path.is_dir():
+                    tables = databases[db_path.name] = {}
+                    for path in sorted(db_path.iterdir()):
+                        if path.is_dir():
+                            info = tables[path.name] = self._read(path)
+                            if info is not None and info.partition:
+                                for number in range(info.partition["count"]):
+                                    name = partition_name(path.name, number)
+                                    if (db_path / name).is_dir():
+                                        tables[name] = self._read(db_path / name)
+        with self.lock:
+            previous, self.databases = self.databases, databases
+        # Whatever changed data/ may have changed the tables' rows too
+        for known in (previous, databases):
+            for db_name, tables in known.items():
+                for table_name in tables:
+                    ResultCache.instance().invalidate(db_name, table_name)
+
+    def _read(self, table_path):
+        try:
+            with open(table_path / "schema.json", "r") as f:
+                return TableInfo(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def database_exists(self, db_name):
+        if db_name in self.databases:
+            return True
+        return self._found_on_disk(db_name) and db_name in self.databases
+
+    def table_exists(self, db_name, table_name):
+        if table_name in self.databases.get(db_name, ()):
+            return True
+        return self._found_on_disk(db_name, table_name) and table_name in self.databases.get(db_name, ())
+
+    def _found_on_disk(self, *names):
+        # Whether a database or table missing from the catalog is in data/,
+        # created by another process since the catalog was read; if so the
+        # catalog is read again
+        if not self.data_dir.joinpath(*names).is_dir():
+            return False
+        self.reload()
+        return True
+
+    def tables(self, db_name):
+        # The database's tables, not counting the partitions of partitioned ones
+        return sorted(name for name in self.databases.get(db_name, ()) if "/" not in name)
+
+    def table(self, db_name, table_name):
+        # Raises FileNotFoundError for a table that doesn't exist, and the
+        # error reading schema.json for one whose schema can't be read
+        tables = self.databases.get(db_name, {})
+        info = tables.get(table_name)
+        if info is not None:
+            return info
+        if table_name not in tables:
+            raise FileNotFoundError(f"Table '{table_name}' does not exist in database '{db_name}'")
+        # Retried on every use, so a repaired schema.json is picked up
+        with open(self.data_dir / db_name / table_name / "schema.json", "r") as f:
+            info = TableInfo(json.load(f))
+        self.set_schema(db_name, table_name, info.schema)
+        return info
+
+    def schema(self, db_name, table_name):
+        return self.table(db_name, table_name).schema
+
+    # -- DDL
+
+    def add_database(self, db_name):
+        with self.lock:
+            if db_name not in self.databases:
+                self.databases = {**self.databases, db_name: {}}
+
+    def drop_database(self, db_name):
+        with self.lock:
+            dropped = self.databases.get(db_name, {})
+            self.databases = {db: tables for db, tables in self.databases.items() if db != db_name}
+        for table_name in dropped:
+            ResultCache.instance().invalidate(db_name, table_name)
+
+    def add_table(self, db_name, table_name, schema):
+        self.set_schema(db_name, table_name, schema)
+
+    def drop_table(self, db_name, table_name):
+        with self.lock:
+            tables = {name: info for name, info in self.databases.get(db_name, {}).items() if name != table_name}
+            self.databases = {**self.databases, db_name: tables}
+        ResultCache.instance().invalidate(db_name, table_name)
+
+    def set_schema(self, db_name, table_name, schema):
+        with self.lock:
+            tables = {**self.databases.get(db_name, {}), table_name: TableInfo(schema)}
+            self.databases = {**self.databases, db_name: tables}
+        ResultCache.instance().invalidate(db_name, table_name)
@@ -0,0 +1,216 @@
+import threading
+import time
+
+from db_core.buffer_pool import BufferPool
+from db_core.catalog import Catalog, DATA_DIR
+from db_core.index_manager import IndexManager
+from db_core.primary_key_manager import PrimaryKeyManager
+from db_core.result_cache import ResultCache
+from db_core.stats import Stats
+from db_core.storage_manager import TableStorage
+from db_core.wal_manager import WALManager
+
+# A table is checkpointed once its WAL reaches this many bytes...
+WAL_SIZE_THRESHOLD = 4 * 1024 * 1024
+# ...or once its oldest un-checkpointed write is this many seconds old
+WAL_AGE_THRESHOLD = 30.0
+CHECK_INTERVAL = 1.0
+# How long a checkpoint waits for the table's readers (SELECTs, open streams
+# and cursors) to finish before putting itself off until the next one
+READ_WAIT = 0.5
+
+class CheckpointManager:
+    def __init__(self, db_name, table_name):
+        self.db_name = db_name
+        self.table_name = table_name
+        self.base_path = DATA_DIR / db_name / table_name
+        self.storage = TableStorage.for_table(db_name, table_name)
+        self.wal_path = self.base_path / "log.wal"
+        self.wal = WALManager(db_name, table_name)
+        self.pk_manager = PrimaryKeyManager.for_table(db_name, table_name)
+        self.indexes = IndexManager.for_table(db_name, table_name)
+        self.checkpoint_lock = WALManager.checkpoint_lock(db_name, table_name)
+        self.rw_lock = WALManager.rw_lock(db_name, table_name)
+
+    def checkpoint(self):
+        if not Catalog.instance().table_exists(self.db_name, self.table_name):
+            return {"error": f"Table '{self.table_name}' does not exist in database '{self.db_name}'."}
+
+        with self.checkpoint_lock:
+            if not self.rw_lock.acquire_write(READ_WAIT):
+                return {"success": f"Checkpoint of table '{self.table_name}' deferred: it is being read.",
+                        "deferred": True}
+            try:
+                result = self._checkpoint()
+            finally:
+                self.rw_lock.release_write()
+        if "error" in result:
+            Stats.instance().checkpoint_failed(self.db_name, self.table_name, result["error"])
+        return result
+
+    def _checkpoint(self):
+        # Apply the WAL prefix to the table's pages without holding the table
+        # lock, so inserts keep appending to the WAL in the meantime. Readers
+        # are kept out by the write lock taken in checkpoint().
+        #
+        # The pages are flushed with the LSN of the end of the prefix in
+        # their header, and only then is the WAL swapped. Readers, and the
+        # next checkpoint, skip the records up to that LSN, so if the swap
+        # fails (or the process dies before it) nothing is applied twice.
+        # No changed page is written back before the flush, so a fold that
+        # fails halfway leaves the table file as it was.
+        folded = self.storage.wal_lsn()
+        entries, offset = self.wal.read_prefix(folded)
+        if not entries:
+            if folded > self.wal.first_lsn():
+                # An earlier fold was flushed but its WAL swap failed: this
+                # finishes that checkpoint
+                start = time.perf_counter()
+                try:
+                    with self.wal.lock:
+                        self.wal.rotate(offset)
+                        self.pk_manager.rebase()
+                except OSError as e:
+                    return {"error": f"Checkpoint failed for table '{self.table_name}': {e}"}
+                Stats.instance().checkpointed(self.db_name, self.table_name, time.perf_counter() - start)
+            return {"success": f"Nothing to checkpoint for table '{self.table_name}'."}
+
+        start = time.perf_counter()
+        compiled = self.wal.compile_entries(entries)
+        mods = [op for op in compiled if op[0] != "insert"]
+        wal_tmp = self.wal_path.with_suffix(".wal.tmp")
+
+        with BufferPool.instance().hold(self.base_path):
+            try:
+                # Logged updates/deletes are applied to the rows they can reach
+                # (via the indexes, or one pass over the pages); an insert-only
+                # WAL doesn't touch existing pages at all.
+                if mods:
+                    for rowid, row in self._affected_rows(mods):
+                        new_row = WALManager.apply_ops(row, mods)
+                        if new_row is None:
+                            self.storage.delete_row(rowid)
+                            self.indexes.on_delete(rowid, row)
+                        elif new_row is not row:
+                            self.storage.update_row(rowid, new_row, row)
+                            self.indexes.on_update(rowid, row, new_row)
+
+                applied = 0
+                for op in compiled:
+                    if op[0] == "insert":
+                        row = WALManager.apply_ops(op[1], mods, applied)
+                        if row is not None:
+                            rowid = self.storage.insert_row(row)
+                            self.indexes.on_insert(rowid, row)
+                    else:
+                        applied += 1
+                # Once enough of the string heap is values no row has any
+                # more, the rest are copied to a new generation of it
+                if mods:
+                    self.storage.compact_strings()
+                self.storage.flush(wal_lsn=self.wal.lsn(offset))
+                self.indexes.flush()
+            except Exception as e:
+                # Drop the half-applied pages still in the buffer pool, before
+                # the hold ends and they could be evicted to disk; the header's
+                # LSN was not moved, so the next checkpoint applies the same
+                # records again.
+                self.storage.discard_unflushed()
+                self.indexes.discard_unflushed()
+                return {"error": f"Checkpoint failed for table '{self.table_name}': {e}"}
+
+        try:
+            # Only the WAL swap is done under the lock: whatever was appended
+            # after `offset` is carried over into the new WAL.
+            with self.wal.lock:
+                self.wal.rotate(offset)
+                self.pk_manager.rebase()
+        except OSError as e:
+            # The pages hold the records already, and say so: they are
+            # skipped until the next checkpoint swaps the WAL
+            try:
+                wal_tmp.unlink()
+            except FileNotFoundError:
+                pass
+            return {"error": f"Checkpoint failed for table '{self.table_name}': {e}"}
+        finally:
+            ResultCache.instance().invalidate(self.db_name, self.table_name)
+
+        Stats.instance().checkpointed(self.db_name, self.table_name, time.perf_counter() - start)
+        return {"success": f"Checkpointed {len(entries)} WAL entries into table '{self.table_name}'."}
+
+    def _affected_rows(self, mods):
+        # When the indexes can answer every logged WHERE only the rows they
+        # return are visited. A row can only match a later statement if it
+        # matched on disk or an earlier statement changed it, and in that
+        # case the earlier statement's lookup has already found it.
+        rowids = set()
+        for op in mods:
+            found = self.indexes.candidates(op[1].tree)
+            if found is None:
+                return self.storage.scan_with_rowids()
+            rowids.update(found)
+        return ((rowid, self.storage.fetch(rowid)) for rowid in sorted(rowids))
+
+
+class Checkpointer:
+    """Background thread that folds a table's WAL once it is big or old enough."""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self, wal_size_threshold=WAL_SIZE_THRESHOLD, wal_age_threshold=WAL_AGE_THRESHOLD,
+                 interval=CHECK_INTERVAL):
+        self.wal_size_threshold = wal_size_threshold
+        self.wal_age_threshold = wal_age_threshold
+        self.interval = interval
+        self.pending = {}  # (db, table) -> time of first write since last checkpoint
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def notify_write(self, db_name, table_name):
+        with self.lock:
+            self.pending.setdefault((db_name, table_name), time.monotonic())
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="tinydbx-checkpointer", daemon=True)
+                self.thread.start()
+
+    def checkpoint(self, db_name, table_name):
+        with self.lock:
+            self.pending.pop((db_name, table_name), None)
+        result = CheckpointManager(db_name, table_name).checkpoint()
+        # Writes that raced with the fold stay in the WAL and start a new age window
+        if WALManager(db_name, table_name).size() > 0:
+            with self.lock:
+                self.pending.setdefault((db_name, table_name), time.monotonic())
+        return result
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _due(self):
+        now = time.monotonic()
+        due = []
+        with self.lock:
+            for (db_name, table_name), since in self.pending.items():
+                if now - since >= self.wal_age_threshold:
+                    due.append((db_name, table_name))
+                elif WALManager(db_name, table_name).size() >= self.wal_size_threshold:
+                    due.append((db_name, table_name))
+        return due
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            # A failure is kept in the table's SHOW STATS row (see
+            # CheckpointManager.checkpoint()), and the WAL is folded again
+            # once it is due
+            for db_name, table_name in self._due():
+                self.checkpoint(db_name, table_name)
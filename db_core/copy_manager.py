@@ -0,0 +1,105 @@
+import csv
+import json
+from pathlib import Path
+
+from db_core.Insert_manager import InsertManager
+from db_core.catalog import Catalog
+
+# Rows validated and logged per WAL record
+BATCH_SIZE = 5000
+
+
+class CopyManager:
+    def __init__(self, db_name, table_name, inserter=None):
+        # `inserter` takes the batches: an InsertManager unless one is given
+        self.db_name = db_name
+        self.table_name = table_name
+        self.inserter = inserter or InsertManager(db_name, table_name)
+
+    def copy_from(self, path, file_format=None, header=False):
+        # Streams the file in batches; each batch is validated and logged as
+        # one WAL record. Batches before a bad row stay loaded.
+        path = Path(path)
+        if file_format is None:
+            file_format = "JSONL" if path.suffix.lower() in (".jsonl", ".json", ".ndjson") else "CSV"
+
+        loaded = 0
+        try:
+            with open(path, "r", newline="", encoding="utf-8") as f:
+                rows = self._csv_rows(f, header) if file_format == "CSV" else self._jsonl_rows(f)
+                batch = []
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) == BATCH_SIZE:
+                        result = self.inserter.insert_rows(batch, first_row=loaded + 1)
+                        if "error" in result:
+                            return self._failed(result["error"], loaded)
+                        loaded += len(batch)
+                        batch = []
+                if batch:
+                    result = self.inserter.insert_rows(batch, first_row=loaded + 1)
+                    if "error" in result:
+                        return self._failed(result["error"], loaded)
+                    loaded += len(batch)
+        except OSError as e:
+            return self._failed(f"Cannot read '{path}': {e}", loaded)
+        except (ValueError, csv.Error) as e:
+            return self._failed(f"Invalid {file_format} input: {e}", loaded)
+
+        return {"success": f"Copied {loaded} rows into table '{self.table_name}'.", "rows": loaded}
+
+    def _failed(self, message, loaded):
+        if loaded:
+            return {"error": f"{message} ({loaded} rows were loaded before the error)", "rows": loaded}
+        return {"error": message}
+
+    def _columns(self):
+        return Catalog.instance().table(self.db_name, self.table_name).columns
+
+    def _csv_rows(self, f, header):
+        # Fields are text and are converted by the column's type; an empty
+        # field is NULL. With a header, columns are matched by name.
+        reader = csv.reader(f)
+        order = None
+        if header:
+            names = next(reader, None) or []
+            order = self._order(names)
+        for record in reader:
+            if not record:
+                continue
+            values = [value if value != "" else None for value in record]
+            if order is not None:
+                width = len(values)
+                yield [values[i] if i is not None and i < width else None for i in order]
+            else:
+                yield values
+
+    def _order(self, names):
+        # Position in the file of each schema column, None if it's missing
+        columns = self._columns()
+        unknown = [name for name in names if name not in columns]
+        if unknown:
+            raise ValueError(f"Column '{unknown[0]}' does not exist")
+        positions = {name: i for i, name in enumerate(names)}
+        return [positions.get(name) for name in columns]
+
+    def _jsonl_rows(self, f):
+        # One JSON value per line: an object keyed by column name (missing
+        # columns are NULL) or an array in column order
+        columns = known = None
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, list):
+                yield record
+            elif isinstance(record, dict):
+                if columns is None:
+                    columns = self._columns()
+                    known = set(columns)
+                if not record.keys() <= known:
+                    unknown = sorted(record.keys() - known)
+                    raise ValueError(f"Column '{unknown[0]}' does not exist")
+                yield [record.get(name) for name in columns]
+            else:
+                raise ValueError(f"Expected an object or an array per line, got {type(record).__name__}")
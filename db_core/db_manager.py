@@ -2,7 +2,9 @@ from pathlib import Path
 import shutil
 import os
 
-DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+from db_core.catalog import Catalog, DATA_DIR
+from db_core.partition_manager import PartitionRouter
+from db_core.stats import Stats
 
 class DBManager:
     def __init__(self, db_name, base_path=DATA_DIR):
@@ -18,6 +20,8 @@ class DBManager:
             return {"error": f"Database '{self.db_name}' already exists."}
         try:
             self.target_path.mkdir(parents=True, exist_ok=True)
+            if Path(self.base_path) == DATA_DIR:
+                Catalog.instance().add_database(self.db_name)
             return {"success": f"Database '{self.db_name}' created successfully."}
         except Exception as e:
             return {"error": f"Error while creating database: {e}"}
@@ -26,7 +30,13 @@ class DBManager:
         if not self.database_exists():
             return {"error": f"Database '{self.db_name}' does not exist."}
         try:
+            if Path(self.base_path) == DATA_DIR:
+                # Partition workers may have the database's files open
+                PartitionRouter.stop_workers()
             shutil.rmtree(self.target_path)
+            if Path(self.base_path) == DATA_DIR:
+                Catalog.instance().drop_database(self.db_name)
+                Stats.instance().forget(self.db_name)
             return {"success": f"Database '{self.db_name}' deleted successfully."}
         except Exception as e:
             return {"error": f"Error while deleting database: {e}"}
@@ -0,0 +1,349 @@
+"""DB-API 2.0 style access to MiniDB from Python.
+
+    from db_core import dbapi
+
+    conn = dbapi.connect("shop")  # database data/shop, created if missing
+    cur = conn.cursor()
+    cur.execute("CREATE TABLE items (id INT PRIMARY KEY, name TEXT, price FLOAT);")
+    cur.executemany("INSERT INTO items VALUES (?, ?, ?);", [(1, "pen", 1.5), (2, "ink", 4.0)])
+    cur.execute("SELECT name, price FROM items WHERE price > ?;", (2,))
+    print(cur.fetchall())  # [('ink', 4.0)]
+
+In process, a statement is parsed once per distinct text (qmark
+parameters, cached like PREPARE) and its parameters are bound as the
+typed values given, without being formatted into SQL. A SELECT's rows
+are read from the table as they are fetched and come back as tuples in
+the order of cursor.description; the table stays read-locked until they
+are all fetched or the cursor is closed, which puts off checkpoints.
+executemany() on an INSERT logs the rows EXECUTEMANY_BATCH at a time, as
+one multi-row INSERT each.
+
+connect("minidb://host:port/shop") gives the same API over a MiniDB
+server, on a connection taken from a pool (see server/pool.py).
+
+Every statement is durable once it returns; there are no transactions,
+so commit() does nothing and rollback() raises NotSupportedError.
+"""
+import weakref
+from pathlib import Path
+
+from db_core import sql_parser as ast
+from db_core.catalog import Catalog, DATA_DIR
+from db_core.db_manager import DBManager
+from db_core.parser import Parser
+from db_core.sql_lexer import SQLSyntaxError
+
+apilevel = "2.0"
+threadsafety = 1  # threads may share the module, not connections
+paramstyle = "qmark"
+
+# Rows per multi-row INSERT logged by executemany()
+EXECUTEMANY_BATCH = 1000
+REMOTE_SCHEME = "minidb://"
+
+
+class Warning(Exception):
+    pass
+
+
+class Error(Exception):
+    pass
+
+
+class InterfaceError(Error):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class DataError(DatabaseError):
+    pass
+
+
+class OperationalError(DatabaseError):
+    pass
+
+
+class IntegrityError(DatabaseError):
+    pass
+
+
+class InternalError(DatabaseError):
+    pass
+
+
+class ProgrammingError(DatabaseError):
+    pass
+
+
+class NotSupportedError(DatabaseError):
+    pass
+
+
+class DBAPITypeObject:
+    def __init__(self, *type_names):
+        self.type_names = frozenset(type_names)
+
+    def __eq__(self, other):
+        return other in self.type_names
+
+    def __hash__(self):
+        return hash(self.type_names)
+
+
+# Compare equal to the type codes in cursor.description
+STRING = DBAPITypeObject("TEXT")
+NUMBER = DBAPITypeObject("INT", "FLOAT", "BOOL")
+BINARY = DBAPITypeObject()
+DATETIME = DBAPITypeObject()
+ROWID = DBAPITypeObject()
+
+
+def error_for(result):
+    # The exception for an {"error": ...} result, by what its message says
+    message = result.get("error", "Unknown error")
+    details = result.get("details")
+    if details:
+        message = f"{message} {details}"
+    if "Primary key violation" in message or "cannot be null" in message:
+        return IntegrityError(message)
+    if " expects " in message or "Column count mismatch" in message:
+        return DataError(message)
+    if message.startswith(("Syntax error", "Invalid WHERE clause", "Invalid SET clause", "Empty command",
+                           "Unsupported")) \
+            or "does not exist" in message or "already exists" in message or "parameter(s)" in message:
+        return ProgrammingError(message)
+    return OperationalError(message)
+
+
+def connect(database, create=True):
+    """Opens a connection to `database`: the name of a database under
+    data/ (or its path there), created if it is missing and `create` is
+    set; or minidb://host:port/name for one on a MiniDB server."""
+    if isinstance(database, str) and database.startswith(REMOTE_SCHEME):
+        from server.pool import connect_remote
+        return connect_remote(database, create)
+    path = Path(database)
+    if len(path.parts) > 1 and path.resolve().parent != DATA_DIR:
+        raise InterfaceError(f"Databases are kept in {DATA_DIR}, not in {path.resolve().parent}")
+    return Connection(path.name, create)
+
+
+class Connection:
+    """An in-process session on one database. Not to be shared between
+    threads; open a connection per thread instead."""
+
+    def __init__(self, db_name, create=True):
+        self.db_name = db_name
+        self.parser = Parser()
+        # SELECTs return a row generator rather than a list
+        self.parser.stream_rows = True
+        # Weak, so a cursor dropped unread is collected and its stream closed
+        self.cursors = weakref.WeakSet()
+        self.closed = False
+        if not Catalog.instance().database_exists(db_name):
+            if not create:
+                raise OperationalError(f"Database '{db_name}' does not exist.")
+            result = DBManager(db_name).create_db()
+            if "error" in result and not Catalog.instance().database_exists(db_name):
+                raise error_for(result)
+        self.run(ast.parse(f"USE {db_name};"))
+
+    def cursor(self):
+        self._check()
+        cursor = Cursor(self)
+        self.cursors.add(cursor)
+        return cursor
+
+    def execute(self, sql, params=()):
+        # Shortcut: a new cursor with `sql` executed on it
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def commit(self):
+        self._check()
+
+    def rollback(self):
+        raise NotSupportedError("MiniDB has no transactions: every statement is durable once it returns")
+
+    def close(self):
+        if self.closed:
+            return
+        for cursor in list(self.cursors):
+            cursor.close()
+        self.parser.close()
+        self.closed = True
+
+    def run(self, statement, args=()):
+        # Runs a statement (a Prepare with `args`, or a parsed statement) and
+        # returns its result, raising the DB-API error for a failed one
+        self._check()
+        if isinstance(statement, ast.Prepare):
+            result = self.parser.run_prepared(statement, args)
+        else:
+            result = self.parser.run(statement)
+        if not isinstance(result, dict):
+            raise InternalError(str(result))
+        if "error" in result:
+            raise error_for(result)
+        return result
+
+    def _forget(self, cursor):
+        self.cursors.discard(cursor)
+
+    def _check(self):
+        if self.closed:
+            raise InterfaceError("Connection is closed")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Cursor:
+    arraysize = 1
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+        self.rows = None  # iterator of the result's rows as tuples
+        self.closed = False
+
+    def execute(self, sql, params=()):
+        self._check()
+        self._reset()
+        prepared = self._prepare(sql)
+        result = self.connection.run(prepared, self._args(params))
+        if "columns" in result:
+            self._set_rows(result["columns"], result["data"])
+        elif isinstance(prepared.statement, ast.Insert):
+            self.rowcount = len(prepared.statement.rows)
+        else:
+            # Updates and deletes are applied by the next checkpoint, so how
+            # many rows they change isn't known yet
+            self.rowcount = result.get("rows", -1)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._check()
+        self._reset()
+        prepared = self._prepare(sql)
+        if isinstance(prepared.statement, ast.Select):
+            raise ProgrammingError("executemany() can't run a SELECT")
+        if not isinstance(prepared.statement, ast.Insert):
+            for params in seq_of_params:
+                self.connection.run(prepared, self._args(params))
+            return self
+        # INSERTs go in batches, each logged as one multi-row INSERT
+        inserted = 0
+        batch = []
+        try:
+            for params in seq_of_params:
+                batch.append(self._args(params))
+                if len(batch) == EXECUTEMANY_BATCH:
+                    inserted += self._insert_batch(prepared, batch)
+                    batch = []
+            if batch:
+                inserted += self._insert_batch(prepared, batch)
+        finally:
+            self.rowcount = inserted
+        return self
+
+    def _insert_batch(self, prepared, batch):
+        try:
+            statement = ast.bind_rows(prepared, batch)
+        except SQLSyntaxError as e:
+            raise ProgrammingError(str(e)) from None
+        self.connection.run(statement)
+        return len(statement.rows)
+
+    def fetchone(self):
+        self._check_result()
+        return next(self.rows, None)
+
+    def fetchmany(self, size=None):
+        self._check_result()
+        size = self.arraysize if size is None else size
+        return [row for _, row in zip(range(size), self.rows)]
+
+    def fetchall(self):
+        self._check_result()
+        return list(self.rows)
+
+    def __iter__(self):
+        self._check_result()
+        return self.rows
+
+    def close(self):
+        if self.closed:
+            return
+        self._reset()
+        self.closed = True
+        self.connection._forget(self)
+
+    def setinputsizes(self, sizes):
+        pass
+
+    def setoutputsize(self, size, column=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _prepare(self, sql):
+        try:
+            return ast.prepare(sql)
+        except SQLSyntaxError as e:
+            message = str(e)
+            if message not in ("Empty command", "Unsupported or invalid command"):
+                message = f"Syntax error: {message}"
+            raise ProgrammingError(message) from None
+
+    @staticmethod
+    def _args(params):
+        if isinstance(params, (str, bytes, dict)) or not hasattr(params, "__len__"):
+            raise ProgrammingError("Parameters must be a sequence, bound in order to the ? markers")
+        return params
+
+    def _set_rows(self, columns, rows):
+        # `columns` are the (name, type) of each column of `rows`, a
+        # generator of tuples
+        self.description = [(name, col_type, None, None, None, None, True) for name, col_type in columns]
+        self.rows = self._rows(rows)
+
+    @staticmethod
+    def _rows(rows):
+        # Closing this releases the table's read lock if the rows weren't
+        # all read
+        try:
+            yield from rows
+        finally:
+            rows.close()
+
+    def _reset(self):
+        if self.rows is not None:
+            self.rows.close()
+        self.rows = None
+        self.description = None
+        self.rowcount = -1
+
+    def _check(self):
+        if self.closed:
+            raise InterfaceError("Cursor is closed")
+        self.connection._check()
+
+    def _check_result(self):
+        self._check()
+        if self.rows is None:
+            raise ProgrammingError("The last statement returned no rows")
@@ -1,23 +1,62 @@
-import json
-from pathlib import Path
+from contextlib import nullcontext
+
+from db_core.checkpoint_manager import Checkpointer
+from db_core.primary_key_manager import PrimaryKeyManager
+from db_core.wal_manager import WALManager
+from db_core.where_clause import WhereError
 
 class DeleteManager:
     def __init__(self, db_name, table_name):
         self.db_name = db_name
         self.table_name = table_name
-        self.base_path = Path("data") / db_name / table_name
-        self.wal_path = self.base_path / "log.wal"
+        self.wal = WALManager(db_name, table_name)
+        self.pk_manager = PrimaryKeyManager.for_table(db_name, table_name)
+
+    def delete(self, where_clause, where_tree=None):
+        try:
+            where = self.wal.compile_where(where_clause, where_tree)
+        except WhereError as e:
+            return {"error": f"Invalid WHERE clause: {e}"}
 
-    def delete(self, where_clause):
         log_entry = {
             "operation": "delete",
             "where": where_clause
         }
 
+        # A delete by primary key drops exactly that key from the PK index;
+        # for any other condition the keys of the rows it matches are looked
+        # up first. That scan runs under the checkpoint lock alone, so other
+        # writes aren't held up by it; the table lock is then taken only to
+        # catch up on what they logged meanwhile and log the delete.
+        primary_key = self.pk_manager.get_primary_key_column()
+        equality = where.equality() if primary_key else None
+        by_key = equality is not None and equality[0] == primary_key
+        lookup = bool(primary_key) and not by_key and self.pk_manager.pk_cache is not None
+        with self.pk_manager.checkpoint_lock if lookup else nullcontext():
+            keys = None
+            if lookup:
+                scanned_to = self.wal.end_lsn()
+                keys = self.pk_manager.matching_keys(where_clause, where_tree)
+            with self.pk_manager.lock:
+                if keys is not None:
+                    keys = self.pk_manager.keys_logged_since(keys, scanned_to, where_clause, where_tree)
+                try:
+                    lsn = self.wal.append(log_entry)
+                except Exception as e:
+                    return {"error": f"Failed to write to WAL: {e}"}
+
+                if by_key:
+                    self.pk_manager.remove_pk_from_cache(equality[1])
+                elif keys is not None:
+                    self.pk_manager.remove_pks_from_cache(keys)
+                elif primary_key and self.pk_manager.pk_cache is not None:
+                    # Loaded by another session since, too late to look the keys up
+                    self.pk_manager.invalidate()
+
         try:
-            with open(self.wal_path, "a") as f:
-                f.write(json.dumps(log_entry) + "\n")
-            return {"success": f"Delete operation logged for table '{self.table_name}'."}
-        except Exception as e:
+            self.wal.commit(lsn)
+        except OSError as e:
             return {"error": f"Failed to write to WAL: {e}"}
 
+        Checkpointer.instance().notify_write(self.db_name, self.table_name)
+        return {"success": f"Delete operation logged for table '{self.table_name}'."}
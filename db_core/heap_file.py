@@ -0,0 +1,608 @@
+import lzma
+import os
+import re
+import struct
+import threading
+import zlib
+from pathlib import Path
+
+from db_core.buffer_pool import PAGE_SIZE, BufferPool
+
+MAGIC = b"TDBP"
+VERSION = 6
+# magic, version, record size, page count, live row count, aux, meta length,
+# pages per segment file, compression (see COMPRESSION_CODES), lsn, string
+# heap base, dead string heap bytes
+FILE_HEADER = struct.Struct("<4sHIQQQHIBQQQ")
+# Version 5 files, with a single string heap generation
+FILE_HEADER_V5 = struct.Struct("<4sHIQQQHIBQ")
+# Version 4 files, with no lsn
+FILE_HEADER_V4 = struct.Struct("<4sHIQQQHIB")
+# Version 3 files, never compressed
+FILE_HEADER_V3 = struct.Struct("<4sHIQQQHI")
+# Version 2 files, a single file of any size
+FILE_HEADER_V2 = struct.Struct("<4sHIQQQH")
+# Pages per segment file (8 MiB): data.pages holds the header page and the
+# first segment, data.pages.1 the next, and so on
+SEGMENT_PAGES = 1024
+# Compressed tables use smaller segments (1 MiB), since a segment is only
+# compressed once it is full
+COMPRESSED_SEGMENT_PAGES = 128
+# Pages compressed together, and covered by one zone map entry (see
+# storage_manager.ZoneMap)
+BLOCK_PAGES = 16
+# slots handed out so far (high-water mark), live slots
+PAGE_HEADER = struct.Struct("<HH")
+
+COMPRESSORS = {"zlib": (zlib.compress, zlib.decompress), "lzma": (lzma.compress, lzma.decompress)}
+COMPRESSION_CODES = {None: 0, "zlib": 1, "lzma": 2}
+COMPRESSION_NAMES = {code: name for name, code in COMPRESSION_CODES.items()}
+
+BLOCK_MAGIC = b"TDBZ"
+# magic, compression, pages per block, first page, page count; then the
+# offset of each block and the end of the last
+BLOCK_HEADER = struct.Struct("<4sBHII")
+
+FREE = 0
+LIVE = 1
+
+_NON_ZERO = re.compile(rb"[^\x00]")
+
+
+class BlockFile:
+    """A frozen segment: its pages from `first` on, compressed in blocks of
+    BLOCK_PAGES pages. A page is read by decompressing its block; the last
+    block decompressed is kept, since a scan reads its pages in turn."""
+
+    def __init__(self, path, pool):
+        self.path = Path(path)
+        self.pool = pool
+        with open(self.path, "rb") as f:
+            header = f.read(BLOCK_HEADER.size)
+            magic, code, self.block_pages, self.first, self.count = BLOCK_HEADER.unpack(header)
+            if magic != BLOCK_MAGIC or code not in COMPRESSION_NAMES:
+                raise ValueError(f"{self.path} is not a TinyDBX compressed segment")
+            blocks = -(-self.count // self.block_pages)
+            self.offsets = struct.unpack(f"<{blocks + 1}Q", f.read(8 * (blocks + 1)))
+        self.decompress = COMPRESSORS[COMPRESSION_NAMES[code]][1]
+        self.cached = (None, b"")
+
+    @classmethod
+    def write(cls, path, first, pages, compression, pool, sync=True):
+        # `pages`: the bytes of pages first, first + 1, ...
+        compress = COMPRESSORS[compression][0]
+        blocks = [compress(b"".join(pages[i:i + BLOCK_PAGES])) for i in range(0, len(pages), BLOCK_PAGES)]
+        offsets = [BLOCK_HEADER.size + 8 * (len(blocks) + 1)]
+        for block in blocks:
+            offsets.append(offsets[-1] + len(block))
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(BLOCK_HEADER.pack(BLOCK_MAGIC, COMPRESSION_CODES[compression], BLOCK_PAGES, first, len(pages)))
+            f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+            for block in blocks:
+                f.write(block)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return cls(path, pool)
+
+    def _block(self, block):
+        cached_block, data = self.cached
+        if cached_block != block:
+            start, end = self.offsets[block], self.offsets[block + 1]
+            with open(self.path, "rb") as f:
+                f.seek(start)
+                raw = f.read(end - start)
+            self.pool.count_read(self.path, len(raw))
+            data = self.decompress(raw)
+            self.cached = (block, data)
+        return data
+
+    def read_page(self, page_no):
+        block, index = divmod(page_no - self.first, self.block_pages)
+        start = index * PAGE_SIZE
+        return self._block(block)[start:start + PAGE_SIZE]
+
+    def read_all(self):
+        return b"".join(self._block(block) for block in range(len(self.offsets) - 1))
+
+
+class SegmentFiles:
+    """The pages of one file, stored in segment files of segment_pages pages
+    each: the path itself, then path.1, path.2 and so on (segment_pages 0
+    for a single file of any size).
+
+    With a compression, a segment that is full is frozen when it is
+    flushed: its pages go to path.N.z (path.z for the first) as a BlockFile
+    and the segment file is removed, or for the first one cut back to its
+    `reserved` pages (a file header). Frozen pages are read through the
+    buffer pool like any others. A page about to be changed thaws its
+    segment back into a plain file first; the segment is frozen again at
+    the next flush. If a crash leaves both files of a segment, the plain
+    one is used: the two hold the same pages until it is written to.
+    """
+
+    def __init__(self, path, pool, segment_pages=0, compression=None, reserved=0):
+        self.path = Path(path)
+        self.pool = pool
+        self.segment_pages = segment_pages
+        self.compression = compression
+        self.reserved = reserved
+        self.frozen = {}  # segment -> BlockFile
+        self.segment_paths = {0: self.path}
+        if segment_pages:
+            for segment, frozen_path in self._frozen_files():
+                if not self._plain(segment):
+                    self.frozen[segment] = BlockFile(frozen_path, pool)
+
+    def segment_path(self, segment):
+        path = self.segment_paths.get(segment)
+        if path is None:
+            path = self.segment_paths[segment] = self.path.with_name(f"{self.path.name}.{segment}")
+        return path
+
+    def frozen_path(self, segment):
+        return self.segment_path(segment).with_name(self.segment_path(segment).name + ".z")
+
+    def _plain(self, segment):
+        # Whether the segment's pages are in its plain file
+        try:
+            size = self.segment_path(segment).stat().st_size
+        except FileNotFoundError:
+            return False
+        return segment > 0 or size > self.reserved * PAGE_SIZE
+
+    def page(self, page_no, dirty=False):
+        # Pins a page, in whichever file holds it
+        if not self.segment_pages:
+            return self.pool.page(self.path, page_no, dirty)
+        segment, local = divmod(page_no, self.segment_pages)
+        frozen = self.frozen.get(segment)
+        if frozen is not None and local >= frozen.first:
+            if not dirty:
+                return self.pool.page(frozen.path, local, loader=frozen.read_page)
+            self.thaw(segment)
+        return self.pool.page(self.segment_path(segment), local, dirty)
+
+    def paths(self, page_count):
+        # The plain files holding the first page_count pages, in order
+        if not self.segment_pages:
+            return [self.path]
+        return [self.segment_path(segment) for segment in range(-(-page_count // self.segment_pages))
+                if segment not in self.frozen or (segment == 0 and self.reserved)]
+
+    def flush(self, page_count, sync=True, full_pages=None):
+        # Writes back the changed pages, then freezes the segments that are
+        # full: those within the first `full_pages` pages (all of them by default)
+        for path in self.paths(page_count):
+            self.pool.flush_file(path, sync)
+        if self.compression and self.segment_pages:
+            full_pages = page_count if full_pages is None else full_pages
+            for segment in range(full_pages // self.segment_pages):
+                if segment not in self.frozen:
+                    self.freeze(segment, sync)
+
+    def freeze(self, segment, sync=True):
+        plain = self.segment_path(segment)
+        first = self.reserved if segment == 0 else 0
+        pages = []
+        for local in range(first, self.segment_pages):
+            with self.pool.page(plain, local) as page:
+                pages.append(bytes(page))
+        frozen = BlockFile.write(self.frozen_path(segment), first, pages, self.compression, self.pool, sync)
+        self.pool.discard_file(plain)
+        if segment == 0:
+            os.truncate(plain, first * PAGE_SIZE)
+        else:
+            plain.unlink()
+        self.frozen[segment] = frozen
+
+    def thaw(self, segment):
+        frozen = self.frozen.pop(segment)
+        plain = self.segment_path(segment)
+        head = b""
+        if frozen.first:
+            self.pool.flush_file(plain)
+            for local in range(frozen.first):
+                with self.pool.page(plain, local) as page:
+                    head += bytes(page)
+        tmp_path = plain.with_name(plain.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(head)
+            f.write(frozen.read_all())
+            f.flush()
+            os.fsync(f.fileno())
+        self.pool.discard_file(plain)
+        os.replace(tmp_path, plain)
+        frozen.path.unlink()
+        self.pool.discard_file(frozen.path)
+
+    def discard(self):
+        # Drops the buffered pages of every segment, written or not
+        for path in [self.path, *self._segment_files(), *(path for _, path in self._frozen_files())]:
+            self.pool.discard_file(path)
+
+    def remove(self):
+        # Deletes every segment but the first, which the caller rewrites
+        self.discard()
+        for path in [*self._segment_files(), *(path for _, path in self._frozen_files())]:
+            path.unlink()
+        self.frozen = {}
+
+    def _segment_files(self):
+        # The plain segment files on disk past the first, in use or left over
+        prefix = self.path.name + "."
+        return sorted((path for path in self.path.parent.glob(f"{self.path.name}.*")
+                       if path.name[len(prefix):].isdigit()), key=lambda path: int(path.name[len(prefix):]))
+
+    def _frozen_files(self):
+        # (segment, path) of the frozen segment files on disk
+        found = []
+        for path in self.path.parent.glob(f"{self.path.name}*.z"):
+            name = path.name[:-2]
+            if name == self.path.name:
+                found.append((0, path))
+            elif name.startswith(self.path.name + ".") and name[len(self.path.name) + 1:].isdigit():
+                found.append((int(name[len(self.path.name) + 1:]), path))
+        return sorted(found)
+
+
+class HeapFile:
+    """Fixed-size records stored in fixed-size pages.
+
+    Page 0 holds the file header. Every other page is a page header, one
+    status byte per slot, then the slots themselves, so the records of a
+    fully used page are contiguous. A row ID is page_no * slots_per_page +
+    slot. The free-space map (one byte per page: free slots, capped at 255)
+    lives in a side file and is rebuilt from the page headers if it is lost.
+
+    The pages are stored in segment files of segment_pages pages each, so
+    a large table is a set of size-capped files that can be scanned
+    independently (see segments()); a compressed table's full segments
+    are kept compressed (see SegmentFiles). A version 2 file is one
+    unsegmented file, and stays so.
+
+    The header is written after the pages, once they are durable, so the
+    `lsn` it holds (the owner's log position the pages include) never runs
+    ahead of them. It also names the generation of the string heap the
+    records point into (see StringHeap): `strings_base`, and the bytes of
+    it no record points to any more, `strings_dead`. Files of versions 2
+    to 5 are given the current header the first time they are flushed.
+    """
+
+    def __init__(self, path, record_size=None, pool=None):
+        self.path = Path(path)
+        self.fsm_path = self.path.with_suffix(".fsm")
+        self.pool = pool or BufferPool.instance()
+        self.lock = threading.RLock()
+        self.record_size = record_size
+        self.slots_per_page = None
+        self.page_count = 0
+        self.row_count = 0
+        self.aux = 0
+        self.lsn = 0
+        self.strings_base = 0
+        self.strings_dead = 0
+        self.meta = b""
+        self.version = VERSION
+        self.segment_pages = SEGMENT_PAGES  # 0 for a single unsegmented file
+        self.compression = None
+        self.files = None  # SegmentFiles, once created or opened
+        self.fsm = None
+        self.free_hint = 1
+        self.opened = False
+
+    @classmethod
+    def create(cls, path, record_size, meta=b"", aux=0, pool=None, compression=None):
+        heap = cls(path, record_size, pool)
+        heap.compression = compression
+        if compression:
+            heap.segment_pages = COMPRESSED_SEGMENT_PAGES
+        heap.files = SegmentFiles(heap.path, heap.pool, heap.segment_pages, compression, reserved=1)
+        heap.files.remove()
+        with open(heap.path, "wb") as f:
+            f.write(bytes(PAGE_SIZE))
+        heap.page_count = 1
+        heap.meta = meta
+        heap.aux = aux
+        heap._set_geometry()
+        heap.fsm = bytearray(1)
+        heap.opened = True
+        heap.flush()
+        return heap
+
+    def _set_geometry(self):
+        self.slots_per_page = (PAGE_SIZE - PAGE_HEADER.size) // (self.record_size + 1)
+        if self.slots_per_page < 1:
+            raise ValueError(f"Records of {self.record_size} bytes do not fit in a {PAGE_SIZE}-byte page")
+        self.records_offset = PAGE_HEADER.size + self.slots_per_page
+
+    def open(self):
+        with self.lock:
+            if self.opened:
+                return self
+            with self.pool.page(self.path, 0) as page:
+                magic, version = struct.unpack_from("<4sH", page)
+                if magic != MAGIC or version not in (2, 3, 4, 5, VERSION):
+                    raise ValueError(f"{self.path} is not a TinyDBX paged table file")
+                compression = lsn = strings_base = strings_dead = 0
+                if version == 2:
+                    header, segment_pages = FILE_HEADER_V2, 0
+                    _, _, record_size, page_count, row_count, aux, meta_len = header.unpack_from(page)
+                elif version == 3:
+                    header = FILE_HEADER_V3
+                    _, _, record_size, page_count, row_count, aux, meta_len, segment_pages = header.unpack_from(page)
+                elif version == 4:
+                    header = FILE_HEADER_V4
+                    (_, _, record_size, page_count, row_count, aux, meta_len, segment_pages,
+                     compression) = header.unpack_from(page)
+                elif version == 5:
+                    header = FILE_HEADER_V5
+                    (_, _, record_size, page_count, row_count, aux, meta_len, segment_pages,
+                     compression, lsn) = header.unpack_from(page)
+                else:
+                    header = FILE_HEADER
+                    (_, _, record_size, page_count, row_count, aux, meta_len, segment_pages,
+                     compression, lsn, strings_base, strings_dead) = header.unpack_from(page)
+                self.meta = bytes(page[header.size:header.size + meta_len])
+            self.version = version
+            self.segment_pages = segment_pages
+            self.compression = COMPRESSION_NAMES[compression]
+            self.files = SegmentFiles(self.path, self.pool, segment_pages, self.compression, reserved=1)
+            self.record_size = record_size
+            self.page_count = page_count
+            self.row_count = row_count
+            self.aux = aux
+            self.lsn = lsn
+            self.strings_base = strings_base
+            self.strings_dead = strings_dead
+            self._set_geometry()
+            self._load_fsm()
+            self.opened = True
+            return self
+
+    def _load_fsm(self):
+        try:
+            fsm = bytearray(self.fsm_path.read_bytes())
+        except FileNotFoundError:
+            fsm = None
+        if fsm is None or len(fsm) != self.page_count:
+            fsm = bytearray(self.page_count)
+            for page_no in range(1, self.page_count):
+                with self._page(page_no) as page:
+                    used, live = PAGE_HEADER.unpack_from(page)
+                fsm[page_no] = min(255, self.slots_per_page - live)
+        self.fsm = fsm
+
+    def flush(self, sync=True):
+        with self.lock:
+            self.files.flush(self.page_count, sync)
+            with self.pool.page(self.path, 0, dirty=True) as page:
+                FILE_HEADER.pack_into(page, 0, MAGIC, VERSION, self.record_size, self.page_count,
+                                      self.row_count, self.aux, len(self.meta), self.segment_pages,
+                                      COMPRESSION_CODES[self.compression], self.lsn, self.strings_base,
+                                      self.strings_dead)
+                page[FILE_HEADER.size:FILE_HEADER.size + len(self.meta)] = self.meta
+            self.pool.flush_file(self.path, sync)
+            self.version = VERSION
+            tmp_path = self.fsm_path.with_suffix(".fsm.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(self.fsm)
+            os.replace(tmp_path, self.fsm_path)
+
+    def segments(self):
+        # (first page, end page) of each segment holding rows, in page order
+        if not self.segment_pages:
+            return [(1, self.page_count)] if self.page_count > 1 else []
+        return [(max(1, start), min(start + self.segment_pages, self.page_count))
+                for start in range(0, self.page_count, self.segment_pages)
+                if min(start + self.segment_pages, self.page_count) > max(1, start)]
+
+    def discard(self):
+        # Drops the buffered pages of every segment, written or not
+        self.files.discard()
+
+    def string_heap(self, path, base=None):
+        # The table's string heap, kept in segments like its pages if it is
+        # compressed: the generation the header names, or the one starting
+        # at `base`, which is empty until appended to
+        if base is None:
+            base, size = self.strings_base, self.aux
+        else:
+            size = base
+        return StringHeap(StringHeap.generation_path(path, base), size, self.pool,
+                          self.segment_pages if self.compression else 0, self.compression, base)
+
+    def _page(self, page_no, dirty=False):
+        return self.files.page(page_no, dirty)
+
+    def rowid(self, page_no, slot):
+        return page_no * self.slots_per_page + slot
+
+    def locate(self, rowid):
+        return divmod(rowid, self.slots_per_page)
+
+    def _slot_offset(self, slot):
+        return self.records_offset + slot * self.record_size
+
+    def insert(self, record):
+        with self.lock:
+            match = _NON_ZERO.search(self.fsm, self.free_hint)
+            if match is None and self.free_hint > 1:
+                match = _NON_ZERO.search(self.fsm, 1)
+            if match is not None:
+                page_no = match.start()
+            else:
+                page_no = self.page_count
+                self.page_count += 1
+                self.fsm.append(min(255, self.slots_per_page))
+            self.free_hint = page_no
+
+            with self._page(page_no, dirty=True) as page:
+                used, live = PAGE_HEADER.unpack_from(page)
+                if used < self.slots_per_page:
+                    slot = used
+                    used += 1
+                else:
+                    slot = page.index(FREE, PAGE_HEADER.size, self.records_offset) - PAGE_HEADER.size
+                page[PAGE_HEADER.size + slot] = LIVE
+                start = self._slot_offset(slot)
+                page[start:start + self.record_size] = record
+                live += 1
+                PAGE_HEADER.pack_into(page, 0, used, live)
+            self.fsm[page_no] = min(255, self.slots_per_page - live)
+            self.row_count += 1
+            return self.rowid(page_no, slot)
+
+    def read(self, rowid):
+        page_no, slot = self.locate(rowid)
+        if page_no < 1 or page_no >= self.page_count:
+            return None
+        with self._page(page_no) as page:
+            if page[PAGE_HEADER.size + slot] != LIVE:
+                return None
+            start = self._slot_offset(slot)
+            return bytes(page[start:start + self.record_size])
+
+    def update(self, rowid, record):
+        page_no, slot = self.locate(rowid)
+        with self.lock, self._page(page_no, dirty=True) as page:
+            if page[PAGE_HEADER.size + slot] != LIVE:
+                raise KeyError(rowid)
+            start = self._slot_offset(slot)
+            page[start:start + self.record_size] = record
+
+    def delete(self, rowid):
+        page_no, slot = self.locate(rowid)
+        with self.lock, self._page(page_no, dirty=True) as page:
+            if page[PAGE_HEADER.size + slot] != LIVE:
+                raise KeyError(rowid)
+            page[PAGE_HEADER.size + slot] = FREE
+            used, live = PAGE_HEADER.unpack_from(page)
+            live -= 1
+            PAGE_HEADER.pack_into(page, 0, used, live)
+            self.fsm[page_no] = min(255, self.slots_per_page - live)
+            self.row_count -= 1
+            if page_no < self.free_hint:
+                self.free_hint = page_no
+
+    def scan_pages(self, start_page=1, end_page=None):
+        # Yields (first rowid of the page, live slot numbers, record bytes of
+        # those slots). Each page is copied out and unpinned before it is
+        # yielded, so an abandoned scan never keeps pages pinned.
+        if end_page is None:
+            end_page = self.page_count
+        record_size = self.record_size
+        for page_no in range(start_page, end_page):
+            with self._page(page_no) as page:
+                used, live = PAGE_HEADER.unpack_from(page)
+                if live == 0:
+                    continue
+                status = bytes(page[PAGE_HEADER.size:PAGE_HEADER.size + used])
+                if live == used:
+                    slots = range(used)
+                    records = bytes(page[self.records_offset:self.records_offset + used * record_size])
+                else:
+                    slots = [i for i, s in enumerate(status) if s == LIVE]
+                    records = b"".join(
+                        page[self._slot_offset(i):self._slot_offset(i) + record_size] for i in slots)
+            yield page_no * self.slots_per_page, slots, records
+
+
+class StringHeap:
+    """Append-only byte heap for TEXT values, paged through the buffer pool.
+
+    The logical size is tracked by the owner (it is stored in the table
+    header), so bytes past it are garbage from an interrupted append. A
+    compressed table's heap is kept in segments, frozen once full like the
+    table's pages (see SegmentFiles).
+
+    Offsets are logical and never reused. Bytes no row refers to any more
+    are dropped by copying the rest to a new generation, which starts at
+    `base`, the offset the old one ended at, and is stored from its start
+    in a file of its own: data.strings for the first, data.<base>.strings
+    for later ones.
+    """
+
+    def __init__(self, path, size=0, pool=None, segment_pages=0, compression=None, base=0):
+        self.path = Path(path)
+        self.pool = pool or BufferPool.instance()
+        self.base = base
+        self.size = size
+        self.files = SegmentFiles(self.path, self.pool, segment_pages, compression)
+
+    @staticmethod
+    def generation_path(path, base):
+        path = Path(path)
+        return path if not base else path.with_name(f"{path.stem}.{base}{path.suffix}")
+
+    @staticmethod
+    def generation_paths(path):
+        # The paths of every generation of the heap on disk
+        path = Path(path)
+        found = [path] if path.exists() else []
+        for candidate in path.parent.glob(f"{path.stem}.*{path.suffix}"):
+            if candidate.name[len(path.stem) + 1:-len(path.suffix)].isdigit():
+                found.append(candidate)
+        return found
+
+    def create(self):
+        # Empties the heap on disk; returns self
+        self.files.remove()
+        with open(self.path, "wb"):
+            pass
+        self.size = self.base
+        return self
+
+    def delete(self):
+        # Removes the heap's files, written or not
+        self.files.remove()
+        self.pool.discard_file(self.path)
+        self.path.unlink(missing_ok=True)
+
+    def page(self, page_no, dirty=False):
+        return self.files.page(page_no, dirty)
+
+    def append(self, raw):
+        offset = self.size
+        pos = 0
+        while pos < len(raw):
+            page_no, start = divmod(offset - self.base + pos, PAGE_SIZE)
+            chunk = raw[pos:pos + PAGE_SIZE - start]
+            with self.page(page_no, dirty=True) as page:
+                page[start:start + len(chunk)] = chunk
+            pos += len(chunk)
+        self.size = offset + len(raw)
+        return offset
+
+    def flush(self, sync=True):
+        # Only whole pages count as full: the last may still be appended to
+        length = self.size - self.base
+        self.files.flush(-(-length // PAGE_SIZE), sync, length // PAGE_SIZE)
+
+    def discard(self):
+        self.files.discard()
+
+    def reader(self):
+        return StringHeapReader(self)
+
+
+class StringHeapReader:
+    """Hands out windows of a StringHeap for the row decoder. A window is one
+    heap page (or the run of pages a long string spans), copied out of the
+    buffer pool so a sequential scan does one pool lookup per heap page."""
+
+    def __init__(self, heap):
+        self.heap = heap
+
+    def window(self, offset, length):
+        base = self.heap.base
+        first = (offset - base) // PAGE_SIZE
+        last = (offset - base + length - 1) // PAGE_SIZE
+        parts = []
+        for page_no in range(first, last + 1):
+            with self.heap.page(page_no) as page:
+                parts.append(bytes(page))
+        start = base + first * PAGE_SIZE
+        return b"".join(parts), start, start + len(parts) * PAGE_SIZE
@@ -0,0 +1,559 @@
+import json
+import os
+import threading
+from bisect import bisect_left, bisect_right
+
+from db_core.catalog import Catalog, DATA_DIR
+from db_core.schema_manager import Schema_Manager
+from db_core.storage_manager import TableStorage
+from db_core.wal_manager import WALManager
+from db_core.where_clause import And, Between, Compare, Const, InList, Literal, Or
+
+INDEX_TYPES = {"HASH", "BTREE"}
+# Rewrite an index file from a snapshot once its change log outgrows this
+COMPACT_AFTER_OPS = 10000
+
+
+class HashIndex:
+    using = "HASH"
+
+    def __init__(self):
+        self.entries = {}
+
+    def add(self, key, rowid):
+        rowids = self.entries.get(key)
+        if rowids is None:
+            self.entries[key] = {rowid}
+        else:
+            rowids.add(rowid)
+
+    def remove(self, key, rowid):
+        rowids = self.entries.get(key)
+        if rowids is not None:
+            rowids.discard(rowid)
+            if not rowids:
+                del self.entries[key]
+
+    def load(self, keys, rowids):
+        entries = self.entries
+        for key, rowid in zip(keys, rowids):
+            found = entries.get(key)
+            if found is None:
+                entries[key] = {rowid}
+            else:
+                found.add(rowid)
+
+    def search(self, key):
+        return list(self.entries.get(key, ()))
+
+    def items(self):
+        return self.entries.items()
+
+    def supports(self, op):
+        return op == "="
+
+
+class BTreeNode:
+    __slots__ = ("keys", "children", "values", "next")
+
+    def __init__(self, leaf):
+        self.keys = []
+        self.children = None if leaf else []
+        self.values = [] if leaf else None
+        self.next = None
+
+
+class BTreeIndex:
+    """In-memory B+ tree mapping a key to the set of row IDs holding it.
+
+    Leaves are chained for range scans. Deletes only drop empty keys from
+    their leaf; nodes are not merged, which keeps separators valid.
+    """
+
+    using = "BTREE"
+    order = 64
+
+    def __init__(self):
+        self.root = BTreeNode(leaf=True)
+
+    def load(self, keys, rowids):
+        # Bulk load from (key, rowid) pairs sorted by key: fill the leaves
+        # left to right, then build each internal level over the one below.
+        leaf_keys = []
+        leaf_values = []
+        for key, rowid in zip(keys, rowids):
+            if leaf_keys and leaf_keys[-1] == key:
+                leaf_values[-1].add(rowid)
+            else:
+                leaf_keys.append(key)
+                leaf_values.append({rowid})
+        if not leaf_keys:
+            self.root = BTreeNode(leaf=True)
+            return
+
+        level = []
+        lows = []
+        for i in range(0, len(leaf_keys), self.order):
+            leaf = BTreeNode(leaf=True)
+            leaf.keys = leaf_keys[i:i + self.order]
+            leaf.values = leaf_values[i:i + self.order]
+            if level:
+                level[-1].next = leaf
+            level.append(leaf)
+            lows.append(leaf.keys[0])
+        while len(level) > 1:
+            parents = []
+            parent_lows = []
+            for i in range(0, len(level), self.order + 1):
+                node = BTreeNode(leaf=False)
+                node.children = level[i:i + self.order + 1]
+                node.keys = lows[i + 1:i + len(node.children)]
+                parents.append(node)
+                parent_lows.append(lows[i])
+            level, lows = parents, parent_lows
+        self.root = level[0]
+
+    def _find_leaf(self, key, path=None):
+        node = self.root
+        while node.children is not None:
+            i = bisect_right(node.keys, key)
+            if path is not None:
+                path.append((node, i))
+            node = node.children[i]
+        return node
+
+    def add(self, key, rowid):
+        path = []
+        leaf = self._find_leaf(key, path)
+        i = bisect_left(leaf.keys, key)
+        if i < len(leaf.keys) and leaf.keys[i] == key:
+            leaf.values[i].add(rowid)
+            return
+        leaf.keys.insert(i, key)
+        leaf.values.insert(i, {rowid})
+        if len(leaf.keys) > self.order:
+            self._split(leaf, path)
+
+    def _split(self, node, path):
+        mid = len(node.keys) // 2
+        right = BTreeNode(leaf=node.children is None)
+        if node.children is None:
+            right.keys, node.keys = node.keys[mid:], node.keys[:mid]
+            right.values, node.values = node.values[mid:], node.values[:mid]
+            right.next, node.next = node.next, right
+            separator = right.keys[0]
+        else:
+            separator = node.keys[mid]
+            right.keys, node.keys = node.keys[mid + 1:], node.keys[:mid]
+            right.children, node.children = node.children[mid + 1:], node.children[:mid + 1]
+
+        if not path:
+            root = BTreeNode(leaf=False)
+            root.keys = [separator]
+            root.children = [node, right]
+            self.root = root
+            return
+        parent, i = path.pop()
+        parent.keys.insert(i, separator)
+        parent.children.insert(i + 1, right)
+        if len(parent.keys) > self.order:
+            self._split(parent, path)
+
+    def remove(self, key, rowid):
+        leaf = self._find_leaf(key)
+        i = bisect_left(leaf.keys, key)
+        if i < len(leaf.keys) and leaf.keys[i] == key:
+            leaf.values[i].discard(rowid)
+            if not leaf.values[i]:
+                del leaf.keys[i]
+                del leaf.values[i]
+
+    def search(self, key):
+        leaf = self._find_leaf(key)
+        i = bisect_left(leaf.keys, key)
+        if i < len(leaf.keys) and leaf.keys[i] == key:
+            return list(leaf.values[i])
+        return []
+
+    def range(self, low=None, low_inclusive=True, high=None, high_inclusive=True):
+        if low is None:
+            leaf = self.root
+            while leaf.children is not None:
+                leaf = leaf.children[0]
+            i = 0
+        else:
+            leaf = self._find_leaf(low)
+            i = bisect_left(leaf.keys, low) if low_inclusive else bisect_right(leaf.keys, low)
+        rowids = []
+        while leaf is not None:
+            keys = leaf.keys
+            while i < len(keys):
+                key = keys[i]
+                if high is not None and (key > high or (key == high and not high_inclusive)):
+                    return rowids
+                rowids.extend(leaf.values[i])
+                i += 1
+            leaf = leaf.next
+            i = 0
+        return rowids
+
+    def items(self):
+        leaf = self.root
+        while leaf.children is not None:
+            leaf = leaf.children[0]
+        while leaf is not None:
+            yield from zip(leaf.keys, leaf.values)
+            leaf = leaf.next
+
+    def supports(self, op):
+        return op in ("=", "<", "<=", ">", ">=")
+
+
+class TableIndex:
+    """One index of a table plus its on-disk file.
+
+    The file is a snapshot line followed by change lines. Changes made by a
+    checkpoint are buffered and only written, together with the table file
+    signature they belong to, once the checkpoint has flushed the pages.
+    """
+
+    def __init__(self, name, column, using, path):
+        self.name = name
+        self.column = column
+        self.using = using
+        self.path = path
+        self.tree = HashIndex() if using == "HASH" else BTreeIndex()
+        self.pending = []
+        self.logged_ops = 0
+
+    def add(self, key, rowid):
+        if key is not None:
+            self.tree.add(key, rowid)
+            self.pending.append({"op": "+", "key": key, "rowid": rowid})
+
+    def remove(self, key, rowid):
+        if key is not None:
+            self.tree.remove(key, rowid)
+            self.pending.append({"op": "-", "key": key, "rowid": rowid})
+
+    def build(self, storage, signature):
+        position = storage.open().codec.columns.index(self.column)
+        pairs = [(row[position], rowid) for rowid, row in storage.scan_with_rowids()
+                 if row[position] is not None]
+        if self.using == "BTREE":
+            pairs.sort()
+        self.tree = HashIndex() if self.using == "HASH" else BTreeIndex()
+        self.tree.load([key for key, _ in pairs], [rowid for _, rowid in pairs])
+        self.pending = []
+        self.write_snapshot(signature)
+
+    def load(self, signature):
+        try:
+            with open(self.path, "r") as f:
+                header = json.loads(f.readline())
+                if header.get("column") != self.column or header.get("using") != self.using:
+                    return False
+                tree = HashIndex() if self.using == "HASH" else BTreeIndex()
+                tree.load(header["keys"], header["rowids"])
+                file_signature = header.get("data")
+                ops = 0
+                for line in f:
+                    if not line.strip():
+                        continue
+                    op = json.loads(line)
+                    if op["op"] == "+":
+                        tree.add(op["key"], op["rowid"])
+                    elif op["op"] == "-":
+                        tree.remove(op["key"], op["rowid"])
+                    elif op["op"] == "sig":
+                        file_signature = op["data"]
+                    ops += 1
+        except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError, AttributeError):
+            return False
+        if file_signature != signature:
+            return False
+        self.tree = tree
+        self.logged_ops = ops
+        return True
+
+    def write_snapshot(self, signature):
+        keys = []
+        rowids = []
+        for key, found in self.tree.items():
+            for rowid in sorted(found):
+                keys.append(key)
+                rowids.append(rowid)
+        header = {
+            "name": self.name,
+            "column": self.column,
+            "using": self.using,
+            "data": signature,
+            # Parallel lists of (key, rowid) pairs, in key order for a B-tree
+            "keys": keys,
+            "rowids": rowids,
+        }
+        self.path.parent.mkdir(exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(header) + "\n")
+        os.replace(tmp_path, self.path)
+        self.pending = []
+        self.logged_ops = 0
+
+    def flush(self, signature):
+        if self.logged_ops + len(self.pending) > COMPACT_AFTER_OPS:
+            self.write_snapshot(signature)
+            return
+        lines = [json.dumps(op) for op in self.pending]
+        lines.append(json.dumps({"op": "sig", "data": signature}))
+        with open(self.path, "a") as f:
+            f.write("\n".join(lines) + "\n")
+        self.logged_ops += len(lines)
+        self.pending = []
+
+
+class IndexManager:
+    """Secondary indexes of one table, shared by every session in the process.
+
+    Indexes map column values to row IDs of checkpointed rows. Rows still in
+    the WAL are covered by the WAL overlay at read time, and the checkpointer
+    keeps the indexes in step as it applies the WAL to the pages. A table
+    with a primary key always has an implicit hash index, <table>_pkey.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_table(cls, db_name, table_name):
+        key = (db_name, table_name)
+        with cls._instances_lock:
+            manager = cls._instances.get(key)
+            if manager is None:
+                manager = cls(db_name, table_name)
+                cls._instances[key] = manager
+            return manager
+
+    def __init__(self, db_name, table_name):
+        self.db_name = db_name
+        self.table_name = table_name
+        self.base_path = DATA_DIR / db_name / table_name
+        self.schema_path = self.base_path / "schema.json"
+        self.index_dir = self.base_path / "indexes"
+        self.storage = TableStorage.for_table(db_name, table_name)
+        self.checkpoint_lock = WALManager.checkpoint_lock(db_name, table_name)
+        self.lock = threading.RLock()
+        self.indexes = None
+        self.column_types = {}
+        self.positions = {}  # column name -> its place in a row
+
+    def _read_schema(self):
+        # The catalog's copy, shared: changes go through _write_schema()
+        return Catalog.instance().schema(self.db_name, self.table_name)
+
+    def _definitions(self, schema):
+        definitions = []
+        if schema.get("primary_key"):
+            definitions.append({"name": f"{self.table_name}_pkey", "column": schema["primary_key"], "using": "HASH"})
+        definitions.extend(schema.get("indexes", []))
+        return definitions
+
+    def _load(self):
+        # Index files are checked against the table file signature and rebuilt
+        # with a scan if they are missing or were written for other pages.
+        if self.indexes is not None:
+            return self.indexes
+        with self.checkpoint_lock, self.lock:
+            if self.indexes is None:
+                schema = self._read_schema()
+                self.column_types = {c["name"]: c.get("type", "TEXT") for c in schema.get("columns", [])}
+                self.positions = {name: i for i, name in enumerate(self.column_types)}
+                signature = self.storage.open().signature()
+                indexes = {}
+                for definition in self._definitions(schema):
+                    index = self._open_index(definition, signature)
+                    indexes[index.name] = index
+                self.indexes = indexes
+        return self.indexes
+
+    def _open_index(self, definition, signature):
+        index = TableIndex(definition["name"], definition["column"], definition["using"],
+                           self._path(definition["name"]))
+        if not index.load(signature):
+            index.build(self.storage, signature)
+        return index
+
+    def _path(self, name):
+        # The primary key index of a partition is named after it, "t/p0_pkey"
+        return self.index_dir / f"{name.replace('/', '_')}.idx"
+
+    def list_indexes(self):
+        return [{"name": i.name, "column": i.column, "using": i.using} for i in self._load().values()]
+
+    def has_index(self, name):
+        # Answered from the schema, without loading or building any index
+        try:
+            schema = self._read_schema()
+        except FileNotFoundError:
+            return False
+        return any(d["name"] == name for d in self._definitions(schema))
+
+    def create_index(self, name, column, using):
+        using = (using or "BTREE").upper()
+        if using not in INDEX_TYPES:
+            return {"error": f"Unknown index type '{using}'. Use HASH or BTREE."}
+        indexes = self._load()
+        if column not in self.column_types:
+            return {"error": f"Column '{column}' does not exist in table '{self.table_name}'."}
+        if name in indexes:
+            return {"error": f"Index '{name}' already exists on table '{self.table_name}'."}
+
+        # Building scans the pages, so keep checkpoints out until it's done
+        with self.checkpoint_lock, self.lock:
+            schema = dict(self._read_schema())
+            definition = {"name": name, "column": column, "using": using}
+            index = TableIndex(name, column, using, self._path(name))
+            index.build(self.storage, self.storage.signature())
+            schema["indexes"] = schema.get("indexes", []) + [definition]
+            self._write_schema(schema)
+            self.indexes[name] = index
+        return {"success": f"Index '{name}' created on '{self.table_name}({column})' using {using}."}
+
+    def drop_index(self, name):
+        indexes = self._load()
+        if name not in indexes:
+            return {"error": f"Index '{name}' does not exist on table '{self.table_name}'."}
+        if name == f"{self.table_name}_pkey":
+            return {"error": f"Index '{name}' backs the primary key and cannot be dropped."}
+        with self.checkpoint_lock, self.lock:
+            schema = dict(self._read_schema())
+            schema["indexes"] = [d for d in schema.get("indexes", []) if d["name"] != name]
+            self._write_schema(schema)
+            del self.indexes[name]
+            try:
+                self._path(name).unlink()
+            except FileNotFoundError:
+                pass
+        return {"success": f"Index '{name}' dropped from table '{self.table_name}'."}
+
+    def _write_schema(self, schema):
+        tmp_path = self.schema_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(schema, f, indent=2)
+        os.replace(tmp_path, self.schema_path)
+        Catalog.instance().set_schema(self.db_name, self.table_name, schema)
+
+    def index_for(self, column, op):
+        # Prefers a B-tree for ranges and whichever index exists for equality
+        best = None
+        for index in self._load().values():
+            if index.column == column and index.tree.supports(op):
+                if best is None or (op == "=" and index.using == "HASH"):
+                    best = index
+        return best
+
+    def lookup(self, column, op, key, used=None):
+        # Row IDs of checkpointed rows whose `column` satisfies `op key`, in
+        # row ID (= page) order, or None if no index can answer it. `key` is
+        # already of the column's type. The index is added to `used`.
+        index = self.index_for(column, op)
+        if index is None or key is None:
+            return None
+        if used is not None:
+            used.append(index)
+        with self.lock:
+            if op == "=":
+                rowids = index.tree.search(key)
+            elif op == "<":
+                rowids = index.tree.range(high=key, high_inclusive=False)
+            elif op == "<=":
+                rowids = index.tree.range(high=key)
+            elif op == ">":
+                rowids = index.tree.range(low=key, low_inclusive=False)
+            else:
+                rowids = index.tree.range(low=key)
+        return sorted(rowids)
+
+    def candidates(self, node, used=None):
+        # Row IDs that can satisfy a resolved WHERE tree, found through the
+        # indexes alone, or None if part of it needs a scan. Callers re-check
+        # the full clause on every row fetched. The indexes looked up are
+        # added to `used`, for EXPLAIN.
+        if isinstance(node, Compare) and isinstance(node.right, Literal):
+            return self.lookup(node.left.name, node.op, node.right.value, used)
+        if isinstance(node, InList) and not node.negated:
+            found = set()
+            for value in node.values:
+                rowids = self.lookup(node.operand.name, "=", value, used)
+                if rowids is None:
+                    return None
+                found.update(rowids)
+            return sorted(found)
+        if isinstance(node, Between) and not node.negated:
+            index = self.index_for(node.operand.name, "<")
+            if index is None:
+                return None
+            if used is not None:
+                used.append(index)
+            with self.lock:
+                return sorted(index.tree.range(low=node.low, high=node.high))
+        if isinstance(node, Const) and not node.value:
+            return []
+        if isinstance(node, And):
+            # Any indexed conjunct narrows the rows; intersect all of them
+            found = None
+            for item in node.items:
+                rowids = self.candidates(item, used)
+                if rowids is not None:
+                    found = set(rowids) if found is None else found.intersection(rowids)
+            return None if found is None else sorted(found)
+        if isinstance(node, Or):
+            found = set()
+            for item in node.items:
+                rowids = self.candidates(item, used)
+                if rowids is None:
+                    return None
+                found.update(rowids)
+            return sorted(found)
+        return None
+
+    def _key(self, column, value):
+        try:
+            return Schema_Manager.coerce(self.column_types.get(column, "TEXT"), value)
+        except ValueError:
+            return None
+
+    def on_insert(self, rowid, row):
+        with self.lock:
+            for index in self._load().values():
+                index.add(self._key(index.column, row[self.positions[index.column]]), rowid)
+
+    def on_update(self, rowid, old_row, new_row):
+        with self.lock:
+            for index in self._load().values():
+                position = self.positions[index.column]
+                old = self._key(index.column, old_row[position])
+                new = self._key(index.column, new_row[position])
+                if old != new:
+                    index.remove(old, rowid)
+                    index.add(new, rowid)
+
+    def on_delete(self, rowid, row):
+        with self.lock:
+            for index in self._load().values():
+                index.remove(self._key(index.column, row[self.positions[index.column]]), rowid)
+
+    def discard_unflushed(self):
+        # A failed checkpoint leaves changes for pages that were never
+        # written; forget them and reload from the index files on next use.
+        with self.lock:
+            self.indexes = None
+
+    def flush(self):
+        # Called by the checkpointer once the table pages are flushed
+        if self.indexes is None:
+            return
+        signature = self.storage.signature()
+        with self.lock:
+            for index in self.indexes.values():
+                index.flush(signature)
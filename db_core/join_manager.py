@@ -0,0 +1,543 @@
+"""SELECTs joining two tables: FROM a [INNER | LEFT] JOIN b ON a.x = b.y.
+
+Each table is read by a SELECT of its own, of the columns the join needs
+and with the parts of the WHERE clause that only use that table, so its
+indexes, zone maps and partitions still narrow the read. The rows read
+are then joined one of two ways:
+
+  index nested loop: if the ON column of one table is its primary key and
+  that table is expected to read at least as many rows as the other, each
+  row of the other is looked up in its <table>_pkey index, and the table
+  is never scanned.
+
+  hash join: the side expected to read fewer rows is loaded into a hash
+  table on its ON column and the other streamed past it. A build side
+  bigger than the memory budget (TINYDBX_JOIN_MEMORY_MB) is spilled: both
+  sides are split into partition files by a hash of the ON value, and each
+  pair of files is joined in turn, split again if still too big.
+
+The rest of the WHERE clause is then applied to the joined rows, followed
+by LIMIT and OFFSET. A joined row is laid out as the columns read from
+the FROM table, then those read from the joined one, each named
+"table.column" (or "alias.column"); SELECT * gives every column so named.
+"""
+import os
+import pickle
+import tempfile
+from contextlib import ExitStack
+from itertools import chain, islice
+
+from db_core import stats
+from db_core.catalog import Catalog
+from db_core.partition_manager import PartitionManager
+from db_core.rows import projector, row_size
+from db_core.select_manager import SelectManager, index_text, limit_text
+from db_core.sql_parser import Select, Where
+from db_core.stats import Stats
+from db_core.wal_manager import WALManager
+from db_core.where_clause import (NUMERIC, Aggregate, And, Between, Compare, InList, IsNull, Like, Name, Not, Or,
+                                  WhereClause, WhereError, render)
+
+JOIN_MEMORY_BYTES = int(os.environ.get("TINYDBX_JOIN_MEMORY_MB", "64")) * 1024 * 1024
+# Spill files go to the system's temporary directory unless this is set
+JOIN_SPILL_DIR = os.environ.get("TINYDBX_JOIN_SPILL_DIR") or None
+SPILL_PARTITIONS = 16
+# A partition still over the budget at this depth is joined in memory
+# anyway: its rows likely share one ON value, which no split separates
+MAX_SPILL_DEPTH = 3
+SPILL_BATCH = 1024  # rows per pickle written to a spill file
+# Plan stages whose rows are what a table read is expected to return
+SCAN_STAGES = ("wal_read", "index_scan", "seq_scan", "parallel_scan")
+
+
+class JoinError(ValueError):
+    pass
+
+
+class Side:
+    """One table of a join, as the query names it."""
+
+    def __init__(self, db_name, table_name, alias):
+        self.table = table_name
+        self.name = alias or table_name
+        self.info = Catalog.instance().table(db_name, table_name)
+        self.partitions = PartitionManager(db_name, table_name, self.info) if self.info.partition else None
+        self.key = None  # its ON column
+        self.needed = []  # the columns read, in table order
+        self.where = None  # a Where of the parts of the WHERE clause on this table alone
+
+    def qualified(self, column):
+        return f"{self.name}.{column}"
+
+
+class JoinManager:
+    def __init__(self, db_name, select, memory_bytes=None):
+        # `memory_bytes`: the budget of a hash join's build side before it
+        # spills; TINYDBX_JOIN_MEMORY_MB by default
+        self.db_name = db_name
+        self.select = select
+        self.join = select.join
+        self.memory_bytes = JOIN_MEMORY_BYTES if memory_bytes is None else memory_bytes
+        self.left = Side(db_name, select.table, select.alias)
+        self.right = Side(db_name, self.join.table, self.join.alias)
+        if self.left.name == self.right.name:
+            raise JoinError(f"Table name '{self.left.name}' is used twice; give one of them an alias")
+        self.sides = (self.left, self.right)
+        self._plan_on()
+        self.output = self._output_columns()
+        residual = self._push_down()
+        self._plan_reads(residual)
+
+    # -- planning
+
+    def _resolve(self, name, error=JoinError):
+        # (side, column) of a column name, qualified or not; None if no
+        # table has it. Raises `error` for a name both tables have.
+        if "." in name:
+            qualifier, column = name.split(".", 1)
+            for side in self.sides:
+                if side.name == qualifier and column in side.info.column_types:
+                    return side, column
+            return None
+        found = [side for side in self.sides if name in side.info.column_types]
+        if len(found) > 1:
+            raise error(f"Column '{name}' is ambiguous: both '{self.left.name}' and '{self.right.name}' have it")
+        return (found[0], name) if found else None
+
+    def _plan_on(self):
+        keys = []
+        for name in (self.join.left, self.join.right):
+            found = self._resolve(name)
+            if found is None:
+                raise JoinError(f"Column '{name}' of the ON condition does not exist")
+            keys.append(found)
+        (first, first_column), (second, second_column) = keys
+        if first is second:
+            raise JoinError("The ON condition must compare a column of each table")
+        first.key, second.key = first_column, second_column
+        left_type = self.left.info.column_types[self.left.key]
+        right_type = self.right.info.column_types[self.right.key]
+        if left_type != right_type and not (left_type in NUMERIC and right_type in NUMERIC):
+            raise JoinError(f"Cannot join {left_type} column '{self.left.qualified(self.left.key)}' with "
+                            f"{right_type} column '{self.right.qualified(self.right.key)}'")
+
+    def _output_columns(self):
+        # (name, qualified name, type) of each result column
+        if self.select.columns == ["*"]:
+            return [(side.qualified(column), side.qualified(column), side.info.column_types[column])
+                    for side in self.sides for column in side.info.columns]
+        output = []
+        for name in self.select.columns:
+            found = self._resolve(name)
+            if found is None:
+                raise JoinError(f"Column '{name}' does not exist")
+            side, column = found
+            output.append((name, side.qualified(column), side.info.column_types[column]))
+        return output
+
+    def _push_down(self):
+        # Hands each side the parts of the WHERE clause (ANDed at its top)
+        # that use its columns alone; returns the tree of the others, which
+        # need the joined row. A LEFT join's joined table gets none: its
+        # rows are kept NULL-extended where unmatched, and the clause must
+        # see those.
+        if self.select.where is None:
+            return None
+        tree = self.select.where.tree
+        mapping = {}
+        for name in names_of(tree):
+            found = self._resolve(name, WhereError)
+            if found is not None:
+                mapping[name] = found[0].qualified(found[1])
+            elif "." in name:
+                raise WhereError(f"Column '{name}' does not exist")
+        tree = rename(tree, mapping)
+        pushed = {self.left: [], self.right: []}
+        residual = []
+        for item in conjuncts(tree):
+            used = {self._resolve(name)[0] for name in names_of(item) if name in mapping.values()}
+            side = used.pop() if len(used) == 1 else None
+            if side is None or (side is self.right and self.join.kind == "LEFT"):
+                residual.append(item)
+            else:
+                pushed[side].append(item)
+        for side, items in pushed.items():
+            if items:
+                prefix = f"{side.name}."
+                local = rename(And(tuple(items)) if len(items) > 1 else items[0],
+                               {column: column[len(prefix):] for column in mapping.values()
+                                if column.startswith(prefix)})
+                side.where = Where(render(local), local)
+        if not residual:
+            return None
+        return And(tuple(residual)) if len(residual) > 1 else residual[0]
+
+    def _plan_reads(self, residual):
+        # The columns each side reads: its ON column and those the result
+        # and the residual WHERE clause use
+        used = {qualified for _, qualified, _ in self.output}
+        if residual is not None:
+            used |= names_of(residual)
+        for side in self.sides:
+            side.needed = [column for column in side.info.columns
+                           if column == side.key or side.qualified(column) in used]
+        self.columns = {side.qualified(column): side.info.column_types[column]
+                        for side in self.sides for column in side.needed}
+        self.where = None
+        if residual is not None:
+            self.where = WhereClause.compile(render(residual), self.columns, residual)
+
+    def describe(self):
+        # (name, type) of each result column
+        return [(name, col_type) for name, _, col_type in self.output]
+
+    def _side_select(self, side):
+        return Select(side.table, side.needed, side.where, parallel=self.select.parallel)
+
+    def _side_plan(self, side):
+        if side.partitions is not None:
+            result = side.partitions.explain(self._side_select(side))
+            if "error" in result:
+                raise JoinError(result["error"])
+            return result["data"]
+        where = side.where
+        return SelectManager(self.db_name, side.table, self.select.parallel).explain(
+            side.needed, where.text if where else None, where.tree if where else None)
+
+    @staticmethod
+    def _expected(plan):
+        # The rows a side's plan is expected to read: those of its scan and
+        # WAL, for each partition it goes to
+        rows = 0
+        factor = 1
+        for row in plan:
+            if row["stage"] == "partitions":
+                factor = row["rows"] or 1
+            elif row["stage"] in SCAN_STAGES:
+                rows += row["rows"] or 0
+        return rows * factor
+
+    def _strategy(self, expected):
+        # ("index", outer side, inner side) for an index nested loop, or
+        # ("hash", build side, probe side)
+        left, right = self.sides
+        candidates = [right] if self.join.kind == "LEFT" else [left, right]
+        for inner in sorted(candidates, key=lambda side: -expected[side]):
+            outer = right if inner is left else left
+            if inner.key == inner.info.primary_key and inner.partitions is None \
+                    and expected[inner] >= expected[outer]:
+                return "index", outer, inner
+        return ("hash",) + self._build_side(expected)
+
+    def _build_side(self, expected):
+        # (build side, probe side) of a hash join: the build side is the
+        # one expected to read fewer rows
+        if expected[self.left] < expected[self.right]:
+            return self.left, self.right
+        return self.right, self.left
+
+    def _on_text(self):
+        return (f"{self.join.kind} JOIN {self.right.table}"
+                f"{'' if self.right.name == self.right.table else ' ' + self.right.name} ON "
+                f"{self.left.qualified(self.left.key)} = {self.right.qualified(self.right.key)}")
+
+    # -- running
+
+    def explain(self):
+        # The plan of each side's read, then of the join and what follows it
+        plans = {side: self._side_plan(side) for side in self.sides}
+        expected = {side: self._expected(plan) for side, plan in plans.items()}
+        how, first, second = self._strategy(expected)
+        if how == "index":
+            plan = plans[first]
+            plan.append(stats.plan_row("index_nested_loop", f"{self._on_text()}: {second.name} looked up in "
+                                       f"{second.table}_pkey for each row of {first.name}", expected[first]))
+        else:
+            plan = plans[self.left] + plans[self.right]
+            plan.append(stats.plan_row("hash_join", f"{self._on_text()}: built on {first.name}",
+                                       expected[first]))
+        return plan + self._output_plan()
+
+    def _output_plan(self):
+        plan = []
+        if self.where is not None:
+            plan.append(stats.plan_row("filter", self.where.text))
+        if self.select.limit is not None or self.select.offset:
+            plan.append(stats.plan_row("limit", limit_text(self.select.limit, self.select.offset)))
+        plan.append(stats.plan_row("project", ", ".join(name for name, _, _ in self.output)))
+        return plan
+
+    def stream(self):
+        # A generator of the joined rows, laid out as describe(). Both
+        # tables are read-locked here, as SelectManager.stream() does, so
+        # the rows are those of the tables as they are now.
+        rows = self._rows()
+        next(rows)
+        return rows
+
+    def _rows(self):
+        with ExitStack() as stack:
+            plans = {side: self._side_plan(side) for side in self.sides}
+            expected = {side: self._expected(plan) for side, plan in plans.items()}
+            how, first, second = self._strategy(expected)
+            rows = None
+            if how == "index":
+                rows = self._index_join(first, second, stack)
+            if rows is None:
+                if how == "index":
+                    # Pending updates set the key: a hash join instead
+                    first, second = self._build_side(expected)
+                # Each input is a chain of stages of its own in a trace
+                stats.branch()
+                build = self._read(first, stack)
+                build_stage = stats.branch()
+                probe = self._read(second, stack)
+                rows = stats.pipe("hash_join", self._hash_join(build, probe, first is self.left),
+                                  f"{self._on_text()}: built on {first.name}", inputs=(build_stage, stats.branch()))
+            yield  # started: stream() returns here
+            if self.where is not None:
+                rows = stats.pipe("filter", self.where.filter(rows), self.where.text)
+            limit, offset = self.select.limit, self.select.offset
+            if limit is not None or offset:
+                start = offset or 0
+                rows = stats.pipe("limit", islice(rows, start, None if limit is None else start + limit),
+                                  limit_text(limit, offset))
+            names = [qualified for _, qualified, _ in self.output]
+            rows = stats.pipe("project", map(projector(list(self.columns), names), rows),
+                              ", ".join(name for name, _, _ in self.output))
+            yield from rows
+
+    def _read(self, side, stack):
+        # The rows of a side, laid out as side.needed; a stream is closed
+        # with the join
+        if side.partitions is not None:
+            result = side.partitions.select(self._side_select(side))
+            if "error" in result:
+                raise JoinError(result["error"])
+            stack.callback(result["data"].close)
+            return result["data"]
+        where = side.where
+        rows = SelectManager(self.db_name, side.table, self.select.parallel).stream(
+            side.needed, where.text if where else None, where.tree if where else None)
+        stack.callback(rows.close)
+        return rows
+
+    def _index_join(self, outer, inner, stack):
+        # The joined rows of an index nested loop, or None if the index
+        # can't be used: pending WAL updates set the key, so rows the index
+        # doesn't list for a value may have it now
+        manager = SelectManager(self.db_name, inner.table)
+        where = manager.compile_where(inner.where.text, inner.where.tree) if inner.where is not None else None
+        index = manager.indexes.index_for(inner.key, "=")
+        if index is None:
+            return None
+        lock = manager.rw_lock
+        lock.acquire_read()
+        try:
+            entries = manager._read_wal()
+            if inner.key in manager._updated_columns(entries):
+                lock.release_read()
+                return None
+        except BaseException:
+            lock.release_read()
+            raise
+        stack.callback(lock.release_read)
+        rows = self._index_rows(manager, entries, where, self._read(outer, stack), outer, inner)
+        stack.callback(rows.close)
+        return stats.pipe("index_nested_loop", rows, f"{self._on_text()}: {inner.name} looked up in "
+                                                     f"{index_text([index])}")
+
+    def _index_rows(self, manager, entries, where, outer_rows, outer, inner):
+        # Looks each outer row's key up in the inner table's checkpointed
+        # rows through the index, with the WAL's pending changes applied,
+        # and in the rows the WAL inserts
+        columns = manager.storage.open().codec.columns
+        position = columns.index(inner.key)
+        logged = {}
+        for row in manager.wal.overlay(iter(()), entries):
+            logged.setdefault(row[position], []).append(row)
+        mods = manager.wal.mods(entries)
+        apply_ops = WALManager.apply_ops
+        lookup = manager.indexes.lookup
+        fetch = manager.storage.fetch
+        project = projector(columns, inner.needed)
+        key_position = outer.needed.index(outer.key)
+        outer_first = outer is self.left
+        keep = self.join.kind == "LEFT"
+        nulls = (None,) * len(inner.needed)
+        scanned = 0
+        try:
+            for row in outer_rows:
+                key = row[key_position]
+                matched = False
+                if key is not None:
+                    found = []
+                    for rowid in lookup(inner.key, "=", key) or ():
+                        scanned += 1
+                        found_row = fetch(rowid)
+                        if found_row is not None and mods:
+                            found_row = apply_ops(found_row, mods)
+                        if found_row is not None:
+                            found.append(found_row)
+                    for found_row in chain(found, logged.get(key, ())):
+                        if where is None or where.matches(found_row):
+                            matched = True
+                            yield row + project(found_row) if outer_first else project(found_row) + row
+                if keep and not matched:
+                    yield row + nulls
+        finally:
+            Stats.instance().add(self.db_name, inner.table, rows_scanned=scanned)
+
+    def _hash_join(self, build, probe, build_left, depth=0):
+        # Joins two row iterators on their ON columns, holding `build` in
+        # a hash table on its key; `build_left` if the build rows are the
+        # FROM table's. Spills to disk past the memory budget.
+        build_side, probe_side = (self.left, self.right) if build_left else (self.right, self.left)
+        build_position = build_side.needed.index(build_side.key)
+        probe_position = probe_side.needed.index(probe_side.key)
+        # A LEFT join keeps the FROM table's unmatched rows, NULL-extended
+        keep_build = build_left and self.join.kind == "LEFT"
+        keep_probe = not build_left and self.join.kind == "LEFT"
+        nulls = (None,) * len(self.right.needed)
+        table = {}
+        size = 0
+        budget = self.memory_bytes
+        build = iter(build)
+        for row in build:
+            key = row[build_position]
+            if key is None:
+                if keep_build:
+                    yield row + nulls
+                continue
+            bucket = table.get(key)
+            if bucket is None:
+                table[key] = [row]
+            else:
+                bucket.append(row)
+            size += row_size(row)
+            if size > budget and depth < MAX_SPILL_DEPTH:
+                rows = chain(chain.from_iterable(table.values()), build)
+                table = None  # freed once written out
+                yield from self._spill(rows, probe, build_left, depth)
+                return
+        matched = set()
+        for row in probe:
+            key = row[probe_position]
+            bucket = table.get(key) if key is not None else None
+            if bucket is None:
+                if keep_probe:
+                    yield row + nulls
+                continue
+            if keep_build:
+                matched.add(key)
+            if build_left:
+                for build_row in bucket:
+                    yield build_row + row
+            else:
+                for build_row in bucket:
+                    yield row + build_row
+        if keep_build:
+            for key, bucket in table.items():
+                if key not in matched:
+                    for build_row in bucket:
+                        yield build_row + nulls
+
+    def _spill(self, build, probe, build_left, depth):
+        # Grace hash join: both inputs split into partition files by a hash
+        # of their key, salted by `depth` so a partition spilled again
+        # splits differently, then joined a pair of files at a time
+        build_side, probe_side = (self.left, self.right) if build_left else (self.right, self.left)
+        with tempfile.TemporaryDirectory(prefix="join-", dir=JOIN_SPILL_DIR) as spill_dir:
+            with stats.stage("spill", f"{SPILL_PARTITIONS} partitions, level {depth + 1}") as stage:
+                build_files, build_rows = write_partitions(
+                    build, build_side.needed.index(build_side.key), os.path.join(spill_dir, "build"), depth)
+                probe_files, probe_rows = write_partitions(
+                    probe, probe_side.needed.index(probe_side.key), os.path.join(spill_dir, "probe"), depth)
+                if stage is not None:
+                    stage.rows = build_rows + probe_rows
+            for build_file, probe_file in zip(build_files, probe_files):
+                yield from self._hash_join(read_partition(build_file), read_partition(probe_file), build_left,
+                                           depth + 1)
+
+
+def write_partitions(rows, position, prefix, depth):
+    # Splits `rows` over SPILL_PARTITIONS files by a hash of their value at
+    # `position`; returns (the files' paths, the rows written)
+    paths = [f"{prefix}{number}" for number in range(SPILL_PARTITIONS)]
+    files = [open(path, "wb") for path in paths]
+    batches = [[] for _ in paths]
+    count = 0
+    try:
+        for row in rows:
+            number = hash((depth, row[position])) % SPILL_PARTITIONS
+            batch = batches[number]
+            batch.append(row)
+            if len(batch) >= SPILL_BATCH:
+                pickle.dump(batch, files[number], pickle.HIGHEST_PROTOCOL)
+                batch.clear()
+            count += 1
+        for batch, f in zip(batches, files):
+            if batch:
+                pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+    finally:
+        for f in files:
+            f.close()
+    return paths, count
+
+
+def read_partition(path):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+            yield from batch
+
+
+def conjuncts(node):
+    # The items ANDed at the top of a tree
+    if isinstance(node, And):
+        return [found for item in node.items for found in conjuncts(item)]
+    return [node]
+
+
+def names_of(node):
+    # The names a parsed tree uses as operands: columns, or bare words read as text
+    if isinstance(node, Name) and not isinstance(node, Aggregate):
+        return {node.name}
+    if isinstance(node, (And, Or)):
+        return set().union(*(names_of(item) for item in node.items))
+    if isinstance(node, Not):
+        return names_of(node.item)
+    if isinstance(node, Compare):
+        return names_of(node.left) | names_of(node.right)
+    if isinstance(node, InList):
+        return names_of(node.operand).union(*(names_of(value) for value in node.values))
+    if isinstance(node, Between):
+        return names_of(node.operand) | names_of(node.low) | names_of(node.high)
+    if isinstance(node, (Like, IsNull)):
+        return names_of(node.operand)  # a LIKE pattern is text, even spelled as a bare word
+    return set()
+
+
+def rename(node, names):
+    # A parsed tree with the names in `names` replaced by what they map to
+    if isinstance(node, Name) and not isinstance(node, Aggregate):
+        return Name(names.get(node.name, node.name))
+    if isinstance(node, (And, Or)):
+        return type(node)(tuple(rename(item, names) for item in node.items))
+    if isinstance(node, Not):
+        return Not(rename(node.item, names))
+    if isinstance(node, Compare):
+        return Compare(node.op, rename(node.left, names), rename(node.right, names))
+    if isinstance(node, InList):
+        return InList(rename(node.operand, names), tuple(rename(value, names) for value in node.values),
+                      node.negated)
+    if isinstance(node, Between):
+        return Between(rename(node.operand, names), rename(node.low, names), rename(node.high, names), node.negated)
+    if isinstance(node, Like):
+        return Like(rename(node.operand, names), node.pattern, node.negated)
+    if isinstance(node, IsNull):
+        return IsNull(rename(node.operand, names), node.negated)
+    return node
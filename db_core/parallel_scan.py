@@ -0,0 +1,153 @@
+"""Table scans split over the segment files of a table (see HeapFile) and
+run in a pool of worker processes, so one large SELECT can use every
+core.
+
+The pool has SCAN_WORKERS processes (TINYDBX_SCAN_WORKERS, or one per
+core; the servers take --scan-workers). A SELECT uses as many as it is
+allowed, all of them unless it says PARALLEL n, and splits the table's
+segments between them in order. Each process reads its pages from the
+files directly, applies the WAL's pending updates and deletes and the
+WHERE clause, and returns the matching rows, or with GROUP BY or
+aggregates, its partial groups. The session concatenates them in segment
+order, so rows come back in the order a sequential scan gives.
+
+Processes are started with "spawn", so a script using the engine must
+keep its top-level code under `if __name__ == "__main__":`.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from itertools import chain, islice
+
+from db_core.buffer_pool import BufferPool
+from db_core.heap_file import HeapFile
+from db_core.rows import projector
+from db_core.storage_manager import RowCodec
+from db_core.wal_manager import WALManager
+from db_core.where_clause import WhereClause
+
+SCAN_WORKERS = int(os.environ.get("TINYDBX_SCAN_WORKERS", "0")) or os.cpu_count() or 1
+# Buffer pool of a worker for one task: the pages are read once each
+TASK_POOL_BYTES = 1024 * 1024
+
+
+@dataclass
+class ScanTask:
+    # What a worker runs over its pages: with group_by set, aggregate_rows()
+    # of `aggregates`; else the rows, projected to `output` and at most
+    # `limit` of them
+    output: list = None
+    limit: int = None
+    group_by: list = None
+    aggregates: list = None
+    # Filled in by SelectManager.scan_parallel()
+    data_path: str = None
+    strings_path: str = None
+    columns: list = field(default_factory=list)  # the schema's column dicts
+    pages: list = field(default_factory=list)  # (first page, end page) ranges
+    mods: list = field(default_factory=list)  # WAL updates/deletes, see mod_spec()
+    where: str = None
+
+
+def mod_spec(op):
+    # A compiled WAL update or delete as a worker can take it: the clause
+    # as text, compiled again on the other side
+    return (op[0], op[1].text, *op[2:])
+
+
+def split(segments, parts):
+    # `segments` in at most `parts` runs of consecutive ones
+    size = -(-len(segments) // parts)
+    return [segments[i:i + size] for i in range(0, len(segments), size)]
+
+
+class ScanPool:
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @classmethod
+    def configure(cls, workers):
+        # Sets the processes of the process-wide pool, replacing a running one
+        with cls._instance_lock:
+            previous, cls._instance = cls._instance, cls(workers)
+        if previous is not None:
+            previous.shutdown()
+
+    def __init__(self, workers=None):
+        self.workers = max(1, workers or SCAN_WORKERS)
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def degree(self, requested=None):
+        # Processes a scan is split over: PARALLEL n, up to the pool's size
+        return self.workers if requested is None else max(1, min(requested, self.workers))
+
+    def run(self, tasks):
+        # The result of each task, in order; None if the pool broke (a worker
+        # was killed), which the caller takes as a cue to scan by itself
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            executor = self.executor
+        try:
+            return list(executor.map(scan_segments, tasks))
+        except BrokenProcessPool:
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = None
+            executor.shutdown(wait=False)
+            return None
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+def scan_segments(task):
+    # Runs in a worker: returns (rows read, result) for one ScanTask
+    pool = BufferPool(TASK_POOL_BYTES)
+    try:
+        heap = HeapFile(task.data_path, pool=pool).open()
+        strings = heap.string_heap(task.strings_path).reader()
+        codec = RowCodec(task.columns)
+        column_types = dict(zip(codec.columns, codec.types))
+        scanned = [0]
+        rows = chain.from_iterable(_decode(heap, codec, strings, task.pages, scanned))
+        if task.mods:
+            mods = [(kind, WhereClause.compile(text, column_types), *rest) for kind, text, *rest in task.mods]
+            apply_ops = WALManager.apply_ops
+            rows = (row for row in (apply_ops(row, mods) for row in rows) if row is not None)
+        if task.where is not None:
+            rows = WhereClause.compile(task.where, column_types).filter(rows)
+        if task.group_by is not None:
+            # Imported here: aggregate_manager imports select_manager, which imports this module
+            from db_core.aggregate_manager import aggregate_rows
+            return scanned[0], aggregate_rows(rows, task.group_by, task.aggregates, column_types)
+        if task.limit is not None:
+            rows = islice(rows, task.limit)
+        if task.output != ["*"]:
+            rows = map(projector(codec.columns, task.output), rows)
+        return scanned[0], list(rows)
+    finally:
+        pool.close()
+
+
+def _decode(heap, codec, strings, pages, scanned):
+    # The rows of each page in turn, one list per page
+    for start, end in pages:
+        for _, slots, records in heap.scan_pages(start, end):
+            scanned[0] += len(slots)
+            yield codec.decode_many(records, strings)
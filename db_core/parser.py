@@ -1,224 +1,579 @@
-import os
-import re
-from pathlib import Path
+import json
+import time
 
 from db_core.db_manager import DBManager
 from db_core.table_manager import TableManager
 from db_core.Insert_manager import InsertManager
-from db_core.select_manager import SelectManager
+from db_core.select_manager import Cursor, SelectManager
+from db_core.aggregate_manager import AggregateError, AggregateManager
 from db_core.update_manager import UpdateManager
 from db_core.delete_manager import DeleteManager
-
-DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+from db_core.copy_manager import CopyManager
+from db_core.checkpoint_manager import Checkpointer
+from db_core.catalog import Catalog
+from db_core.index_manager import IndexManager
+from db_core.join_manager import JoinError, JoinManager
+from db_core.partition_manager import PartitionManager, WorkerError
+from db_core.result_cache import ResultCache, select_key
+from db_core.rows import as_dicts
+from db_core.buffer_pool import BufferPool
+from db_core.storage_manager import TableStorage
+from db_core import stats
+from db_core.stats import Stats, Trace
+from db_core.wal_manager import WALManager
+from db_core import sql_parser as ast
+from db_core.sql_lexer import SQLSyntaxError
+from db_core.where_clause import WhereError
+
+# Statements counted in SHOW STATS, under their kind's counter
+COUNTED = {ast.Select: "selects", ast.Insert: "inserts", ast.Copy: "inserts",
+           ast.Update: "updates", ast.Delete: "deletes"}
 
 class Parser:
+    HANDLERS = {
+        ast.UseDatabase: "parse_use",
+        ast.CreateDatabase: "parse_create_db",
+        ast.CreateTable: "parse_create_table",
+        ast.CreateIndex: "parse_create_index",
+        ast.DropIndex: "parse_drop_index",
+        ast.Insert: "parse_insert",
+        ast.Select: "parse_select",
+        ast.Update: "parse_update",
+        ast.Delete: "parse_delete",
+        ast.Checkpoint: "parse_checkpoint",
+        ast.Copy: "parse_copy",
+        ast.Prepare: "parse_prepare",
+        ast.Execute: "parse_execute",
+        ast.Deallocate: "parse_deallocate",
+        ast.Declare: "parse_declare",
+        ast.Fetch: "parse_fetch",
+        ast.Close: "parse_close",
+        ast.Explain: "parse_explain",
+        ast.ShowStats: "parse_show_stats",
+    }
+
     def __init__(self):
         self.active_db = None
+        # Prepared statements belong to the session, like the active database
+        self.prepared = {}
+        self.cursors = {}
+        # Set by sessions that send rows as they are produced: a SELECT then
+        # returns "columns" and a generator of rows as its "data"
+        self.stream_rows = False
+        self.catalog = Catalog.instance()
+        self.stats = Stats.instance()
+        self.result_cache = ResultCache.instance()
+        self.parse_seconds = 0.0  # of the statement being run
 
     def route(self, command: str):
-        cmd = command.strip().rstrip(";").strip()
-        if not cmd:
-            return {"error": "Empty command"}
-
-        # Use command
-        if re.match(r"^\s*USE\s+(\w+)\s*$", cmd, re.IGNORECASE):
-            return self.parse_use(cmd)
-
-        # CREATE DATABASE
-        if re.match(r"^\s*CREATE\s+DATABASE\s+(\w+)\s*$", cmd, re.IGNORECASE):
-            return self.parse_create_db(cmd)
-
-        # CREATE TABLE
-        if "CREATE TABLE" in cmd.upper():
-            return self.parse_create_table(cmd)
-
-        # INSERT
-        if re.match(r"^\s*INSERT\s+INTO\s+(\w+)\s+VALUES\s*\(.+\)\s*$", cmd, re.IGNORECASE):
-            return self.parse_insert(cmd)
-
-        # SELECT
-        if re.match(r"^\s*SELECT\s+.+\s+FROM\s+(\w+)(?:\s+WHERE\s+.+)?\s*$", cmd, re.IGNORECASE):
-            return self.parse_select(cmd)
-
-        # UPDATE
-        if re.match(r"^\s*UPDATE\s+(\w+)\s+SET\s+.+\s+WHERE\s+.+\s*$", cmd, re.IGNORECASE):
-            return self.parse_update(cmd)
-
-        # DELETE
-        if re.match(r"^\s*DELETE\s+FROM\s+(\w+)\s+WHERE\s+.+\s*$", cmd, re.IGNORECASE):
-            return self.parse_delete(cmd)
-
-        return {"error": "Unsupported or invalid command"}
-
-    def parse_use(self, cmd: str):
-        m = re.match(r"^\s*USE\s+(\w+)\s*$", cmd, re.IGNORECASE)
-        if not m:
-            return {"error": "Invalid USE syntax"}
-        self.active_db = m.group(1)
+        # One pass of the lexer and parser turns the command into a statement
+        # object, which is handed to the parse_* method for its type.
+        start = time.perf_counter()
+        try:
+            statement = ast.parse(command)
+        except SQLSyntaxError as e:
+            message = str(e)
+            if message in ("Empty command", "Unsupported or invalid command"):
+                return {"error": message}
+            return {"error": f"Syntax error: {message}"}
+        self.parse_seconds = time.perf_counter() - start
+        return self.run(statement)
+
+    def run(self, statement):
+        # Runs a parsed statement and counts it against its table. While hooks are
+        # registered it is traced, and they are told how it went.
+        handler = getattr(self, self.HANDLERS[type(statement)])
+        if not self.stats.hooks or stats.active() is not None:
+            result = handler(statement)
+            self._count(statement, result)
+            return result
+        trace = Trace()
+        trace.add("parse", self.parse_seconds)
+        start = time.perf_counter()
+        with stats.tracing(trace):
+            result = handler(statement)
+        seconds = time.perf_counter() - start
+        self._count(statement, result)
+        self.stats.notify({
+            "database": self.active_db,
+            "table": getattr(statement, "table", None),
+            "statement": type(statement).__name__,
+            "seconds": seconds,
+            "error": not isinstance(result, dict) or "error" in result,
+            "stages": trace.as_rows(),
+        })
+        return result
+
+    def _count(self, statement, result):
+        kind = COUNTED.get(type(statement))
+        if kind is None or not isinstance(result, dict) or "error" in result:
+            return
+        counts = {"statements": 1, kind: 1}
+        if isinstance(statement, ast.Insert):
+            counts["rows_inserted"] = len(statement.rows)
+        elif isinstance(statement, ast.Copy):
+            counts["rows_inserted"] = result.get("rows", 0)
+        self.stats.add(self.active_db, statement.table, **counts)
+
+    def parse_use(self, statement):
+        self.active_db = statement.name
         # Check if the database exists
-        db_manager = DBManager(self.active_db)
-        print(db_manager)
-        if not db_manager.database_exists():
+        if not self.catalog.database_exists(self.active_db):
             return {"error": f"Database '{self.active_db}' does not exist."}
         return {"success": f"Using database {self.active_db}"}
 
-    def parse_create_db(self, command: str):
-        command = command.strip().rstrip(";")
-        match = re.match(r"CREATE\s+DATABASE\s+(\w+)", command, re.IGNORECASE)
-        if match:
-            db_name = match.group(1)
-            db = DBManager(db_name)
-            return db.create_db()
-        return "Invalid CREATE DATABASE syntax"
-
-    def parse_create_table(self, command: str):
-        command = command.strip().rstrip(";")
+    def parse_create_db(self, statement):
+        db = DBManager(statement.name)
+        return db.create_db()
 
+    def parse_create_table(self, statement):
         if not self.active_db:
             return {"error": "No active database. Use 'USE <dbname>;'"}
 
-        match_table = re.search(r"CREATE\s+TABLE\s+(\w+)\s*\((.+)\)", command, re.IGNORECASE)
-        if not match_table:
-            return "Invalid CREATE TABLE syntax"
-
-        table_name = match_table.group(1)
-        columns_str = match_table.group(2)
-        columns_list = self._parse_columns(columns_str)
-
+        columns_list = [{"name": col.name, "type": col.type, "constraints": col.constraints}
+                        for col in statement.columns]
         schema = {"columns": columns_list}
+        if statement.partition_by is not None:
+            schema["partition"] = {"column": statement.partition_by, "count": statement.partitions}
+        if statement.compression not in (None, "none"):
+            schema["compression"] = statement.compression
 
-        table = TableManager(self.active_db, table_name, schema)
+        table = TableManager(self.active_db, statement.table, schema)
         return table.create_table()
 
-    def _parse_columns(self, columns_str: str):
-        columns = [col.strip() for col in columns_str.split(",")]
+    def parse_create_index(self, statement):
+        if not self.active_db:
+            return {"error": "No active database. Use 'USE <dbname>;'"}
 
-        schema = []
-        for col in columns:
-            parts = col.split()
-            col_name = parts[0]
-            col_type = parts[1].upper()
-            constraints = [p.upper() for p in parts[2:]] if len(parts) > 2 else []
+        if not self._table_exists(self.active_db, statement.table):
+            return {"error": f"Table '{statement.table}' does not exist in database '{self.active_db}'."}
+        if self._partitions(statement.table) is not None:
+            return {"error": f"Indexes on partitioned table '{statement.table}' are not supported."}
+        # Index names are unique per database so DROP INDEX can find them
+        owner = self._find_index(statement.name)
+        if owner:
+            return {"error": f"Index '{statement.name}' already exists on table '{owner}'."}
 
-            schema.append({"name": col_name, "type": col_type, "constraints": constraints})
-        return schema
+        indexes = IndexManager.for_table(self.active_db, statement.table)
+        return indexes.create_index(statement.name, statement.column, statement.using)
 
-    def parse_insert(self, command: str):
+    def parse_drop_index(self, statement):
         if not self.active_db:
             return {"error": "No active database. Use 'USE <dbname>;'"}
 
-        m = re.match(r"^\s*INSERT\s+INTO\s+(\w+)\s+VALUES\s*\((.+)\)\s*$", command, re.IGNORECASE)
-        if not m:
-            return {"error": "Invalid Insert Syntax"}
+        table_name = statement.table
+        if table_name is None:
+            table_name = self._find_index(statement.name)
+            if table_name is None:
+                return {"error": f"Index '{statement.name}' does not exist in database '{self.active_db}'."}
+        elif not self._table_exists(self.active_db, table_name):
+            return {"error": f"Table '{table_name}' does not exist in database '{self.active_db}'."}
+        if self._partitions(table_name) is not None:
+            return {"error": f"Indexes on partitioned table '{table_name}' are not supported."}
 
-        table_name = m.group(1)
+        return IndexManager.for_table(self.active_db, table_name).drop_index(statement.name)
+
+    def _find_index(self, index_name):
+        for table_name in self.catalog.tables(self.active_db):
+            if IndexManager.for_table(self.active_db, table_name).has_index(index_name):
+                return table_name
+        return None
+
+    def parse_insert(self, statement):
+        if not self.active_db:
+            return {"error": "No active database. Use 'USE <dbname>;'"}
+
+        table_name = statement.table
         if not self._table_exists(self.active_db, table_name):
             return {"error": f"Table '{table_name}' does not exist in database '{self.active_db}'"}
-        
-        values_str = m.group(2)
-        raw_values = [self._unquote(v.strip()) for v in self._split_commas_respecting_quotes(values_str)]
-
-        norm_values = []
-        for v in raw_values:
-            if v.isdigit():
-                norm_values.append(int(v))
-            else:
-                try:
-                    norm_values.append(float(v))
-                except ValueError:
-                    if v.lower() == "true":
-                        norm_values.append(True)
-                    elif v.lower() == "false":
-                        norm_values.append(False)
-                    else:
-                        norm_values.append(v)
 
+        partitions = self._partitions(table_name)
+        if partitions is not None:
+            return partitions.insert_rows(statement.rows)
         insert = InsertManager(self.active_db, table_name)
-        return insert.insert_values(norm_values)
+        if len(statement.rows) == 1:
+            return insert.insert_values(statement.rows[0])
+        return insert.insert_rows(statement.rows)
 
-    def parse_select(self, command: str):
+    def parse_copy(self, statement):
         if not self.active_db:
-            return {"error": "No active database selected. Use 'USE <dbname>;' before a SELECT statement."}
+            return {"error": "No active database. Use 'USE <dbname>;'"}
 
-        m = re.match(r"^\s*SELECT\s+(.+)\s+FROM\s+(\w+)(?:\s+WHERE\s+(.+))?\s*$", command, re.IGNORECASE)
-        if not m:
-            return {"error": "Invalid SELECT syntax."}
+        table_name = statement.table
+        if not self._table_exists(self.active_db, table_name):
+            return {"error": f"Table '{table_name}' does not exist in database '{self.active_db}'"}
 
-        columns_str, table_name, where_clause = m.groups()
-        columns = [c.strip() for c in columns_str.split(",")]
+        copy_manager = CopyManager(self.active_db, table_name, self._partitions(table_name))
+        return copy_manager.copy_from(statement.path, statement.format, statement.header)
 
-        if not self._table_exists(self.active_db, table_name):
-            return {"error": f"Table '{table_name}' does not exist in database '{self.active_db}'."}
+    def parse_select(self, statement):
+        if not self.active_db:
+            return {"error": "No active database selected. Use 'USE <dbname>;' before a SELECT statement."}
 
+        table_name = statement.table
+        for name in statement.tables:
+            if not self._table_exists(self.active_db, name):
+                return {"error": f"Table '{name}' does not exist in database '{self.active_db}'."}
+        unknown = self._unknown_column(statement)
+        if unknown is not None:
+            return unknown
+
+        # A result cached since its tables last changed is sent again without
+        # reading them
+        cache = self.result_cache if statement.cache and self.result_cache.enabled else None
+        if cache is not None:
+            key = select_key(self.active_db, statement)
+            entry = cache.get(key)
+            if entry is not None:
+                rows = stats.pipe("result_cache", (row for row in entry.rows), "hit")
+                return self._select_result(table_name, entry.description, rows)
+            tables = tuple((self.active_db, name) for name in dict.fromkeys(statement.tables))
+            versions = cache.versions(tables)
+
+        where = statement.where
+        where_text, where_tree = (where.text, where.tree) if where is not None else (None, None)
+        partitions = self._partitions(table_name)
         try:
-            select_manager = SelectManager(self.active_db, table_name)
-            result = select_manager.select(columns, where_clause)
-            return {"success": f"Selected data from '{table_name}'", "data": result}
+            # Rows come back as a generator of tuples; streamed they are sent
+            # as they are, with their description, else as dicts
+            if statement.join is not None:
+                join = JoinManager(self.active_db, statement)
+                rows = join.stream()
+                description = join.describe()
+            elif partitions is not None:
+                result = partitions.select(statement)
+                if "data" not in result:
+                    return result
+                description = partitions.describe(statement)
+                rows = result["data"]
+            else:
+                # Streamed rows are read as they are sent; unstreamed ones are
+                # all kept anyway, so the scan may be split over processes
+                select_manager = self._select_manager(statement)
+                read = select_manager.stream if self.stream_rows else select_manager.select
+                rows = read(statement.columns, where_text, where_tree, statement.limit, statement.offset)
+                description = select_manager.describe(statement.columns)
+            if cache is not None:
+                rows = cache.collect(key, tables, versions, description, rows)
+            return self._select_result(table_name, description, rows)
+        except WhereError as e:
+            return {"error": f"Invalid WHERE clause: {e}"}
+        except (AggregateError, JoinError) as e:
+            return {"error": str(e)}
         except Exception as e:
             return {"error": f"An unexpected error occurred during SELECT operation: {e}"}
 
-    def parse_update(self, command: str):
+    def _select_result(self, table_name, description, rows):
+        # Unstreamed, each row is turned into its dict as the scan gives it,
+        # so the rows are never held as tuples and dicts at once
+        if self.stream_rows:
+            return {"success": f"Selected data from '{table_name}'", "columns": description, "data": rows}
+        return {"success": f"Selected data from '{table_name}'",
+                "data": as_dicts([name for name, _ in description], rows)}
+
+    def _select_manager(self, select):
+        # Grouped SELECTs are reduced to their groups by the AggregateManager,
+        # which runs them the same way
+        if not select.grouped:
+            return SelectManager(self.active_db, select.table, select.parallel)
+        having = select.having
+        return AggregateManager(self.active_db, select.table, select.group_by,
+                                having.text if having is not None else None,
+                                having.tree if having is not None else None, parallel=select.parallel)
+
+    def parse_update(self, statement):
         if not self.active_db:
             return {"error": "No active database selected. Use 'USE <dbname>;' before an UPDATE statement."}
 
-        m = re.match(r"^\s*UPDATE\s+(\w+)\s+SET\s+(.+)\s+WHERE\s+(.+)\s*$", command, re.IGNORECASE)
-        if not m:
-            return {"error": "Invalid UPDATE syntax."}
-
-        table_name, set_clause, where_clause = m.groups()
-
+        table_name = statement.table
         if not self._table_exists(self.active_db, table_name):
             return {"error": f"Table '{table_name}' does not exist in database '{self.active_db}'."}
 
+        partitions = self._partitions(table_name)
+        if partitions is not None:
+            return partitions.update(statement)
         update_manager = UpdateManager(self.active_db, table_name)
-        return update_manager.update(set_clause, where_clause)
+        return update_manager.update(statement.set_text, statement.where.text, statement.where.tree)
 
-    def parse_delete(self, command: str):
+    def parse_delete(self, statement):
         if not self.active_db:
             return {"error": "No active database selected. Use 'USE <dbname>;' before a DELETE statement."}
 
-        m = re.match(r"^\s*DELETE\s+FROM\s+(\w+)\s+WHERE\s+(.+)\s*$", command, re.IGNORECASE)
-        if not m:
-            return {"error": "Invalid DELETE syntax."}
-
-        table_name, where_clause = m.groups()
-
+        table_name = statement.table
         if not self._table_exists(self.active_db, table_name):
             return {"error": f"Table '{table_name}' does not exist in database '{self.active_db}'."}
 
+        partitions = self._partitions(table_name)
+        if partitions is not None:
+            return partitions.delete(statement)
         delete_manager = DeleteManager(self.active_db, table_name)
-        return delete_manager.delete(where_clause)
-
-    def _split_commas_respecting_quotes(self, s: str):
-        items = []
-        cur = []
-        in_sq = False
-        in_dq = False
-        i = 0
-        while i < len(s):
-            ch = s[i]
-            if ch == "'" and not in_dq:
-                in_sq = not in_sq
-                cur.append(ch)
-            elif ch == '"' and not in_sq:
-                in_dq = not in_dq
-                cur.append(ch)
-            elif ch == "," and not in_sq and not in_dq:
-                items.append("".join(cur).strip())
-                cur = []
+        return delete_manager.delete(statement.where.text, statement.where.tree)
+
+    def parse_checkpoint(self, statement):
+        if not self.active_db:
+            return {"error": "No active database selected. Use 'USE <dbname>;' before a CHECKPOINT statement."}
+
+        table_name = statement.table
+        if table_name:
+            if not self._table_exists(self.active_db, table_name):
+                return {"error": f"Table '{table_name}' does not exist in database '{self.active_db}'."}
+            tables = [table_name]
+        else:
+            tables = self.catalog.tables(self.active_db)
+
+        results = {table: self._checkpoint(table) for table in tables}
+        errors = {table: r["error"] for table, r in results.items() if "error" in r}
+        if errors:
+            return {"error": "Checkpoint failed for some tables.", "details": errors}
+        deferred = [table for table, r in results.items() if r.get("deferred")]
+        if deferred:
+            return {"success": f"Checkpoint complete for {len(tables) - len(deferred)} table(s) in "
+                               f"'{self.active_db}'; deferred for tables being read.",
+                    "deferred": deferred}
+        return {"success": f"Checkpoint complete for {len(tables)} table(s) in '{self.active_db}'."}
+
+    def _checkpoint(self, table_name):
+        partitions = self._partitions(table_name)
+        if partitions is not None:
+            return partitions.checkpoint()
+        return Checkpointer.instance().checkpoint(self.active_db, table_name)
+
+    def parse_prepare(self, statement):
+        if statement.name in self.prepared:
+            return {"error": f"Prepared statement '{statement.name}' already exists."}
+        self.prepared[statement.name] = statement
+        return {"success": f"Prepared statement '{statement.name}' with {statement.params} parameter(s)."}
+
+    def parse_execute(self, statement):
+        return self.execute(statement.name, statement.args)
+
+    def execute(self, name, args=()):
+        # Runs a prepared statement; `args` are bound as the typed values given
+        prepared = self.prepared.get(name)
+        if prepared is None:
+            return {"error": f"Prepared statement '{name}' does not exist."}
+        return self.run_prepared(prepared, args)
+
+    def run_prepared(self, prepared, args=()):
+        try:
+            statement = ast.bind(prepared, args)
+        except SQLSyntaxError as e:
+            return {"error": str(e)}
+        return self.run(statement)
+
+    def parse_deallocate(self, statement):
+        if statement.name is None:
+            self.prepared.clear()
+            return {"success": "All prepared statements deallocated."}
+        if self.prepared.pop(statement.name, None) is None:
+            return {"error": f"Prepared statement '{statement.name}' does not exist."}
+        return {"success": f"Prepared statement '{statement.name}' deallocated."}
+
+    def parse_declare(self, statement):
+        if not self.active_db:
+            return {"error": "No active database selected. Use 'USE <dbname>;' before a DECLARE statement."}
+        if statement.name in self.cursors:
+            return {"error": f"Cursor '{statement.name}' already exists."}
+
+        select = statement.statement
+        for name in select.tables:
+            if not self._table_exists(self.active_db, name):
+                return {"error": f"Table '{name}' does not exist in database '{self.active_db}'."}
+        unknown = self._unknown_column(select)
+        if unknown is not None:
+            return unknown
+        where = select.where
+        where_text, where_tree = (where.text, where.tree) if where is not None else (None, None)
+        partitions = self._partitions(select.table)
+        try:
+            if select.join is not None:
+                join = JoinManager(self.active_db, select)
+                rows = join.stream()
+                description = join.describe()
+            elif partitions is not None:
+                result = partitions.select(select)
+                if "error" in result:
+                    return result
+                rows = result["data"]
+                description = partitions.describe(select)
             else:
-                cur.append(ch)
-            i += 1
-        if cur:
-            items.append("".join(cur).strip())
-        return items
-
-    def _unquote(self, s: str):
-        s = s.strip()
-        if (s.startswith("'") and s.endswith("'")) or (s.startswith('"') and s.endswith('"')):
-            return s[1:-1]
-        return s
+                select_manager = self._select_manager(select)
+                rows = select_manager.stream(select.columns, where_text, where_tree, select.limit, select.offset)
+                description = select_manager.describe(select.columns)
+        except WhereError as e:
+            return {"error": f"Invalid WHERE clause: {e}"}
+        except (AggregateError, JoinError) as e:
+            return {"error": str(e)}
+        except Exception as e:
+            return {"error": f"An unexpected error occurred during DECLARE operation: {e}"}
+        self.cursors[statement.name] = Cursor(statement.name, rows, description)
+        return {"success": f"Cursor '{statement.name}' declared."}
+
+    def parse_fetch(self, statement):
+        # Only the rows fetched are read from the table; the cursor stays
+        # where they end for the next FETCH
+        cursor = self.cursors.get(statement.name)
+        if cursor is None:
+            return {"error": f"Cursor '{statement.name}' does not exist."}
+        if self.stream_rows:
+            return {"success": f"Fetched from cursor '{statement.name}'", "columns": cursor.columns,
+                    "data": cursor.iter(statement.count)}
+        try:
+            rows = as_dicts([name for name, _ in cursor.columns], cursor.fetch(statement.count))
+        except Exception as e:
+            return {"error": f"An unexpected error occurred during FETCH operation: {e}"}
+        return {"success": f"Fetched from cursor '{statement.name}'", "rows": len(rows), "data": rows}
+
+    def parse_close(self, statement):
+        if statement.name is None:
+            self.close()
+            return {"success": "All cursors closed."}
+        cursor = self.cursors.pop(statement.name, None)
+        if cursor is None:
+            return {"error": f"Cursor '{statement.name}' does not exist."}
+        cursor.close()
+        return {"success": f"Cursor '{statement.name}' closed."}
+
+    def parse_explain(self, statement):
+        # Without ANALYZE, the plan: the stages the statement would run and
+        # the rows each reads, where known. With it, the statement is run
+        # (a write is applied!) and each stage shows its rows and time.
+        inner = statement.statement
+        if not self.active_db:
+            return {"error": "No active database selected. Use 'USE <dbname>;' before an EXPLAIN statement."}
+        for name in inner.tables if isinstance(inner, ast.Select) else [inner.table]:
+            if not self._table_exists(self.active_db, name):
+                return {"error": f"Table '{name}' does not exist in database '{self.active_db}'."}
+        unknown = self._unknown_column(inner) if isinstance(inner, ast.Select) else None
+        if unknown is not None:
+            return unknown
+        kind = type(inner).__name__.upper()
+        if statement.analyze:
+            return self._explain_analyze(inner, kind)
+        partitions = self._partitions(inner.table)
+        try:
+            if isinstance(inner, ast.Select) and inner.join is not None:
+                plan = JoinManager(self.active_db, inner).explain()
+            elif partitions is not None:
+                return partitions.explain(inner)
+            elif isinstance(inner, ast.Select):
+                where = inner.where
+                plan = self._select_manager(inner).explain(inner.columns, where.text if where else None,
+                                                           where.tree if where else None, inner.limit, inner.offset)
+            else:
+                plan = self._write_plan(inner)
+        except WhereError as e:
+            return {"error": f"Invalid WHERE clause: {e}"}
+        except (AggregateError, JoinError) as e:
+            return {"error": str(e)}
+        except Exception as e:
+            return {"error": f"An unexpected error occurred during EXPLAIN operation: {e}"}
+        return {"success": f"Plan of {kind} on '{inner.table}'", "data": plan}
+
+    def _explain_analyze(self, inner, kind):
+        trace = Trace()
+        trace.add("parse", self.parse_seconds)
+        streaming, self.stream_rows = self.stream_rows, False
+        start = time.perf_counter()
+        try:
+            with stats.tracing(trace):
+                result = self.run(inner)
+                data = result.get("data") if isinstance(result, dict) else None
+                if isinstance(data, list):
+                    # As the text protocol sends the rows
+                    with trace.timed("serialize", "JSON") as stage:
+                        json.dumps(data, ensure_ascii=False)
+                        stage.rows = len(data)
+        finally:
+            self.stream_rows = streaming
+        seconds = time.perf_counter() - start
+        if not isinstance(result, dict) or "error" in result:
+            return result
+        plan = {"success": f"Plan of {kind} on '{inner.table}', run in {seconds * 1000:.3f} ms",
+                "execution_ms": round(seconds * 1000, 3), "data": trace.as_rows()}
+        if isinstance(data, list):
+            plan["rows"] = len(data)
+        elif "rows" in result:
+            plan["rows"] = result["rows"]
+        return plan
+
+    def _write_plan(self, statement):
+        # Writes are logged to the WAL and applied by the next checkpoint
+        if isinstance(statement, ast.Insert):
+            rows = len(statement.rows)
+            return [stats.plan_row("wal_append", f"{rows} row(s) logged as one WAL record", rows),
+                    stats.plan_row("checkpoint", "rows added to the table's pages by the next checkpoint", rows)]
+        wal = WALManager(self.active_db, statement.table)
+        where = wal.compile_where(statement.where.text, statement.where.tree)
+        used = []
+        rowids = IndexManager.for_table(self.active_db, statement.table).candidates(where.tree, used)
+        if rowids is None:
+            how = "found by a pass over the table's pages"
+        else:
+            how = "found through " + ", ".join(dict.fromkeys(index.name for index in used))
+        change = "updated" if isinstance(statement, ast.Update) else "deleted"
+        return [stats.plan_row("wal_append", f"logged: WHERE {statement.where.text}", None),
+                stats.plan_row("checkpoint", f"rows {change} by the next checkpoint, {how}",
+                               None if rowids is None else len(rowids))]
+
+    def parse_show_stats(self, statement):
+        # Counters since the process started, for each table of the active
+        # database, or of every database if none is in use
+        databases = [self.active_db] if self.active_db else sorted(self.catalog.databases)
+        rows = []
+        try:
+            for db_name in databases:
+                for table_name in self.catalog.tables(db_name):
+                    rows.append({"database": db_name, "table": table_name, **self.table_stats(db_name, table_name)})
+        except WorkerError as e:
+            return {"error": f"Cannot read the statistics of a partitioned table: {e}"}
+        return {"success": f"Statistics for {len(rows)} table(s)", "data": rows,
+                "buffer_pool": BufferPool.instance().stats(), "result_cache": self.result_cache.stats()}
+
+    def table_stats(self, db_name, table_name):
+        # The counters of one table, and the bytes its files have had read
+        # and written. A partitioned table's are gathered from its workers.
+        info = self.catalog.table(db_name, table_name)
+        if info.partition:
+            return PartitionManager(db_name, table_name, info).stats()
+        wal = WALManager(db_name, table_name)
+        pages_read, pages_written = BufferPool.instance().io_under(wal.base_path)
+        row = self.stats.table(db_name, table_name)
+        row["bytes_read"] = pages_read + wal.writer.bytes_read
+        row["bytes_written"] = pages_written + wal.writer.lsn
+        row["wal_bytes"] = wal.size()
+        row["disk_bytes"] = TableStorage.for_table(db_name, table_name).disk_bytes()
+        return row
+
+    def close(self):
+        # Ends the session: open cursors would otherwise keep their tables
+        # read-locked
+        while self.cursors:
+            self.cursors.popitem()[1].close()
 
     def _table_exists(self, db_name, table_name):
-        db_path = DATA_DIR / db_name / table_name
-        return db_path.exists()
+        return self.catalog.table_exists(db_name, table_name)
+
+    def _unknown_column(self, select):
+        # The error for a select list naming a column its table doesn't have,
+        # found before anything is read; None if there is none. Grouped
+        # SELECTs are checked by the AggregateManager, joins by the JoinManager.
+        if select.join is not None or select.grouped or select.columns == ["*"]:
+            return None
+        try:
+            columns = self.catalog.table(self.active_db, select.table).column_types
+        except (OSError, ValueError):
+            return None
+        for name in select.columns:
+            if name not in columns:
+                return {"error": f"Column '{name}' does not exist"}
+        return None
+
+    def _partitions(self, table_name):
+        # The PartitionManager of a partitioned table of the active database;
+        # None for any other table
+        try:
+            info = self.catalog.table(self.active_db, table_name)
+        except (OSError, ValueError):
+            return None
+        return PartitionManager(self.active_db, table_name, info) if info.partition else None
@@ -0,0 +1,527 @@
+import atexit
+import os
+import pickle
+import struct
+import subprocess
+import sys
+import threading
+import zlib
+from concurrent.futures import Future
+from dataclasses import replace
+from pathlib import Path
+
+from db_core import stats
+from db_core.aggregate_manager import combine_groups, group_columns, partial_aggregates, plan_aggregates, result_type
+from db_core.catalog import Catalog, partition_name
+from db_core.Insert_manager import validate_rows
+from db_core.result_cache import ResultCache
+from db_core.rows import projector
+from db_core.schema_manager import Schema_Manager
+from db_core.sql_parser import Explain, Insert, Select
+from db_core.stats import Stats
+from db_core.where_clause import Aggregate, And, Column, Compare, Const, InList, Literal, Or, WhereClause
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Worker processes partitions are spread over, and the threads each runs
+# statements on
+PARTITION_WORKERS = os.cpu_count() or 1
+WORKER_THREADS = 4
+MAX_PARTITIONS = 1024
+# Rows of a streamed SELECT a worker sends at a time
+STREAM_BATCH = 1000
+# Message framing on a worker's pipes: payload length, then a pickle
+FRAME = struct.Struct(">I")
+
+
+class WorkerError(RuntimeError):
+    pass
+
+
+def send_message(f, message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    f.write(FRAME.pack(len(data)) + data)
+    f.flush()
+
+
+def recv_message(f):
+    # The next message, or None once the other end has closed the pipe
+    header = f.read(FRAME.size)
+    if len(header) < FRAME.size:
+        return None
+    (length,) = FRAME.unpack(header)
+    data = f.read(length)
+    if len(data) < length:
+        return None
+    return pickle.loads(data)
+
+
+def partition_of(value, col_type, count):
+    # The partition a partition column value hashes to; None for a value the
+    # column can't hold, which no row has. The hash is of the value as
+    # stored, so it doesn't change between processes or runs.
+    if value is None:
+        return 0
+    try:
+        value = Schema_Manager.coerce(col_type, value)
+    except ValueError:
+        return None
+    key = value if col_type == "TEXT" else repr(value)
+    return zlib.crc32(key.encode("utf-8")) % count
+
+
+class WorkerProcess:
+    """One partition worker (python -m db_core.partition_worker): requests
+    go down its stdin and come back on its stdout, matched by number, so
+    any number of sessions can have requests in flight at once."""
+
+    def __init__(self, settings):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+        self.process = subprocess.Popen([sys.executable, "-m", "db_core.partition_worker"],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        self.lock = threading.Lock()  # serializes writes to stdin
+        self.pending = {}  # request number -> Future
+        self.next_id = 0
+        self.alive = True
+        send_message(self.process.stdin, settings)
+        self.reader = threading.Thread(target=self._read, name="tinydbx-partition-reader", daemon=True)
+        self.reader.start()
+
+    def call(self, op, *args):
+        future = Future()
+        with self.lock:
+            if not self.alive:
+                raise WorkerError("Partition worker has exited")
+            request_id = self.next_id
+            self.next_id += 1
+            self.pending[request_id] = future
+            try:
+                send_message(self.process.stdin, (request_id, op, args))
+            except OSError as e:
+                self.pending.pop(request_id, None)
+                raise WorkerError(f"Partition worker has exited: {e}") from None
+        return future
+
+    def _read(self):
+        try:
+            while True:
+                message = recv_message(self.process.stdout)
+                if message is None:
+                    break
+                request_id, ok, value = message
+                with self.lock:
+                    future = self.pending.pop(request_id)
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(WorkerError(value))
+        finally:
+            with self.lock:
+                self.alive = False
+                pending, self.pending = self.pending, {}
+            for future in pending.values():
+                future.set_exception(WorkerError("Partition worker has exited"))
+
+    def stop(self, timeout=10):
+        # Closing its stdin lets the worker finish what it is running and exit
+        with self.lock:
+            self.alive = False
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.reader.join(timeout)
+
+
+class PartitionRouter:
+    """The worker processes owning the partitions of partitioned tables.
+
+    Each partition belongs to one worker for as long as the workers run,
+    which is the only process that opens its files, so the caches of a
+    partition's pages, WAL and keys live in that process alone. Workers
+    are started on first use; a worker that has died is replaced.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @classmethod
+    def stop_workers(cls):
+        # Stops the workers if they were started; the next statement on a
+        # partitioned table starts new ones, with nothing cached
+        with cls._instance_lock:
+            router = cls._instance
+        if router is not None:
+            router.stop()
+
+    def __init__(self, workers=PARTITION_WORKERS):
+        self.count = max(1, workers)
+        self.lock = threading.Lock()
+        self.workers = [None] * self.count
+        atexit.register(self.stop)
+
+    def owner(self, db_name, table_name, number):
+        # Partitions of a table go to consecutive workers, starting at one
+        # picked by the table's name
+        slot = (zlib.crc32(f"{db_name}/{table_name}".encode("utf-8")) + number) % self.count
+        with self.lock:
+            worker = self.workers[slot]
+            if worker is None or not worker.alive:
+                worker = self.workers[slot] = WorkerProcess(self._settings())
+            return worker
+
+    def call(self, db_name, table_name, number, op, *args):
+        # Future of `op` run by the owner of partition `number`
+        return self.owner(db_name, table_name, number).call(op, *args)
+
+    def _settings(self):
+        from db_core.wal_manager import WALWriter
+        return {"durability": WALWriter.durability, "commit_delay": WALWriter.commit_delay,
+                "batch_size": WALWriter.batch_size, "threads": WORKER_THREADS}
+
+    def stop(self):
+        with self.lock:
+            workers, self.workers = self.workers, [None] * self.count
+        for worker in workers:
+            if worker is not None:
+                worker.stop()
+
+
+class PartitionManager:
+    """Runs statements on a table hash-partitioned on one column.
+
+    A statement whose WHERE clause pins the partition column to values
+    (col = v, col IN (...), and ANDs and ORs of them) goes to the owners
+    of those values' partitions only; any other goes to all partitions,
+    whose workers run it in parallel, and the router merges what they
+    return. Grouped SELECTs are sent as partial aggregates per group
+    (AVG as SUM and COUNT) and combined here, before HAVING and LIMIT.
+    """
+
+    def __init__(self, db_name, table_name, info=None):
+        self.db_name = db_name
+        self.table_name = table_name
+        info = info or Catalog.instance().table(db_name, table_name)
+        self.schema = info.schema
+        self.columns = info.columns
+        self.column_types = info.column_types
+        self.column = info.partition["column"]
+        self.count = info.partition["count"]
+        self.col_type = self.column_types[self.column]
+        self.router = PartitionRouter.instance()
+        # The partitions are written to in their workers: the results of the
+        # table cached in this process are held back until the writes return
+        self.result_cache = ResultCache.instance()
+
+    def name(self, number):
+        return partition_name(self.table_name, number)
+
+    def create_partitions(self):
+        # Called by TableManager once the table's own schema.json is written
+        schema = {key: value for key, value in self.schema.items() if key != "partition"}
+        results = self._gather("create", range(self.count),
+                               lambda number: (self.db_name, self.name(number), schema))
+        errors = [result["error"] for result in results if "error" in result]
+        if errors:
+            return {"error": f"Error while creating the partitions of table '{self.table_name}': {errors[0]}"}
+        return {"success": f"Table '{self.table_name}' created successfully in database '{self.db_name}' "
+                           f"with {self.count} partitions."}
+
+    # -- routing
+
+    def targets(self, where):
+        # The partitions a statement with this WHERE clause (a Where, or
+        # None) can touch, in order
+        if where is None:
+            return list(range(self.count))
+        clause = WhereClause.compile(where.text, self.column_types, where.tree)
+        numbers = self._targets(clause.tree)
+        return list(range(self.count)) if numbers is None else sorted(numbers)
+
+    def _targets(self, node):
+        # Set of partitions a resolved tree can match in, or None for all
+        if isinstance(node, Compare) and node.op == "=" and isinstance(node.right, Literal) \
+                and isinstance(node.left, Column) and node.left.name == self.column:
+            return self._numbers([node.right.value])
+        if isinstance(node, InList) and not node.negated and node.operand.name == self.column:
+            return self._numbers(node.values)
+        if isinstance(node, Const) and not node.value:
+            return set()
+        if isinstance(node, And):
+            found = None
+            for item in node.items:
+                numbers = self._targets(item)
+                if numbers is not None:
+                    found = numbers if found is None else found & numbers
+            return found
+        if isinstance(node, Or):
+            found = set()
+            for item in node.items:
+                numbers = self._targets(item)
+                if numbers is None:
+                    return None
+                found |= numbers
+            return found
+        return None
+
+    def _numbers(self, values):
+        numbers = (partition_of(value, self.col_type, self.count) for value in values)
+        return {number for number in numbers if number is not None}
+
+    def _gather(self, op, numbers, args_for):
+        # Runs `op` on the owners of the partitions at once; returns their
+        # results in the same order, a failed call's as an {"error": ...}
+        futures = []
+        for number in numbers:
+            try:
+                futures.append(self.router.call(self.db_name, self.table_name, number, op, *args_for(number)))
+            except WorkerError as e:
+                futures.append(e)
+        results = []
+        for number, future in zip(numbers, futures):
+            try:
+                if isinstance(future, Exception):
+                    raise future
+                results.append(future.result())
+            except WorkerError as e:
+                results.append({"error": f"Partition {number} of table '{self.table_name}' failed: {e}"})
+        return results
+
+    def _run(self, numbers, statement):
+        # The statement run on each partition in `numbers`
+        return self._gather("run", numbers, lambda number: (
+            self.db_name, self.name(number), replace(statement, table=self.name(number))))
+
+    # -- statements
+
+    def insert_rows(self, rows, first_row=None):
+        # Rows are checked here, so errors name them as in the statement,
+        # then logged by each partition as one WAL record. A partition that
+        # fails doesn't undo the rows logged by the others.
+        try:
+            validated = validate_rows(self.schema, rows, first_row)
+        except ValueError as e:
+            return {"error": str(e)}
+        if not validated:
+            return {"success": f"No rows inserted into table '{self.table_name}'."}
+        position = self.columns.index(self.column)
+        groups = {}
+        for row in validated:
+            groups.setdefault(partition_of(row[position], self.col_type, self.count), []).append(row)
+        numbers = sorted(groups)
+        with self.result_cache.writing(self.db_name, self.table_name):
+            results = self._gather("run", numbers,
+                                   lambda number: (self.db_name, self.name(number),
+                                                   Insert(self.name(number), groups[number])))
+        inserted = sum(len(groups[number]) for number, result in zip(numbers, results) if "error" not in result)
+        errors = [result["error"] for result in results if "error" in result]
+        if errors:
+            if inserted:
+                return {"error": f"{errors[0]} ({inserted} rows were inserted into other partitions)",
+                        "rows": inserted}
+            return {"error": errors[0]}
+        if len(validated) == 1:
+            return {"success": f"Insert operation logged for table '{self.table_name}'."}
+        return {"success": f"{inserted} rows inserted into table '{self.table_name}'.", "rows": inserted}
+
+    def select(self, statement):
+        # Returns the SELECT's result as {"success", "data"}, its rows a
+        # generator of tuples laid out as describe(statement), or {"error"}.
+        # Raises WhereError or AggregateError for a bad query. The rows are
+        # streamed: each partition's are read from its worker a batch at a
+        # time as the generator is consumed (see _stream()).
+        numbers = self.targets(statement.where)
+        if statement.grouped:
+            result = self._select_groups(statement, numbers)
+            if "data" in result:
+                result["data"] = (row for row in result["data"])
+            return result
+        limit, offset = statement.limit, statement.offset
+        if len(numbers) == 1:
+            part = statement
+            limit = offset = None
+        else:
+            # Each partition returns up to the rows the whole query needs
+            part = replace(statement, limit=None if limit is None else limit + (offset or 0), offset=None)
+        detail = (f"partition {numbers[0]} of {self.count}" if len(numbers) == 1
+                  else f"{len(numbers)} of {self.count} partitions, in parallel")
+        with stats.stage("partitions", detail):
+            results = self._gather("open", numbers, lambda number: (
+                self.db_name, self.name(number), replace(part, table=self.name(number)), STREAM_BATCH))
+        errors = [result["error"] for result in results if "error" in result]
+        if errors:
+            self._close(numbers, results)
+            return {"error": errors[0]}
+        rows = self._stream(numbers, results, limit, offset)
+        return {"success": f"Selected data from '{self.table_name}'",
+                "data": stats.pipe("merge", rows, f"rows of {len(numbers)} partition(s)")}
+
+    def _stream(self, numbers, opened, limit, offset):
+        # The rows of the streams opened on the partitions, one partition
+        # after the other, holding one batch of each at most; the streams
+        # still open are closed once the rows are read or the generator is
+        # closed
+        start = offset or 0
+        stop = None if limit is None else start + limit
+        position = 0
+        try:
+            for i, (number, result) in enumerate(zip(numbers, opened)):
+                batch = result["data"]
+                while True:
+                    for row in batch:
+                        if stop is not None and position >= stop:
+                            return
+                        if position >= start:
+                            yield row
+                        position += 1
+                    if result["stream"] is None:
+                        break
+                    batch = self.router.call(self.db_name, self.table_name, number, "fetch",
+                                             result["stream"], STREAM_BATCH).result()
+                    if len(batch) < STREAM_BATCH:
+                        result["stream"] = None  # the worker closed it
+                opened[i] = None
+        finally:
+            self._close(numbers, opened)
+
+    def _close(self, numbers, opened):
+        # Closes the streams opened on the partitions that are still open
+        for number, result in zip(numbers, opened):
+            if result is not None and result.get("stream") is not None:
+                try:
+                    self.router.call(self.db_name, self.table_name, number, "close", result["stream"])
+                except WorkerError:
+                    pass  # it went with the worker
+
+    def _fan_out(self, numbers, statement):
+        detail = (f"partition {numbers[0]} of {self.count}" if len(numbers) == 1
+                  else f"{len(numbers)} of {self.count} partitions, in parallel")
+        with stats.stage("partitions", detail) as stage:
+            results = self._run(numbers, statement)
+            if stage is not None:
+                stage.rows = sum(len(result.get("data", ())) for result in results)
+        return results
+
+    def _select_groups(self, statement, numbers):
+        having = statement.having
+        aggregates, having_clause = plan_aggregates(statement.columns, statement.group_by or [],
+                                                    having.text if having else None, having.tree if having else None,
+                                                    self.column_types)
+        group_by = statement.group_by or []
+        part = replace(statement, columns=group_by + partial_aggregates(aggregates), having=None,
+                       limit=None, offset=None)
+        results = self._fan_out(numbers or [0], part)
+        errors = [result["error"] for result in results if "error" in result]
+        if errors:
+            return {"error": errors[0]}
+
+        with stats.stage("merge", f"groups of {len(numbers)} partition(s)") as stage:
+            rows = combine_groups([result["data"] for result in results], group_by, aggregates)
+            if having_clause is not None:
+                rows = list(having_clause.filter(rows))
+            names = [column.name if isinstance(column, Aggregate) else column for column in statement.columns]
+            rows = list(map(projector(group_columns(group_by, aggregates), names), rows))
+            if statement.limit is not None or statement.offset:
+                start = statement.offset or 0
+                rows = rows[start:None if statement.limit is None else start + statement.limit]
+            if stage is not None:
+                stage.rows = len(rows)
+        return {"success": f"Selected data from '{self.table_name}'", "data": rows}
+
+    def describe(self, statement):
+        # (name, type) of each column of the SELECT's rows
+        if statement.grouped:
+            return [(column.name, result_type(column, self.column_types)) if isinstance(column, Aggregate)
+                    else (column, self.column_types[column]) for column in statement.columns]
+        names = self.columns if statement.columns == ["*"] else statement.columns
+        return [(name, self.column_types.get(name, "TEXT")) for name in names]
+
+    def update(self, statement):
+        if statement.column == self.column:
+            return {"error": f"Cannot update column '{self.column}': table '{self.table_name}' is partitioned on it."}
+        return self._write(statement, "Update")
+
+    def delete(self, statement):
+        return self._write(statement, "Delete")
+
+    def _write(self, statement, kind):
+        # Logged by each partition the WHERE clause can match in; one that
+        # it can't match anywhere still checks the statement
+        numbers = self.targets(statement.where) or [0]
+        with self.result_cache.writing(self.db_name, self.table_name):
+            results = self._fan_out(numbers, statement)
+        errors = [result["error"] for result in results if "error" in result]
+        if errors:
+            return {"error": errors[0]}
+        return {"success": f"{kind} operation logged for table '{self.table_name}'."}
+
+    def checkpoint(self):
+        with self.result_cache.writing(self.db_name, self.table_name):
+            results = self._gather("checkpoint", range(self.count), lambda number: (self.db_name, self.name(number)))
+        errors = [result["error"] for result in results if "error" in result]
+        if errors:
+            return {"error": errors[0]}
+        if any(result.get("deferred") for result in results):
+            return {"success": f"Checkpoint of table '{self.table_name}' deferred for partitions being read.",
+                    "deferred": True}
+        return {"success": f"Checkpointed the {self.count} partitions of table '{self.table_name}'."}
+
+    def explain(self, statement):
+        # The plan of the statement on the first partition it goes to, after
+        # a row for the routing
+        if isinstance(statement, Insert):
+            position = self.columns.index(self.column)
+            numbers = sorted({partition_of(row[position] if len(row) > position else None, self.col_type,
+                                           self.count) for row in statement.rows} - {None}) or [0]
+        else:
+            numbers = self.targets(statement.where) or [0]
+        detail = (f"partition {numbers[0]} of {self.count} by HASH({self.column})" if len(numbers) == 1
+                  else f"{len(numbers)} of {self.count} partitions by HASH({self.column}), in parallel")
+        if isinstance(statement, Select) and statement.grouped:
+            plan_aggregates(statement.columns, statement.group_by or [],
+                            statement.having.text if statement.having else None,
+                            statement.having.tree if statement.having else None, self.column_types)
+        result = self._gather("run", numbers[:1], lambda number: (
+            self.db_name, self.name(number), Explain(replace(statement, table=self.name(number)))))[0]
+        if "error" in result:
+            return result
+        plan = [stats.plan_row("partitions", detail, len(numbers))] + result["data"]
+        if len(numbers) > 1 and isinstance(statement, Select):
+            what = "groups combined" if statement.grouped else "rows concatenated"
+            plan.append(stats.plan_row("merge", f"{what} from {len(numbers)} partitions"))
+        return {"success": f"Plan of {type(statement).__name__.upper()} on '{self.table_name}'", "data": plan}
+
+    def stats(self):
+        # The table's SHOW STATS row: statement counts as the router saw
+        # them, the rest summed over the partitions
+        results = self._gather("stats", range(self.count), lambda number: (self.db_name, self.name(number)))
+        errors = [result["error"] for result in results if "error" in result]
+        if errors:
+            raise WorkerError(errors[0])
+        row = Stats.instance().table(self.db_name, self.table_name)
+        own = {"statements", "selects", "inserts", "updates", "deletes", "rows_inserted"}
+        for name in results[0]:
+            if name in own:
+                continue
+            if name == "checkpoint_error":
+                row[name] = next((result[name] for result in results if result[name] is not None), None)
+                continue
+            values = [result[name] for result in results]
+            row[name] = max(values) if name in ("checkpoint_ms_max", "checkpoint_ms_last") else sum(values)
+            if isinstance(row[name], float):
+                row[name] = round(row[name], 3)
+        return row
+
@@ -0,0 +1,141 @@
+"""A partition worker: runs statements on the partitions it owns for the
+PartitionRouter that started it (see db_core/partition_manager.py).
+
+Requests come in on stdin as (number, op, args) and each is answered on
+stdout as (number, ok, result), in the order they finish. The first
+message is the router's settings. Output printed by the engine goes to
+stderr, so it can't corrupt the replies. The worker exits when stdin is
+closed.
+"""
+import itertools
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from db_core.catalog import Catalog
+from db_core.checkpoint_manager import Checkpointer
+from db_core.parser import Parser
+from db_core.partition_manager import WORKER_THREADS, recv_message, send_message
+from db_core.sql_parser import Select
+from db_core.table_manager import TableManager
+from db_core.wal_manager import WALWriter
+
+
+def create(db_name, table_name, schema):
+    return TableManager(db_name, table_name, dict(schema)).create_table()
+
+
+def parser_for(db_name, table_name):
+    # A session on the database; the lookup reads the catalog again if the
+    # table was created after this worker loaded it
+    Catalog.instance().table_exists(db_name, table_name)
+    parser = Parser()
+    parser.active_db = db_name
+    return parser
+
+
+def run(db_name, table_name, statement):
+    # A SELECT's rows go back as the tuples the engine reads them as,
+    # laid out as its select list; the router attaches the names
+    parser = parser_for(db_name, table_name)
+    parser.stream_rows = isinstance(statement, Select)
+    result = parser.run(statement)
+    if isinstance(result, dict) and "columns" in result:
+        del result["columns"]
+        result["data"] = list(result["data"])
+    return result
+
+
+# The SELECTs the router reads a batch at a time (see
+# PartitionManager.select()), by number; each holds its partition's read
+# lock until it is read to the end or closed
+streams = {}
+streams_lock = threading.Lock()
+stream_numbers = itertools.count()
+
+
+def open_stream(db_name, table_name, statement, count):
+    # The SELECT's first `count` rows, and the number of its stream to
+    # fetch the rest from; None if there are no more
+    parser = parser_for(db_name, table_name)
+    parser.stream_rows = True
+    result = parser.run(statement)
+    if "data" not in result:
+        return result
+    rows = result["data"]
+    batch = list(islice(rows, count))
+    if len(batch) < count:
+        rows.close()
+        return {"data": batch, "stream": None}
+    with streams_lock:
+        number = next(stream_numbers)
+        streams[number] = rows
+    return {"data": batch, "stream": number}
+
+
+def fetch(number, count):
+    # The stream's next `count` rows; fewer once it is done, and then it
+    # is closed
+    with streams_lock:
+        rows = streams[number]
+    batch = list(islice(rows, count))
+    if len(batch) < count:
+        close(number)
+    return batch
+
+
+def close(number):
+    with streams_lock:
+        rows = streams.pop(number, None)
+    if rows is not None:
+        rows.close()
+
+
+def checkpoint(db_name, table_name):
+    parser_for(db_name, table_name)
+    return Checkpointer.instance().checkpoint(db_name, table_name)
+
+
+def table_stats(db_name, table_name):
+    return parser_for(db_name, table_name).table_stats(db_name, table_name)
+
+
+OPS = {"create": create, "run": run, "open": open_stream, "fetch": fetch, "close": close,
+       "checkpoint": checkpoint, "stats": table_stats}
+
+
+def main():
+    requests = sys.stdin.buffer
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    settings = recv_message(requests)
+    if settings is None:
+        return
+    WALWriter.configure(settings["durability"], settings["commit_delay"], settings["batch_size"])
+    Catalog.instance()
+
+    lock = threading.Lock()
+
+    def serve(request_id, op, args):
+        try:
+            reply = (request_id, True, OPS[op](*args))
+        except Exception as e:
+            reply = (request_id, False, f"{type(e).__name__}: {e}")
+        with lock:
+            send_message(replies, reply)
+
+    with ThreadPoolExecutor(settings.get("threads", WORKER_THREADS),
+                            thread_name_prefix="tinydbx-partition") as pool:
+        while True:
+            message = recv_message(requests)
+            if message is None:
+                break
+            pool.submit(serve, *message)
+    replies.close()
+
+
+if __name__ == "__main__":
+    main()
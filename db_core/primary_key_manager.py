@@ -1,46 +1,239 @@
 import json
-from pathlib import Path
+import os
+import threading
+
+from db_core.catalog import Catalog, DATA_DIR
+from db_core.select_manager import SelectManager
+from db_core.storage_manager import TableStorage
+from db_core.wal_manager import WALManager
 
 class PrimaryKeyManager:
+    # One instance per table, shared by every connection in the process
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_table(cls, db_name, table_name):
+        key = (db_name, table_name)
+        with cls._instances_lock:
+            manager = cls._instances.get(key)
+            if manager is None:
+                manager = cls(db_name, table_name)
+                cls._instances[key] = manager
+            return manager
+
     def __init__(self, db_name, table_name):
-        self.base_path = Path("data") / db_name / table_name
-        self.schema_path = self.base_path / "schema.json"
-        self.data_path = self.base_path / "data.json"
+        self.db_name = db_name
+        self.table_name = table_name
+        self.base_path = DATA_DIR / db_name / table_name
+        self.storage = TableStorage.for_table(db_name, table_name)
+        self.index_path = self.base_path / "pk.idx"
+        self.wal = WALManager(db_name, table_name)
         self.pk_cache = None
         self.primary_key_column = None
+        self.schema_loaded = False
+        self.lock = WALManager.table_lock(db_name, table_name)
+        self.checkpoint_lock = WALManager.checkpoint_lock(db_name, table_name)
 
     def _load_schema(self):
         try:
-            with open(self.schema_path, "r") as f:
-                schema = json.load(f)
-            self.primary_key_column = schema.get("primary_key")
+            self.primary_key_column = Catalog.instance().table(self.db_name, self.table_name).primary_key
         except (FileNotFoundError, json.JSONDecodeError):
             self.primary_key_column = None
+        self.schema_loaded = True
+
+    def get_primary_key_column(self):
+        if not self.schema_loaded:
+            self._load_schema()
+        return self.primary_key_column
+
+    def _data_signature(self):
+        return self.storage.signature()
+
+    def _load_index(self):
+        # pk.idx is a snapshot line followed by incremental "+"/"-" lines. Every
+        # line records the WAL size it corresponds to, so a crash between the
+        # WAL append and the index append shows up as a size mismatch.
+        try:
+            with open(self.index_path, "r") as f:
+                header = json.loads(f.readline())
+                if header.get("column") != self.primary_key_column:
+                    return False
+                if header.get("data") != self._data_signature():
+                    return False
+                keys = set(header.get("keys", []))
+                wal_size = header.get("wal")
+                for line in f:
+                    if not line.strip():
+                        continue
+                    op = json.loads(line)
+                    if op["op"] == "+":
+                        if "keys" in op:
+                            keys.update(op["keys"])
+                        else:
+                            keys.add(op["key"])
+                    elif "keys" in op:
+                        keys.difference_update(op["keys"])
+                    else:
+                        keys.discard(op["key"])
+                    wal_size = op["wal"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError, AttributeError):
+            return False
+
+        if wal_size != self.wal.size():
+            return False
+        self.pk_cache = keys
+        return True
 
     def _build_cache(self):
         if not self.primary_key_column:
             return
 
+        # Stream the table through the WAL overlay; only the keys are kept
         self.pk_cache = set()
         try:
-            with open(self.data_path, "r") as f:
-                rows = json.load(f)
-            for row in rows:
-                if self.primary_key_column in row:
-                    self.pk_cache.add(row[self.primary_key_column])
-        except (FileNotFoundError, json.JSONDecodeError):
+            entries = self.wal.read_entries(self.storage.wal_lsn())
+            rows = self.wal.overlay(self.storage.scan_rows(), entries)
+            position = self.storage.open().codec.columns.index(self.primary_key_column)
+            self.pk_cache.update(row[position] for row in rows)
+        except FileNotFoundError:
             pass  # No data yet, cache remains empty
+        self._write_snapshot()
+
+    def _write_snapshot(self):
+        header = {
+            "column": self.primary_key_column,
+            "data": self._data_signature(),
+            "wal": self.wal.size(),
+            "keys": list(self.pk_cache),
+        }
+        tmp_path = self.index_path.with_suffix(".tmp")
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(json.dumps(header) + "\n")
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            pass  # The in-memory cache is still valid; the file is rebuilt next start
+
+    def _append_op(self, op, pk_value):
+        try:
+            with open(self.index_path, "a") as f:
+                f.write(json.dumps({"op": op, "key": pk_value, "wal": self.wal.size()}) + "\n")
+        except OSError:
+            pass
+
+    def ensure_loaded(self):
+        # Loading reads the table pages, so it must not overlap a checkpoint:
+        # take the checkpoint lock before the table lock, in the same order
+        # the checkpointer does. Call this before taking self.lock.
+        if not self.get_primary_key_column() or self.pk_cache is not None:
+            return
+        with self.checkpoint_lock, self.lock:
+            if self.pk_cache is None and not self._load_index():
+                self._build_cache()
+
+    def is_loaded(self):
+        return not self.get_primary_key_column() or self.pk_cache is not None
 
     def check_pk_uniqueness(self, pk_value):
-        if not self.primary_key_column:
-            return True  # No primary key defined
+        # The caller holds self.lock and has made sure the cache is loaded
+        with self.lock:
+            if not self.get_primary_key_column():
+                return True  # No primary key defined
 
-        if self.pk_cache is None:
-            self._load_schema()
-            self._build_cache()
+            return pk_value not in self.pk_cache
 
-        return pk_value not in self.pk_cache
+    def existing_keys(self, keys):
+        # The keys of `keys` already in the table; same contract as
+        # check_pk_uniqueness
+        with self.lock:
+            if not self.get_primary_key_column():
+                return []
+            return [key for key in keys if key in self.pk_cache]
 
     def add_pk_to_cache(self, pk_value):
-        if self.primary_key_column and self.pk_cache is not None:
-            self.pk_cache.add(pk_value)
\ No newline at end of file
+        with self.lock:
+            if self.primary_key_column and self.pk_cache is not None:
+                self.pk_cache.add(pk_value)
+                self._append_op("+", pk_value)
+
+    def add_pks_to_cache(self, keys):
+        # One index line for a whole batch
+        if len(keys) == 1:
+            return self.add_pk_to_cache(keys[0])
+        with self.lock:
+            if self.primary_key_column and self.pk_cache is not None:
+                self.pk_cache.update(keys)
+                self._append_ops("+", keys)
+
+    def remove_pks_from_cache(self, keys):
+        # Same as add_pks_to_cache(), for the keys of deleted rows
+        if len(keys) == 1:
+            return self.remove_pk_from_cache(keys[0])
+        with self.lock:
+            if self.primary_key_column and self.pk_cache is not None and keys:
+                self.pk_cache.difference_update(keys)
+                self._append_ops("-", keys)
+
+    def _append_ops(self, op, keys):
+        try:
+            with open(self.index_path, "a") as f:
+                f.write(json.dumps({"op": op, "keys": keys, "wal": self.wal.size()}) + "\n")
+        except OSError:
+            pass
+
+    def matching_keys(self, where_clause, where_tree=None):
+        # The keys of the rows the clause matches in the table as logged so
+        # far. Call with the checkpoint lock held, and then self.lock so no
+        # other write changes the rows until the caller's own record is
+        # logged, or see keys_logged_since().
+        self.wal.flush()
+        manager = SelectManager(self.db_name, self.table_name)
+        where = manager.compile_where(where_clause, where_tree)
+        position = self.storage.open().codec.columns.index(self.primary_key_column)
+        return manager.scan(where, lambda rows: [row[position] for row in rows])
+
+    def keys_logged_since(self, keys, lsn, where_clause, where_tree=None):
+        # `keys`, found by matching_keys() without self.lock from the log up
+        # to LSN `lsn`, brought up to date with the records logged since:
+        # the keys of inserted rows the clause matches are added, and if
+        # anything else was logged the keys are looked up again. Call with
+        # the checkpoint lock and then self.lock held, as for matching_keys().
+        entries = self.wal.read_entries(lsn)
+        if not entries:
+            return keys
+        compiled = self.wal.compile_entries(entries)
+        if any(op[0] != "insert" for op in compiled):
+            return self.matching_keys(where_clause, where_tree)
+        where = self.wal.compile_where(where_clause, where_tree)
+        position = self.storage.open().codec.columns.index(self.primary_key_column)
+        return keys + [row[position] for row in where.filter(row for _, row in compiled)]
+
+    def remove_pk_from_cache(self, key):
+        # `key` comes from a typed "pk = value" WHERE clause, so it compares
+        # equal to the stored key the delete will match
+        with self.lock:
+            if not self.primary_key_column or self.pk_cache is None:
+                return
+            if key in self.pk_cache:
+                self.pk_cache.discard(key)
+                self._append_op("-", key)
+
+    def invalidate(self):
+        # Used when a statement changes keys we can't identify cheaply; the
+        # index is rebuilt from the table file + WAL on the next uniqueness check.
+        with self.lock:
+            self.pk_cache = None
+            try:
+                self.index_path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def rebase(self):
+        # Called by the checkpointer after the table file and log.wal were swapped.
+        # The set of live keys is unchanged, only the file signatures moved.
+        with self.lock:
+            if self.pk_cache is not None:
+                self._write_snapshot()
+            else:
+                self.invalidate()
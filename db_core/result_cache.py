@@ -0,0 +1,203 @@
+"""Process-wide cache of SELECT results.
+
+A result is kept under its statement, normalised to the parsed tree, and
+its database, together with the version of each table it read. Every
+change to a table (an INSERT, UPDATE, DELETE or COPY, a checkpoint, DDL)
+bumps the table's version, which makes the results read from it stale:
+they are dropped the next time they are looked up. A hit hands back the
+rows kept, without reading the table at all.
+
+Readers see a logged write before it is committed, so a write bumps the
+version both before its WAL record is appended and once it is committed,
+and in between the table's results are neither cached nor looked up: a
+session that has read the write can't be handed an older result.
+
+The cache is off unless given a budget, TINYDBX_RESULT_CACHE_MB or
+configure(); results are evicted least recently used first to keep it
+within that. A SELECT ending in NOCACHE neither uses nor fills it.
+"""
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import count
+
+from db_core.rows import row_size
+
+RESULT_CACHE_BYTES = int(os.environ.get("TINYDBX_RESULT_CACHE_MB", "0")) * 1024 * 1024
+# A result taking more than this share of the budget is not kept
+MAX_ENTRY_SHARE = 4
+
+
+def select_key(db_name, select):
+    # What a SELECT's rows depend on besides the contents of its tables:
+    # everything but PARALLEL and NOCACHE, with the WHERE and HAVING
+    # clauses as parsed, so spacing and keyword case don't matter
+    where = select.where.tree if select.where is not None else None
+    having = select.having.tree if select.having is not None else None
+    return (db_name, select.table, tuple(select.columns), where, tuple(select.group_by or ()), having,
+            select.limit, select.offset, select.alias, select.join)
+
+
+class Entry:
+    __slots__ = ("tables", "versions", "description", "rows", "size")
+
+    def __init__(self, tables, versions, description, rows, size):
+        self.tables = tables  # (db, table) of each table read
+        self.versions = versions  # their versions before they were read
+        self.description = description  # (name, type) of each column of the rows
+        self.rows = rows
+        self.size = size
+
+
+class ResultCache:
+    """LRU cache of SELECT results, invalidated per table by version.
+
+    A SELECT that misses takes the versions of its tables (versions())
+    before reading them, and passes its rows through collect(), which adds
+    them once they have all been read, unless a table changed meanwhile.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> Entry, least recently used first
+        self.versions_of = {}  # (db, table) -> version; 0 for a table never changed
+        self.clock = count(1)  # versions are never reused, even for a table dropped and created again
+        self.writing_to = {}  # (db, table) -> writes begun and not yet committed
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0  # stale results dropped
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def configure(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._make_room()
+
+    def invalidate(self, db_name, table_name):
+        # Call once a change to the table can be read: results read before
+        # it are stale from now on
+        with self.lock:
+            self.versions_of[(db_name, table_name)] = next(self.clock)
+
+    def begin_write(self, db_name, table_name):
+        # Call before readers can see the write; end_write() once it is
+        # committed, or has failed
+        key = (db_name, table_name)
+        with self.lock:
+            self.writing_to[key] = self.writing_to.get(key, 0) + 1
+            self.versions_of[key] = next(self.clock)
+
+    def end_write(self, db_name, table_name):
+        key = (db_name, table_name)
+        with self.lock:
+            if self.writing_to[key] == 1:
+                del self.writing_to[key]
+            else:
+                self.writing_to[key] -= 1
+            self.versions_of[key] = next(self.clock)
+
+    @contextmanager
+    def writing(self, db_name, table_name):
+        self.begin_write(db_name, table_name)
+        try:
+            yield
+        finally:
+            self.end_write(db_name, table_name)
+
+    def versions(self, tables):
+        with self.lock:
+            return tuple(self.versions_of.get(table, 0) for table in tables)
+
+    def get(self, key):
+        # The Entry of a result still current, or None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._current(entry.tables, entry.versions):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                self._remove(key)
+                self.invalidations += 1
+            self.misses += 1
+            return None
+
+    def collect(self, key, tables, versions, description, rows):
+        # Passes `rows` through, keeping them to add as the result under
+        # `key` once they have all been read; a result read only in part,
+        # or too big to keep, is not added
+        limit = self.max_bytes // MAX_ENTRY_SHARE
+        kept = []
+        size = 0
+        rows = iter(rows)
+        try:
+            for row in rows:
+                if kept is not None:
+                    size += row_size(row)
+                    if size > limit:
+                        kept = None
+                    else:
+                        kept.append(row)
+                yield row
+        finally:
+            close = getattr(rows, "close", None)
+            if close is not None:
+                close()
+        if kept is not None:
+            self.put(key, tables, versions, description, kept, size)
+
+    def put(self, key, tables, versions, description, rows, size):
+        with self.lock:
+            if size > self.max_bytes // MAX_ENTRY_SHARE or not self._current(tables, versions):
+                return
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = Entry(tables, versions, description, rows, size)
+            self.bytes += size
+            self._make_room()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def _current(self, tables, versions):
+        return all(self.versions_of.get(table, 0) == version and table not in self.writing_to
+                   for table, version in zip(tables, versions))
+
+    def _remove(self, key):
+        self.bytes -= self.entries.pop(key).size
+
+    def _make_room(self):
+        while self.entries and self.bytes > self.max_bytes:
+            self.bytes -= self.entries.popitem(last=False)[1].size
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "capacity_bytes": self.max_bytes,
+                "cached_results": len(self.entries),
+                "cached_bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -1,6 +1,9 @@
 
 class Schema_Manager:
     VALID_TYPES = {"INT", "TEXT", "FLOAT", "BOOL"}
+    # INT values are stored as int64
+    INT_MIN = -2 ** 63
+    INT_MAX = 2 ** 63 - 1
     def __init__(self,schema:dict):
         self.schema=schema
     def validate(self):
@@ -31,6 +34,35 @@ class Schema_Manager:
             return {"error": "Multiple primary keys defined; only one is allowed."}
 
         return {"success": "Schema is valid."}
-        
-        
+
+    @staticmethod
+    def coerce(col_type, value):
+        # Converts a value (often text from a logged statement) to the Python
+        # type stored for col_type. Raises ValueError if it can't be converted.
+        if value is None:
+            return None
+        if col_type == "INT":
+            if isinstance(value, bool):
+                return int(value)
+            if isinstance(value, int):
+                return value
+            if isinstance(value, float):
+                if not value.is_integer():
+                    raise ValueError(f"{value!r} is not an INT")
+                return int(value)
+            return int(str(value).strip())
+        if col_type == "FLOAT":
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return float(value)
+            return float(str(value).strip())
+        if col_type == "BOOL":
+            if isinstance(value, bool):
+                return value
+            text = str(value).strip().lower()
+            if text in ("true", "1"):
+                return True
+            if text in ("false", "0"):
+                return False
+            raise ValueError(f"{value!r} is not a BOOL")
+        return value if isinstance(value, str) else str(value)
         
\ No newline at end of file
@@ -1,102 +1,376 @@
-import json
-from pathlib import Path
+from dataclasses import replace
+from itertools import chain, islice
 
-DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+from db_core import stats
+from db_core.catalog import DATA_DIR
+from db_core.index_manager import IndexManager
+from db_core.parallel_scan import ScanPool, ScanTask, mod_spec, split
+from db_core.rows import projector
+from db_core.stats import Stats
+from db_core.storage_manager import TableStorage
+from db_core.wal_manager import WALManager
+from db_core.where_clause import WhereClause
 
 class SelectManager:
-    def __init__(self, db_name, table_name):
+    def __init__(self, db_name, table_name, parallel=None, zone_maps=True):
+        # `parallel`: the processes a full scan may be split over (PARALLEL
+        # n); None for as many as the scan pool has. `zone_maps`: whether a
+        # filtered scan skips the blocks the table's zone maps rule out.
         self.db_name = db_name
         self.table_name = table_name
+        self.parallel = parallel
+        self.zone_maps = zone_maps
         self.base_path = DATA_DIR / db_name / table_name
-        self.data_path = self.base_path / "data.json"
+        self.storage = TableStorage.for_table(db_name, table_name)
+        self.data_path = self.storage.data_path
         self.wal_path = self.base_path / "log.wal"
+        self.wal = WALManager(db_name, table_name)
+        self.indexes = IndexManager.for_table(db_name, table_name)
+        self.rw_lock = WALManager.rw_lock(db_name, table_name)
 
-    def select(self, columns, where_clause):
-        self._apply_wal()
+    def select(self, columns, where_clause, where_tree=None, limit=None, offset=None):
+        # The rows as tuples laid out as describe(columns). Raises WhereError
+        # (a ValueError) for a clause that doesn't parse or doesn't fit the
+        # table's columns. `where_tree` is the clause as already parsed with
+        # its statement, if it was.
+        where = self.compile_where(where_clause, where_tree) if where_clause else None
+        scanned = [0]
+        rows = self._select_parallel(columns, where, limit, offset, scanned) if where is not None else None
+        if rows is None:
+            rows = self.scan(where, lambda rows: list(self._pipeline(rows, columns, None, limit, offset)), scanned)
+        Stats.instance().add(self.db_name, self.table_name, rows_scanned=scanned[0], rows_returned=len(rows))
+        return rows
 
-        try:
-            with open(self.data_path, "r") as f:
-                rows = json.load(f)
-                print(f"Read {len(rows)} rows from {self.data_path}")
-        except (FileNotFoundError, json.JSONDecodeError):
-            rows = []
-            print(f"Could not read rows from {self.data_path}")
+    def scan(self, where, query, scanned=None):
+        # Runs query() over the rows `where` matches (all if it is None),
+        # looked up through an index where one applies
+        if where is None:
+            return self.run_consistent(query, scanned=scanned)
+        return self.run_consistent(lambda rows: query(self._filter_rows(rows, where)),
+                                   lambda entries, scanned: self._where_rows(where, entries, scanned), scanned)
 
-        if where_clause:
-            rows = self._filter_rows(rows, where_clause)
+    def stream(self, columns, where_clause, where_tree=None, limit=None, offset=None):
+        # Like select(), but returns a generator yielding the rows as the scan
+        # produces them. The clause is compiled and the table read-locked
+        # here, so a bad clause raises before anything is streamed, and the
+        # rows are those of the table as it is now, however late they are read.
+        # The scan is never split over processes, whose rows come back all
+        # at once: a stream holds no more rows than its reader asks for.
+        where = self.compile_where(where_clause, where_tree) if where_clause else None
+        rows = self._stream(columns, where, limit, offset)
+        next(rows, None)
+        return rows
 
+    def _select_parallel(self, columns, where, limit, offset, scanned):
+        # select() run as a parallel scan: the list of rows, or None if the
+        # scan is better run here (see scan_parallel())
+        task = ScanTask(output=columns, limit=None if limit is None else limit + (offset or 0))
+        found = self.scan_parallel(where, task, scanned)
+        if found is None:
+            return None
+        parts, logged = found
         if columns != ["*"]:
-            rows = self._project_columns(rows, columns)
+            logged = self._project_columns(logged, columns)
+        rows = chain(chain.from_iterable(parts), logged)
+        if limit is not None or offset:
+            start = offset or 0
+            rows = stats.pipe("limit", islice(rows, start, None if limit is None else start + limit),
+                              limit_text(limit, offset))
+        return list(rows)
 
-        return rows
+    def scan_parallel(self, where, task, scanned):
+        """Runs `task` (a ScanTask) over the table's segment files in the scan
+        pool's processes, each applying the WAL's pending updates and deletes
+        and `where` to its pages. Returns (the result of each process, in
+        page order; the logged inserts `where` matches), or None if the scan
+        is better run here: the query asks for one process, the table has
+        one segment (or the zone maps leave one range of pages to read), or
+        an index answers `where`."""
+        pool = ScanPool.instance()
+        degree = pool.degree(self.parallel)
+        if degree < 2:
+            return None
+        with self.rw_lock.read():
+            entries = self._read_wal()
+            if where is not None and self._index_lookup(where, entries) is not None:
+                return None
+            try:
+                storage = self.storage.open()
+                segments = storage.segments()
+                pruned = self._prune(where, entries, segments) if where is not None else None
+            except FileNotFoundError:
+                return None
+            ranges = segments if pruned is None else pruned[0]
+            if len(ranges) < 2:
+                return None
+            codec = storage.codec
+            columns = [{"name": name, "type": col_type} for name, col_type in zip(codec.columns, codec.types)]
+            mods = [mod_spec(op) for op in self.wal.mods(entries)]
+            tasks = [replace(task, data_path=str(self.data_path), strings_path=str(storage.strings_path),
+                             columns=columns, pages=pages, mods=mods, where=where.text if where else None)
+                     for pages in split(ranges, degree)]
+            detail = f"{self.table_name}: {len(segments)} segments in {len(tasks)} processes"
+            if pruned is not None:
+                detail += f", {zone_text(*pruned[1:])}"
+                self._count_skipped(*pruned[1:])
+            with stats.stage("parallel_scan", detail) as stage:
+                results = pool.run(tasks)
+                if results is None:
+                    return None
+                if stage is not None:
+                    stage.rows = sum(len(result) for _, result in results)
+            scanned[0] += sum(count for count, _ in results)
+            logged = self.wal.overlay(iter(()), entries)
+            if where is not None:
+                logged = where.filter(logged)
+            return [result for _, result in results], list(logged)
 
-    def _filter_rows(self, rows, where_clause):
-        # Naive implementation of a WHERE clause parser
-        # This should be replaced with a more robust solution
+    def _stream(self, columns, where, limit, offset):
+        # Holds the table's read lock until the stream is exhausted or
+        # closed: checkpoints wait for it or are put off, writes aren't.
+        self.rw_lock.acquire_read()
+        scanned = [0]
+        returned = 0
         try:
-            column, value = where_clause.split("=")
-            column = column.strip()
-            value = value.strip().strip("'\"")
-            return [row for row in rows if str(row.get(column)) == value]
-        except Exception as e:
-            # Handle cases with more complex conditions or invalid syntax
-            return []
+            entries = self._read_wal()
+            rows = self._where_rows(where, entries, scanned) if where is not None else None
+            if rows is None:
+                rows = stats.pipe("seq_scan", self.storage.scan_rows(scanned=scanned), self.table_name)
+            rows = self._pipeline(self._replay(rows, entries), columns, where, limit, offset)
+            yield  # started: stream() returns here
+            for row in rows:
+                returned += 1
+                yield row
+        except FileNotFoundError:
+            return
+        finally:
+            self.rw_lock.release_read()
+            Stats.instance().add(self.db_name, self.table_name, rows_scanned=scanned[0], rows_returned=returned)
 
-    def _project_columns(self, rows, columns):
-        return [{col: row.get(col) for col in columns} for row in rows]
+    def _pipeline(self, rows, columns, where, limit, offset):
+        # scan -> filter -> limit -> project, each step a generator pulling
+        # rows from the one before: once the limit is reached nothing more
+        # is read from the table
+        if where is not None:
+            rows = self._filter_rows(rows, where)
+        if limit is not None or offset:
+            start = offset or 0
+            rows = stats.pipe("limit", islice(rows, start, None if limit is None else start + limit),
+                              limit_text(limit, offset))
+        if columns != ["*"]:
+            rows = stats.pipe("project", self._project_columns(rows, columns), ", ".join(columns))
+        return rows
 
-    def _apply_wal(self):
-        try:
-            with open(self.data_path, "r") as f:
-                rows = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            rows = []
+    def explain(self, columns, where_clause, where_tree=None, limit=None, offset=None):
+        # The stages select() runs, without running them: what each does and
+        # the rows it reads, where that is known up front
+        where = self.compile_where(where_clause, where_tree) if where_clause else None
+        plan = self.plan_scan(where)
+        if limit is not None or offset:
+            plan.append(stats.plan_row("limit", limit_text(limit, offset)))
+        if columns != ["*"]:
+            plan.append(stats.plan_row("project", ", ".join(columns)))
+        return plan
 
-        try:
-            with open(self.wal_path, "r") as f:
-                for line in f:
-                    log_entry = json.loads(line)
-                    if log_entry["operation"] == "insert":
-                        rows.append(log_entry["data"])
-                    elif log_entry["operation"] == "update":
-                        rows = self._apply_update(rows, log_entry["set"], log_entry["where"])
-                    elif log_entry["operation"] == "delete":
-                        rows = self._apply_delete(rows, log_entry["where"])
-
-            with open(self.data_path, "w") as f:
-                json.dump(rows, f, indent=2)
-            
-            with open(self.wal_path, "w") as f:
-                f.write("")
+    def plan_scan(self, where, grouped=False):
+        # The stages of scan(where): how the table's rows are read, merged
+        # with the WAL and filtered. A filtered or `grouped` scan of more
+        # than one segment is split over processes.
+        with self.rw_lock.read():
+            entries, _ = self.wal.read_prefix(self.storage.wal_lsn())
+            plan = [stats.plan_row("wal_read", None, len(entries))]
+            lookup = self._index_lookup(where, entries) if where is not None else None
+            if lookup is not None:
+                rowids, used = lookup
+                plan.append(stats.plan_row("index_scan", index_text(used), len(rowids)))
+            else:
+                try:
+                    row_count = self.storage.row_count()
+                    segments = self.storage.segments()
+                    pruned = self._prune(where, entries, segments) if where is not None else None
+                except FileNotFoundError:
+                    row_count, segments, pruned = 0, [], None
+                detail = self.table_name
+                ranges = segments
+                if pruned is not None:
+                    ranges, kept, total = pruned
+                    row_count = round(row_count * kept / total)
+                degree = min(ScanPool.instance().degree(self.parallel), len(ranges))
+                if (where is not None or grouped) and degree > 1:
+                    detail = f"{self.table_name}: {len(segments)} segments in {degree} processes"
+                    plan.append(stats.plan_row("parallel_scan", detail if pruned is None else
+                                               f"{detail}, {zone_text(kept, total)}", row_count))
+                else:
+                    plan.append(stats.plan_row("seq_scan", detail if pruned is None else
+                                               f"{detail}: {zone_text(kept, total)}", row_count))
+        plan.append(stats.plan_row("wal_replay", f"{len(entries)} WAL entries"))
+        if where is not None:
+            plan.append(stats.plan_row("filter", where.text))
+        return plan
 
-        except FileNotFoundError:
-            pass
+    def describe(self, columns):
+        # (name, type) of each result column
+        codec = self.storage.open().codec
+        types = dict(zip(codec.columns, codec.types))
+        names = codec.columns if columns == ["*"] else columns
+        return [(name, types.get(name, "TEXT")) for name in names]
 
-    def _apply_update(self, rows, set_clause, where_clause):
-        # This is a naive implementation and should be improved
-        try:
-            where_col, where_val = where_clause.split("=")
-            where_col = where_col.strip()
-            where_val = where_val.strip().strip("'")
+    def compile_where(self, where_clause, where_tree=None):
+        codec = self.storage.open().codec
+        return WhereClause.compile(where_clause, dict(zip(codec.columns, codec.types)), where_tree)
 
-            set_col, set_val = set_clause.split("=")
-            set_col = set_col.strip()
-            set_val = set_val.strip().strip("'")
+    def read_rows(self):
+        return self.run_consistent(list)
 
-            for row in rows:
-                if str(row.get(where_col)) == where_val:
-                    row[set_col] = set_val
+    def run_consistent(self, query, source=None, scanned=None):
+        # Runs query() over the table pages merged with the WAL tail, streamed
+        # so only the query's result is held in memory. `source(entries,
+        # scanned)` may supply the checkpointed rows instead of a full scan
+        # (an index lookup); it returns None if it can't. The read lock keeps
+        # checkpoints from changing the pages meanwhile, so the rows are a
+        # snapshot: the pages as they are plus the WAL prefix read now.
+        # Writes only append to the WAL, past that prefix, and go on.
+        # The rows read are counted in `scanned` if the caller passes it
+        # (and then counts them itself), else counted here.
+        counting = scanned is None
+        if counting:
+            scanned = [0]
+        with self.rw_lock.read():
+            entries = self._read_wal()
+            try:
+                rows = source(entries, scanned) if source else None
+                if rows is None:
+                    rows = stats.pipe("seq_scan", self.storage.scan_rows(scanned=scanned), self.table_name)
+                return query(self._replay(rows, entries))
+            except FileNotFoundError:
+                return query(iter(()))
+            finally:
+                if counting and scanned[0]:
+                    Stats.instance().add(self.db_name, self.table_name, rows_scanned=scanned[0])
+
+    def _read_wal(self):
+        with stats.stage("wal_read") as stage:
+            entries, _ = self.wal.read_prefix(self.storage.wal_lsn())
+            if stage is not None:
+                stage.rows = len(entries)
+        return entries
+
+    def _replay(self, rows, entries):
+        rows = self.wal.overlay(rows, entries)
+        if stats.active() is None:
             return rows
-        except Exception as e:
+        return stats.pipe("wal_replay", rows, f"{len(entries)} WAL entries")
+
+    def _updated_columns(self, entries):
+        # The columns pending WAL updates set
+        columns = set()
+        for entry in entries:
+            if entry.get("operation") == "update":
+                try:
+                    set_col, _ = WALManager.parse_assignment(entry["set"])
+                except (KeyError, ValueError):
+                    continue
+                columns.add(set_col)
+        return columns
+
+    def _index_lookup(self, where, entries):
+        # (row IDs, indexes used) of the checkpointed rows the indexes say
+        # can match, or None. That is only safe if no pending WAL update
+        # sets a column the clause uses, since such an update could make
+        # other rows match.
+        if self._updated_columns(entries) & where.columns:
+            return None
+        used = []
+        rowids = self.indexes.candidates(where.tree, used)
+        if rowids is None:
+            return None
+        return rowids, used
+
+    def _index_rows(self, where, entries, scanned):
+        # Fetches only the checkpointed rows the indexes say can match
+        lookup = self._index_lookup(where, entries)
+        if lookup is None:
+            return None
+        rowids, used = lookup
+        rows = self._fetch(rowids, scanned)
+        if stats.active() is None:
             return rows
+        return stats.pipe("index_scan", rows, index_text(used))
 
-    def _apply_delete(self, rows, where_clause):
-        # This is a naive implementation and should be improved
-        try:
-            where_col, where_val = where_clause.split("=")
-            where_col = where_col.strip()
-            where_val = where_val.strip().strip("'")
+    def _where_rows(self, where, entries, scanned):
+        # The checkpointed rows `where` may match: looked up through an
+        # index, or scanned skipping the blocks the zone maps rule out.
+        # None if neither narrows the scan.
+        rows = self._index_rows(where, entries, scanned)
+        if rows is not None:
+            return rows
+        pruned = self._prune(where, entries)
+        if pruned is None:
+            return None
+        ranges, kept, total = pruned
+        self._count_skipped(kept, total)
+        return stats.pipe("seq_scan", self.storage.scan_ranges(ranges, scanned),
+                          f"{self.table_name}: {zone_text(kept, total)}")
+
+    def _prune(self, where, entries, ranges=None):
+        # (page ranges, blocks kept, blocks in all) of a scan of `ranges`
+        # (the whole table by default) for `where`, or None if the zone
+        # maps rule nothing out. Like an index lookup, only safe if no
+        # pending WAL update sets a column the clause uses.
+        if not self.zone_maps or self._updated_columns(entries) & where.columns:
+            return None
+        pruned = self.storage.prune(where, ranges)
+        return pruned if pruned[1] < pruned[2] else None
+
+    def _count_skipped(self, kept, total):
+        Stats.instance().add(self.db_name, self.table_name, blocks_skipped=total - kept)
+
+    def _fetch(self, rowids, scanned):
+        fetch = self.storage.fetch
+        for rowid in rowids:
+            scanned[0] += 1
+            row = fetch(rowid)
+            if row is not None:
+                yield row
+
+    def _filter_rows(self, rows, where):
+        return stats.pipe("filter", where.filter(rows), where.text)
+
+    def _project_columns(self, rows, columns):
+        return map(projector(self.storage.open().codec.columns, columns), rows)
+
+
+def limit_text(limit, offset):
+    parts = [] if limit is None else [f"LIMIT {limit}"]
+    if offset:
+        parts.append(f"OFFSET {offset}")
+    return " ".join(parts)
+
+
+def zone_text(kept, total):
+    return f"{kept} of {total} blocks by zone maps"
+
+
+def index_text(indexes):
+    # "name (USING on column)" of each index a lookup used, once each
+    return ", ".join(dict.fromkeys(f"{index.name} ({index.using} on {index.column})" for index in indexes))
+
+
+class Cursor:
+    """A declared cursor: its SELECT's row stream, read a batch at a time."""
+
+    def __init__(self, name, rows, columns):
+        self.name = name
+        self.rows = rows  # tuples, laid out as `columns`
+        self.columns = columns  # (name, type) of each column
+
+    def fetch(self, count=None):
+        # The next `count` rows, or all that are left
+        return list(self.rows if count is None else islice(self.rows, count))
+
+    def iter(self, count=None):
+        # Same rows as fetch(), yielded one at a time
+        yield from (self.rows if count is None else islice(self.rows, count))
 
-            return [row for row in rows if str(row.get(where_col)) != where_val]
-        except Exception as e:
-            return rows
\ No newline at end of file
+    def close(self):
+        self.rows.close()
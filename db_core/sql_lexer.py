@@ -0,0 +1,132 @@
+import re
+
+
+class SQLSyntaxError(ValueError):
+    pass
+
+
+# One alternative per token kind; findall() returns one tuple of groups per
+# token, with only the matching kind's group non-empty. Quotes are kept in
+# the string groups so that '' still reads as a (non-empty) match. A word
+# may be qualified by a table name, "t.col".
+TOKEN = re.compile(r"""\s*(?:
+    ([^\W\d]\w*(?:\.[^\W\d]\w*)?)
+  | (-?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)(?![\w.])
+  | (<=|>=|!=|<>|[=<>(),*;?])
+  | ('[^'\\]*(?:(?:''|\\.)[^'\\]*)*')
+  | ("[^"\\]*(?:(?:""|\\.)[^"\\]*)*")
+  | (\S)
+)""", re.VERBOSE | re.DOTALL)
+
+# Words that are always keywords inside expressions; every other word is
+# matched as a keyword only where the grammar expects one, so names such as
+# "set" or "index" still work as columns and values.
+RESERVED = {"AND", "OR", "NOT", "IN", "BETWEEN", "LIKE", "IS", "NULL", "TRUE", "FALSE"}
+RESERVED_VALUES = {"NULL": None, "TRUE": True, "FALSE": False}
+
+ESCAPES = re.compile(r"\\(.)", re.DOTALL)
+ESCAPED = {"n": "\n", "t": "\t", "r": "\r", "0": "\0"}
+
+
+def _unescape(raw):
+    quote = raw[0]
+    value = raw[1:-1]
+    if quote in value:
+        value = value.replace(quote * 2, quote)
+    if "\\" in value:
+        value = ESCAPES.sub(lambda m: ESCAPED.get(m.group(1), m.group(1)), value)
+    return value
+
+
+def tokenize(text):
+    """Splits SQL text into (kind, value, raw) tuples in one pass.
+
+    kind is "literal" (value is an int, float or str), "keyword" (a RESERVED
+    word, value upper-cased), "word", or "op"; raw is the token's source
+    text. Strings take '' (or "") and backslash escapes.
+    """
+    tokens = []
+    append = tokens.append
+    reserved = RESERVED
+    for word, number, op, string, dstring, error in TOKEN.findall(text):
+        if word:
+            upper = word.upper()
+            if upper in reserved:
+                append(("keyword", upper, word))
+            else:
+                append(("word", word, word))
+        elif op:
+            append(("op", op, op))
+        elif number:
+            if "." in number or "e" in number or "E" in number:
+                append(("literal", float(number), number))
+            else:
+                append(("literal", int(number), number))
+        elif string or dstring:
+            raw = string or dstring
+            append(("literal", _unescape(raw), raw))
+        else:
+            if error in "'\"":
+                raise SQLSyntaxError("Unterminated string literal")
+            raise SQLSyntaxError(f"Unexpected character {error!r}")
+    return tokens
+
+
+def sql_literal(value):
+    # SQL source for a typed value; tokenize() reads it back as the same value
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if value != value or value in (float("inf"), float("-inf")):
+            raise SQLSyntaxError(f"Cannot use {value} as a value")
+        return repr(value)
+    if isinstance(value, str):
+        return "'" + value.replace("\\", "\\\\").replace("'", "''") + "'"
+    raise SQLSyntaxError(f"Unsupported value type {type(value).__name__}")
+
+
+def join_tokens(tokens):
+    # Source text for a run of tokens, with whitespace normalised
+    return " ".join(token[2] for token in tokens)
+
+
+STATEMENT_END = re.compile(r"""'[^'\\]*(?:(?:''|\\.)[^'\\]*)*'|"[^"\\]*(?:(?:""|\\.)[^"\\]*)*"|(;)""", re.DOTALL)
+
+
+def split_statements(text):
+    # Splits a script on semicolons outside string literals
+    statements = []
+    start = 0
+    for m in STATEMENT_END.finditer(text):
+        if m.group(1):
+            if text[start:m.start()].strip():
+                statements.append(text[start:m.start()].strip())
+            start = m.end()
+    if text[start:].strip():
+        statements.append(text[start:].strip())
+    return statements
+
+
+STATEMENT_SCAN = re.compile(r"""[^'";]+|'(?:[^'\\]|''|\\.)*'|"(?:[^"\\]|""|\\.)*"|;|['"]""", re.DOTALL)
+
+
+def take_statements(buffer):
+    """Splits the complete, semicolon-terminated statements off the front of
+    text read from a stream. Returns (statements, rest), where rest is the
+    unfinished statement (possibly inside an open string) to keep reading."""
+    statements = []
+    start = 0
+    for m in STATEMENT_SCAN.finditer(buffer):
+        token = m.group()
+        if token == ";":
+            statement = buffer[start:m.end()].strip()
+            if statement != ";":
+                statements.append(statement)
+            start = m.end()
+        elif token in ("'", '"'):
+            break  # a string still open at the end of the buffer
+    return statements, buffer[start:]
@@ -0,0 +1,757 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+
+from db_core.sql_lexer import RESERVED_VALUES, SQLSyntaxError, join_tokens, sql_literal, tokenize
+from db_core.where_clause import Aggregate, ExpressionParser, Param, bind as bind_tree, render
+
+# Parsed statements kept per normalised text
+PLAN_CACHE_SIZE = 1024
+# Longer statements (bulk INSERTs, mostly) are parsed every time
+MAX_CACHED_LENGTH = 4096
+
+
+# Statement tree produced by parse(). Values are typed Python values: int,
+# float, str, bool or None; in a PREPAREd statement, also Param markers.
+
+@dataclass
+class Where:
+    text: str  # clause text, as logged in the WAL
+    tree: object  # parsed, not yet resolved against a schema
+
+
+@dataclass
+class UseDatabase:
+    name: str
+
+
+@dataclass
+class CreateDatabase:
+    name: str
+
+
+@dataclass
+class ColumnDef:
+    name: str
+    type: str
+    constraints: list = field(default_factory=list)
+
+
+@dataclass
+class CreateTable:
+    table: str
+    columns: list
+    partition_by: str = None  # the column of PARTITION BY HASH (column)
+    partitions: int = None
+    compression: str = None  # of COMPRESSION name, lower-cased
+
+
+@dataclass
+class CreateIndex:
+    name: str
+    table: str
+    column: str
+    using: str = None
+
+
+@dataclass
+class DropIndex:
+    name: str
+    table: str = None
+
+
+@dataclass
+class Insert:
+    table: str
+    rows: list  # one list of values per row
+
+
+@dataclass
+class Copy:
+    table: str
+    path: str
+    format: str = None  # "CSV" or "JSONL"; None to go by the file extension
+    header: bool = False
+
+
+@dataclass(frozen=True)
+class Join:
+    # [INNER | LEFT] JOIN table [alias] ON left = right; the ON columns as
+    # written, qualified or not
+    table: str
+    kind: str  # "INNER" or "LEFT"
+    left: str
+    right: str
+    alias: str = None
+
+
+@dataclass
+class Select:
+    table: str
+    columns: list  # names, ["*"], or names and Aggregate calls; qualified names only with a JOIN
+    where: Where = None
+    limit: int = None  # None for no LIMIT
+    offset: int = None
+    group_by: list = None
+    having: Where = None
+    parallel: int = None  # PARALLEL n: processes a full scan may use; None for the default
+    cache: bool = True  # False for NOCACHE: the result cache is neither read nor filled
+    alias: str = None  # of the FROM table
+    join: Join = None
+
+    @property
+    def tables(self):
+        # The tables read, FROM's first
+        return [self.table] if self.join is None else [self.table, self.join.table]
+
+    @property
+    def grouped(self):
+        # Returns one row per group, or with aggregates and no GROUP BY, one
+        return bool(self.group_by) or self.having is not None \
+            or any(isinstance(column, Aggregate) for column in self.columns)
+
+
+@dataclass
+class Declare:
+    name: str
+    statement: Select
+
+
+@dataclass
+class Fetch:
+    name: str
+    count: int = None  # None for FETCH ALL
+
+
+@dataclass
+class Close:
+    name: str = None  # None for CLOSE ALL
+
+
+@dataclass
+class Update:
+    table: str
+    column: str
+    value: object
+    set_text: str  # "col = value" as logged in the WAL
+    where: Where
+
+
+@dataclass
+class Delete:
+    table: str
+    where: Where
+
+
+@dataclass
+class Checkpoint:
+    table: str = None
+
+
+@dataclass
+class Prepare:
+    name: str
+    statement: object  # Insert, Select, Update or Delete
+    params: int  # number of ? markers
+
+
+@dataclass
+class Execute:
+    name: str
+    args: list
+
+
+@dataclass
+class Deallocate:
+    name: str = None  # None for DEALLOCATE ALL
+
+
+@dataclass
+class Explain:
+    statement: object  # Insert, Select, Update or Delete
+    analyze: bool = False
+
+
+@dataclass
+class ShowStats:
+    pass
+
+
+class StatementParser:
+    """Recursive-descent parser over the token list of one statement.
+
+    Apart from the reserved expression words, keywords are matched by
+    spelling where the grammar expects them, so they stay usable as names.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        # A trailing semicolon ends the statement
+        self.end = len(self.tokens)
+        if self.end and self.tokens[-1][0] == "op" and self.tokens[-1][1] == ";":
+            self.end -= 1
+        self.pos = 0
+        # Count of ? markers seen; None outside PREPARE, where they're invalid
+        self.params = None
+
+    def normalized(self):
+        # The statement's text with whitespace normalised: the plan cache key
+        return join_tokens(self.tokens[:self.end])
+
+    def parse(self):
+        if self.end == 0:
+            raise SQLSyntaxError("Empty command")
+        verb = self.verb(STATEMENTS)
+        if verb is None:
+            raise SQLSyntaxError("Unsupported or invalid command")
+        statement = getattr(self, f"parse_{verb.lower()}")()
+        if self.pos < self.end:
+            raise SQLSyntaxError(f"Unexpected {self.tokens[self.pos][2]!r}")
+        return statement
+
+    def verb(self, verbs):
+        kind, value, raw = self.tokens[self.pos]
+        if kind == "word" and raw.upper() in verbs:
+            self.pos += 1
+            return raw.upper()
+        return None
+
+    # -- token helpers
+
+    def error(self, expected):
+        if self.pos < self.end:
+            return SQLSyntaxError(f"Expected {expected} but found {self.tokens[self.pos][2]!r}")
+        return SQLSyntaxError(f"Expected {expected} but the statement ended")
+
+    def word(self):
+        # Any identifier (reserved words excluded)
+        name = self.name()
+        if "." in name:
+            self.pos -= 1
+            raise self.error("a name")
+        return name
+
+    def name(self):
+        # An identifier, which may be qualified by a table: "t.col"
+        if self.pos < self.end and self.tokens[self.pos][0] == "word":
+            self.pos += 1
+            return self.tokens[self.pos - 1][1]
+        raise self.error("a name")
+
+    def accept_keyword(self, keyword):
+        if self.pos < self.end:
+            kind, value, raw = self.tokens[self.pos]
+            if kind in ("word", "keyword") and raw.upper() == keyword:
+                self.pos += 1
+                return True
+        return False
+
+    def keyword(self, keyword):
+        if not self.accept_keyword(keyword):
+            raise self.error(keyword)
+
+    def accept_op(self, op):
+        if self.pos < self.end:
+            token = self.tokens[self.pos]
+            if token[0] == "op" and token[1] == op:
+                self.pos += 1
+                return True
+        return False
+
+    def op(self, op):
+        if not self.accept_op(op):
+            raise self.error(f"'{op}'")
+
+    def value(self):
+        # A literal; NULL/TRUE/FALSE; or a bare word, read as text
+        if self.pos >= self.end:
+            raise self.error("a value")
+        kind, value, raw = self.tokens[self.pos]
+        if kind == "literal" or kind == "word":
+            self.pos += 1
+            return value
+        if kind == "keyword" and value in RESERVED_VALUES:
+            self.pos += 1
+            return RESERVED_VALUES[value]
+        if kind == "op" and value == "?" and self.params is not None:
+            self.pos += 1
+            self.params += 1
+            return Param(self.params - 1)
+        raise self.error("a value")
+
+    def where(self, clauses=(), aggregates=False):
+        # `clauses` are the words of clauses that may follow the condition;
+        # `aggregates` allows aggregate calls in it, as HAVING does
+        start = self.pos
+        if start >= self.end:
+            raise self.error("a WHERE condition" if not aggregates else "a HAVING condition")
+        end = self._clause_end(start, clauses) if clauses else self.end
+        parser = ExpressionParser(self.tokens, start, end, self.params, aggregates)
+        tree = parser.parse()
+        self.pos = parser.pos
+        self.params = parser.params
+        return Where(join_tokens(self.tokens[start:self.pos]), tree)
+
+    def _clause_end(self, start, words):
+        # Position of the first of `words` outside parentheses and right
+        # after an operand, so a column or text value spelled like one of
+        # them is still read as part of the condition
+        depth = 0
+        for pos in range(start + 1, self.end):
+            kind, value, raw = self.tokens[pos]
+            if kind == "op":
+                if value == "(":
+                    depth += 1
+                elif value == ")":
+                    depth -= 1
+            elif kind == "word" and depth == 0 and raw.upper() in words:
+                prev_kind, prev_value, _ = self.tokens[pos - 1]
+                if prev_kind in ("literal", "word") or (prev_kind == "keyword" and prev_value in RESERVED_VALUES) \
+                        or (prev_kind == "op" and prev_value in (")", "?")):
+                    return pos
+        return self.end
+
+    def count(self, clause):
+        # A row count: a non-negative integer, or ? in a PREPARE
+        value = self.value()
+        if not isinstance(value, Param):
+            check_count(clause, value)
+        return value
+
+    # -- statements
+
+    def parse_use(self):
+        return UseDatabase(self.word())
+
+    def parse_create(self):
+        if self.accept_keyword("DATABASE"):
+            return CreateDatabase(self.word())
+        if self.accept_keyword("TABLE"):
+            return self._create_table()
+        if self.accept_keyword("INDEX"):
+            return self._create_index()
+        raise self.error("DATABASE, TABLE or INDEX")
+
+    def _create_table(self):
+        table = self.word()
+        self.op("(")
+        columns = []
+        while True:
+            name = self.word()
+            col_type = self.word().upper()
+            constraints = []
+            while self.pos < self.end and self.tokens[self.pos][0] in ("word", "keyword"):
+                constraints.append(self.tokens[self.pos][2].upper())
+                self.pos += 1
+            columns.append(ColumnDef(name, col_type, constraints))
+            if not self.accept_op(","):
+                break
+        self.op(")")
+        statement = CreateTable(table, columns)
+        if self.accept_keyword("PARTITION"):
+            self.keyword("BY")
+            self.keyword("HASH")
+            self.op("(")
+            statement.partition_by = self.word()
+            self.op(")")
+            self.keyword("PARTITIONS")
+            count = self.value()
+            if isinstance(count, bool) or not isinstance(count, int) or count < 1:
+                raise SQLSyntaxError("PARTITIONS must be a positive integer")
+            statement.partitions = count
+        if self.accept_keyword("COMPRESSION"):
+            statement.compression = self.word().lower()
+        return statement
+
+    def _create_index(self):
+        name = self.word()
+        self.keyword("ON")
+        table = self.word()
+        self.op("(")
+        column = self.word()
+        self.op(")")
+        using = self.word().upper() if self.accept_keyword("USING") else None
+        return CreateIndex(name, table, column, using)
+
+    def parse_drop(self):
+        self.keyword("INDEX")
+        name = self.word()
+        table = self.word() if self.accept_keyword("ON") else None
+        return DropIndex(name, table)
+
+    def parse_insert(self):
+        self.keyword("INTO")
+        table = self.word()
+        self.keyword("VALUES")
+        rows = []
+        while True:
+            self.op("(")
+            rows.append(self._value_list())
+            if not self.accept_op(","):
+                break
+        return Insert(table, rows)
+
+    def _value_list(self):
+        # value (, value)* ')' -- the hot loop for wide INSERTs, so it walks
+        # the tokens directly rather than through value()/accept_op()
+        tokens = self.tokens
+        end = self.end
+        pos = self.pos
+        values = []
+        append = values.append
+        while pos < end:
+            kind, value, raw = tokens[pos]
+            if kind == "literal" or kind == "word":
+                append(value)
+            elif kind == "keyword" and value in RESERVED_VALUES:
+                append(RESERVED_VALUES[value])
+            elif kind == "op" and value == "?" and self.params is not None:
+                append(Param(self.params))
+                self.params += 1
+            else:
+                break
+            pos += 1
+            if pos < end and tokens[pos][0] == "op":
+                if tokens[pos][1] == ",":
+                    pos += 1
+                    continue
+                if tokens[pos][1] == ")":
+                    self.pos = pos + 1
+                    return values
+            break
+        self.pos = pos
+        raise self.error("a value" if not values or tokens[pos - 1][1] == "," else "',' or ')'")
+
+    def parse_select(self):
+        if self.accept_op("*"):
+            columns = ["*"]
+        else:
+            columns = [self._select_item()]
+            while self.accept_op(","):
+                columns.append(self._select_item())
+        self.keyword("FROM")
+        table = self.word()
+        alias = self._alias()
+        join = self._join()
+        if join is None:
+            columns = self._unqualify(alias or table, columns)
+        where = self.where(("GROUP", "HAVING", "ORDER", "LIMIT", "OFFSET", "PARALLEL", "NOCACHE")) \
+            if self.accept_keyword("WHERE") else None
+        group_by = having = None
+        if self.accept_keyword("GROUP"):
+            self.keyword("BY")
+            group_by = [self.word()]
+            while self.accept_op(","):
+                group_by.append(self.word())
+            group_by = list(dict.fromkeys(group_by))  # a column named twice groups the same
+        if self.accept_keyword("HAVING"):
+            having = self.where(("ORDER", "LIMIT", "OFFSET", "PARALLEL", "NOCACHE"), aggregates=True)
+        limit = offset = parallel = None
+        cache = True
+        while True:
+            if limit is None and self.accept_keyword("LIMIT"):
+                limit = self.count("LIMIT")
+            elif offset is None and self.accept_keyword("OFFSET"):
+                offset = self.count("OFFSET")
+            elif parallel is None and self.accept_keyword("PARALLEL"):
+                parallel = self.value()
+                if isinstance(parallel, bool) or not isinstance(parallel, int) or parallel < 1:
+                    raise SQLSyntaxError("PARALLEL must be a positive integer")
+            elif cache and self.accept_keyword("NOCACHE"):
+                cache = False
+            else:
+                break
+        if self.accept_keyword("ORDER"):
+            raise SQLSyntaxError("ORDER BY is not supported")
+        select = Select(table, columns, where, limit, offset, group_by, having, parallel, cache, alias, join)
+        if join is not None and select.grouped:
+            raise SQLSyntaxError("GROUP BY, HAVING and aggregates can't be used with a JOIN")
+        return select
+
+    def _unqualify(self, qualifier, columns):
+        # Without a JOIN, "t.col" (or "alias.col") is the FROM table's column
+        # col: the qualifier is dropped from the select list and from the
+        # names in the rest of the statement. A name qualified otherwise is
+        # left as it is, to be reported as a column the table doesn't have.
+        prefix = qualifier + "."
+
+        def strip(name):
+            return name[len(prefix):] if name is not None and name.startswith(prefix) else name
+
+        self.tokens = self.tokens[:self.pos] + [
+            (kind, strip(value), strip(raw)) if kind == "word" else (kind, value, raw)
+            for kind, value, raw in self.tokens[self.pos:]]
+        return [Aggregate.of(column.func, strip(column.column)) if isinstance(column, Aggregate) else strip(column)
+                for column in columns]
+
+    def _alias(self):
+        # [AS] alias after a table name; a clause word is not one
+        if self.accept_keyword("AS"):
+            return self.word()
+        if self.pos < self.end and self.tokens[self.pos][0] == "word" \
+                and self.tokens[self.pos][2].upper() not in JOIN_CLAUSES:
+            return self.word()
+        return None
+
+    def _join(self):
+        # [INNER | LEFT [OUTER]] JOIN table [[AS] alias] ON name = name
+        kind = "INNER"
+        if self.accept_keyword("LEFT"):
+            kind = "LEFT"
+            self.accept_keyword("OUTER")
+            self.keyword("JOIN")
+        elif self.accept_keyword("INNER"):
+            self.keyword("JOIN")
+        elif not self.accept_keyword("JOIN"):
+            return None
+        table = self.word()
+        alias = self._alias()
+        self.keyword("ON")
+        left = self.name()
+        self.op("=")
+        right = self.name()
+        if self.pos < self.end and self.tokens[self.pos][0] == "keyword" and self.tokens[self.pos][1] in ("AND", "OR"):
+            raise SQLSyntaxError("ON takes one column = column condition; put the others in WHERE")
+        return Join(table, kind, left, right, alias)
+
+    def _select_item(self):
+        # A column name, or an aggregate call: COUNT(*), SUM(col), ...
+        name = self.name()
+        if not (self.pos < self.end and self.tokens[self.pos][:2] == ("op", "(")):
+            return name
+        parser = ExpressionParser(self.tokens, self.pos, self.end, aggregates=True)
+        item = parser.aggregate(name)
+        self.pos = parser.pos
+        return item
+
+    def parse_update(self):
+        table = self.word()
+        self.keyword("SET")
+        set_start = self.pos
+        column = self.word()
+        self.op("=")
+        value = self.value()
+        set_text = join_tokens(self.tokens[set_start:self.pos])
+        if self.accept_op(","):
+            raise SQLSyntaxError("UPDATE can only SET one column")
+        self.keyword("WHERE")
+        return Update(table, column, value, set_text, self.where())
+
+    def parse_delete(self):
+        self.keyword("FROM")
+        table = self.word()
+        self.keyword("WHERE")
+        return Delete(table, self.where())
+
+    def parse_checkpoint(self):
+        table = self.word() if self.pos < self.end else None
+        return Checkpoint(table)
+
+    def parse_copy(self):
+        table = self.word()
+        self.keyword("FROM")
+        if self.pos >= self.end or self.tokens[self.pos][0] != "literal" \
+                or not isinstance(self.tokens[self.pos][1], str):
+            raise self.error("a quoted file name")
+        path = self.tokens[self.pos][1]
+        self.pos += 1
+        file_format = None
+        header = False
+        while self.pos < self.end:
+            if self.accept_keyword("FORMAT"):
+                file_format = self.word().upper()
+                if file_format not in ("CSV", "JSONL"):
+                    raise SQLSyntaxError(f"Unknown COPY format '{file_format}'")
+            elif self.accept_keyword("HEADER"):
+                header = True
+            elif not self.accept_keyword("WITH"):
+                raise self.error("FORMAT or HEADER")
+        return Copy(table, path, file_format, header)
+
+    def parse_prepare(self):
+        name = self.word()
+        self.keyword("AS")
+        return self.prepared(name)
+
+    def prepared(self, name):
+        # The rest of the tokens as a statement that may take ? markers
+        verb = self.verb(PREPARABLE) if self.pos < self.end else None
+        if verb is None:
+            raise self.error("INSERT, SELECT, UPDATE or DELETE")
+        self.params = 0
+        statement = getattr(self, f"parse_{verb.lower()}")()
+        if self.pos < self.end:
+            raise SQLSyntaxError(f"Unexpected {self.tokens[self.pos][2]!r}")
+        return Prepare(name, statement, self.params)
+
+    def parse_execute(self):
+        name = self.word()
+        args = []
+        if self.accept_op("("):
+            if not self.accept_op(")"):
+                args = self._value_list()
+        return Execute(name, args)
+
+    def parse_deallocate(self):
+        self.accept_keyword("PREPARE")
+        if self.accept_keyword("ALL"):
+            return Deallocate()
+        return Deallocate(self.word())
+
+    def parse_declare(self):
+        name = self.word()
+        self.keyword("CURSOR")
+        self.keyword("FOR")
+        if self.pos >= self.end or self.verb({"SELECT"}) is None:
+            raise self.error("SELECT")
+        return Declare(name, self.parse_select())
+
+    def parse_fetch(self):
+        # FETCH [ALL | NEXT | count] [FROM | IN] name
+        count = 1
+        if self.accept_keyword("ALL"):
+            count = None
+        elif not self.accept_keyword("NEXT") and self.pos < self.end and self.tokens[self.pos][0] == "literal":
+            count = self.count("FETCH")
+        if not self.accept_keyword("FROM"):
+            self.accept_keyword("IN")
+        return Fetch(self.word(), count)
+
+    def parse_close(self):
+        if self.accept_keyword("ALL"):
+            return Close()
+        return Close(self.word())
+
+    def parse_explain(self):
+        analyze = self.accept_keyword("ANALYZE")
+        verb = self.verb(PREPARABLE) if self.pos < self.end else None
+        if verb is None:
+            raise self.error("INSERT, SELECT, UPDATE or DELETE")
+        return Explain(getattr(self, f"parse_{verb.lower()}")(), analyze)
+
+    def parse_show(self):
+        self.keyword("STATS")
+        return ShowStats()
+
+
+STATEMENTS = {"USE", "CREATE", "DROP", "INSERT", "SELECT", "UPDATE", "DELETE", "CHECKPOINT",
+              "COPY", "PREPARE", "EXECUTE", "DEALLOCATE", "DECLARE", "FETCH", "CLOSE", "EXPLAIN", "SHOW"}
+PREPARABLE = {"INSERT", "SELECT", "UPDATE", "DELETE"}
+# Words that follow a table in FROM, so are not read as its alias
+JOIN_CLAUSES = {"WHERE", "GROUP", "HAVING", "ORDER", "LIMIT", "OFFSET", "PARALLEL", "NOCACHE", "JOIN", "INNER",
+                "LEFT", "ON"}
+
+def check_count(clause, value):
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise SQLSyntaxError(f"{clause} must be a non-negative integer")
+
+
+_plans = OrderedDict()
+_plans_lock = threading.Lock()
+
+
+def _cached(key):
+    with _plans_lock:
+        statement = _plans.get(key)
+        if statement is not None:
+            _plans.move_to_end(key)
+        return statement
+
+
+def _remember(key, statement):
+    with _plans_lock:
+        _plans[key] = statement
+        if len(_plans) > PLAN_CACHE_SIZE:
+            _plans.popitem(last=False)
+
+
+def parse(text):
+    """Parses one SQL statement into its statement object; raises
+    SQLSyntaxError (a ValueError) if it isn't valid.
+
+    Statements come from an LRU cache keyed on their text, so a repeated
+    statement is not parsed again. The objects returned are shared between
+    callers and must not be modified.
+    """
+    key = text.strip()
+    if len(key) > MAX_CACHED_LENGTH:
+        return StatementParser(text).parse()
+    statement = _cached(key)
+    if statement is not None:
+        return statement
+    parser = StatementParser(text)
+    normalized = parser.normalized()
+    statement = _cached(normalized)
+    if statement is None:
+        statement = parser.parse()
+        _remember(normalized, statement)
+    if key != normalized:
+        _remember(key, statement)
+    return statement
+
+
+def prepare(text):
+    """Parses one statement as an unnamed Prepare whose ? markers are bound
+    by bind(). Statements other than INSERT, SELECT, UPDATE and DELETE take
+    no parameters and come back as a Prepare of none. Cached like parse()."""
+    key = ("?", text.strip())
+    statement = _cached(key)
+    if statement is not None:
+        return statement
+    parser = StatementParser(text)
+    if parser.end and parser.tokens[0][0] == "word" and parser.tokens[0][2].upper() in PREPARABLE:
+        statement = parser.prepared(None)
+    else:
+        statement = Prepare(None, parser.parse(), 0)
+    if len(key[1]) <= MAX_CACHED_LENGTH:
+        _remember(key, statement)
+    return statement
+
+
+def bind(prepared, args):
+    """Returns the statement of a Prepare with its ? markers replaced by
+    `args`, which are used as typed values, as they are."""
+    if len(args) != prepared.params:
+        what = f"Prepared statement '{prepared.name}'" if prepared.name else "The statement"
+        raise SQLSyntaxError(f"{what} takes {prepared.params} parameter(s), got {len(args)}")
+    statement = prepared.statement
+    if not prepared.params:
+        return statement
+    args = list(args)
+    for arg in args:
+        sql_literal(arg)  # rejects values the WAL couldn't log
+    if isinstance(statement, Insert):
+        return replace(statement, rows=[[args[v.index] if isinstance(v, Param) else v for v in values]
+                                        for values in statement.rows])
+    where = _bind_where(statement.where, args)
+    if isinstance(statement, Update):
+        value = args[statement.value.index] if isinstance(statement.value, Param) else statement.value
+        return replace(statement, value=value, set_text=f"{statement.column} = {sql_literal(value)}",
+                       where=where)
+    if isinstance(statement, Select):
+        counts = {}
+        for clause in ("limit", "offset"):
+            value = getattr(statement, clause)
+            if isinstance(value, Param):
+                value = counts[clause] = args[value.index]
+                check_count(clause.upper(), value)
+        return replace(statement, where=where, having=_bind_where(statement.having, args), **counts)
+    return replace(statement, where=where)
+
+
+def bind_rows(prepared, arg_rows):
+    """Binds a prepared INSERT once per sequence of `arg_rows`, returning a
+    single Insert of all the rows."""
+    statement = prepared.statement
+    rows = []
+    for args in arg_rows:
+        rows.extend(bind(prepared, args).rows)
+    return replace(statement, rows=rows)
+
+
+def _bind_where(where, args):
+    if where is None:
+        return None
+    tree = bind_tree(where.tree, args)
+    return Where(render(tree), tree)
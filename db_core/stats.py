@@ -0,0 +1,238 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Counted per table for SHOW STATS; the byte counts and WAL size are read
+# from the buffer pool and the WAL writer when the stats are shown
+COUNTERS = ("statements", "selects", "inserts", "updates", "deletes", "rows_scanned", "rows_returned",
+            "rows_inserted", "blocks_skipped", "checkpoints", "checkpoint_ms_total", "checkpoint_ms_max",
+            "checkpoint_ms_last", "checkpoint_failures")
+
+
+class Stage:
+    __slots__ = ("name", "detail", "rows", "seconds", "inputs")
+
+    def __init__(self, name, detail=None, input=None):
+        self.name = name
+        self.detail = detail
+        self.rows = None
+        self.seconds = 0.0  # including the time of its inputs
+        # The stages it pulls its rows from: one, or a join's two
+        self.inputs = (input,) if input is not None else ()
+
+    def self_seconds(self):
+        return self.seconds - sum(stage.seconds for stage in self.inputs)
+
+    def as_dict(self):
+        return {"stage": self.name, "detail": self.detail, "rows": self.rows,
+                "time_ms": round(self.self_seconds() * 1000, 3), "total_ms": round(self.seconds * 1000, 3)}
+
+
+class Trace:
+    """Stage timings and row counts of one statement, recorded by the code
+    running it while the trace is the thread's active one (see tracing()).
+    The row stages of a query form a chain, each pulling rows from the one
+    before: their times include their input's, and self_seconds() is a
+    stage's own share."""
+
+    def __init__(self):
+        self.stages = []
+        self.tail = None  # last stage of the row chain
+
+    def add(self, name, seconds, rows=None, detail=None):
+        stage = Stage(name, detail)
+        stage.seconds = seconds
+        stage.rows = rows
+        self.stages.append(stage)
+        return stage
+
+    @contextmanager
+    def timed(self, name, detail=None, consumes=False):
+        # A stage run as one call; `consumes` if it reads the whole row
+        # chain, after which a new chain starts from its result
+        stage = Stage(name, detail, self.tail if consumes else None)
+        self.stages.append(stage)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds += time.perf_counter() - start
+            if consumes:
+                self.tail = None
+
+    def pipe(self, name, rows, detail=None, inputs=None):
+        # Wraps a row iterator as the next stage of the chain; `inputs`
+        # are the last stages of the chains it pulls from, if not the one
+        # before it (see branch())
+        stage = Stage(name, detail, self.tail)
+        if inputs is not None:
+            stage.inputs = tuple(input for input in inputs if input is not None)
+        stage.rows = 0
+        self.stages.append(stage)
+        self.tail = stage
+        return self._pipe(stage, iter(rows))
+
+    @staticmethod
+    def _pipe(stage, rows):
+        clock = time.perf_counter
+        try:
+            while True:
+                start = clock()
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    return
+                finally:
+                    stage.seconds += clock() - start
+                stage.rows += 1
+                yield row
+        finally:
+            close = getattr(rows, "close", None)
+            if close is not None:
+                close()
+
+    def as_rows(self):
+        return [stage.as_dict() for stage in self.stages]
+
+
+_local = threading.local()
+
+
+def active():
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def tracing(trace):
+    previous = active()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+def pipe(name, rows, detail=None, inputs=None):
+    # `rows` as a stage of the active trace; unchanged if there is none
+    trace = active()
+    if trace is None:
+        return rows
+    return trace.pipe(name, rows, detail, inputs)
+
+
+def branch():
+    # Ends the row chain of the active trace, returning its last stage (or
+    # None), so the next stage starts a chain of its own: one input of a
+    # stage pulling from several, which is passed them as pipe()'s `inputs`
+    trace = active()
+    if trace is None:
+        return None
+    tail, trace.tail = trace.tail, None
+    return tail
+
+
+_UNTRACED = nullcontext()
+
+
+def stage(name, detail=None, consumes=False):
+    # A timed stage of the active trace, as `with stage(...) as s:`; s is
+    # None if there is no trace
+    trace = active()
+    if trace is None:
+        return _UNTRACED
+    return trace.timed(name, detail, consumes)
+
+
+class Stats:
+    """Process-wide statement counters per table, and hooks called with
+    the stage timings of every statement.
+
+    A hook is a callable taking one dict: the statement's database, table,
+    kind ("Select", "Insert", ...), total seconds, whether it failed, and
+    its stages as EXPLAIN ANALYZE shows them. Statements are traced only
+    while some hook is registered.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {}  # (db, table) -> {counter: value}
+        self.checkpoint_errors = {}  # (db, table) -> why its last checkpoint failed
+        self.hooks = ()
+
+    def add_hook(self, hook):
+        with self.lock:
+            self.hooks = self.hooks + (hook,)
+
+    def remove_hook(self, hook):
+        with self.lock:
+            self.hooks = tuple(h for h in self.hooks if h is not hook)
+
+    def notify(self, record):
+        for hook in self.hooks:
+            try:
+                hook(record)
+            except Exception:
+                pass  # a broken hook mustn't fail the statement
+
+    def add(self, db_name, table_name, **counts):
+        key = (db_name, table_name)
+        with self.lock:
+            counters = self.tables.get(key)
+            if counters is None:
+                counters = self.tables[key] = dict.fromkeys(COUNTERS, 0)
+            for name, value in counts.items():
+                counters[name] += value
+
+    def checkpointed(self, db_name, table_name, seconds):
+        ms = seconds * 1000
+        key = (db_name, table_name)
+        with self.lock:
+            counters = self.tables.get(key)
+            if counters is None:
+                counters = self.tables[key] = dict.fromkeys(COUNTERS, 0)
+            counters["checkpoints"] += 1
+            counters["checkpoint_ms_total"] += ms
+            counters["checkpoint_ms_last"] = ms
+            counters["checkpoint_ms_max"] = max(counters["checkpoint_ms_max"], ms)
+            self.checkpoint_errors.pop(key, None)
+
+    def checkpoint_failed(self, db_name, table_name, error):
+        # Kept for SHOW STATS until a checkpoint of the table succeeds: a
+        # background checkpoint has no one else to tell
+        self.add(db_name, table_name, checkpoint_failures=1)
+        with self.lock:
+            self.checkpoint_errors[(db_name, table_name)] = error
+
+    def table(self, db_name, table_name):
+        key = (db_name, table_name)
+        with self.lock:
+            counters = self.tables.get(key) or dict.fromkeys(COUNTERS, 0)
+            row = {name: round(value, 3) if isinstance(value, float) else value
+                   for name, value in counters.items()}
+            row["checkpoint_error"] = self.checkpoint_errors.get(key)
+            return row
+
+    def forget(self, db_name, table_name=None):
+        # Drops the counters of a table, or of every table of a database
+        with self.lock:
+            self.tables = {key: counters for key, counters in self.tables.items()
+                           if key[0] != db_name or (table_name is not None and key[1] != table_name)}
+            self.checkpoint_errors = {key: error for key, error in self.checkpoint_errors.items()
+                                      if key[0] != db_name or (table_name is not None and key[1] != table_name)}
+
+
+def plan_row(name, detail=None, rows=None):
+    # A stage as plain EXPLAIN shows it, not run: `rows` is what it is
+    # expected to read, if that is known
+    return {"stage": name, "detail": detail, "rows": rows}
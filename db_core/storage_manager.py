@@ -0,0 +1,581 @@
+import json
+import os
+import struct
+import threading
+from itertools import chain
+
+from db_core.catalog import Catalog, DATA_DIR
+from db_core.heap_file import BLOCK_PAGES, HeapFile, StringHeap
+from db_core.schema_manager import Schema_Manager
+from db_core.wal_manager import WALManager
+
+# Header of the flat data.tbl files written before the paged format:
+# magic, version, column count, record size, committed row count, heap generation
+LEGACY_TBL_HEADER = struct.Struct("<4sHHIQI")
+
+TYPE_CODES = {"INT": b"I", "FLOAT": b"F", "TEXT": b"T", "BOOL": b"B"}
+FIELD_FORMATS = {"INT": "q", "FLOAT": "d", "TEXT": "QI", "BOOL": "?"}
+# TEXT bounds in a zone map are cut to this many characters
+ZONE_TEXT_CHARS = 32
+# Sorts after any string that starts with the same characters
+_TEXT_TOP = "\U0010ffff"
+# A checkpoint copies the live TEXT values to a new string heap generation
+# once this share of the heap, and at least STRING_HEAP_COMPACT_BYTES, is
+# bytes no row refers to any more
+STRING_HEAP_COMPACT_SHARE = float(os.environ.get("TINYDBX_STRING_HEAP_COMPACT_SHARE", "0.5"))
+STRING_HEAP_COMPACT_BYTES = 64 * 1024
+# Live TEXT bytes copied to a new generation per append
+_COPY_CHUNK = 64 * 1024
+
+
+class RowCodec:
+    """Packs rows into fixed-size records laid out in schema column order.
+
+    Each record is a null bitmap followed by one slot per column: INT as
+    int64, FLOAT as float64, BOOL as one byte and TEXT as an (offset, length)
+    reference into the table's string heap. Rows are tuples (or lists) of
+    values in the same order; see db_core/rows.py.
+    """
+
+    def __init__(self, columns):
+        self.columns = [col["name"] for col in columns]
+        self.types = [col.get("type", "TEXT") for col in columns]
+        self.null_bytes = (len(columns) + 7) // 8
+        fmt = "<" + f"{self.null_bytes}s" + "".join(FIELD_FORMATS[t] for t in self.types)
+        self.record = struct.Struct(fmt)
+        self.record_size = self.record.size
+        self.type_codes = b"".join(TYPE_CODES[t] for t in self.types)
+        # Where each TEXT column's (offset, length) starts in an unpacked record
+        self.text_fields = {}
+        field_no = 1
+        for i, col_type in enumerate(self.types):
+            if col_type == "TEXT":
+                self.text_fields[i] = field_no
+            field_no += 2 if col_type == "TEXT" else 1
+        self._decode = None
+
+    def encode(self, row, heap_offset, old=None):
+        # Returns (record bytes, heap bytes); heap_offset is where the heap
+        # bytes will start once appended. `old`, the (row, record) `row`
+        # replaces, lends its references to the TEXT values left unchanged.
+        nulls = bytearray(self.null_bytes)
+        fields = []
+        heap = bytearray()
+        old_fields = self.record.unpack(old[1]) if old is not None else None
+        for i, (value, col_type) in enumerate(zip(row, self.types)):
+            if value is None:
+                nulls[i >> 3] |= 1 << (i & 7)
+                fields.extend((0, 0) if col_type == "TEXT" else (0,))
+                continue
+            value = Schema_Manager.coerce(col_type, value)
+            if col_type == "TEXT":
+                if old_fields is not None and old[0][i] == value:
+                    field_no = self.text_fields[i]
+                    fields.extend(old_fields[field_no:field_no + 2])
+                    continue
+                raw = value.encode("utf-8")
+                fields.extend((heap_offset + len(heap), len(raw)))
+                heap += raw
+            else:
+                fields.append(value)
+        return self.record.pack(bytes(nulls), *fields), bytes(heap)
+
+    def text_bytes(self, record):
+        # Heap bytes the record's TEXT values take
+        fields = self.record.unpack(record)
+        return sum(fields[field_no + 1] for field_no in self.text_fields.values())
+
+    def move_text(self, record, move):
+        # The record with each non-empty TEXT reference (offset, length)
+        # replaced by (move(offset, length), length)
+        fields = list(self.record.unpack(record))
+        for field_no in self.text_fields.values():
+            if fields[field_no + 1]:
+                fields[field_no] = move(fields[field_no], fields[field_no + 1])
+        return self.record.pack(*fields)
+
+    def decode_one(self, record, heap):
+        return self.decode_many(record, heap)[0]
+
+    def decode_many(self, buf, heap):
+        # `heap` is either the whole string heap as bytes or an object with a
+        # window(offset, length) method returning (bytes, start, end) for a
+        # range of the heap that covers the requested string.
+        if self._decode is None:
+            self._decode = self._compile_decoder()
+        window = getattr(heap, "window", None)
+        if window is None:
+            window = lambda offset, length, heap=heap: (heap, 0, len(heap))
+        return self._decode(self.record.iter_unpack(buf), window)
+
+    def _compile_decoder(self):
+        # Builds a decoder specialised for this schema: one tuple-unpack and one
+        # tuple display per record, with the per-column null checks only taken
+        # for records whose null bitmap is non-zero. TEXT values are sliced
+        # from the current heap window, fetching a new one only when a string
+        # falls outside it.
+        names = []
+        text_lines = []
+        fast = []
+        slow = []
+        for i, col_type in enumerate(self.types):
+            if col_type == "TEXT":
+                names += [f"o{i}", f"l{i}"]
+                text_lines += [
+                    f"        if l{i}:",
+                    f"            if o{i} < start or o{i} + l{i} > end:",
+                    f"                data, start, end = window(o{i}, l{i})",
+                    f"            s{i} = str(data[o{i} - start:o{i} - start + l{i}], 'utf-8')",
+                    "        else:",
+                    f"            s{i} = ''",
+                ]
+                value = f"s{i}"
+            else:
+                names.append(f"v{i}")
+                value = f"v{i}"
+            fast.append(value)
+            slow.append(f"None if nulls[{i >> 3}] & {1 << (i & 7)} else {value}")
+        target = ", ".join(["nulls"] + names) + ","
+        source = "\n".join([
+            "def decode(records, window):",
+            "    rows = []",
+            "    append = rows.append",
+            "    data, start, end = b'', 0, 0",
+            f"    for {target} in records:",
+            *text_lines,
+            "        if nulls == no_nulls:",
+            f"            append(({', '.join(fast)},))",
+            "        else:",
+            f"            append(({', '.join(slow)},))",
+            "    return rows",
+            "",
+        ])
+        namespace = {"no_nulls": bytes(self.null_bytes)}
+        exec(compile(source, f"<decoder {','.join(self.columns)}>", "exec"), namespace)
+        return namespace["decode"]
+
+
+class ZoneMap:
+    """Per-block column statistics of a table: for each block of BLOCK_PAGES
+    pages, the least and greatest value and the NULL count of every column
+    over the rows written to it. Writes only widen them; a block whose rows
+    were updated or deleted is recomputed from its rows when the table is
+    flushed (see TableStorage.flush), as the rows that set its bounds may
+    be gone. So they bound what a block holds, and a scan can skip the
+    blocks a WHERE clause can't match (see WhereClause.may_match).
+
+    A block is None until a row is written to it, and a column's entry is
+    None if its values can't be bounded (a NaN, or a value of the wrong
+    type). Saved as data.zones with the table's pages and rebuilt from the
+    rows if it is lost or doesn't fit them.
+    """
+
+    def __init__(self, columns, types, block_pages=BLOCK_PAGES):
+        self.columns = columns
+        self.text = [col_type == "TEXT" for col_type in types]
+        self.block_pages = block_pages
+        self.blocks = []
+
+    @classmethod
+    def load(cls, path, columns, types, page_count):
+        # The saved map, or None if there is none for these columns and pages
+        try:
+            with open(path, "r") as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if saved.get("columns") != columns or saved.get("pages") != page_count:
+            return None
+        zones = cls(columns, types, saved["block_pages"])
+        zones.blocks = saved["blocks"]
+        return zones
+
+    def save(self, path, page_count):
+        tmp_path = path.with_suffix(".zones.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"columns": self.columns, "pages": page_count, "block_pages": self.block_pages,
+                       "blocks": self.blocks}, f)
+        os.replace(tmp_path, path)
+
+    def clear(self, block):
+        # Forgets the block's rows, for them to be added again
+        if block < len(self.blocks):
+            self.blocks[block] = None
+
+    def add(self, page_no, row):
+        # Widens the zone of the page's block to take in `row`
+        block = page_no // self.block_pages
+        while len(self.blocks) <= block:
+            self.blocks.append(None)
+        zone = self.blocks[block]
+        if zone is None:
+            zone = self.blocks[block] = [[None, None, 0] for _ in self.columns]
+        for i, bounds in enumerate(zone):
+            if bounds is None:
+                continue
+            value = row[i]
+            if value is None:
+                bounds[2] += 1
+                continue
+            low = high = value
+            if self.text[i] and len(value) > ZONE_TEXT_CHARS:
+                low = value[:ZONE_TEXT_CHARS]
+                high = low + _TEXT_TOP
+                if value[ZONE_TEXT_CHARS] == _TEXT_TOP:
+                    zone[i] = None
+                    continue
+            try:
+                if value != value:
+                    zone[i] = None  # NaN
+                    continue
+                if bounds[0] is None or low < bounds[0]:
+                    bounds[0] = low
+                if bounds[1] is None or high > bounds[1]:
+                    bounds[1] = high
+            except TypeError:
+                zone[i] = None
+
+    def prune(self, ranges, where):
+        # The parts of `ranges` ((first page, end page) pairs) in blocks
+        # `where` may match, as (ranges, blocks kept, blocks in all)
+        kept = []
+        count = total = 0
+        for start, end in ranges:
+            for block in range(start // self.block_pages, (end - 1) // self.block_pages + 1):
+                total += 1
+                zone = self.blocks[block] if block < len(self.blocks) else None
+                if zone is None or not where.may_match(dict(zip(self.columns, zone))):
+                    continue
+                count += 1
+                first = max(start, block * self.block_pages)
+                last = min(end, (block + 1) * self.block_pages)
+                if kept and kept[-1][1] == first:
+                    kept[-1] = (kept[-1][0], last)
+                else:
+                    kept.append((first, last))
+        return kept, count, total
+
+
+class TableStorage:
+    """Paged table storage: fixed-size records in data.pages and its segment
+    files (see HeapFile) and TEXT bytes in data.strings, all read through
+    the shared buffer pool, with a ZoneMap of the pages in data.zones.
+
+    There is one instance per table per process (TableStorage.for_table), so
+    the page count, free-space map and string heap size stay consistent
+    between the read path and the checkpointer. Changes are only durable
+    after flush().
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_table(cls, db_name, table_name):
+        key = (db_name, table_name)
+        with cls._instances_lock:
+            storage = cls._instances.get(key)
+            if storage is None:
+                storage = cls(db_name, table_name)
+                cls._instances[key] = storage
+            return storage
+
+    def __init__(self, db_name, table_name):
+        self.db_name = db_name
+        self.table_name = table_name
+        self.base_path = DATA_DIR / db_name / table_name
+        self.data_path = self.base_path / "data.pages"
+        self.strings_path = self.base_path / "data.strings"
+        self.zones_path = self.base_path / "data.zones"
+        self.legacy_json_path = self.base_path / "data.json"
+        self.legacy_tbl_path = self.base_path / "data.tbl"
+        self.codec = None
+        self.heap = None
+        self.strings = None
+        self.zones = None
+        self.stale_zones = set()  # blocks to recompute at the next flush
+        self.retired_strings = None  # string heap generation to remove at the next flush
+        self.lock = threading.RLock()
+
+    def _load_codec(self):
+        if self.codec is None:
+            schema = Catalog.instance().schema(self.db_name, self.table_name)
+            self.codec = RowCodec(schema.get("columns", []))
+        return self.codec
+
+    def exists(self):
+        return self.data_path.exists()
+
+    def create(self):
+        codec = self._load_codec()
+        compression = Catalog.instance().schema(self.db_name, self.table_name).get("compression")
+        with self.lock:
+            heap = HeapFile.create(self.data_path, codec.record_size, meta=codec.type_codes,
+                                   compression=compression)
+            self.strings = heap.string_heap(self.strings_path).create()
+            self.zones = ZoneMap(codec.columns, codec.types)
+            self.heap = heap
+
+    def open(self):
+        with self.lock:
+            if self.heap is None:
+                self.ensure_migrated()
+                codec = self._load_codec()
+                heap = HeapFile(self.data_path).open()
+                if heap.meta != codec.type_codes or heap.record_size != codec.record_size:
+                    raise ValueError(f"{self.data_path} does not match the table schema")
+                # The table header's aux field holds the logical size of the string heap
+                self.strings = heap.string_heap(self.strings_path)
+                self.heap = heap
+                self.zones = ZoneMap.load(self.zones_path, codec.columns, codec.types, heap.page_count)
+                if self.zones is None:
+                    self._rebuild_zones()
+            return self
+
+    def _rebuild_zones(self):
+        zones = ZoneMap(self.codec.columns, self.codec.types)
+        slots_per_page = self.heap.slots_per_page
+        for rowid, row in self.scan_with_rowids():
+            zones.add(rowid // slots_per_page, row)
+        self.zones = zones
+
+    def signature(self):
+        try:
+            st = self.data_path.stat()
+            return [st.st_size, st.st_mtime_ns]
+        except FileNotFoundError:
+            return None
+
+    def row_count(self):
+        return self.open().heap.row_count
+
+    def segments(self):
+        # (first page, end page) of each segment file holding rows
+        return self.open().heap.segments()
+
+    def prune(self, where, ranges=None):
+        # (page ranges, blocks kept, blocks in all) of a scan of `ranges` (the
+        # whole table by default) left once the zone maps rule out the blocks
+        # `where` can't match
+        self.open()
+        if ranges is None:
+            ranges = [(1, self.heap.page_count)] if self.heap.page_count > 1 else []
+        return self.zones.prune(ranges, where)
+
+    def disk_bytes(self):
+        # What the table's files take on disk: pages, strings, WAL and indexes
+        total = 0
+        for path in self.base_path.rglob("*"):
+            try:
+                total += path.stat().st_size if path.is_file() else 0
+            except FileNotFoundError:
+                pass  # removed meanwhile, by a checkpoint compressing a segment
+        return total
+
+    def ensure_migrated(self):
+        # Convert tables written in an older format (data.json, or the flat
+        # data.tbl) once, keeping the originals next to the table as backups.
+        with WALManager.table_lock(self.db_name, self.table_name):
+            legacy = self.legacy_tbl_path.exists() or self.legacy_json_path.exists()
+            # data.pages next to a legacy file means an earlier migration was
+            # interrupted before the originals were renamed; start it over.
+            if self.data_path.exists() and not legacy:
+                return
+            legacy_files = []
+            if self.legacy_tbl_path.exists():
+                rows, heap_path = self._read_legacy_tbl()
+                legacy_files = [self.legacy_tbl_path, heap_path]
+            elif self.legacy_json_path.exists():
+                with open(self.legacy_json_path, "r") as f:
+                    columns = self._load_codec().columns
+                    rows = [tuple(map(row.get, columns)) for row in json.load(f)]
+                legacy_files = [self.legacy_json_path]
+            else:
+                rows = []
+
+            self.create()
+            for row in rows:
+                self.insert_row(row)
+            self.flush()
+            for path in legacy_files:
+                os.replace(path, path.with_name(path.name + ".migrated"))
+
+    def _read_legacy_tbl(self):
+        codec = self._load_codec()
+        raw = self.legacy_tbl_path.read_bytes()
+        _, _, ncols, record_size, row_count, heap_gen = LEGACY_TBL_HEADER.unpack_from(raw)
+        if record_size != codec.record_size or ncols != len(codec.columns):
+            raise ValueError(f"{self.legacy_tbl_path} does not match the table schema")
+        start = LEGACY_TBL_HEADER.size + ncols
+        heap_path = self.base_path / f"data.{heap_gen}.heap"
+        heap = heap_path.read_bytes() if heap_path.exists() else b""
+        return codec.decode_many(raw[start:start + row_count * record_size], heap), heap_path
+
+    def _encode(self, row, old=None):
+        record, text = self.codec.encode(row, self.strings.size, old)
+        if text:
+            self.strings.append(text)
+        return record
+
+    def scan_with_rowids(self, start_page=1, end_page=None):
+        self.open()
+        codec = self.codec
+        strings = self.strings.reader()
+        for first_rowid, slots, records in self.heap.scan_pages(start_page, end_page):
+            rows = codec.decode_many(records, strings)
+            yield from zip((first_rowid + slot for slot in slots), rows)
+
+    def scan_rows(self, start_page=1, end_page=None, scanned=None):
+        # `scanned`, a one-item list, is increased by the rows read
+        return chain.from_iterable(self._decode_pages(start_page, end_page, scanned))
+
+    def _decode_pages(self, start_page, end_page, scanned):
+        # The rows of each page in turn, one list per page
+        self.open()
+        codec = self.codec
+        strings = self.strings.reader()
+        for _, slots, records in self.heap.scan_pages(start_page, end_page):
+            if scanned is not None:
+                scanned[0] += len(slots)
+            yield codec.decode_many(records, strings)
+
+    def scan_ranges(self, ranges, scanned=None):
+        # scan_rows() of each (first page, end page) of `ranges` in turn
+        return chain.from_iterable(self.scan_rows(start, end, scanned) for start, end in ranges)
+
+    def read_rows(self):
+        return list(self.scan_rows())
+
+    def fetch(self, rowid):
+        self.open()
+        record = self.heap.read(rowid)
+        if record is None:
+            return None
+        return self.codec.decode_one(record, self.strings.reader())
+
+    def insert_row(self, row):
+        with self.open().lock:
+            rowid = self.heap.insert(self._encode(row))
+            self.zones.add(rowid // self.heap.slots_per_page, row)
+            return rowid
+
+    def update_row(self, rowid, row, old_row=None):
+        # `old_row`, the row as it was, if the caller has it: the TEXT
+        # values it shares with `row` keep their heap bytes
+        with self.open().lock:
+            old_record = self.heap.read(rowid)
+            old = (old_row, old_record) if old_row is not None and old_record is not None else None
+            size = self.strings.size
+            record = self._encode(row, old)
+            self.heap.update(rowid, record)
+            if old_record is not None:
+                # The old values' bytes, less those the new record still uses
+                kept = self.codec.text_bytes(record) - (self.strings.size - size)
+                self.heap.strings_dead += self.codec.text_bytes(old_record) - kept
+            self.zones.add(rowid // self.heap.slots_per_page, row)
+            self.stale_zones.add(rowid // self.heap.slots_per_page // self.zones.block_pages)
+
+    def delete_row(self, rowid):
+        with self.open().lock:
+            old_record = self.heap.read(rowid)
+            self.heap.delete(rowid)
+            if old_record is not None:
+                self.heap.strings_dead += self.codec.text_bytes(old_record)
+            self.stale_zones.add(rowid // self.heap.slots_per_page // self.zones.block_pages)
+
+    def compact_strings(self):
+        # Copies the TEXT values of the live rows to a new generation of the
+        # string heap and points the rows at the copies, if enough of the
+        # heap is dead bytes (see STRING_HEAP_COMPACT_SHARE); returns whether
+        # it did. The old generation stays on disk until flush() has made
+        # the new one, and the pages pointing at it, durable.
+        with self.open().lock:
+            old = self.strings
+            dead = self.heap.strings_dead
+            if dead < STRING_HEAP_COMPACT_BYTES or dead < STRING_HEAP_COMPACT_SHARE * (old.size - old.base):
+                return False
+            # Generations left by an interrupted compaction go first
+            for path in old.generation_paths(self.strings_path):
+                if path != old.path:
+                    StringHeap(path, pool=old.pool).delete()
+            new = self.heap.string_heap(self.strings_path, base=old.size).create()
+            reader = old.reader()
+            pending = bytearray()
+
+            def move(offset, length):
+                data, start, _ = reader.window(offset, length)
+                moved = new.size + len(pending)
+                pending.extend(data[offset - start:offset - start + length])
+                if len(pending) >= _COPY_CHUNK:
+                    new.append(bytes(pending))
+                    pending.clear()
+                return moved
+
+            codec = self.codec
+            for first_rowid, slots, records in self.heap.scan_pages():
+                size = codec.record_size
+                for slot, i in zip(slots, range(0, len(records), size)):
+                    record = records[i:i + size]
+                    if codec.text_bytes(record):
+                        self.heap.update(first_rowid + slot, codec.move_text(record, move))
+            if pending:
+                new.append(bytes(pending))
+            self.strings = new
+            self.retired_strings = old
+            self.heap.strings_dead = 0
+            return True
+
+    def _recompute_zones(self):
+        # The zones of the blocks with updated or deleted rows, from the
+        # rows they hold now
+        block_pages = self.zones.block_pages
+        slots_per_page = self.heap.slots_per_page
+        for block in sorted(self.stale_zones):
+            self.zones.clear(block)
+            start = max(1, block * block_pages)
+            end = min((block + 1) * block_pages, self.heap.page_count)
+            for rowid, row in self.scan_with_rowids(start, end):
+                self.zones.add(rowid // slots_per_page, row)
+        self.stale_zones.clear()
+
+    def discard_unflushed(self):
+        with self.lock:
+            if self.heap is not None:
+                self.heap.discard()
+                self.strings.discard()
+            if self.retired_strings is not None:
+                # A compaction that never reached the disk: the generation
+                # the header names is still the old one
+                self.strings.delete()
+                self.retired_strings = None
+            self.heap = None
+            self.strings = None
+            self.zones = None
+            self.stale_zones.clear()
+
+    def wal_lsn(self):
+        # The WAL position the pages include (see CheckpointManager), 0 for
+        # a table with no pages yet
+        try:
+            return self.open().heap.lsn
+        except FileNotFoundError:
+            return 0
+
+    def flush(self, sync=True, wal_lsn=None):
+        # `wal_lsn` is recorded in the header as the WAL position the pages
+        # now include
+        with self.open().lock:
+            # Strings first, so the header never points past durable heap
+            # bytes, and the zones before the pages they cover
+            self.strings.flush(sync)
+            self.heap.aux = self.strings.size
+            self.heap.strings_base = self.strings.base
+            if wal_lsn is not None:
+                self.heap.lsn = wal_lsn
+            if self.stale_zones:
+                self._recompute_zones()
+            self.zones.save(self.zones_path, self.heap.page_count)
+            self.heap.flush(sync)
+            if self.retired_strings is not None:
+                self.retired_strings.delete()
+                self.retired_strings = None
@@ -1,6 +1,10 @@
 from pathlib import Path
 import json
+from db_core.catalog import Catalog, DATA_DIR
+from db_core.heap_file import COMPRESSORS
+from db_core.partition_manager import MAX_PARTITIONS, PartitionManager
 from db_core.schema_manager import Schema_Manager 
+from db_core.storage_manager import TableStorage
 
 
 class TableManager:
@@ -8,13 +12,14 @@ class TableManager:
         self.db_name = db_name
         self.table_name = table_name
         self.schema = schema
-        self.base_path = Path("data") / db_name  # Fixed base path to match db_manager
+        self.base_path = DATA_DIR / db_name  # Same base path as db_manager and the catalog
         self.table_path = self.base_path / table_name  # Path to the specific table
+        self.catalog = Catalog.instance()
 
     def create_table(self):
-        if not self.base_path.exists():
+        if not self.catalog.database_exists(self.db_name):
             return {"error": f"Database '{self.db_name}' does not exist."}
-        if self.table_path.exists():
+        if self.catalog.table_exists(self.db_name, self.table_name) or self.table_path.exists():
             return {"error": f"Table '{self.table_name}' already exists in database '{self.db_name}'."}
 
         # Validate schema and identify primary key
@@ -31,16 +36,34 @@ class TableManager:
         if "error" in validation_result:
             return validation_result
 
+        compression = self.schema.get("compression")
+        if compression is not None and compression not in COMPRESSORS:
+            return {"error": f"Unknown compression '{compression}'; use one of "
+                             f"{', '.join(sorted(COMPRESSORS))} or none."}
+
+        partition = self.schema.get("partition")
+        if partition:
+            names = [col["name"] for col in self.schema["columns"]]
+            if partition["column"] not in names:
+                return {"error": f"Partition column '{partition['column']}' does not exist."}
+            if partition["count"] > MAX_PARTITIONS:
+                return {"error": f"A table can have at most {MAX_PARTITIONS} partitions."}
+            if primary_key and primary_key != partition["column"]:
+                # Keys are checked by each partition against its own rows only
+                return {"error": f"The primary key of a partitioned table must be its partition column "
+                                 f"'{partition['column']}'."}
+            return self._create_partitioned()
+
         try:
             self.table_path.mkdir(parents=True, exist_ok=False)
 
             # Write schema.json
             with open(self.table_path / "schema.json", "w") as f:
                 json.dump(self.schema, f, indent=2)
+            self.catalog.add_table(self.db_name, self.table_name, self.schema)
 
-            # Initialize empty rows.json
-            with open(self.table_path / "data.json", "w") as f:
-                json.dump([], f)
+            # Initialize the empty binary table file
+            TableStorage.for_table(self.db_name, self.table_name).create()
 
             # Create empty WAL log
             with open(self.table_path / "log.wal", "w") as f:
@@ -50,4 +73,15 @@ class TableManager:
 
         except Exception as e:
             return {"error": f"Error while creating table '{self.table_name}': {e}"}
-    
+
+    def _create_partitioned(self):
+        # The table's own directory holds only its schema; each partition is
+        # created as a table of its own by the worker that owns it
+        try:
+            self.table_path.mkdir(parents=True, exist_ok=False)
+            with open(self.table_path / "schema.json", "w") as f:
+                json.dump(self.schema, f, indent=2)
+            self.catalog.add_table(self.db_name, self.table_name, self.schema)
+        except Exception as e:
+            return {"error": f"Error while creating table '{self.table_name}': {e}"}
+        return PartitionManager(self.db_name, self.table_name).create_partitions()
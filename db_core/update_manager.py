@@ -1,24 +1,89 @@
-import json
-from pathlib import Path
+from db_core.catalog import Catalog
+from db_core.checkpoint_manager import Checkpointer
+from db_core.primary_key_manager import PrimaryKeyManager
+from db_core.schema_manager import Schema_Manager
+from db_core.wal_manager import WALManager
+from db_core.where_clause import WhereError
 
 class UpdateManager:
     def __init__(self, db_name, table_name):
         self.db_name = db_name
         self.table_name = table_name
-        self.base_path = Path("data") / db_name / table_name
-        self.wal_path = self.base_path / "log.wal"
+        self.wal = WALManager(db_name, table_name)
+        self.pk_manager = PrimaryKeyManager.for_table(db_name, table_name)
+
+    def _validate_set(self, set_clause):
+        try:
+            col_types = Catalog.instance().table(self.db_name, self.table_name).column_types
+        except Exception as e:
+            return {"error": f"Error reading schema: {e}"}
+
+        try:
+            set_col, set_val = WALManager.parse_assignment(set_clause)
+        except ValueError:
+            return {"error": "Invalid SET clause. Expected 'column = value'."}
+
+        if set_col not in col_types:
+            return {"error": f"Column '{set_col}' does not exist in table '{self.table_name}'."}
+        try:
+            value = Schema_Manager.coerce(col_types[set_col], set_val)
+        except ValueError:
+            return {"error": f"Column '{set_col}' expects {col_types[set_col]} but got '{set_val}'."}
+        if col_types[set_col] == "INT" and value is not None \
+                and not Schema_Manager.INT_MIN <= value <= Schema_Manager.INT_MAX:
+            return {"error": f"Column '{set_col}' value {value} is out of range for INT."}
+        return None
+
+    def update(self, set_clause, where_clause, where_tree=None):
+        # Values are stored typed, so reject a SET that could never be applied
+        error = self._validate_set(set_clause)
+        if error:
+            return error
+        try:
+            self.wal.compile_where(where_clause, where_tree)
+        except WhereError as e:
+            return {"error": f"Invalid WHERE clause: {e}"}
 
-    def update(self, set_clause, where_clause):
         log_entry = {
             "operation": "update",
             "set": set_clause,
             "where": where_clause
         }
 
+        set_col, set_val = WALManager.parse_assignment(set_clause)
+        if set_col == self.pk_manager.get_primary_key_column():
+            # A new key is checked against the keys of the rows the WHERE
+            # matches now, under the checkpoint lock and then the table lock
+            # so neither changes until the update is logged
+            with self.pk_manager.checkpoint_lock, self.pk_manager.lock:
+                self.pk_manager.ensure_loaded()
+                col_type = Catalog.instance().table(self.db_name, self.table_name).column_types[set_col]
+                new_key = Schema_Manager.coerce(col_type, set_val)
+                old_keys = self.pk_manager.matching_keys(where_clause, where_tree)
+                if old_keys and new_key is None:
+                    return {"error": f"Primary key '{set_col}' cannot be null."}
+                if len(old_keys) > 1:
+                    return {"error": f"Primary key violation: '{new_key}' appears more than once."}
+                if old_keys and old_keys[0] != new_key and not self.pk_manager.check_pk_uniqueness(new_key):
+                    return {"error": f"Primary key violation: '{new_key}' already exists."}
+                try:
+                    lsn = self.wal.append(log_entry)
+                except Exception as e:
+                    return {"error": f"Failed to write to WAL: {e}"}
+                if old_keys and old_keys[0] != new_key:
+                    self.pk_manager.remove_pk_from_cache(old_keys[0])
+                    self.pk_manager.add_pk_to_cache(new_key)
+        else:
+            with self.pk_manager.lock:
+                try:
+                    lsn = self.wal.append(log_entry)
+                except Exception as e:
+                    return {"error": f"Failed to write to WAL: {e}"}
+
         try:
-            with open(self.wal_path, "a") as f:
-                f.write(json.dumps(log_entry) + "\n")
-            return {"success": f"Update operation logged for table '{self.table_name}'."}
-        except Exception as e:
+            self.wal.commit(lsn)
+        except OSError as e:
             return {"error": f"Failed to write to WAL: {e}"}
 
+        Checkpointer.instance().notify_write(self.db_name, self.table_name)
+        return {"success": f"Update operation logged for table '{self.table_name}'."}
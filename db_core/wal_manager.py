@@ -0,0 +1,588 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from itertools import chain
+
+from db_core import stats
+from db_core.catalog import Catalog, DATA_DIR
+from db_core.result_cache import ResultCache
+from db_core.schema_manager import Schema_Manager
+from db_core.sql_lexer import RESERVED_VALUES, SQLSyntaxError, tokenize
+from db_core.where_clause import WhereClause, WhereError
+
+# "off": records are written as they are logged, never fsynced.
+# "group": a statement returns once its record is fsynced; statements
+#   committing at the same time share one write and one fsync.
+# "statement": every statement writes and fsyncs on its own.
+DURABILITY = "group"
+# Seconds a group commit waits for more statements to join it
+COMMIT_DELAY = 0.0
+# A group is written as soon as this many records are waiting
+COMMIT_BATCH_SIZE = 256
+DURABILITY_MODES = ("off", "group", "statement")
+
+
+def wal_start(f):
+    # (LSN of the first record, bytes before it) of a WAL open for binary
+    # reading. A rotated WAL starts with a {"lsn": ...} line giving the LSN
+    # its records continue from, counted in bytes ever logged to the table;
+    # one that was never rotated starts at LSN 0.
+    line = f.readline()
+    if line.startswith(b'{"lsn"') and line.endswith(b"\n"):
+        return json.loads(line)["lsn"], len(line)
+    return 0, 0
+
+
+class WALWriter:
+    """The open log.wal of one table, shared by every session.
+
+    append() runs under the table lock and fixes the record's place in the
+    log; commit() runs after the lock is released and waits until the
+    record is as durable as the mode asks. In group mode the first waiting
+    session writes and fsyncs everything appended so far, and the others
+    wait for it.
+    """
+
+    _writers = {}
+    _writers_lock = threading.Lock()
+    durability = DURABILITY
+    commit_delay = COMMIT_DELAY
+    batch_size = COMMIT_BATCH_SIZE
+
+    @classmethod
+    def for_table(cls, db_name, table_name):
+        key = (db_name, table_name)
+        with cls._writers_lock:
+            writer = cls._writers.get(key)
+            if writer is None:
+                writer = cls(DATA_DIR / db_name / table_name / "log.wal")
+                cls._writers[key] = writer
+            return writer
+
+    @classmethod
+    def configure(cls, durability=None, commit_delay=None, batch_size=None):
+        if durability is not None:
+            if durability not in DURABILITY_MODES:
+                raise ValueError(f"Unknown durability mode '{durability}'")
+            cls.durability = durability
+        if commit_delay is not None:
+            cls.commit_delay = commit_delay
+        if batch_size is not None:
+            cls.batch_size = batch_size
+
+    def __init__(self, path):
+        self.path = path
+        self.cond = threading.Condition(threading.Lock())
+        self.fd = None
+        self.size = 0  # bytes in the log, counting records not yet written
+        self.start = 0  # bytes before its first record (see wal_start)
+        self.pending = []  # group mode: records appended but not yet written
+        self.lsn = 0  # bytes ever appended; a record's LSN is where it ends
+        self.durable = 0  # LSN up to which the log is fsynced
+        self.flushing = False
+        self.commits = 0  # write+fsync rounds, for measuring group commit
+        self.rotations = 0
+        self.bytes_read = 0  # by readers of the log, for SHOW STATS
+        # The WAL as last parsed by read_prefix(): ((rotations, inode, applied), end, entries)
+        self.parsed = (None, 0, [])
+        # ...and as last compiled by overlay(): (entries, mods, inserts)
+        self.compiled = ([], [], [])
+
+    def _open(self):
+        # Called with the condition held. A partial last line, left by a
+        # crash mid-write, is cut off so new records start on a fresh line.
+        if self.fd is not None:
+            return
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        size = os.fstat(self.fd).st_size
+        self.start = 0
+        if size:
+            with open(self.path, "rb") as f:
+                self.start = wal_start(f)[1]
+                f.seek(max(0, size - 65536))
+                data = f.read()
+            if not data.endswith(b"\n"):
+                newline = data.rfind(b"\n")
+                if newline >= 0 or size <= 65536:
+                    size = size - len(data) + newline + 1
+                    os.ftruncate(self.fd, size)
+        self.size = size
+
+    def append(self, data):
+        with self.cond:
+            if self.durability == "group":
+                self._open()
+                self.pending.append(data)
+                if len(self.pending) >= self.batch_size:
+                    self.cond.notify_all()
+            else:
+                # Written straight away, after any group being written
+                while self.flushing:
+                    self.cond.wait()
+                self._open()
+                os.write(self.fd, data)
+            self.lsn += len(data)
+            self.size += len(data)
+            return self.lsn
+
+    def commit(self, lsn):
+        mode = self.durability
+        if mode == "off":
+            return
+        with self.cond:
+            if mode == "statement":
+                if self.durable < lsn:
+                    os.fsync(self.fd)
+                    self.durable = max(self.durable, lsn)
+                    self.commits += 1
+                return
+            while self.durable < lsn:
+                if self.flushing:
+                    self.cond.wait()
+                    continue
+                self.flushing = True
+                try:
+                    if self.pending and self.commit_delay > 0:
+                        deadline = time.monotonic() + self.commit_delay
+                        while len(self.pending) < self.batch_size:
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0:
+                                break
+                            self.cond.wait(remaining)
+                    data = b"".join(self.pending)
+                    self.pending = []
+                    target = self.lsn
+                    self.cond.release()
+                    try:
+                        if data:
+                            os.write(self.fd, data)
+                        os.fsync(self.fd)
+                    except OSError:
+                        self.cond.acquire()
+                        self.pending.insert(0, data)
+                        raise
+                    self.cond.acquire()
+                    self.durable = max(self.durable, target)
+                    self.commits += 1
+                finally:
+                    self.flushing = False
+                    self.cond.notify_all()
+
+    def flush(self):
+        # Writes pending records to the file without waiting for an fsync,
+        # for readers that must see every logged record
+        with self.cond:
+            while self.flushing:
+                self.cond.wait()
+            if self.pending:
+                os.write(self.fd, b"".join(self.pending))
+                self.pending = []
+
+    def rotate(self, offset, tmp_path):
+        # Replaces the log with its bytes from `offset` on, headed by the LSN
+        # they start at; used by the checkpointer under the table lock, so
+        # nothing is appended meanwhile.
+        with self.cond:
+            while self.flushing:
+                self.cond.wait()
+            self._open()
+            if self.pending:
+                os.write(self.fd, b"".join(self.pending))
+                self.pending = []
+            with open(self.path, "rb") as f:
+                lsn, start = wal_start(f)
+                f.seek(offset)
+                tail = f.read()
+            with open(tmp_path, "wb") as f:
+                f.write((json.dumps({"lsn": lsn + offset - start}) + "\n").encode("utf-8"))
+                f.write(tail)
+                if self.durability != "off":
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.rotations += 1
+            os.close(self.fd)
+            self.fd = None
+            self._open()
+            self.durable = self.lsn
+            self.cond.notify_all()
+
+    def close(self):
+        # Writes out anything pending and closes the file; the next append
+        # opens it again
+        with self.cond:
+            while self.flushing:
+                self.cond.wait()
+            if self.fd is not None:
+                if self.pending:
+                    os.write(self.fd, b"".join(self.pending))
+                    self.pending = []
+                if self.durability != "off":
+                    os.fsync(self.fd)
+                os.close(self.fd)
+                self.fd = None
+            self.durable = self.lsn
+            self.cond.notify_all()
+
+class RWLock:
+    """A table's reader/writer lock. Any number of readers (SELECTs, and the
+    streams and cursors open on the table) hold it at once; a checkpoint
+    holds it alone while it changes the table's pages and swaps the WAL.
+    A writer waiting for it holds back new readers, so a steady stream of
+    SELECTs can't starve checkpoints. Not reentrant, and not owned by a
+    thread: a stream may be finished on another thread than it started on.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting = 0  # writers waiting
+
+    def acquire_read(self):
+        with self.cond:
+            while self.writer or self.waiting:
+                self.cond.wait()
+            self.readers += 1
+
+    def release_read(self):
+        with self.cond:
+            self.readers -= 1
+            if not self.readers:
+                self.cond.notify_all()
+
+    def acquire_write(self, timeout=None):
+        # Returns False if readers still hold the lock after `timeout` seconds
+        with self.cond:
+            self.waiting += 1
+            try:
+                if not self.cond.wait_for(lambda: not self.writer and not self.readers, timeout):
+                    return False
+                self.writer = True
+                return True
+            finally:
+                self.waiting -= 1
+                self.cond.notify_all()  # readers held back go on if we gave up
+
+    def release_write(self):
+        with self.cond:
+            self.writer = False
+            self.cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+
+class WALManager:
+    # One lock per table serializes WAL appends against checkpoint rotation
+    _table_locks = {}
+    _table_locks_guard = threading.Lock()
+    # Held for the whole of a checkpoint; only one may fold a table at a time
+    _checkpoint_locks = {}
+    # Reader/writer lock per table between reads of its pages and the
+    # checkpoints that change them. WAL appends don't take it.
+    _rw_locks = {}
+
+    @classmethod
+    def table_lock(cls, db_name, table_name):
+        key = (db_name, table_name)
+        with cls._table_locks_guard:
+            lock = cls._table_locks.get(key)
+            if lock is None:
+                lock = threading.RLock()
+                cls._table_locks[key] = lock
+            return lock
+
+    @classmethod
+    def checkpoint_lock(cls, db_name, table_name):
+        key = (db_name, table_name)
+        with cls._table_locks_guard:
+            lock = cls._checkpoint_locks.get(key)
+            if lock is None:
+                lock = threading.RLock()
+                cls._checkpoint_locks[key] = lock
+            return lock
+
+    @classmethod
+    def rw_lock(cls, db_name, table_name):
+        key = (db_name, table_name)
+        with cls._table_locks_guard:
+            lock = cls._rw_locks.get(key)
+            if lock is None:
+                lock = RWLock()
+                cls._rw_locks[key] = lock
+            return lock
+
+    def __init__(self, db_name, table_name):
+        self.db_name = db_name
+        self.table_name = table_name
+        self.base_path = DATA_DIR / db_name / table_name
+        self.wal_path = self.base_path / "log.wal"
+        self.lock = WALManager.table_lock(db_name, table_name)
+        self.writer = WALWriter.for_table(db_name, table_name)
+        self.column_types = None
+
+    def append(self, log_entry):
+        # Call under the table lock; returns the LSN to pass to commit().
+        # Until then the table's results aren't cached (see ResultCache).
+        data = (json.dumps(log_entry) + "\n").encode("utf-8")
+        cache = ResultCache.instance()
+        cache.begin_write(self.db_name, self.table_name)
+        try:
+            with stats.stage("wal_append"):
+                return self.writer.append(data)
+        except BaseException:
+            cache.end_write(self.db_name, self.table_name)
+            raise
+
+    def commit(self, lsn):
+        # Call after releasing the table lock: waits until the record is
+        # durable, as far as the configured mode asks
+        try:
+            with stats.stage("wal_commit", self.writer.durability):
+                self.writer.commit(lsn)
+        finally:
+            ResultCache.instance().end_write(self.db_name, self.table_name)
+
+    def rotate(self, offset):
+        self.writer.rotate(offset, self.wal_path.with_suffix(".wal.tmp"))
+
+    def flush(self):
+        # Writes the records waiting for a group commit to the file, so
+        # read_prefix() sees them
+        self.writer.flush()
+
+    def size(self):
+        # Bytes of the records in the log
+        with self.writer.cond:
+            if self.writer.fd is not None:
+                return self.writer.size - self.writer.start
+        try:
+            with open(self.wal_path, "rb") as f:
+                return os.fstat(f.fileno()).st_size - wal_start(f)[1]
+        except FileNotFoundError:
+            return 0
+
+    def _start(self):
+        try:
+            with open(self.wal_path, "rb") as f:
+                return wal_start(f)
+        except FileNotFoundError:
+            return 0, 0
+
+    def first_lsn(self):
+        # The LSN of the first record in the log
+        return self._start()[0]
+
+    def end_lsn(self):
+        # The LSN of the end of the log, counting records waiting for a group
+        # commit
+        return self.first_lsn() + self.size()
+
+    def lsn(self, offset):
+        # The LSN of the byte at `offset` in the log
+        lsn, start = self._start()
+        return lsn + offset - start
+
+    def read_entries(self, applied=0):
+        # Includes records still waiting for a group commit. Those up to LSN
+        # `applied`, which the table's pages already include, are left out,
+        # and so is a last line with no newline, torn by a crash mid-write.
+        self.writer.flush()
+        try:
+            with open(self.wal_path, "rb") as f:
+                lsn, start = wal_start(f)
+                f.seek(start + max(0, applied - lsn))
+                return [json.loads(line) for line in f if line.endswith(b"\n") and line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def read_prefix(self, applied=0):
+        # Returns (entries, offset) for every complete line currently in the
+        # WAL past LSN `applied` (see read_entries()), and the offset of its
+        # end. A line being appended concurrently is left for the next reader.
+        # Lines parsed by an earlier call are reused until the WAL is rotated,
+        # so each call only parses what was appended since; the list is
+        # shared and must not be changed.
+        writer = self.writer
+        rotations = writer.rotations
+        try:
+            with open(self.wal_path, "rb") as f:
+                identity = (rotations, os.fstat(f.fileno()).st_ino, applied)
+                parsed_identity, start, parsed = writer.parsed
+                if parsed_identity != identity:
+                    lsn, start = wal_start(f)
+                    start, parsed = start + max(0, applied - lsn), []
+                f.seek(start)
+                raw = f.read()
+        except FileNotFoundError:
+            return [], 0
+        writer.bytes_read += len(raw)
+        end = raw.rfind(b"\n") + 1
+        entries = [json.loads(line) for line in raw[:end].splitlines() if line.strip()]
+        if parsed:
+            entries = parsed + entries
+        end += start
+        if writer.rotations == rotations:
+            writer.parsed = (identity, end, entries)
+        return entries, end
+
+    def replay(self, rows, entries=None, applied=0):
+        if entries is None:
+            entries = self.read_entries(applied)
+        return list(self.overlay(rows, entries))
+
+    def compile_entries(self, entries):
+        # Parses logged statements once into tuples:
+        #   ("insert", row), one per row of a batch
+        #   ("update", where, set_position, set_val)
+        #   ("delete", where)
+        # where `where` is a compiled WhereClause, rows are tuples in the
+        # table's column order and `set_position` is the place in them of
+        # the column set. Entries that can't be parsed are skipped, as
+        # replay always has.
+        column_types = self._column_types()
+        positions = {name: i for i, name in enumerate(column_types)}
+        compiled = []
+        for log_entry in entries:
+            operation = log_entry.get("operation")
+            try:
+                if operation == "insert":
+                    if "rows" in log_entry:
+                        # A batch: column names once, then one list per row
+                        columns = log_entry["columns"]
+                        if columns == list(positions):
+                            compiled.extend(("insert", tuple(row)) for row in log_entry["rows"])
+                        else:
+                            picks = [columns.index(name) if name in columns else None for name in positions]
+                            compiled.extend(("insert", tuple(None if i is None else row[i] for i in picks))
+                                            for row in log_entry["rows"])
+                    else:
+                        data = log_entry["data"]
+                        compiled.append(("insert", tuple(map(data.get, positions))))
+                elif operation == "update":
+                    where = self.compile_where(log_entry["where"])
+                    set_col, set_val = self.parse_assignment(log_entry["set"])
+                    set_val = Schema_Manager.coerce(column_types[set_col], set_val)
+                    compiled.append(("update", where, positions[set_col], set_val))
+                elif operation == "delete":
+                    compiled.append(("delete", self.compile_where(log_entry["where"])))
+            except (KeyError, ValueError):
+                continue
+        return compiled
+
+    def compile_where(self, where_clause, where_tree=None):
+        try:
+            return WhereClause.compile(where_clause, self._column_types(), where_tree)
+        except WhereError as error:
+            # Entries logged before WHERE expressions were validated may hold
+            # an unquoted value such as "name = John Smith"
+            try:
+                column, value = self.parse_condition(where_clause)
+            except ValueError:
+                raise error from None
+            quoted = value.replace("'", "''")
+            return WhereClause.compile(f"{column} = '{quoted}'", self._column_types())
+
+    @staticmethod
+    def apply_ops(row, ops, start=0):
+        # Applies compiled update/delete ops to one row (a tuple), giving a
+        # new tuple if any changes it. Returns None if the row is deleted.
+        original = row
+        for i in range(start, len(ops)):
+            op = ops[i]
+            if op[1].matches(row):
+                if op[0] == "delete":
+                    return None
+                if row is original:
+                    row = list(row)
+                row[op[2]] = op[3]
+        return row if row is original else tuple(row)
+
+    def overlay(self, rows, entries):
+        # Streams `rows` (the checkpointed table) with the logged changes
+        # applied in order, followed by the logged inserts. Only the WAL is
+        # held in memory, never the table. With nothing logged that is
+        # `rows` itself.
+        mods, inserts = self._split(entries)
+        if mods:
+            rows = self._modified(rows, mods)
+        if inserts:
+            rows = chain(rows, self._inserted(inserts, mods))
+        return rows
+
+    def _modified(self, rows, mods):
+        apply_ops = self.apply_ops
+        for row in rows:
+            row = apply_ops(row, mods)
+            if row is not None:
+                yield row
+
+    def _inserted(self, inserts, mods):
+        apply_ops = self.apply_ops
+        for logged, start in inserts:
+            row = apply_ops(logged, mods, start)
+            if row is not None:
+                yield row
+
+    def mods(self, entries):
+        # The compiled updates and deletes of `entries`, as overlay() applies them
+        return self._split(entries)[0]
+
+    def _split(self, entries):
+        # Compiles `entries` into overlay()'s updates/deletes and inserts,
+        # each insert with the number of updates/deletes logged before it.
+        # The ops compiled for a WAL prefix that `entries` extends (the same
+        # entry dicts, as read_prefix() returns them) are reused.
+        done_entries, mods, inserts = self.writer.compiled
+        done = len(done_entries)
+        if not done or len(entries) < done or entries[done - 1] is not done_entries[-1]:
+            done, mods, inserts = 0, [], []
+        if done == len(entries) and done:
+            return mods, inserts
+        mods, inserts = list(mods), list(inserts)
+        for op in self.compile_entries(entries[done:]):
+            if op[0] == "insert":
+                inserts.append((op[1], len(mods)))
+            else:
+                mods.append(op)
+        self.writer.compiled = (entries, mods, inserts)
+        return mods, inserts
+
+    def _column_types(self):
+        if self.column_types is None:
+            try:
+                self.column_types = Catalog.instance().table(self.db_name, self.table_name).column_types
+            except (FileNotFoundError, json.JSONDecodeError):
+                self.column_types = {}
+        return self.column_types
+
+    @staticmethod
+    def parse_assignment(clause):
+        # "col = value" -> ("col", value) with value typed as written: a
+        # number, a quoted string (escapes resolved), NULL/TRUE/FALSE or a
+        # bare word as text. Raises ValueError on anything else.
+        try:
+            tokens = tokenize(clause)
+        except SQLSyntaxError:
+            tokens = []
+        if len(tokens) == 3 and tokens[0][0] == "word" and tokens[1][1] == "=":
+            kind, value = tokens[2][:2]
+            if kind in ("literal", "word"):
+                return tokens[0][1], value
+            if kind == "keyword" and value in RESERVED_VALUES:
+                return tokens[0][1], RESERVED_VALUES[value]
+        # Entries logged by older versions, e.g. "name = John Smith"
+        return WALManager.parse_condition(clause)
+
+    @staticmethod
+    def parse_condition(clause):
+        # "col = value" -> ("col", "value"); raises ValueError on anything else
+        column, value = clause.split("=")
+        return column.strip(), value.strip().strip("'")
@@ -0,0 +1,636 @@
+import operator
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from db_core.schema_manager import Schema_Manager
+from db_core.sql_lexer import RESERVED_VALUES, SQLSyntaxError, sql_literal, tokenize
+
+
+class WhereError(SQLSyntaxError):
+    pass
+
+
+
+NEGATED = {"=": "!=", "!=": "=", "<": ">=", ">=": "<", ">": "<=", "<=": ">"}
+FLIPPED = {"=": "=", "!=": "!=", "<": ">", ">": "<", "<=": ">=", ">=": "<="}
+PY_OPS = {"=": "==", "!=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+OPERATORS = {"=": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le,
+             ">": operator.gt, ">=": operator.ge}
+NUMERIC = {"INT", "FLOAT"}
+AGGREGATES = {"COUNT", "SUM", "AVG", "MIN", "MAX"}
+# Compiled clauses kept per (text, schema)
+CACHE_SIZE = 512
+
+
+# Expression tree. The parser produces Name for bare identifiers; resolve()
+# turns each into a Column or, for words that aren't columns, a text Literal.
+
+@dataclass(frozen=True)
+class Name:
+    name: str
+
+
+@dataclass(frozen=True)
+class Column:
+    name: str
+
+
+@dataclass(frozen=True)
+class Literal:
+    value: object
+    text: str
+
+
+@dataclass(frozen=True)
+class Compare:
+    op: str
+    left: object
+    right: object
+
+
+@dataclass(frozen=True)
+class InList:
+    operand: object
+    values: tuple
+    negated: bool = False
+
+
+@dataclass(frozen=True)
+class Between:
+    operand: object
+    low: object
+    high: object
+    negated: bool = False
+
+
+@dataclass(frozen=True)
+class Like:
+    operand: object
+    pattern: object
+    negated: bool = False
+
+
+@dataclass(frozen=True)
+class IsNull:
+    operand: object
+    negated: bool = False
+
+
+@dataclass(frozen=True)
+class And:
+    items: tuple
+
+
+@dataclass(frozen=True)
+class Or:
+    items: tuple
+
+
+@dataclass(frozen=True)
+class Not:
+    item: object
+
+
+@dataclass(frozen=True)
+class Param:
+    # A ? marker in a prepared statement, numbered from 0 in source order
+    index: int
+
+
+@dataclass(frozen=True)
+class Aggregate(Name):
+    # COUNT, SUM, AVG, MIN or MAX of a column, or COUNT(*) with column None.
+    # Its name is the call as written, "SUM(score)", which is also the name
+    # of its result: in HAVING it is resolved like a column of the groups.
+    func: str = None
+    column: str = None
+
+    @classmethod
+    def of(cls, func, column=None):
+        return cls(f"{func}({column or '*'})", func, column)
+
+
+@dataclass(frozen=True)
+class Const:
+    # True, False, or None for SQL UNKNOWN (a comparison with NULL)
+    value: object
+
+
+class ExpressionParser:
+    """Recursive-descent parser for WHERE expressions:
+
+        expr      := and_expr (OR and_expr)*
+        and_expr  := not_expr (AND not_expr)*
+        not_expr  := NOT not_expr | '(' expr ')' | predicate
+        predicate := operand (cmp operand | [NOT] IN '(' operand, ... ')'
+                     | [NOT] BETWEEN operand AND operand | [NOT] LIKE operand
+                     | IS [NOT] NULL)
+
+    With aggregates=True (a HAVING clause) an operand may also be an
+    aggregate call, COUNT(*) or SUM(col) and the like.
+    """
+
+    def __init__(self, tokens, pos=0, end=None, params=None, aggregates=False):
+        # Parses tokens[pos:end], so a statement parser can hand over the
+        # tokens of its WHERE clause without copying them. `params` is the
+        # number of ? markers already seen, or None where they aren't allowed.
+        self.tokens = tokens
+        self.pos = pos
+        self.end = len(tokens) if end is None else end
+        self.params = params
+        self.aggregates = aggregates
+
+    def parse(self):
+        if self.pos >= self.end:
+            raise WhereError("Empty WHERE clause")
+        node = self.expr()
+        if self.pos < self.end:
+            raise WhereError(f"Unexpected {self.tokens[self.pos][2]!r}")
+        return node
+
+    def peek(self, kind=None, value=None):
+        if self.pos >= self.end:
+            return None
+        token = self.tokens[self.pos]
+        if (kind is None or token[0] == kind) and (value is None or token[1] == value):
+            return token
+        return None
+
+    def accept(self, kind, value=None):
+        token = self.peek(kind, value)
+        if token is not None:
+            self.pos += 1
+        return token
+
+    def expect(self, kind, value=None):
+        token = self.accept(kind, value)
+        if token is None:
+            found = self.tokens[self.pos][2] if self.pos < self.end else "end of clause"
+            raise WhereError(f"Expected {value or kind} but found {found!r}")
+        return token
+
+    def expr(self):
+        items = [self.and_expr()]
+        while self.accept("keyword", "OR"):
+            items.append(self.and_expr())
+        return items[0] if len(items) == 1 else Or(tuple(items))
+
+    def and_expr(self):
+        items = [self.not_expr()]
+        while self.accept("keyword", "AND"):
+            items.append(self.not_expr())
+        return items[0] if len(items) == 1 else And(tuple(items))
+
+    def not_expr(self):
+        if self.accept("keyword", "NOT"):
+            return Not(self.not_expr())
+        if self.accept("op", "("):
+            node = self.expr()
+            self.expect("op", ")")
+            return node
+        return self.predicate()
+
+    def operand(self):
+        token = self.peek()
+        if token is None:
+            raise WhereError("Unexpected end of WHERE clause")
+        kind, value, text = token
+        self.pos += 1
+        if kind == "literal":
+            return Literal(value, text)
+        if kind == "word":
+            if self.aggregates and self.peek("op", "("):
+                return self.aggregate(value)
+            return Name(value)
+        if kind == "keyword" and value in RESERVED_VALUES:
+            return Literal(RESERVED_VALUES[value], text)
+        if kind == "op" and value == "?" and self.params is not None:
+            self.params += 1
+            return Param(self.params - 1)
+        raise WhereError(f"Unexpected {text!r}")
+
+    def aggregate(self, func):
+        # FUNC '(' column | '*' ')', with the '(' next
+        if func.upper() not in AGGREGATES:
+            raise WhereError(f"Unknown aggregate function {func!r}")
+        func = func.upper()
+        self.pos += 1
+        if self.accept("op", "*"):
+            if func != "COUNT":
+                raise WhereError(f"{func}(*) is not supported; only COUNT(*) is")
+            column = None
+        else:
+            column = self.expect("word")[1]
+        self.expect("op", ")")
+        return Aggregate.of(func, column)
+
+    def predicate(self):
+        left = self.operand()
+        token = self.accept("op")
+        if token is not None:
+            if token[1] not in PY_OPS and token[1] != "<>":
+                raise WhereError(f"Unexpected {token[2]!r}")
+            op = "!=" if token[1] == "<>" else token[1]
+            return Compare(op, left, self.operand())
+
+        if self.accept("keyword", "IS"):
+            negated = self.accept("keyword", "NOT") is not None
+            self.expect("keyword", "NULL")
+            return IsNull(left, negated)
+
+        negated = self.accept("keyword", "NOT") is not None
+        if self.accept("keyword", "IN"):
+            self.expect("op", "(")
+            values = [self.operand()]
+            while self.accept("op", ","):
+                values.append(self.operand())
+            self.expect("op", ")")
+            return InList(left, tuple(values), negated)
+        if self.accept("keyword", "BETWEEN"):
+            low = self.operand()
+            self.expect("keyword", "AND")
+            return Between(left, low, self.operand(), negated)
+        if self.accept("keyword", "LIKE"):
+            return Like(left, self.operand(), negated)
+        found = self.tokens[self.pos][2] if self.pos < self.end else "end of clause"
+        raise WhereError(f"Expected a comparison after {getattr(left, 'name', None) or left.text!r}, found {found!r}")
+
+
+def bind(node, args):
+    """Replaces the Param markers of a parsed tree with literals for `args`."""
+    if isinstance(node, Param):
+        return Literal(args[node.index], sql_literal(args[node.index]))
+    if isinstance(node, (And, Or)):
+        return type(node)(tuple(bind(item, args) for item in node.items))
+    if isinstance(node, Not):
+        return Not(bind(node.item, args))
+    if isinstance(node, Compare):
+        return Compare(node.op, bind(node.left, args), bind(node.right, args))
+    if isinstance(node, InList):
+        return InList(node.operand, tuple(bind(v, args) for v in node.values), node.negated)
+    if isinstance(node, Between):
+        return Between(node.operand, bind(node.low, args), bind(node.high, args), node.negated)
+    if isinstance(node, Like):
+        return Like(node.operand, bind(node.pattern, args), node.negated)
+    return node
+
+
+def aggregates_of(node):
+    """The Aggregate calls of a parsed (not yet resolved) tree, in order."""
+    if isinstance(node, Aggregate):
+        return [node]
+    if isinstance(node, (And, Or)):
+        return [found for item in node.items for found in aggregates_of(item)]
+    if isinstance(node, Not):
+        return aggregates_of(node.item)
+    if isinstance(node, Compare):
+        return aggregates_of(node.left) + aggregates_of(node.right)
+    if isinstance(node, (InList, Between, Like, IsNull)):
+        return aggregates_of(node.operand)
+    return []
+
+
+def render(node):
+    """SQL text for a parsed tree; parsing it gives the same tree back."""
+    if isinstance(node, Name):
+        return node.name
+    if isinstance(node, Literal):
+        return node.text
+    if isinstance(node, Param):
+        return "?"
+    if isinstance(node, (And, Or)):
+        joiner = " AND " if isinstance(node, And) else " OR "
+        return joiner.join(f"({render(item)})" if isinstance(item, (And, Or)) else render(item)
+                           for item in node.items)
+    if isinstance(node, Not):
+        item = render(node.item)
+        return f"NOT ({item})" if isinstance(node.item, (And, Or)) else f"NOT {item}"
+    if isinstance(node, Compare):
+        return f"{render(node.left)} {node.op} {render(node.right)}"
+    negated = "NOT " if getattr(node, "negated", False) else ""
+    if isinstance(node, InList):
+        return f"{render(node.operand)} {negated}IN ({', '.join(render(v) for v in node.values)})"
+    if isinstance(node, Between):
+        return f"{render(node.operand)} {negated}BETWEEN {render(node.low)} AND {render(node.high)}"
+    if isinstance(node, Like):
+        return f"{render(node.operand)} {negated}LIKE {render(node.pattern)}"
+    if isinstance(node, IsNull):
+        return f"{render(node.operand)} IS {'NOT ' if node.negated else ''}NULL"
+    raise WhereError("Invalid WHERE expression")
+
+
+class Resolver:
+    """Binds names to schema columns and converts literals to the type of the
+    column they are compared with, so rows are compared as typed values.
+    NOT is pushed down to the leaves on the way, which keeps SQL's rule that
+    a comparison with NULL is never true, negated or not."""
+
+    def __init__(self, column_types):
+        self.column_types = column_types
+
+    def resolve(self, node, negate=False):
+        if isinstance(node, Not):
+            return self.resolve(node.item, not negate)
+        if isinstance(node, (And, Or)):
+            items = tuple(self.resolve(item, negate) for item in node.items)
+            conjunction = isinstance(node, And) != negate
+            return And(items) if conjunction else Or(items)
+        if isinstance(node, Compare):
+            return self._compare(node, negate)
+        if isinstance(node, InList):
+            column = self._column(node.operand)
+            values = [self._literal(column, v) for v in node.values]
+            negated = node.negated != negate
+            if None in values:
+                if negated:
+                    return Const(None)  # x NOT IN (..., NULL) is never true
+                values = [v for v in values if v is not None]
+            return InList(column, tuple(sorted(set(values), key=repr)), negated)
+        if isinstance(node, Between):
+            column = self._column(node.operand)
+            low, high = self._literal(column, node.low), self._literal(column, node.high)
+            if low is None or high is None:
+                return Const(None)
+            return Between(column, low, high, node.negated != negate)
+        if isinstance(node, Like):
+            column = self._column(node.operand)
+            if not isinstance(node.pattern, (Literal, Name)):
+                raise WhereError("LIKE needs a pattern")
+            pattern = str(node.pattern.value) if isinstance(node.pattern, Literal) else node.pattern.name
+            return Like(column, pattern, node.negated != negate)
+        if isinstance(node, IsNull):
+            return IsNull(self._column(node.operand), node.negated != negate)
+        raise WhereError("Invalid WHERE expression")
+
+    def _column(self, operand):
+        if isinstance(operand, Name) and operand.name in self.column_types:
+            return Column(operand.name)
+        name = operand.name if isinstance(operand, Name) else operand.text
+        raise WhereError(f"Column '{name}' does not exist")
+
+    def _is_column(self, operand):
+        return isinstance(operand, Name) and operand.name in self.column_types
+
+    def _literal(self, column, operand):
+        # Converts a literal (or a bare word, read as text) to the column's type
+        if isinstance(operand, Name):
+            if operand.name in self.column_types:
+                raise WhereError(f"Expected a value, found column '{operand.name}'")
+            operand = Literal(operand.name, operand.name)
+        value = operand.value
+        if value is None:
+            return None
+        col_type = self.column_types[column.name]
+        if col_type == "TEXT":
+            return operand.text if isinstance(value, (int, float)) and not isinstance(value, bool) else str(value)
+        try:
+            if col_type in NUMERIC and isinstance(value, str):
+                value = int(value) if re.fullmatch(r"\s*-?\d+\s*", value) else float(value)
+            if col_type == "INT" and isinstance(value, float) and not value.is_integer():
+                return value  # 2.5 stays a float and still compares numerically
+            return Schema_Manager.coerce(col_type, value)
+        except ValueError:
+            raise WhereError(f"Cannot compare {col_type} column '{column.name}' with {operand.text}")
+
+    def _compare(self, node, negate):
+        op = NEGATED[node.op] if negate else node.op
+        left, right = node.left, node.right
+        if self._is_column(left) and self._is_column(right):
+            left_type = self.column_types[left.name]
+            right_type = self.column_types[right.name]
+            if left_type != right_type and not (left_type in NUMERIC and right_type in NUMERIC):
+                raise WhereError(f"Cannot compare {left_type} column '{left.name}' with "
+                                 f"{right_type} column '{right.name}'")
+            return Compare(op, Column(left.name), Column(right.name))
+        if self._is_column(left):
+            column, value = Column(left.name), self._literal(Column(left.name), right)
+        elif self._is_column(right):
+            column, value = Column(right.name), self._literal(Column(right.name), left)
+            op = FLIPPED[op]
+        elif isinstance(left, Name):
+            raise WhereError(f"Column '{left.name}' does not exist")
+        else:
+            # Two literals: fold to a constant
+            if left.value is None or right.value is None:
+                return Const(None)
+            try:
+                return Const(OPERATORS[op](left.value, right.value))
+            except TypeError:
+                raise WhereError(f"Cannot compare {left.text} with {right.text}")
+        if value is None:
+            return Const(None)
+        return Compare(op, column, Literal(value, repr(value)))
+
+
+def like_pattern(pattern):
+    # SQL LIKE: % is any run of characters, _ is exactly one
+    parts = []
+    for ch in pattern:
+        parts.append(".*" if ch == "%" else "." if ch == "_" else re.escape(ch))
+    return re.compile("".join(parts), re.DOTALL).fullmatch
+
+
+class CodeGenerator:
+    """Turns a resolved tree into the source of a single Python expression
+    over `row`, a tuple of values in the order of `column_types`; constants
+    are passed in through the function's globals."""
+
+    def __init__(self, column_types):
+        self.column_types = column_types
+        self.positions = {name: i for i, name in enumerate(column_types)}
+        self.consts = {}
+        self.names = 0
+
+    def const(self, value):
+        name = f"k{len(self.consts)}"
+        self.consts[name] = value
+        return name
+
+    def fetch(self, column):
+        name = f"v{self.names}"
+        self.names += 1
+        return name, f"({name} := row[{self.positions[column.name]}]) is not None"
+
+    def like_test(self, pattern, text):
+        # 'abc%', '%abc' and '%abc%' become string methods; anything else a regex
+        core = pattern.strip("%")
+        if "%" not in core and "_" not in core:
+            literal = self.const(core)
+            if pattern == core:
+                return f"{text} == {literal}"
+            if pattern == core + "%":
+                return f"{text}.startswith({literal})"
+            if pattern == "%" + core:
+                return f"{text}.endswith({literal})"
+            return f"{literal} in {text}"
+        return f"{self.const(like_pattern(pattern))}({text}) is not None"
+
+    def emit(self, node):
+        if isinstance(node, Const):
+            return "True" if node.value else "False"
+        if isinstance(node, And):
+            return "(" + " and ".join(self.emit(item) for item in node.items) + ")"
+        if isinstance(node, Or):
+            return "(" + " or ".join(self.emit(item) for item in node.items) + ")"
+        if isinstance(node, IsNull):
+            return f"(row[{self.positions[node.operand.name]}] is {'not ' if node.negated else ''}None)"
+
+        var, guard = self.fetch(node.operand if not isinstance(node, Compare) else node.left)
+        if isinstance(node, Compare):
+            if isinstance(node.right, Column):
+                other, other_guard = self.fetch(node.right)
+                return f"({guard} and {other_guard} and {var} {PY_OPS[node.op]} {other})"
+            return f"({guard} and {var} {PY_OPS[node.op]} {self.const(node.right.value)})"
+        if isinstance(node, InList):
+            values = self.const(frozenset(node.values))
+            return f"({guard} and {var} {'not in' if node.negated else 'in'} {values})"
+        if isinstance(node, Between):
+            low, high = self.const(node.low), self.const(node.high)
+            return f"({guard} and {'not ' if node.negated else ''}({low} <= {var} <= {high}))"
+        if isinstance(node, Like):
+            text = var if self.column_types[node.operand.name] == "TEXT" else f"str({var})"
+            test = self.like_test(node.pattern, text)
+            return f"({guard} and {'not ' if node.negated else ''}{test})"
+        raise WhereError("Invalid WHERE expression")
+
+
+def columns_of(node):
+    if isinstance(node, (And, Or)):
+        return set().union(*(columns_of(item) for item in node.items))
+    if isinstance(node, Compare):
+        return {side.name for side in (node.left, node.right) if isinstance(side, Column)}
+    if isinstance(node, (InList, Between, Like, IsNull)):
+        return {node.operand.name}
+    return set()
+
+
+def may_match(node, bounds):
+    """False if no row within `bounds` can match a resolved tree. `bounds`
+    maps a column to (least value, greatest value, NULL count), the values
+    None if the column only holds NULLs; a column it doesn't have, or has
+    None for, may hold anything."""
+    if isinstance(node, Const):
+        return node.value is True
+    if isinstance(node, And):
+        return all(may_match(item, bounds) for item in node.items)
+    if isinstance(node, Or):
+        return any(may_match(item, bounds) for item in node.items)
+    column = node.left if isinstance(node, Compare) else node.operand
+    zone = bounds.get(column.name)
+    if zone is None:
+        return True
+    low, high, nulls = zone
+    if isinstance(node, IsNull):
+        return low is not None if node.negated else nulls > 0
+    if low is None:
+        return False  # only NULLs, which no comparison matches
+    try:
+        if isinstance(node, Compare):
+            if isinstance(node.right, Column):
+                return True
+            value = node.right.value
+            op = node.op
+            if op == "=":
+                return low <= value <= high
+            if op == "!=":
+                return not low == value == high
+            if op == "<":
+                return low < value
+            if op == "<=":
+                return low <= value
+            if op == ">":
+                return high > value
+            return high >= value
+        if isinstance(node, InList):
+            if node.negated:
+                return not (low == high and low in node.values)
+            return any(low <= value <= high for value in node.values)
+        if isinstance(node, Between):
+            if node.negated:
+                return not (node.low <= low and high <= node.high)
+            return low <= node.high and high >= node.low
+    except TypeError:
+        pass
+    return True
+
+
+class WhereClause:
+    """A WHERE clause compiled against a table schema.
+
+    `matches(row)` and `filter(rows)` are generated functions evaluating the
+    whole expression inline, built once per distinct clause text and schema.
+    Rows are tuples of values in the order of the schema's `column_types`.
+    """
+
+    _cache = OrderedDict()
+    _code_cache = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    def __init__(self, text, column_types, tree=None):
+        # `tree` is the clause already parsed by the statement parser
+        self.text = text
+        if tree is None:
+            try:
+                tree = ExpressionParser(tokenize(text)).parse()
+            except WhereError:
+                raise
+            except SQLSyntaxError as e:
+                raise WhereError(str(e)) from None
+        self.tree = Resolver(column_types).resolve(tree)
+        self.columns = frozenset(columns_of(self.tree))
+        generator = CodeGenerator(column_types)
+        expression = generator.emit(self.tree)
+        # filter() inlines the expression into the loop, saving a function
+        # call per row over calling matches()
+        source = (f"def matches(row):\n    return {expression}\n"
+                  f"def filter(rows):\n    return (row for row in rows if {expression})\n")
+        namespace = dict(generator.consts)
+        exec(self._code(source), namespace)
+        self.source = source
+        self.matches = namespace["matches"]
+        self.filter = namespace["filter"]
+
+    @classmethod
+    def _code(cls, source):
+        # Constants live in the namespace, not the source, so clauses that
+        # differ only in their values (a prepared statement run with new
+        # arguments, say) share one code object
+        with cls._cache_lock:
+            code = cls._code_cache.get(source)
+            if code is not None:
+                cls._code_cache.move_to_end(source)
+                return code
+        code = compile(source, "<where>", "exec")
+        with cls._cache_lock:
+            cls._code_cache[source] = code
+            if len(cls._code_cache) > CACHE_SIZE:
+                cls._code_cache.popitem(last=False)
+        return code
+
+    @classmethod
+    def compile(cls, text, column_types, tree=None):
+        key = (text, tuple(column_types.items()))
+        with cls._cache_lock:
+            where = cls._cache.get(key)
+            if where is not None:
+                cls._cache.move_to_end(key)
+                return where
+        where = cls(text, column_types, tree)
+        with cls._cache_lock:
+            cls._cache[key] = where
+            if len(cls._cache) > CACHE_SIZE:
+                cls._cache.popitem(last=False)
+        return where
+
+    def may_match(self, bounds):
+        # See may_match(): False if the clause can't hold for rows within `bounds`
+        return may_match(self.tree, bounds)
+
+    def equality(self):
+        # (column, value) if the clause is exactly "column = value"
+        node = self.tree
+        if isinstance(node, Compare) and node.op == "=" and isinstance(node.right, Literal):
+            return node.left.name, node.right.value
+        return None
@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_core.catalog import Catalog
+from db_core.parallel_scan import ScanPool
+from db_core.parser import Parser
+from db_core.result_cache import ResultCache
+from db_core.sql_lexer import take_statements
+from db_core.wal_manager import DURABILITY_MODES, WALWriter
+from server.protocol import (COMPLETE, QUERY, STARTUP, TERMINATE, BinarySession, FrameBuffer,
+                             ProtocolError, json_frame)
+
+HOST = "127.0.0.1"
+PORT = 5555
+# Threads running storage work for all connections together
+WORKERS = 8
+READ_SIZE = 65536
+
+
+class MiniDBProtocol:
+    """One client connection: its own Parser (active database, prepared
+    statements), fed with every complete statement the client has sent,
+    in order. Clients may pipeline: send many statements without waiting,
+    and read the replies in the same order. A client that opens with
+    protocol.STARTUP gets framed replies, with SELECT rows streamed."""
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.parser = Parser()
+
+    def run_batch(self, commands):
+        out = []
+        for raw_cmd in commands:
+            try:
+                result = self.parser.route(raw_cmd)
+            except Exception as e:
+                result = {"error": f"Server error: {e}"}
+
+            if isinstance(result, (dict, list)):
+                out.append(json.dumps(result, ensure_ascii=False))
+            else:
+                out.append(str(result))
+        out.append("")
+        return "\n".join(out).encode("utf-8")
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        writer.write(b"MiniDB server ready. Send semicolon-terminated commands.\n")
+        buffer = ""
+        first = True
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                if first and data[:1] == STARTUP[:1]:
+                    await self.handle_binary(reader, writer, data)
+                    return
+                first = False
+                chunk = data.decode("utf-8", errors="replace")
+                buffer += chunk
+                if ";" not in chunk:
+                    continue
+                commands, buffer = take_statements(buffer)
+                quitting = False
+                for i, raw_cmd in enumerate(commands):
+                    if raw_cmd.lower() in ("exit;", "quit;"):
+                        commands, quitting = commands[:i], True
+                        break
+
+                # A pipelined batch is run and serialised in one trip to
+                # the executor, and its replies go out together
+                if commands:
+                    writer.write(await loop.run_in_executor(self.executor, self.run_batch, commands))
+                if quitting:
+                    writer.write(b"Goodbye\n")
+                    await writer.drain()
+                    return
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ProtocolError):
+            pass
+        finally:
+            self.parser.close()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def handle_binary(self, reader, writer, data):
+        loop = asyncio.get_running_loop()
+        while len(data) < len(STARTUP):
+            more = await reader.read(READ_SIZE)
+            if not more:
+                return
+            data += more
+        if data[:len(STARTUP)] != STARTUP:
+            writer.write(json_frame(COMPLETE, {"error": "Unsupported protocol version"}))
+            await writer.drain()
+            return
+
+        async def write(chunk):
+            writer.write(chunk)
+            await writer.drain()
+
+        # Runs on a worker thread; blocks it until the loop has sent the
+        # chunk, so a slow client holds back the scan feeding it
+        def send(chunk):
+            asyncio.run_coroutine_threadsafe(write(chunk), loop).result()
+
+        session = BinarySession(self.parser, send)
+        writer.write(session.ready())
+        frames = FrameBuffer()
+        frames.feed(data[len(STARTUP):])
+        while True:
+            queries = []
+            closing = False
+            message = frames.next_frame()
+            while message is not None:
+                kind, payload = message
+                if kind == TERMINATE:
+                    closing = True
+                    break
+                if kind == QUERY:
+                    queries.append(payload.decode("utf-8", errors="replace"))
+                else:
+                    raise ProtocolError(f"Unexpected message type {kind!r}")
+                message = frames.next_frame()
+
+            if queries:
+                writer.write(await loop.run_in_executor(self.executor, self.run_frames, session, queries))
+            await writer.drain()
+            if closing:
+                return
+            data = await reader.read(READ_SIZE)
+            if not data:
+                return
+            frames.feed(data)
+
+    def run_frames(self, session, queries):
+        for sql in queries:
+            session.run(sql)
+        return session.take()
+
+
+async def serve(host=HOST, port=PORT, workers=WORKERS):
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="minidb-worker")
+    Catalog.instance()  # load the catalog before the first connection
+
+    async def on_connect(reader, writer):
+        await MiniDBProtocol(executor).handle(reader, writer)
+
+    server = await asyncio.start_server(on_connect, host, port, limit=READ_SIZE, backlog=1024)
+    print(f"Starting MiniDB asyncio server on {host}:{port} with {workers} workers")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MiniDB asyncio server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--durability", choices=DURABILITY_MODES)
+    parser.add_argument("--commit-delay", type=float, help="seconds a group commit waits for more statements")
+    parser.add_argument("--scan-workers", type=int, help="processes a table scan can be split over")
+    parser.add_argument("--result-cache-mb", type=int, help="memory for cached SELECT results; 0 for none")
+    args = parser.parse_args(argv)
+    WALWriter.configure(durability=args.durability, commit_delay=args.commit_delay)
+    if args.scan_workers is not None:
+        ScanPool.configure(args.scan_workers)
+    if args.result_cache_mb is not None:
+        ResultCache.instance().configure(args.result_cache_mb * 1024 * 1024)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        print("\nShutting down server.")
+
+
+if __name__ == "__main__":
+    main()
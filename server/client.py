@@ -1,26 +1,146 @@
+import argparse
+import json
+import os
 import socket
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from server.protocol import (COMPLETE, QUERY, READY, ROW_BATCH, ROW_DESCRIPTION, STARTUP, TERMINATE,
+                             FrameBuffer, ProtocolError, decode_batch, decode_description, frame)
 
 HOST = "127.0.0.1"
 PORT = 5555
+RECV_SIZE = 65536
 
-def recv_line(sock):
-    """Receive bytes until a newline, return decoded string (no newline)."""
-    buf = ""
-    while True:
-        data = sock.recv(4096)
-        if not data:
-            return None
-        buf += data.decode("utf-8", errors="replace")
-        if "\n" in buf:
-            line, rest = buf.split("\n", 1)
-            return line
-
-def repl():
-    with socket.create_connection((HOST, PORT)) as s:
+
+class QueryError(Exception):
+    pass
+
+
+class Connection:
+    """A MiniDB connection in text mode, or with binary=True in the framed
+    protocol, where SELECT rows arrive typed and in batches. Whatever has
+    been received is held in one reusable buffer and decoded from there."""
+
+    def __init__(self, host=HOST, port=PORT, binary=False):
+        self.sock = socket.create_connection((host, port))
+        self.buffer = FrameBuffer()
+        self.chunk = bytearray(RECV_SIZE)
+        self.binary = binary
+        self.welcome = self.recv_line()
+        self.description = None
+        self.result = None
+        if binary:
+            self.sock.sendall(STARTUP)
+            kind, payload = self.recv_frame()
+            if kind != READY:
+                raise ProtocolError(json.loads(payload).get("error", "Startup refused"))
+            self.settings = json.loads(payload)
+
+    def _recv(self):
+        n = self.sock.recv_into(self.chunk)
+        if not n:
+            raise ConnectionError("Server closed the connection")
+        self.buffer.feed(memoryview(self.chunk)[:n])
+
+    def recv_line(self):
+        """Receive bytes until a newline, return decoded string (no newline)."""
+        while True:
+            line = self.buffer.read_line()
+            if line is not None:
+                return line.decode("utf-8", errors="replace")
+            self._recv()
+
+    def recv_frame(self):
+        while True:
+            message = self.buffer.next_frame()
+            if message is not None:
+                return message
+            self._recv()
+
+    def send(self, sql):
+        # Pipelining: statements may be sent ahead of reading their results
+        if self.binary:
+            self.sock.sendall(frame(QUERY, sql.encode("utf-8")))
+        else:
+            if not sql.rstrip().endswith(";"):
+                sql += ";"
+            self.sock.sendall(sql.encode("utf-8"))
+
+    def stream(self, sql=None):
+        """Yields the rows of the next result as tuples, a batch at a time.
+        Sends `sql` first if given. self.description holds the (name, type)
+        of each column and, once the rows are read, self.result holds the
+        statement's result; a failed statement raises QueryError."""
+        if sql is not None:
+            self.send(sql)
+        self.description = None
+        types = []
+        done = False
+        try:
+            while True:
+                kind, payload = self.recv_frame()
+                if kind == ROW_DESCRIPTION:
+                    self.description = decode_description(payload)
+                    types = [col_type for _, col_type in self.description]
+                elif kind == ROW_BATCH:
+                    yield from decode_batch(payload, types)
+                elif kind == COMPLETE:
+                    done = True
+                    self.result = json.loads(payload)
+                    if isinstance(self.result, dict) and "error" in self.result:
+                        raise QueryError(self.result["error"])
+                    return
+                else:
+                    raise ProtocolError(f"Unexpected message type {kind!r}")
+        finally:
+            # Stopped early: the rest of the result is still on its way, and
+            # must be read past before the next one
+            while not done:
+                kind, payload = self.recv_frame()
+                done = kind == COMPLETE
+
+    def execute(self, sql=None):
+        """Returns the next result the way the text protocol shows it: a
+        SELECT's rows as a list of dicts under "data". Sends `sql` first if
+        given."""
+        if sql is not None:
+            self.send(sql)
+        if not self.binary:
+            line = self.recv_line()
+            try:
+                return json.loads(line)
+            except ValueError:
+                return line
+        try:
+            rows = list(self.stream())
+        except QueryError:
+            return self.result
+        if self.description is None:
+            return self.result
+        names = [name for name, _ in self.description]
+        result = dict(self.result)
+        result["data"] = [dict(zip(names, row)) for row in rows]
+        return result
+
+    def close(self):
+        try:
+            self.sock.sendall(frame(TERMINATE) if self.binary else b"exit;\n")
+        except OSError:
+            pass
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def repl(host=HOST, port=PORT, binary=False):
+    with Connection(host, port, binary) as conn:
         # Read welcome
-        welcome = recv_line(s)
-        if welcome:
-            print(welcome)
+        if conn.welcome:
+            print(conn.welcome)
 
         print("Connected to MiniDB. Type SQL commands terminated with ';'. Type 'exit;' to quit.")
         while True:
@@ -29,27 +149,29 @@ def repl():
                 line = input("MiniDB> ").rstrip()
                 if line == "":
                     continue
-                if line.lower() in ("exit", "quit"):
-                    s.sendall(b"exit;\n")
+                if line.lower() in ("exit", "quit", "exit;", "quit;"):
                     print("Exiting client.")
                     return
                 lines.append(line)
                 if line.endswith(";"):
                     break
             command = " ".join(lines).strip()
-            if not command.endswith(";"):
-                command += ";"
 
             try:
-                s.sendall(command.encode("utf-8"))
-            except BrokenPipeError:
+                conn.send(command)
+                resp = conn.execute()
+            except (BrokenPipeError, ConnectionError):
                 print("Connection lost.")
                 return
-            resp = recv_line(s)
-            if resp is None:
-                print("No response (server closed connection).")
-                return
+            if isinstance(resp, (dict, list)):
+                resp = json.dumps(resp, ensure_ascii=False)
             print(resp)
 
+
 if __name__ == "__main__":
-    repl()
+    parser = argparse.ArgumentParser(description="MiniDB client")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--binary", action="store_true", help="use the framed binary protocol")
+    args = parser.parse_args()
+    repl(args.host, args.port, args.binary)
@@ -0,0 +1,167 @@
+"""Load test for the MiniDB servers.
+
+Starts a server in a subprocess, holds a number of idle client connections
+open, and meanwhile runs active clients doing point SELECTs. Reports how
+many connections the server held, its threads and memory, and the request
+latency. Run it once per server to compare them:
+
+    python server/load_test.py --server threaded
+    python server/load_test.py --server asyncio
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = "127.0.0.1"
+SERVERS = {
+    "threaded": lambda port: [sys.executable, os.path.join(ROOT, "server", "server.py"), str(port)],
+    "asyncio": lambda port: [sys.executable, os.path.join(ROOT, "server", "async_server.py"), "--port", str(port)],
+}
+ROWS = 1000
+# Connections opened at once; socketserver's default listen backlog is 5,
+# and a fuller backlog makes clients wait seconds for SYN retries
+CONNECT_BATCH = 5
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def process_stats(pid):
+    # Threads and resident memory of the server, from /proc (Linux only)
+    stats = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Threads", "VmRSS"):
+                    stats[key] = value.strip()
+    except OSError:
+        pass
+    return stats
+
+
+async def connect(port):
+    reader, writer = await asyncio.open_connection(HOST, port, limit=1 << 20)
+    await reader.readline()  # welcome
+    return reader, writer
+
+
+async def command(reader, writer, sql):
+    writer.write(sql.encode("utf-8"))
+    await writer.drain()
+    return await reader.readline()
+
+
+async def setup(port):
+    reader, writer = await connect(port)
+    await command(reader, writer, "CREATE DATABASE loadtest;")
+    await command(reader, writer, "USE loadtest;")
+    await command(reader, writer, "CREATE TABLE lt (id INT PRIMARY KEY, name TEXT, score FLOAT);")
+    values = ", ".join(f"({i}, 'name{i}', {i}.5)" for i in range(ROWS))
+    await command(reader, writer, f"INSERT INTO lt VALUES {values};")
+    await command(reader, writer, "CHECKPOINT;")
+    writer.close()
+
+
+async def open_connections(port, count, timeout):
+    async def one():
+        try:
+            return await asyncio.wait_for(connect(port), timeout)
+        except (OSError, asyncio.TimeoutError):
+            return None
+
+    held = []
+    for start in range(0, count, CONNECT_BATCH):
+        results = await asyncio.gather(*(one() for _ in range(start, min(count, start + CONNECT_BATCH))))
+        held.extend(r for r in results if r is not None)
+    return held
+
+
+async def active_client(reader, writer, requests, pipeline, latencies):
+    sent = 0
+    while sent < requests:
+        batch = min(pipeline, requests - sent)
+        sql = "".join(f"SELECT * FROM lt WHERE id = {(sent + i) * 7 % ROWS};" for i in range(batch))
+        start = time.perf_counter()
+        writer.write(sql.encode("utf-8"))
+        await writer.drain()
+        for _ in range(batch):
+            await reader.readline()
+        # Every statement in a pipelined batch waits for the whole batch
+        latencies.extend([time.perf_counter() - start] * batch)
+        sent += batch
+    writer.close()
+
+
+async def run(args, port, pid):
+    await setup(port)
+    held = await open_connections(port, args.idle, args.connect_timeout)
+    await asyncio.sleep(0.5)
+    idle_stats = process_stats(pid)
+
+    clients = await open_connections(port, args.clients, args.connect_timeout)
+    for reader, writer in clients:
+        await command(reader, writer, "USE loadtest;")
+
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(active_client(reader, writer, args.requests, args.pipeline, latencies)
+                           for reader, writer in clients))
+    elapsed = time.perf_counter() - start
+    busy_stats = process_stats(pid)
+    for _, writer in held:
+        writer.close()
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print(f"server:            {args.server}")
+    print(f"idle connections:  {len(held)} of {args.idle} held")
+    print(f"server threads:    {idle_stats.get('Threads', '?')} idle, {busy_stats.get('Threads', '?')} under load")
+    print(f"server RSS:        {idle_stats.get('VmRSS', '?')} idle, {busy_stats.get('VmRSS', '?')} under load")
+    print(f"requests:          {len(latencies)} from {len(clients)} clients, pipeline {args.pipeline}")
+    print(f"throughput:        {len(latencies) / elapsed:.0f} req/s")
+    print(f"latency:           p50 {pct(0.50):.2f} ms, p99 {pct(0.99):.2f} ms, max {latencies[-1] * 1000:.2f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MiniDB server load test")
+    parser.add_argument("--server", choices=sorted(SERVERS), default="asyncio")
+    parser.add_argument("--idle", type=int, default=1000, help="idle connections to hold open")
+    parser.add_argument("--clients", type=int, default=32, help="clients sending requests")
+    parser.add_argument("--requests", type=int, default=200, help="requests per active client")
+    parser.add_argument("--pipeline", type=int, default=1, help="statements sent per round trip")
+    parser.add_argument("--connect-timeout", type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    port = free_port()
+    server = subprocess.Popen(SERVERS[args.server](port), cwd=ROOT,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection((HOST, port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise SystemExit("server did not start")
+                time.sleep(0.1)
+        asyncio.run(run(args, port, server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""The DB-API of db_core/dbapi.py over a MiniDB server.
+
+dbapi.connect("minidb://host:port/name") opens a RemoteConnection: a
+framed-protocol connection taken from the server's ConnectionPool, kept
+on `name` for as long as it is open and handed back to the pool by
+close(). Rows arrive typed, as the protocol sends them, and are read off
+the socket as they are fetched.
+
+Statements are checked and parsed on the client as well. One with
+parameters is PREPAREd on the server the first time the connection runs
+it, then run with EXECUTE, so the server parses only the values. An
+executemany() of an INSERT is sent EXECUTEMANY_BATCH rows at a time as
+one multi-row INSERT; any other is pipelined, all the statements sent
+before their results are read.
+"""
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_core import dbapi
+from db_core import sql_parser as ast
+from db_core.sql_lexer import SQLSyntaxError, sql_literal
+from server.client import HOST, PORT, Connection, QueryError
+
+# Idle connections a pool keeps per server
+POOL_SIZE = 8
+# Statements kept PREPAREd per server connection
+PREPARED_PER_CONNECTION = 256
+
+
+class ConnectionPool:
+    """Idle framed-protocol connections to one server, reused by
+    RemoteConnections instead of each opening its own."""
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    @classmethod
+    def for_server(cls, host=HOST, port=PORT):
+        key = (host, port)
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                pool = cls._pools[key] = cls(host, port)
+            return pool
+
+    def __init__(self, host=HOST, port=PORT, size=POOL_SIZE):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.lock = threading.Lock()
+        self.idle = []
+
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        try:
+            conn = Connection(self.host, self.port, binary=True)
+        except OSError as e:
+            raise dbapi.OperationalError(f"Can't connect to {self.host}:{self.port}: {e}") from None
+        conn.database = None  # the one in use on the server
+        conn.prepared = OrderedDict()  # statement text -> name PREPAREd as
+        conn.prepared_count = 0
+        return conn
+
+    def release(self, conn):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+def connect_remote(url, create=True, pool=None):
+    # url: minidb://host:port/name
+    parts = urlsplit(url)
+    db_name = parts.path.strip("/")
+    if not db_name:
+        raise dbapi.InterfaceError(f"No database named in {url!r}")
+    pool = pool or ConnectionPool.for_server(parts.hostname or HOST, parts.port or PORT)
+    return RemoteConnection(pool, db_name, create)
+
+
+class RemoteConnection(dbapi.Connection):
+
+    def __init__(self, pool, db_name, create=True):
+        self.db_name = db_name
+        self.pool = pool
+        self.conn = pool.acquire()
+        self.cursors = weakref.WeakSet()
+        self.closed = False
+        self.reading = None  # the cursor whose rows are still coming in
+        try:
+            if self.conn.database != db_name:
+                self._use(create)
+        except Exception:
+            self.conn.close()
+            raise
+
+    def _use(self, create):
+        result = self.conn.execute(f"USE {db_name_literal(self.db_name)};")
+        if "error" in result and create:
+            created = self.conn.execute(f"CREATE DATABASE {db_name_literal(self.db_name)};")
+            result = self.conn.execute(f"USE {db_name_literal(self.db_name)};")
+            if "error" in result:
+                result = created
+        if "error" in result:
+            raise dbapi.error_for(result)
+        self.conn.database = self.db_name
+
+    def cursor(self):
+        self._check()
+        cursor = RemoteCursor(self)
+        self.cursors.add(cursor)
+        return cursor
+
+    def close(self):
+        if self.closed:
+            return
+        for cursor in list(self.cursors):
+            cursor.close()
+        self.closed = True
+        if self.conn is not None:
+            self.pool.release(self.conn)
+            self.conn = None
+
+    def stream(self, sql):
+        # Sends `sql` and reads its reply up to the first row: returns the
+        # statement's result and, for a SELECT, its description and a
+        # generator of the rows, still being read from the socket
+        self._check()
+        self._set_aside()
+        rows = self.conn.stream(sql)
+        try:
+            first = next(rows)
+        except StopIteration:
+            return self.conn.result, self.conn.description, None
+        except QueryError:
+            raise dbapi.error_for(self.conn.result) from None
+        except OSError as e:
+            self._broken()
+            raise dbapi.OperationalError(f"Connection lost: {e}") from None
+        return None, self.conn.description, self._rows(first, rows)
+
+    def _rows(self, first, rows):
+        try:
+            yield first
+            yield from rows
+        except QueryError:
+            raise dbapi.error_for(self.conn.result) from None
+        finally:
+            rows.close()
+
+    def run(self, sql):
+        result, _, _ = self.stream(sql)
+        return result
+
+    def pipeline(self, statements):
+        # Sends all the statements, then reads their results
+        self._check()
+        self._set_aside()
+        try:
+            for sql in statements:
+                self.conn.send(sql)
+            results = [self.conn.execute() for _ in statements]
+        except OSError as e:
+            self._broken()
+            raise dbapi.OperationalError(f"Connection lost: {e}") from None
+        for result in results:
+            if isinstance(result, dict) and "error" in result:
+                raise dbapi.error_for(result)
+        return results
+
+    def prepared_name(self, sql):
+        # The name `sql` is PREPAREd as on this server connection
+        prepared = self.conn.prepared
+        name = prepared.get(sql)
+        if name is not None:
+            prepared.move_to_end(sql)
+            return name
+        name = f"dbapi_{self.conn.prepared_count}"
+        self.conn.prepared_count += 1
+        statements = [f"PREPARE {name} AS {sql}"]
+        if len(prepared) >= PREPARED_PER_CONNECTION:
+            _, oldest = prepared.popitem(last=False)
+            statements.append(f"DEALLOCATE {oldest};")
+        self.pipeline(statements)
+        prepared[sql] = name
+        return name
+
+    def _set_aside(self):
+        # The rows still due for another cursor are read into memory first,
+        # so this connection can go on to the next statement
+        if self.reading is not None:
+            cursor, self.reading = self.reading, None
+            cursor.buffer()
+
+    def _broken(self):
+        # The server connection can't be reused: don't return it to the pool
+        conn, self.conn = self.conn, None
+        self.closed = True
+        if conn is not None:
+            conn.sock.close()
+
+
+class RemoteCursor(dbapi.Cursor):
+
+    def execute(self, sql, params=()):
+        self._check()
+        self._reset()
+        prepared = self._prepare(sql)
+        args = self._args(params)
+        try:
+            ast.bind(prepared, args)
+        except SQLSyntaxError as e:
+            raise dbapi.ProgrammingError(str(e)) from None
+        text = self._text(sql, prepared, args)
+        result, description, rows = self.connection.stream(text)
+        if description is not None:
+            self.description = [(name, col_type, None, None, None, None, True) for name, col_type in description]
+            self.rows = rows if rows is not None else (row for row in ())
+            if rows is not None:
+                self.connection.reading = self
+        elif isinstance(prepared.statement, ast.Insert):
+            self.rowcount = len(prepared.statement.rows)
+        else:
+            self.rowcount = result.get("rows", -1)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._check()
+        self._reset()
+        prepared = self._prepare(sql)
+        if isinstance(prepared.statement, ast.Select):
+            raise dbapi.ProgrammingError("executemany() can't run a SELECT")
+        if not isinstance(prepared.statement, ast.Insert):
+            statements = []
+            for params in seq_of_params:
+                args = self._args(params)
+                try:
+                    ast.bind(prepared, args)
+                except SQLSyntaxError as e:
+                    raise dbapi.ProgrammingError(str(e)) from None
+                statements.append(self._text(sql, prepared, args))
+            if statements:
+                self.connection.pipeline(statements)
+            return self
+        inserted = 0
+        batch = []
+        try:
+            for params in seq_of_params:
+                batch.append(self._args(params))
+                if len(batch) == dbapi.EXECUTEMANY_BATCH:
+                    inserted += self._insert_batch(prepared, batch)
+                    batch = []
+            if batch:
+                inserted += self._insert_batch(prepared, batch)
+        finally:
+            self.rowcount = inserted
+        return self
+
+    def _insert_batch(self, prepared, batch):
+        try:
+            statement = ast.bind_rows(prepared, batch)
+        except SQLSyntaxError as e:
+            raise dbapi.ProgrammingError(str(e)) from None
+        values = ", ".join("(" + ", ".join(map(sql_literal, row)) + ")" for row in statement.rows)
+        self.connection.run(f"INSERT INTO {statement.table} VALUES {values};")
+        return len(statement.rows)
+
+    def _text(self, sql, prepared, args):
+        if not prepared.params:
+            return sql
+        name = self.connection.prepared_name(sql)
+        return f"EXECUTE {name} ({', '.join(map(sql_literal, args))});"
+
+    def buffer(self):
+        if self.rows is not None:
+            rows = list(self.rows)
+            self.rows = (row for row in rows)
+
+    def _reset(self):
+        if self.connection.reading is self:
+            self.connection.reading = None
+        try:
+            super()._reset()
+        except OSError:
+            # Closed with rows still due on a connection that's since broken
+            self.connection._broken()
+
+
+def db_name_literal(name):
+    # Database names are plain words
+    if not name.replace("_", "").isalnum():
+        raise dbapi.InterfaceError(f"Invalid database name {name!r}")
+    return name
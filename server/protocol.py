@@ -0,0 +1,293 @@
+"""Framed binary protocol spoken by the MiniDB servers and client.
+
+A connection starts in text mode: the server sends its welcome line and
+reads semicolon-terminated commands, replying with one JSON line each. A
+client that sends STARTUP right after the welcome line switches the
+connection to framed messages instead. Every message is a type byte and
+a big-endian uint32 payload length, followed by the payload.
+
+Client messages:
+    Q  one SQL statement, UTF-8 (the semicolon is optional)
+    X  close the connection
+
+Server messages:
+    R  startup accepted; JSON settings
+    T  row description: uint16 column count, then per column a type byte
+       (I, F, T or B) and a uint16-length-prefixed UTF-8 name
+    D  a batch of rows, column by column (see BatchEncoder)
+    C  statement complete; the JSON result, without its rows. Ends every
+       statement's reply; a SELECT's is preceded by T and any D messages.
+"""
+import json
+import struct
+import sys
+from array import array
+from itertools import accumulate, islice
+
+# Text commands never start with a NUL byte
+MAGIC = b"\x00MDB"
+VERSION = 1
+STARTUP = MAGIC + struct.pack(">H", VERSION)
+
+HEADER = struct.Struct(">cI")
+QUERY = b"Q"
+TERMINATE = b"X"
+READY = b"R"
+ROW_DESCRIPTION = b"T"
+ROW_BATCH = b"D"
+COMPLETE = b"C"
+
+# Rows per D message, and how many bytes of replies a session collects
+# before handing them to the socket
+BATCH_ROWS = 1000
+FLUSH_SIZE = 256 * 1024
+MAX_MESSAGE = 64 * 1024 * 1024
+
+TYPE_CODES = {"INT": b"I", "FLOAT": b"F", "TEXT": b"T", "BOOL": b"B"}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+# Array typecodes of the fixed-width values; all are sent little-endian
+ARRAY_CODES = {"INT": "q", "FLOAT": "d"}
+UINT32 = "I" if array("I").itemsize == 4 else "L"
+SWAP = sys.byteorder == "big"
+COUNT = struct.Struct("<I")
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def frame(kind, payload=b""):
+    return HEADER.pack(kind, len(payload)) + payload
+
+
+def json_frame(kind, value):
+    return frame(kind, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+def _pack(code, values):
+    packed = array(code, values)
+    if SWAP:
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(code, data):
+    values = array(code)
+    values.frombytes(data)
+    if SWAP:
+        values.byteswap()
+    return values
+
+
+def encode_description(description):
+    parts = [struct.pack(">H", len(description))]
+    for name, col_type in description:
+        raw = name.encode("utf-8")
+        parts.append(TYPE_CODES.get(col_type, b"T") + struct.pack(">H", len(raw)) + raw)
+    return b"".join(parts)
+
+
+def decode_description(payload):
+    (count,) = struct.unpack_from(">H", payload)
+    pos = 2
+    description = []
+    for _ in range(count):
+        code = payload[pos:pos + 1]
+        (length,) = struct.unpack_from(">H", payload, pos + 1)
+        pos += 3
+        description.append((bytes(payload[pos:pos + length]).decode("utf-8"), TYPE_NAMES[bytes(code)]))
+        pos += length
+    return description
+
+
+class BatchEncoder:
+    """Packs rows (tuples in description order) into D message payloads for
+    one row description.
+
+    A batch is a uint32 row count followed by each column in turn: a flag
+    byte, then if the flag is set one byte per row marking the NULLs, then
+    the values. INT and FLOAT are int64 and float64, BOOL one byte, TEXT
+    the uint32 byte lengths followed by the UTF-8 strings back to back.
+    NULLs take the place of a 0 or an empty string.
+    """
+
+    def __init__(self, description):
+        self.names = [name for name, _ in description]
+        self.types = [col_type for _, col_type in description]
+
+    def columns(self, rows):
+        if not rows:
+            return [[] for _ in self.names]
+        return list(zip(*rows))
+
+    def encode(self, rows):
+        parts = [COUNT.pack(len(rows))]
+        for col_type, values in zip(self.types, self.columns(rows)):
+            if None in values:
+                parts.append(b"\x01")
+                parts.append(bytes([value is None for value in values]))
+                fill = "" if col_type == "TEXT" else 0
+                values = [fill if value is None else value for value in values]
+            else:
+                parts.append(b"\x00")
+
+            if col_type == "TEXT":
+                encoded = [str(value).encode("utf-8") for value in values]
+                parts.append(_pack(UINT32, map(len, encoded)))
+                parts.append(b"".join(encoded))
+            elif col_type == "BOOL":
+                parts.append(bytes(map(bool, values)))
+            else:
+                parts.append(_pack(ARRAY_CODES[col_type], values))
+        return b"".join(parts)
+
+
+def decode_batch(payload, types):
+    # Returns the batch's rows as tuples in description order
+    (count,) = COUNT.unpack_from(payload)
+    pos = COUNT.size
+    columns = []
+    for col_type in types:
+        nulls = None
+        if payload[pos]:
+            nulls = payload[pos + 1:pos + 1 + count]
+            pos += count
+        pos += 1
+
+        if col_type == "TEXT":
+            lengths = _unpack(UINT32, payload[pos:pos + 4 * count])
+            pos += 4 * count
+            ends = list(accumulate(lengths))
+            size = ends[-1] if ends else 0
+            blob = bytes(payload[pos:pos + size])
+            pos += size
+            starts = [0] + ends[:-1]
+            text = blob.decode("utf-8")
+            if len(text) == size:
+                # All ASCII: byte offsets are character offsets
+                values = [text[start:end] for start, end in zip(starts, ends)]
+            else:
+                values = [blob[start:end].decode("utf-8") for start, end in zip(starts, ends)]
+        elif col_type == "BOOL":
+            values = list(map(bool, payload[pos:pos + count]))
+            pos += count
+        else:
+            values = _unpack(ARRAY_CODES[col_type], payload[pos:pos + 8 * count]).tolist()
+            pos += 8 * count
+
+        if nulls is not None:
+            values = [None if null else value for value, null in zip(values, nulls)]
+        columns.append(values)
+    if not columns:
+        return [()] * count
+    return list(zip(*columns))
+
+
+class FrameBuffer:
+    """Bytes received on a connection and not yet consumed, kept in one
+    bytearray that is compacted in place rather than rebuilt per read."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.pos = 0
+        self.scanned = 0  # how far read_line() has looked for a newline
+
+    def feed(self, chunk):
+        if self.pos and self.pos * 2 >= len(self.data):
+            del self.data[:self.pos]
+            self.scanned -= self.pos
+            self.pos = 0
+        self.data += chunk
+
+    def __len__(self):
+        return len(self.data) - self.pos
+
+    def read_exact(self, size):
+        if len(self) < size:
+            return None
+        start = self.pos
+        self.pos += size
+        return bytes(self.data[start:self.pos])
+
+    def read_line(self):
+        # Returns the next line without its newline, or None if it hasn't
+        # all arrived
+        end = self.data.find(b"\n", max(self.pos, self.scanned))
+        if end < 0:
+            self.scanned = len(self.data)
+            return None
+        line = bytes(self.data[self.pos:end])
+        self.pos = self.scanned = end + 1
+        return line
+
+    def next_frame(self):
+        # Returns (type, payload) for the next complete message, or None
+        if len(self) < HEADER.size:
+            return None
+        kind, length = HEADER.unpack_from(self.data, self.pos)
+        if length > MAX_MESSAGE:
+            raise ProtocolError(f"Message of {length} bytes exceeds the {MAX_MESSAGE} byte limit")
+        end = self.pos + HEADER.size + length
+        if len(self.data) < end:
+            return None
+        payload = bytes(self.data[self.pos + HEADER.size:end])
+        self.pos = end
+        return kind, payload
+
+
+class BinarySession:
+    """Runs the statements of a framed connection on its Parser. Replies
+    are collected and passed to `send(bytes)` whenever FLUSH_SIZE bytes
+    have built up, so a large SELECT goes out batch by batch while it is
+    being read; take() returns whatever is left once a run is over."""
+
+    def __init__(self, parser, send, batch_rows=BATCH_ROWS):
+        self.parser = parser
+        self.parser.stream_rows = True
+        self.send = send
+        self.batch_rows = batch_rows
+        self.out = bytearray()
+
+    def ready(self):
+        return json_frame(READY, {"protocol": VERSION, "batch_rows": self.batch_rows})
+
+    def write(self, data):
+        self.out += data
+        if len(self.out) >= FLUSH_SIZE:
+            self.send(self.take())
+
+    def take(self):
+        data = bytes(self.out)
+        self.out.clear()
+        return data
+
+    def run(self, sql):
+        try:
+            result = self.parser.route(sql)
+        except Exception as e:
+            result = {"error": f"Server error: {e}"}
+        if isinstance(result, dict) and "columns" in result:
+            result = self.stream(result)
+        self.write(json_frame(COMPLETE, result))
+
+    def stream(self, result):
+        description = result.pop("columns")
+        rows = result.pop("data")
+        self.write(frame(ROW_DESCRIPTION, encode_description(description)))
+        encoder = BatchEncoder(description)
+        count = 0
+        try:
+            while True:
+                try:
+                    batch = list(islice(rows, self.batch_rows))
+                    payload = encoder.encode(batch) if batch else None
+                except Exception as e:
+                    return {"error": f"Server error: {e}", "rows": count}
+                if payload is None:
+                    break
+                self.write(frame(ROW_BATCH, payload))
+                count += len(batch)
+        finally:
+            rows.close()
+        result["rows"] = count
+        return result
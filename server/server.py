@@ -2,8 +2,12 @@ import socketserver
 import json
 import sys
 import os
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_core.catalog import Catalog
 from db_core.parser import Parser
+from db_core.sql_lexer import take_statements
+from server.protocol import (COMPLETE, QUERY, STARTUP, TERMINATE, BinarySession, FrameBuffer,
+                             ProtocolError, json_frame)
 HOST = "127.0.0.1"
 PORT = 5555
 
@@ -11,6 +15,12 @@ class MiniDBRequestHandler(socketserver.BaseRequestHandler):
     
         def handle(self):
             parser = Parser()
+            try:
+                self.serve(parser)
+            finally:
+                parser.close()
+
+        def serve(self, parser):
             conn = self.request
             conn.settimeout(None)
 
@@ -18,6 +28,7 @@ class MiniDBRequestHandler(socketserver.BaseRequestHandler):
             conn.sendall(welcome.encode("utf-8"))
 
             buffer = ""
+            first = True
             while True:
                 try:
                     data = conn.recv(4096)
@@ -27,16 +38,22 @@ class MiniDBRequestHandler(socketserver.BaseRequestHandler):
                 if not data:
                     break
 
-                buffer += data.decode("utf-8", errors="replace")
-
-                while ";" in buffer:
-                    idx = buffer.index(";")
-                    raw_cmd = buffer[:idx + 1].strip()
-                    buffer = buffer[idx + 1:]
-
-                    if not raw_cmd:
-                        continue
-
+                if first and data[:1] == STARTUP[:1]:
+                    try:
+                        self.handle_binary(parser, conn, data)
+                    except (ConnectionError, ProtocolError):
+                        pass
+                    return
+                first = False
+
+                chunk = data.decode("utf-8", errors="replace")
+                buffer += chunk
+                if ";" not in chunk:
+                    continue
+                # A ';' inside a quoted string doesn't end the statement
+                commands, buffer = take_statements(buffer)
+
+                for raw_cmd in commands:
                     cmd_lower = raw_cmd.lower()
                     if cmd_lower in ("exit;", "quit;"):
                         conn.sendall(b"Goodbye\n")
@@ -58,13 +75,51 @@ class MiniDBRequestHandler(socketserver.BaseRequestHandler):
                     except BrokenPipeError:
                         return
 
+        def handle_binary(self, parser, conn, data):
+            while len(data) < len(STARTUP):
+                more = conn.recv(4096)
+                if not more:
+                    return
+                data += more
+            if data[:len(STARTUP)] != STARTUP:
+                conn.sendall(json_frame(COMPLETE, {"error": "Unsupported protocol version"}))
+                return
+
+            session = BinarySession(parser, conn.sendall)
+            conn.sendall(session.ready())
+            frames = FrameBuffer()
+            frames.feed(data[len(STARTUP):])
+            while True:
+                message = frames.next_frame()
+                if message is None:
+                    # Everything received has been run; send the replies
+                    # before waiting for more
+                    pending = session.take()
+                    if pending:
+                        conn.sendall(pending)
+                    data = conn.recv(65536)
+                    if not data:
+                        return
+                    frames.feed(data)
+                    continue
+                kind, payload = message
+                if kind == TERMINATE:
+                    conn.sendall(session.take())
+                    return
+                if kind != QUERY:
+                    raise ProtocolError(f"Unexpected message type {kind!r}")
+                session.run(payload.decode("utf-8", errors="replace"))
+
 class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     allow_reuse_address = True
 
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        PORT = int(sys.argv[1])
     print(f"Starting MiniDB server on {HOST}:{PORT}")
+    Catalog.instance()  # load the catalog before the first connection
 
     with ThreadedTCPServer((HOST,PORT), MiniDBRequestHandler) as server: 
         try:
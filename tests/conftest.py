@@ -0,0 +1,42 @@
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The tests' databases are kept in a directory of the session's own, not in
+# data/. It must be set before db_core is imported, which reads it, and is
+# inherited by the processes the engine starts.
+DATA_DIR = tempfile.mkdtemp(prefix="tinydbx-tests-")
+os.environ["TINYDBX_DATA_DIR"] = DATA_DIR
+
+from db_core.db_manager import DBManager
+from db_core.parser import Parser
+from helpers import run
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def db_name():
+    # The engine's caches are process-wide, so each test gets a database
+    # of its own
+    name = f"t_{uuid.uuid4().hex[:12]}"
+    yield name
+    DBManager(name).delete_db()
+
+
+@pytest.fixture
+def session(db_name):
+    parser = Parser()
+    run(parser, f"CREATE DATABASE {db_name};")
+    run(parser, f"USE {db_name};")
+    yield parser
+    parser.close()
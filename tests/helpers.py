@@ -0,0 +1,80 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(parser, sql):
+    # The statement's result, which must not be an error
+    result = parser.route(sql)
+    assert "error" not in result, f"{sql} -> {result['error']}"
+    return result
+
+
+def rows(parser, sql):
+    return run(parser, sql)["data"]
+
+
+def insert_range(parser, table, count, make, batch=1000):
+    # Inserts make(i) for i in range(count), `batch` rows per INSERT
+    for start in range(0, count, batch):
+        values = ", ".join(make(i) for i in range(start, min(count, start + batch)))
+        run(parser, f"INSERT INTO {table} VALUES {values};")
+
+
+def in_new_process(db_name, sql):
+    # The result of `sql` run by a fresh process, which has nothing cached
+    # and reads the table from its files and WAL, as after a restart
+    script = ("import json, sys\n"
+              "from db_core.parser import Parser\n"
+              "parser = Parser()\n"
+              "parser.route('USE ' + sys.argv[1] + ';')\n"
+              "print(json.dumps(parser.route(sys.argv[2])))\n")
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    out = subprocess.run([sys.executable, "-c", script, db_name, sql], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+@contextmanager
+def threaded_server():
+    # (host, port) of a server.server server running on a thread
+    from server.server import MiniDBRequestHandler, ThreadedTCPServer
+    tcp = ThreadedTCPServer(("127.0.0.1", 0), MiniDBRequestHandler)
+    thread = threading.Thread(target=tcp.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield tcp.server_address
+    finally:
+        tcp.shutdown()
+        tcp.server_close()
+
+
+@contextmanager
+def async_server():
+    # (host, port) of a server.async_server server, its loop on a thread
+    from server.async_server import MiniDBProtocol
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=4)
+
+    async def on_connect(reader, writer):
+        await MiniDBProtocol(executor).handle(reader, writer)
+
+    tcp = loop.run_until_complete(asyncio.start_server(on_connect, "127.0.0.1", 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield tcp.sockets[0].getsockname()[:2]
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        tcp.close()
+        loop.run_until_complete(tcp.wait_closed())
+        loop.close()
+        executor.shutdown()
@@ -0,0 +1,68 @@
+import random
+
+import pytest
+
+from db_core import aggregate_manager
+from db_core.aggregate_manager import aggregate_rows
+from db_core.where_clause import Aggregate
+from helpers import insert_range, rows, run
+
+TYPES = {"id": "INT", "g": "TEXT", "v": "FLOAT", "b": "BOOL"}
+AGGREGATES = [Aggregate("COUNT(*)", "COUNT", None), Aggregate("COUNT(v)", "COUNT", "v"),
+              Aggregate("SUM(v)", "SUM", "v"), Aggregate("AVG(id)", "AVG", "id"),
+              Aggregate("MIN(v)", "MIN", "v"), Aggregate("MAX(id)", "MAX", "id"), Aggregate("SUM(b)", "SUM", "b")]
+
+
+@pytest.fixture
+def table(session):
+    run(session, "CREATE TABLE t (id INT, g TEXT, v FLOAT);")
+    run(session, "INSERT INTO t VALUES (1, 'a', 1.5), (2, 'a', NULL), (3, 'b', 4), (4, NULL, 2);")
+    return session
+
+
+def test_group_by(table):
+    assert rows(table, "SELECT g, COUNT(*), COUNT(v), SUM(v), AVG(v), MIN(v), MAX(id) FROM t GROUP BY g;") == [
+        {"g": "a", "COUNT(*)": 2, "COUNT(v)": 1, "SUM(v)": 1.5, "AVG(v)": 1.5, "MIN(v)": 1.5, "MAX(id)": 2},
+        {"g": "b", "COUNT(*)": 1, "COUNT(v)": 1, "SUM(v)": 4.0, "AVG(v)": 4.0, "MIN(v)": 4.0, "MAX(id)": 3},
+        {"g": None, "COUNT(*)": 1, "COUNT(v)": 1, "SUM(v)": 2.0, "AVG(v)": 2.0, "MIN(v)": 2.0, "MAX(id)": 4}]
+
+
+def test_where_having_and_empty_input(table):
+    assert rows(table, "SELECT COUNT(*), SUM(id) FROM t WHERE id > 1;") == [{"COUNT(*)": 3, "SUM(id)": 9}]
+    assert rows(table, "SELECT g, COUNT(*) FROM t GROUP BY g HAVING COUNT(*) > 1;") == [{"g": "a", "COUNT(*)": 2}]
+    assert rows(table, "SELECT COUNT(*), SUM(v) FROM t WHERE id > 100;") == [{"COUNT(*)": 0, "SUM(v)": None}]
+
+
+def test_aggregates_over_wal_and_pages(table):
+    insert_range(table, "t", 5000, lambda i: f"({i + 10}, 'g{i % 3}', {i})")
+    run(table, "CHECKPOINT t;")
+    run(table, "UPDATE t SET v = 0 WHERE g = 'g0';")
+    run(table, "DELETE FROM t WHERE g = 'g1';")
+    result = rows(table, "SELECT g, COUNT(*), SUM(v) FROM t WHERE id >= 10 GROUP BY g;")
+    assert result == [{"g": "g0", "COUNT(*)": 1667, "SUM(v)": 0.0},
+                      {"g": "g2", "COUNT(*)": 1666, "SUM(v)": float(sum(range(2, 5000, 3)))}]
+
+
+@pytest.mark.parametrize("sql, error", [
+    ("SELECT g, id FROM t GROUP BY g;", "Column 'id' must appear in GROUP BY or be used in an aggregate"),
+    ("SELECT SUM(g) FROM t;", "Cannot take SUM of TEXT column 'g'"),
+    ("SELECT SUM(nope) FROM t;", "Column 'nope' does not exist"),
+    ("SELECT g FROM t GROUP BY nope;", "Column 'nope' does not exist"),
+])
+def test_errors(table, sql, error):
+    assert table.route(sql) == {"error": error}
+
+
+@pytest.mark.skipif(aggregate_manager.np is None, reason="numpy is not installed")
+@pytest.mark.parametrize("group_by", [[], ["g"], ["g", "b"]])
+def test_paths_agree(group_by, monkeypatch):
+    # The vectorized path gives the groups the row-at-a-time one does
+    monkeypatch.setattr(aggregate_manager, "BATCH_ROWS", 100)
+    generator = random.Random(7)
+    data = [(i, generator.choice(["x", "y", None]), generator.choice([None, generator.uniform(-5, 5)]),
+             generator.choice([True, False, None])) for i in range(1000)]
+    expected = aggregate_rows(iter(data), group_by, AGGREGATES, TYPES, vectorized=False)
+    result = aggregate_rows(iter(data), group_by, AGGREGATES, TYPES, vectorized=True)
+    assert len(result) == len(expected)
+    for row, expected_row in zip(result, expected):
+        assert row == pytest.approx(expected_row)
@@ -0,0 +1,121 @@
+import pytest
+
+from db_core.buffer_pool import PAGE_SIZE, BufferPool
+from helpers import in_new_process, insert_range, rows, run
+
+
+def write_pages(path, count):
+    with open(path, "wb") as f:
+        for i in range(count):
+            f.write(bytes([i]) * PAGE_SIZE)
+
+
+def test_lru_eviction_writes_back_dirty_pages(tmp_path):
+    path = tmp_path / "f"
+    write_pages(path, 20)
+    pool = BufferPool(max_bytes=8 * PAGE_SIZE)
+    with pool.page(path, 0, dirty=True) as page:
+        page[0] = 0xFF
+    for page_no in range(1, 20):
+        with pool.page(path, page_no) as page:
+            assert page[0] == page_no
+    assert pool.stats()["cached_pages"] == 8
+    assert pool.stats()["evictions"] == 12
+    assert path.read_bytes()[0] == 0xFF
+    with pool.page(path, 19):
+        pass
+    assert pool.stats()["hits"] == 1
+    pool.close()
+
+
+def test_pinned_pages_are_not_evicted(tmp_path):
+    path = tmp_path / "f"
+    write_pages(path, 20)
+    pool = BufferPool(max_bytes=8 * PAGE_SIZE)
+    pool.pin(path, 0)
+    for page_no in range(1, 20):
+        with pool.page(path, page_no):
+            pass
+    assert (str(path), 0) in pool.frames
+    pool.unpin(path, 0)
+    pool.close()
+
+
+def test_held_pages_wait_for_a_flush(tmp_path):
+    path = tmp_path / "f"
+    write_pages(path, 20)
+    pool = BufferPool(max_bytes=8 * PAGE_SIZE)
+    with pool.hold(tmp_path):
+        with pool.page(path, 0, dirty=True) as page:
+            page[0] = 0xFF
+        for page_no in range(1, 20):
+            with pool.page(path, page_no):
+                pass
+        assert path.read_bytes()[0] == 0
+        pool.flush_file(path)
+    assert path.read_bytes()[0] == 0xFF
+    pool.close()
+
+
+def test_held_pages_are_spilled_within_budget(tmp_path):
+    path = tmp_path / "f"
+    write_pages(path, 20)
+    pool = BufferPool(max_bytes=8 * PAGE_SIZE)
+    with pool.hold(tmp_path):
+        for page_no in range(20):
+            with pool.page(path, page_no, dirty=True) as page:
+                page[1] = 0xFF
+        assert len(pool.frames) == 8 and pool.stats()["pages_spilled"] == 12
+        assert path.read_bytes()[1] == 0 and (tmp_path / "pages.spill").exists()
+        # Read back from the spill file, still to be written
+        with pool.page(path, 0) as page:
+            assert page[1] == 0xFF
+        pool.flush_file(path)
+        assert all(path.read_bytes()[i * PAGE_SIZE + 1] == 0xFF for i in range(20))
+    assert not (tmp_path / "pages.spill").exists()
+    pool.close()
+
+
+def test_discarded_spilled_pages_are_not_written(tmp_path):
+    path = tmp_path / "f"
+    write_pages(path, 20)
+    pool = BufferPool(max_bytes=8 * PAGE_SIZE)
+    with pool.hold(tmp_path):
+        for page_no in range(20):
+            with pool.page(path, page_no, dirty=True) as page:
+                page[1] = 0xFF
+        pool.discard_file(path)
+    assert not pool.spilled and not (tmp_path / "pages.spill").exists()
+    assert path.read_bytes()[1::PAGE_SIZE] == bytes(range(20))
+    pool.close()
+
+
+@pytest.fixture
+def small_pool():
+    pool = BufferPool.instance()
+    budget = pool.max_pages * pool.page_size
+    pool.configure(64 * PAGE_SIZE)
+    yield pool
+    pool.configure(budget)
+
+
+def test_scan_stays_within_budget(session, small_pool):
+    run(session, "CREATE TABLE t (id INT, name TEXT);")
+    insert_range(session, "t", 30000, lambda i: f"({i}, 'name {i}')", batch=3000)
+    run(session, "CHECKPOINT t;")
+    assert len(rows(session, "SELECT * FROM t NOCACHE;")) == 30000
+    assert rows(session, "SELECT name FROM t WHERE id = 29999 NOCACHE;") == [{"name": "name 29999"}]
+    stats = small_pool.stats()
+    assert stats["cached_pages"] <= 64 and stats["evictions"] > 0
+
+
+def test_large_fold_stays_within_budget(session, db_name, small_pool):
+    run(session, "CREATE TABLE t (id INT, v INT, name TEXT);")
+    insert_range(session, "t", 30000, lambda i: f"({i}, 0, 'name {i}')", batch=3000)
+    run(session, "CHECKPOINT t;")
+    run(session, "UPDATE t SET v = 1 WHERE id >= 0;")
+    run(session, "CHECKPOINT t;")
+    stats = small_pool.stats()
+    assert stats["cached_pages"] <= 64 and stats["pages_spilled"] > 0
+    assert rows(session, "SELECT COUNT(*) FROM t WHERE v = 1 NOCACHE;") == [{"COUNT(*)": 30000}]
+    assert in_new_process(db_name, "SELECT COUNT(*) FROM t WHERE v = 1;")["data"] == [{"COUNT(*)": 30000}]
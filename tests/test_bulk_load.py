@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from db_core import copy_manager
+from helpers import rows, run
+
+
+@pytest.fixture
+def table(session):
+    run(session, "CREATE TABLE t (id INT PRIMARY KEY, name TEXT, score FLOAT);")
+    return session
+
+
+def test_multi_row_insert(table):
+    result = run(table, "INSERT INTO t VALUES (1, 'a', 1.5), (2, NULL, 2), (3, 'c,d', NULL);")
+    assert result["rows"] == 3
+    assert rows(table, "SELECT * FROM t;") == [{"id": 1, "name": "a", "score": 1.5},
+                                               {"id": 2, "name": None, "score": 2.0},
+                                               {"id": 3, "name": "c,d", "score": None}]
+
+
+def test_multi_row_insert_is_all_or_nothing(table):
+    result = table.route("INSERT INTO t VALUES (1, 'a', 1.0), (2, 'b', 'x');")
+    assert "error" in result
+    assert rows(table, "SELECT * FROM t;") == []
+
+
+def test_copy_csv_with_header(table, tmp_path):
+    path = tmp_path / "rows.csv"
+    path.write_text('score,id,name\n1.5,1,"a, b"\n,2,\n')
+    assert run(table, f"COPY t FROM '{path}' WITH HEADER;")["rows"] == 2
+    assert rows(table, "SELECT * FROM t;") == [{"id": 1, "name": "a, b", "score": 1.5},
+                                               {"id": 2, "name": None, "score": None}]
+
+
+def test_copy_jsonl(table, tmp_path):
+    path = tmp_path / "rows.jsonl"
+    path.write_text(json.dumps({"id": 1, "name": "a"}) + "\n\n" + json.dumps([2, "b", 0.5]) + "\n")
+    assert run(table, f"COPY t FROM '{path}';")["rows"] == 2
+    assert rows(table, "SELECT * FROM t;") == [{"id": 1, "name": "a", "score": None},
+                                               {"id": 2, "name": "b", "score": 0.5}]
+
+
+def test_copy_in_batches(table, tmp_path, monkeypatch):
+    # A bad row stops the load; the batches before it stay
+    monkeypatch.setattr(copy_manager, "BATCH_SIZE", 10)
+    path = tmp_path / "rows.csv"
+    path.write_text("".join(f"{i},n{i},{i}\n" for i in range(25)) + "25,bad,x\n")
+    result = table.route(f"COPY t FROM '{path}' FORMAT CSV;")
+    assert result["rows"] == 20 and "20 rows were loaded before the error" in result["error"]
+    assert len(rows(table, "SELECT id FROM t;")) == 20
+
+
+def test_copy_errors(table, tmp_path):
+    path = tmp_path / "rows.csv"
+    path.write_text("nope,id\n1,2\n")
+    assert table.route(f"COPY t FROM '{path}' HEADER;") == {
+        "error": "Invalid CSV input: Column 'nope' does not exist"}
+    assert table.route(f"COPY t FROM '{tmp_path / 'missing.csv'}';")["error"].startswith("Cannot read")
@@ -0,0 +1,55 @@
+import pytest
+
+from db_core.catalog import DATA_DIR, Catalog
+from db_core.db_manager import DBManager
+from db_core.parser import Parser
+from helpers import in_new_process, rows, run
+
+
+def test_ddl_keeps_the_catalog_current(session, db_name):
+    catalog = Catalog.instance()
+    assert catalog.database_exists(db_name) and catalog.tables(db_name) == []
+    run(session, "CREATE TABLE t (id INT PRIMARY KEY, name TEXT);")
+    run(session, "CREATE TABLE p (id INT) PARTITION BY HASH (id) PARTITIONS 2;")
+    assert catalog.tables(db_name) == ["p", "t"]
+    info = catalog.table(db_name, "t")
+    assert (info.columns, info.column_types, info.primary_key) == (
+        ["id", "name"], {"id": "INT", "name": "TEXT"}, "id")
+    DBManager(db_name).delete_db()
+    assert not catalog.database_exists(db_name) and not catalog.table_exists(db_name, "t")
+
+
+def test_statements_read_schemas_from_the_catalog(session, db_name):
+    run(session, "CREATE TABLE t (id INT, name TEXT);")
+    schema = DATA_DIR / db_name / "t" / "schema.json"
+    saved = schema.read_text()
+    schema.unlink()
+    run(session, "INSERT INTO t VALUES (1, 'a');")
+    assert rows(session, "SELECT name FROM t WHERE id = 1;") == [{"name": "a"}]
+
+    # reload() sees what's on disk: a table whose schema can't be read is
+    # listed, and read again on each use until it can be
+    catalog = Catalog.instance()
+    catalog.reload()
+    assert catalog.table_exists(db_name, "t")
+    with pytest.raises(FileNotFoundError):
+        catalog.table(db_name, "t")
+    schema.write_text(saved)
+    assert catalog.table(db_name, "t").columns == ["id", "name"]
+
+
+def test_what_another_process_creates_is_found(db_name):
+    # The catalog is loaded before the database exists; another process
+    # then creates it and a table
+    catalog = Catalog.instance()
+    assert not catalog.database_exists(db_name)
+    in_new_process(db_name, f"CREATE DATABASE {db_name};")
+    in_new_process(db_name, "CREATE TABLE t (id INT, name TEXT);")
+    parser = Parser()
+    try:
+        assert run(parser, f"USE {db_name};")["success"]
+        run(parser, "INSERT INTO t VALUES (1, 'a');")
+        assert rows(parser, "SELECT name FROM t;") == [{"name": "a"}]
+        assert "already exists" in parser.route("CREATE TABLE t (id INT);")["error"]
+    finally:
+        parser.close()
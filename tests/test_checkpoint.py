@@ -0,0 +1,75 @@
+import pytest
+
+from db_core.storage_manager import TableStorage
+from db_core.wal_manager import WALManager
+from helpers import in_new_process, insert_range, rows, run
+
+EXPECTED = [{"id": i, "v": i * 10 if i % 3 else -1} for i in range(300) if i % 7]
+
+
+@pytest.fixture
+def table(session):
+    run(session, "CREATE TABLE t (id INT PRIMARY KEY, v INT);")
+    insert_range(session, "t", 300, lambda i: f"({i}, {i * 10})", batch=100)
+    run(session, "UPDATE t SET v = -1 WHERE id IN (" + ", ".join(str(i) for i in range(0, 300, 3)) + ");")
+    run(session, "DELETE FROM t WHERE id IN (" + ", ".join(str(i) for i in range(0, 300, 7)) + ");")
+    return session
+
+
+def table_rows(parser):
+    return rows(parser, "SELECT * FROM t NOCACHE;")
+
+
+def test_checkpoint_folds_wal(table, db_name):
+    assert table_rows(table) == EXPECTED
+    run(table, "CHECKPOINT t;")
+    assert WALManager(db_name, "t").size() == 0
+    assert table_rows(table) == EXPECTED
+    assert run(table, "CHECKPOINT t;")["success"].startswith("Checkpoint complete")
+
+
+def test_recovery_replays_wal(table, db_name):
+    assert in_new_process(db_name, "SELECT * FROM t;")["data"] == EXPECTED
+    run(table, "CHECKPOINT t;")
+    run(table, "INSERT INTO t VALUES (1000, 1);")
+    run(table, "DELETE FROM t WHERE id = 1;")
+    expected = [row for row in EXPECTED if row["id"] != 1] + [{"id": 1000, "v": 1}]
+    assert in_new_process(db_name, "SELECT * FROM t;")["data"] == expected
+
+
+def test_replay_skips_records_already_folded(table, db_name, monkeypatch):
+    # The pages are flushed but the WAL isn't swapped: its records must
+    # not be applied a second time, here or after a restart
+    def fail(self, offset):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(WALManager, "rotate", fail)
+    result = table.route("CHECKPOINT t;")
+    assert "disk full" in result["details"]["t"]
+    assert table_rows(table) == EXPECTED
+    assert in_new_process(db_name, "SELECT * FROM t;")["data"] == EXPECTED
+    row = rows(table, "SHOW STATS;")[0]
+    assert row["checkpoint_failures"] == 1 and "disk full" in row["checkpoint_error"]
+
+    monkeypatch.undo()
+    run(table, "CHECKPOINT t;")
+    assert WALManager(db_name, "t").size() == 0
+    assert table_rows(table) == EXPECTED
+    assert in_new_process(db_name, "SELECT * FROM t;")["data"] == EXPECTED
+    assert rows(table, "SHOW STATS;")[0]["checkpoint_error"] is None
+
+
+def test_failed_fold_leaves_table_unchanged(table, db_name, monkeypatch):
+    storage = TableStorage.for_table(db_name, "t")
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(storage, "flush", fail)
+    assert "error" in table.route("CHECKPOINT t;")
+    assert table_rows(table) == EXPECTED
+
+    monkeypatch.undo()
+    run(table, "CHECKPOINT t;")
+    assert table_rows(table) == EXPECTED
+    assert in_new_process(db_name, "SELECT * FROM t;")["data"] == EXPECTED
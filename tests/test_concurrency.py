@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+
+from db_core.parser import Parser
+from db_core.wal_manager import RWLock, WALManager
+from helpers import insert_range, rows, run
+
+
+def test_rwlock_readers_share_writers_wait():
+    lock = RWLock()
+    lock.acquire_read()
+    lock.acquire_read()
+    assert not lock.acquire_write(timeout=0.01)
+    lock.release_read()
+    lock.release_read()
+    assert lock.acquire_write(timeout=0.01)
+    entered = threading.Event()
+
+    def read():
+        with lock.read():
+            entered.set()
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    assert not entered.wait(0.05)
+    lock.release_write()
+    reader.join()
+    assert entered.is_set()
+
+
+@pytest.fixture
+def table(session):
+    run(session, "CREATE TABLE t (id INT PRIMARY KEY, v INT);")
+    insert_range(session, "t", 2000, lambda i: f"({i}, 0)")
+    run(session, "CHECKPOINT t;")
+    return session
+
+
+def test_open_stream_is_a_snapshot(table):
+    # Rows written while a stream is open are not in it
+    table.stream_rows = True
+    result = run(table, "SELECT id FROM t;")
+    first = next(result["data"])
+    other = Parser()
+    run(other, f"USE {table.active_db};")
+    run(other, "INSERT INTO t VALUES (5000, 1);")
+    run(other, "DELETE FROM t WHERE id = 1999;")
+    assert [first, *result["data"]] == [(i,) for i in range(2000)]
+    table.stream_rows = False
+    assert len(rows(table, "SELECT id FROM t;")) == 2000
+
+
+def test_writes_go_on_while_a_table_is_read(table, db_name):
+    # Readers hold the table's read lock, which no INSERT waits on
+    with WALManager.rw_lock(db_name, "t").read():
+        done = threading.Event()
+
+        def write():
+            parser = Parser()
+            run(parser, f"USE {db_name};")
+            run(parser, "INSERT INTO t VALUES (5000, 1);")
+            done.set()
+
+        threading.Thread(target=write).start()
+        assert done.wait(5)
+
+
+def test_concurrent_sessions(table, db_name):
+    errors = []
+
+    def write(number):
+        parser = Parser()
+        run(parser, f"USE {db_name};")
+        for i in range(50):
+            run(parser, f"INSERT INTO t VALUES ({10000 + number * 100 + i}, {number});")
+        run(parser, f"UPDATE t SET v = -1 WHERE v = {number};")
+
+    def read():
+        parser = Parser()
+        run(parser, f"USE {db_name};")
+        for _ in range(20):
+            count = rows(parser, "SELECT COUNT(*) FROM t NOCACHE;")[0]["COUNT(*)"]
+            if not 2000 <= count <= 2200:
+                errors.append(count)
+
+    def checkpoint():
+        parser = Parser()
+        run(parser, f"USE {db_name};")
+        for _ in range(5):
+            run(parser, "CHECKPOINT t;")
+
+    threads = [threading.Thread(target=write, args=(number,)) for number in range(1, 5)]
+    threads += [threading.Thread(target=read) for _ in range(2)] + [threading.Thread(target=checkpoint)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert rows(table, "SELECT COUNT(*) FROM t WHERE v = -1;") == [{"COUNT(*)": 200}]
+    run(table, "CHECKPOINT t;")
+    assert rows(table, "SELECT COUNT(*) FROM t NOCACHE;") == [{"COUNT(*)": 2200}]
@@ -0,0 +1,50 @@
+import pytest
+
+from db_core.stats import Stats
+from helpers import insert_range, rows, run
+
+COUNT = 20000
+
+
+def scanned(db_name, table):
+    return Stats.instance().table(db_name, table)["rows_scanned"]
+
+
+@pytest.fixture
+def table(session):
+    run(session, "CREATE TABLE t (id INT, v INT);")
+    insert_range(session, "t", COUNT, lambda i: f"({i}, {i % 10})", batch=2000)
+    run(session, "CHECKPOINT t;")
+    return session
+
+
+def test_fetch_reads_only_what_it_returns(table, db_name):
+    run(table, "DECLARE c CURSOR FOR SELECT * FROM t;")
+    assert rows(table, "FETCH 5 FROM c;") == [{"id": i, "v": i} for i in range(5)]
+    assert rows(table, "FETCH 3 FROM c;") == [{"id": i, "v": i} for i in range(5, 8)]
+    run(table, "CLOSE c;")
+    assert 8 <= scanned(db_name, "t") < COUNT // 10
+
+
+def test_fetch_all_and_close(table):
+    run(table, "DECLARE c CURSOR FOR SELECT id FROM t WHERE id >= 19990;")
+    assert rows(table, "FETCH 4 FROM c;") == [{"id": i} for i in range(19990, 19994)]
+    assert rows(table, "FETCH ALL FROM c;") == [{"id": i} for i in range(19994, 20000)]
+    assert rows(table, "FETCH 1 FROM c;") == []
+    run(table, "CLOSE c;")
+    assert table.route("FETCH 1 FROM c;")["error"] == "Cursor 'c' does not exist."
+
+
+def test_limit_stops_the_scan(table, db_name):
+    assert rows(table, "SELECT id FROM t LIMIT 3 OFFSET 10;") == [{"id": 10}, {"id": 11}, {"id": 12}]
+    assert scanned(db_name, "t") < COUNT // 10
+    assert rows(table, "SELECT id FROM t WHERE v = 9 LIMIT 2 OFFSET 1;") == [{"id": 19}, {"id": 29}]
+
+
+def test_cursor_holds_back_checkpoints_until_closed(table):
+    run(table, "DECLARE c CURSOR FOR SELECT * FROM t;")
+    rows(table, "FETCH 1 FROM c;")
+    run(table, "INSERT INTO t VALUES (-1, -1);")
+    assert run(table, "CHECKPOINT t;")["deferred"] == ["t"]
+    run(table, "CLOSE c;")
+    assert "deferred" not in run(table, "CHECKPOINT t;")
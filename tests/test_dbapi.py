@@ -0,0 +1,68 @@
+import pytest
+
+from db_core import dbapi
+
+
+@pytest.fixture
+def conn(db_name):
+    with dbapi.connect(db_name) as conn:
+        conn.execute("CREATE TABLE items (id INT PRIMARY KEY, name TEXT, price FLOAT, stocked BOOL);")
+        yield conn
+
+
+def test_typed_rows_and_description(conn):
+    cur = conn.cursor()
+    cur.executemany("INSERT INTO items VALUES (?, ?, ?, ?);", [(1, "pen", 1.5, True), (2, "ink", 4, None)])
+    assert cur.rowcount == 2
+    cur.execute("SELECT name, price, stocked FROM items WHERE price > ?;", (1,))
+    assert [column[:2] for column in cur.description] == [("name", "TEXT"), ("price", "FLOAT"), ("stocked", "BOOL")]
+    assert cur.description[1][1] == dbapi.NUMBER and cur.description[0][1] == dbapi.STRING
+    assert cur.fetchone() == ("pen", 1.5, True)
+    assert cur.fetchall() == [("ink", 4.0, None)]
+    assert cur.fetchone() is None
+
+
+def test_executemany_in_batches(conn, monkeypatch):
+    monkeypatch.setattr(dbapi, "EXECUTEMANY_BATCH", 100)
+    cur = conn.executemany("INSERT INTO items VALUES (?, ?, ?, ?);", ((i, f"n{i}", i / 2, i % 2 == 0)
+                                                                    for i in range(250)))
+    assert cur.rowcount == 250
+    cur.execute("SELECT id FROM items WHERE stocked = ?;", (True,))
+    cur.arraysize = 10
+    assert cur.fetchmany() == [(i,) for i in range(0, 20, 2)]
+    assert len(list(cur)) == 115
+
+
+def test_errors(conn):
+    conn.execute("INSERT INTO items VALUES (?, ?, ?, ?);", (1, "pen", 1.5, True))
+    with pytest.raises(dbapi.IntegrityError):
+        conn.execute("INSERT INTO items VALUES (?, ?, ?, ?);", (1, "again", 1.0, False))
+    with pytest.raises(dbapi.ProgrammingError):
+        conn.execute("SELECT * FROM nope;")
+    with pytest.raises(dbapi.ProgrammingError):
+        conn.execute("SELECT * FROM items WHERE id = ?;", (1, 2))
+    with pytest.raises(dbapi.ProgrammingError):
+        conn.executemany("SELECT * FROM items;", [()])
+    with pytest.raises(dbapi.NotSupportedError):
+        conn.rollback()
+    cur = conn.execute("UPDATE items SET price = ? WHERE id = ?;", (2.0, 1))
+    with pytest.raises(dbapi.ProgrammingError):
+        cur.fetchall()
+
+
+def test_unread_rows_release_the_table(conn):
+    conn.executemany("INSERT INTO items VALUES (?, ?, ?, ?);", [(i, "x", 1.0, True) for i in range(10)])
+    cur = conn.execute("SELECT * FROM items;")
+    cur.fetchone()
+    cur.close()
+    assert "deferred" not in conn.parser.route("CHECKPOINT items;")
+    with pytest.raises(dbapi.InterfaceError):
+        cur.fetchone()
+    conn.close()
+    with pytest.raises(dbapi.InterfaceError):
+        conn.cursor()
+
+
+def test_connect_without_create(db_name):
+    with pytest.raises(dbapi.OperationalError):
+        dbapi.connect(db_name, create=False)
@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+from db_core import wal_manager
+from db_core.catalog import DATA_DIR
+from db_core.parser import Parser
+from db_core.wal_manager import WALWriter
+from helpers import in_new_process, rows, run
+
+THREADS = 8
+PER_THREAD = 25
+
+
+@pytest.fixture
+def durability(monkeypatch):
+    # Sets the mode for the test; the class attributes are put back after
+    def configure(mode, commit_delay=0.0):
+        for name in ("durability", "commit_delay", "batch_size"):
+            monkeypatch.setattr(WALWriter, name, getattr(WALWriter, name))
+        WALWriter.configure(durability=mode, commit_delay=commit_delay)
+    return configure
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    calls = []
+    fsync = wal_manager.os.fsync
+
+    def counting(fd):
+        calls.append(fd)
+        fsync(fd)
+
+    monkeypatch.setattr(wal_manager.os, "fsync", counting)
+    return calls
+
+
+def insert_concurrently(db_name):
+    def work(number):
+        parser = Parser()
+        run(parser, f"USE {db_name};")
+        for i in range(PER_THREAD):
+            run(parser, f"INSERT INTO t VALUES ({number * PER_THREAD + i});")
+
+    threads = [threading.Thread(target=work, args=(number,)) for number in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+@pytest.fixture
+def table(session):
+    run(session, "CREATE TABLE t (id INT PRIMARY KEY);")
+    return session
+
+
+def ids(parser):
+    return sorted(row["id"] for row in rows(parser, "SELECT id FROM t NOCACHE;"))
+
+
+def test_group_commit_shares_fsyncs(table, db_name, durability):
+    durability("group", commit_delay=0.005)
+    writer = WALWriter.for_table(db_name, "t")
+    before = writer.commits
+    insert_concurrently(db_name)
+    assert ids(table) == list(range(THREADS * PER_THREAD))
+    assert writer.commits - before < THREADS * PER_THREAD
+    assert writer.durable == writer.lsn
+
+
+@pytest.mark.parametrize("mode", ["statement", "off"])
+def test_other_modes(table, db_name, durability, fsyncs, mode):
+    durability(mode)
+    for i in range(5):
+        run(table, f"INSERT INTO t VALUES ({i});")
+    assert len(fsyncs) == (5 if mode == "statement" else 0)
+    assert ids(table) == list(range(5))
+    assert in_new_process(db_name, "SELECT COUNT(*) FROM t;")["data"] == [{"COUNT(*)": 5}]
+
+
+def test_torn_record_is_cut_off(table, db_name):
+    # A record half written by a crash is dropped, and the next one starts
+    # on a line of its own
+    run(table, "INSERT INTO t VALUES (1);")
+    WALWriter.for_table(db_name, "t").close()
+    with open(DATA_DIR / db_name / "t" / "log.wal", "ab") as f:
+        f.write(b'{"operation": "insert", "da')
+    assert "success" in in_new_process(db_name, "INSERT INTO t VALUES (2);")
+    assert in_new_process(db_name, "SELECT id FROM t;")["data"] == [{"id": 1}, {"id": 2}]
@@ -0,0 +1,46 @@
+import pytest
+
+from helpers import rows, run
+
+
+@pytest.fixture
+def joined(session):
+    run(session, "CREATE TABLE c (id INT PRIMARY KEY, name TEXT);")
+    run(session, "CREATE TABLE o (id INT PRIMARY KEY, cid INT, amount FLOAT);")
+    run(session, "INSERT INTO c VALUES (1, 'ann'), (2, 'bob'), (3, 'cy');")
+    run(session, "INSERT INTO o VALUES (10, 1, 5.0), (11, 1, 7.5), (12, 3, 1.0), (13, 9, 2.0);")
+    return session
+
+
+def test_inner_join(joined):
+    assert rows(joined, "SELECT o.id, c.name FROM o JOIN c ON o.cid = c.id;") == [
+        {"o.id": 10, "c.name": "ann"}, {"o.id": 11, "c.name": "ann"}, {"o.id": 12, "c.name": "cy"}]
+
+
+def test_join_aliases_and_where(joined):
+    result = rows(joined, "SELECT x.id, y.name FROM o AS x INNER JOIN c y ON y.id = x.cid "
+                          "WHERE x.amount > 2 AND y.name LIKE 'a%';")
+    assert result == [{"x.id": 10, "y.name": "ann"}, {"x.id": 11, "y.name": "ann"}]
+
+
+def test_left_join(joined):
+    result = rows(joined, "SELECT c.name, o.id FROM c LEFT OUTER JOIN o ON c.id = o.cid;")
+    assert sorted(result, key=lambda row: (row["c.name"], row["o.id"] or 0)) == [
+        {"c.name": "ann", "o.id": 10}, {"c.name": "ann", "o.id": 11},
+        {"c.name": "bob", "o.id": None}, {"c.name": "cy", "o.id": 12}]
+    assert rows(joined, "SELECT c.name FROM c LEFT JOIN o ON c.id = o.cid WHERE o.id IS NULL;") == [
+        {"c.name": "bob"}]
+
+
+def test_join_star_limit(joined):
+    result = rows(joined, "SELECT * FROM o JOIN c ON o.cid = c.id WHERE c.id = 1 LIMIT 1 OFFSET 1;")
+    assert result == [{"o.id": 11, "o.cid": 1, "o.amount": 7.5, "c.id": 1, "c.name": "ann"}]
+
+
+@pytest.mark.parametrize("sql, error", [
+    ("SELECT o.id FROM o JOIN c;", "Syntax error: Expected ON but the statement ended"),
+    ("SELECT c.id FROM o x;", "Column 'c.id' does not exist"),
+    ("SELECT o.id FROM o JOIN c ON o.cid = c.nope;", "Column 'c.nope' of the ON condition does not exist"),
+])
+def test_join_errors(joined, sql, error):
+    assert joined.route(sql) == {"error": error}
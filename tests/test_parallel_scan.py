@@ -0,0 +1,68 @@
+import pytest
+
+from db_core import heap_file
+from db_core.parallel_scan import ScanPool
+from db_core.stats import Stats
+from db_core.storage_manager import TableStorage
+from helpers import insert_range, rows, run
+
+COUNT = 20000
+
+
+@pytest.fixture
+def pool():
+    # A pool of two processes, whatever the machine has
+    workers = ScanPool.instance().workers
+    ScanPool.configure(2)
+    yield ScanPool.instance()
+    ScanPool.configure(workers)
+
+
+@pytest.fixture
+def table(session, monkeypatch):
+    # Small segments, so the table has many
+    monkeypatch.setattr(heap_file, "SEGMENT_PAGES", 4)
+    run(session, "CREATE TABLE t (id INT, v INT, s TEXT);")
+    insert_range(session, "t", COUNT, lambda i: f"({i}, {i % 10}, 's{i % 3}')", batch=2000)
+    run(session, "CHECKPOINT t;")
+    # Pending in the WAL, so the workers apply them
+    run(session, "UPDATE t SET v = 100 WHERE id < 50;")
+    run(session, "DELETE FROM t WHERE id >= 19990;")
+    return session
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT id, s FROM t WHERE v = 3",
+    "SELECT * FROM t WHERE v >= 9 LIMIT 30",
+    "SELECT s, COUNT(*), SUM(v), MAX(id) FROM t WHERE id > 10 GROUP BY s",
+    "SELECT COUNT(*), MIN(v) FROM t WHERE s = 's1'",
+])
+def test_parallel_scan_matches_sequential(table, pool, query, monkeypatch):
+    sequential = rows(table, f"{query} PARALLEL 1 NOCACHE;")
+    plan = rows(table, f"EXPLAIN {query};")
+    assert plan[1]["stage"] == "parallel_scan" and plan[1]["detail"].endswith("segments in 2 processes")
+    runs = []
+    scan = ScanPool.run
+    monkeypatch.setattr(ScanPool, "run", lambda self, tasks: runs.append(len(tasks)) or scan(self, tasks))
+    assert rows(table, f"{query} NOCACHE;") == sequential
+    assert runs == [2]
+
+
+def test_filtered_stream_is_not_collected(table, db_name, monkeypatch):
+    # However many segments the table has, a cursor's scan isn't split
+    # over processes, which would return every matching row at once
+    def collect(*args, **kwargs):
+        raise AssertionError("a stream ran a parallel scan")
+
+    monkeypatch.setattr(ScanPool.instance(), "workers", 4)
+    monkeypatch.setattr(ScanPool, "run", collect)
+    assert len(TableStorage.for_table(db_name, "t").segments()) > 2
+    run(table, "DECLARE c CURSOR FOR SELECT id FROM t WHERE v = 3;")
+    assert rows(table, "FETCH 4 FROM c;") == [{"id": i} for i in (53, 63, 73, 83)]
+    run(table, "CLOSE c;")
+    assert Stats.instance().table(db_name, "t")["rows_scanned"] < COUNT // 10
+
+    table.stream_rows = True
+    result = run(table, "SELECT id FROM t WHERE v = 3;")
+    assert next(result["data"]) == (53,)
+    result["data"].close()
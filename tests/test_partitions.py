@@ -0,0 +1,67 @@
+import pytest
+
+from db_core import partition_manager
+from db_core.partition_manager import PartitionRouter
+from helpers import in_new_process, insert_range, rows, run
+
+
+@pytest.fixture
+def table(session):
+    run(session, "CREATE TABLE p (id INT PRIMARY KEY, v INT) PARTITION BY HASH (id) PARTITIONS 3;")
+    run(session, "INSERT INTO p VALUES (1, 10), (2, 20), (3, 30), (4, 40);")
+    return session
+
+
+def by_id(result):
+    return sorted(result, key=lambda row: row["id"])
+
+
+def test_rows_and_keys_across_partitions(table, db_name):
+    assert table.route("INSERT INTO p VALUES (4, 1);") == {"error": "Primary key violation: '4' already exists."}
+    assert by_id(rows(table, "SELECT * FROM p;")) == [{"id": i, "v": i * 10} for i in range(1, 5)]
+    assert rows(table, "SELECT COUNT(*), SUM(v) FROM p WHERE v > 10;") == [{"COUNT(*)": 3, "SUM(v)": 90}]
+    run(table, "UPDATE p SET v = 0 WHERE id = 3;")
+    run(table, "DELETE FROM p WHERE v = 10;")
+    expected = [{"id": 2, "v": 20}, {"id": 3, "v": 0}, {"id": 4, "v": 40}]
+    assert by_id(rows(table, "SELECT * FROM p;")) == expected
+    run(table, "CHECKPOINT p;")
+    assert by_id(rows(table, "SELECT * FROM p NOCACHE;")) == expected
+    assert by_id(in_new_process(db_name, "SELECT * FROM p;")["data"]) == expected
+
+
+def test_key_lookup_reads_one_partition(table):
+    plan = rows(table, "EXPLAIN SELECT * FROM p WHERE id = 2;")
+    assert plan[0]["stage"] == "partitions" and plan[0]["detail"].endswith("of 3 by HASH(id)")
+    assert plan[0]["rows"] == 1
+    assert rows(table, "SELECT v FROM p WHERE id = 2;") == [{"v": 20}]
+
+
+def test_primary_key_must_be_partition_column(session):
+    result = session.route("CREATE TABLE q (id INT PRIMARY KEY, v INT) PARTITION BY HASH (v) PARTITIONS 2;")
+    assert result == {"error": "The primary key of a partitioned table must be its partition column 'v'."}
+
+
+def test_cursor_reads_batches(session, db_name, monkeypatch):
+    run(session, "CREATE TABLE p (id INT PRIMARY KEY, v INT) PARTITION BY HASH (id) PARTITIONS 3;")
+    insert_range(session, "p", 3000, lambda i: f"({i}, {i % 10})")
+    monkeypatch.setattr(partition_manager, "STREAM_BATCH", 50)
+    router = PartitionRouter.instance()
+    replies = []
+
+    def call(db, table, number, op, *args):
+        future = PartitionRouter.call(router, db, table, number, op, *args)
+        replies.append((op, future))
+        return future
+
+    monkeypatch.setattr(router, "call", call)
+    run(session, "DECLARE c CURSOR FOR SELECT id FROM p;")
+    assert len(rows(session, "FETCH 120 FROM c;")) == 120
+    sent = [len(future.result()["data"] if op == "open" else future.result())
+            for op, future in replies if op in ("open", "fetch")]
+    assert max(sent) <= 50 and sum(sent) <= 120 + 3 * 50
+    fetched = 120
+    while batch := rows(session, "FETCH 500 FROM c;"):
+        fetched += len(batch)
+    assert fetched == 3000
+    run(session, "CLOSE c;")
+    assert len(rows(session, "SELECT id FROM p LIMIT 10 OFFSET 2995;")) == 5
@@ -0,0 +1,59 @@
+import pytest
+
+from db_core.sql_lexer import SQLSyntaxError
+from db_core.sql_parser import bind, prepare
+from helpers import rows, run
+
+
+@pytest.fixture
+def table(session):
+    run(session, "CREATE TABLE t (id INT PRIMARY KEY, s TEXT);")
+    run(session, "PREPARE ins AS INSERT INTO t VALUES (?, ?);")
+    run(session, "EXECUTE ins (1, 'a');")
+    run(session, "EXECUTE ins (2, 'it''s');")
+    assert "error" not in session.execute("ins", (3, "a;b"))
+    return session
+
+
+def test_execute_binds_values(table):
+    run(table, "PREPARE q AS SELECT * FROM t WHERE id >= ? LIMIT ?;")
+    assert rows(table, "EXECUTE q (1, 1);") == [{"id": 1, "s": "a"}]
+    assert rows(table, "EXECUTE q (2, 5);") == [{"id": 2, "s": "it's"}, {"id": 3, "s": "a;b"}]
+    run(table, "PREPARE u AS UPDATE t SET s = ? WHERE id = ?;")
+    run(table, "EXECUTE u ('z', 1);")
+    run(table, "PREPARE d AS DELETE FROM t WHERE s = ?;")
+    run(table, "EXECUTE d ('a;b');")
+    assert rows(table, "SELECT * FROM t;") == [{"id": 1, "s": "z"}, {"id": 2, "s": "it's"}]
+
+
+def test_args_are_values_not_sql(table):
+    # Bound as typed values, never spliced into the statement text
+    result = table.execute("ins", (4, "x'); DROP TABLE t; --"))
+    assert "error" not in result
+    assert rows(table, "SELECT s FROM t WHERE id = 4;") == [{"s": "x'); DROP TABLE t; --"}]
+    run(table, "PREPARE q AS SELECT id FROM t WHERE s = ?;")
+    assert table.execute("q", ("' OR 1 = 1 --",))["data"] == []
+
+
+def test_deallocate(table):
+    run(table, "PREPARE q AS SELECT * FROM t;")
+    assert table.route("PREPARE q AS SELECT * FROM t;") == {"error": "Prepared statement 'q' already exists."}
+    run(table, "DEALLOCATE q;")
+    assert table.route("EXECUTE q;") == {"error": "Prepared statement 'q' does not exist."}
+    run(table, "DEALLOCATE ALL;")
+    assert table.route("EXECUTE ins (5, 'e');") == {"error": "Prepared statement 'ins' does not exist."}
+
+
+def test_wrong_argument_count(table):
+    assert table.route("EXECUTE ins (3);") == {"error": "Prepared statement 'ins' takes 2 parameter(s), got 1"}
+
+
+def test_bind():
+    prepared = prepare("SELECT * FROM t WHERE id = ? AND s LIKE ? LIMIT ?")
+    assert prepared is prepare("SELECT * FROM t WHERE id = ? AND s LIKE ? LIMIT ?")
+    statement = bind(prepared, (1, "a%", 3))
+    assert statement.where.text == "id = 1 AND s LIKE 'a%'" and statement.limit == 3
+    with pytest.raises(SQLSyntaxError):
+        bind(prepared, (1, "a%", -1))
+    with pytest.raises(SQLSyntaxError):
+        bind(prepared, (float("nan"), "a%", 1))
@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+from db_core.parser import Parser
+from db_core.primary_key_manager import PrimaryKeyManager
+from helpers import in_new_process, rows, run
+
+
+@pytest.fixture
+def table(session):
+    run(session, "CREATE TABLE t (id INT PRIMARY KEY, name TEXT);")
+    run(session, "INSERT INTO t VALUES (1, 'a'), (2, 'b'), (3, 'c');")
+    return session
+
+
+def test_insert_rejects_existing_key(table):
+    assert table.route("INSERT INTO t VALUES (2, 'x');") == {"error": "Primary key violation: '2' already exists."}
+    assert rows(table, "SELECT name FROM t WHERE id = 2;") == [{"name": "b"}]
+
+
+def test_insert_rejects_key_repeated_in_statement(table):
+    result = table.route("INSERT INTO t VALUES (7, 'x'), (7, 'y');")
+    assert result == {"error": "Primary key violation: '7' appears more than once."}
+    assert rows(table, "SELECT * FROM t WHERE id = 7;") == []
+
+
+def test_insert_rejects_null_key(table):
+    assert table.route("INSERT INTO t VALUES (NULL, 'x');") == {"error": "Primary key 'id' cannot be null."}
+
+
+def test_update_rejects_existing_key(table):
+    assert table.route("UPDATE t SET id = 3 WHERE id = 1;") == {"error": "Primary key violation: '3' already exists."}
+    assert rows(table, "SELECT id FROM t;") == [{"id": 1}, {"id": 2}, {"id": 3}]
+
+
+def test_update_rejects_one_key_for_several_rows(table):
+    result = table.route("UPDATE t SET id = 9 WHERE id > 1;")
+    assert result == {"error": "Primary key violation: '9' appears more than once."}
+    assert rows(table, "SELECT * FROM t WHERE id = 9;") == []
+
+
+def test_update_moves_key(table):
+    run(table, "UPDATE t SET id = 10 WHERE id = 1;")
+    assert table.route("INSERT INTO t VALUES (10, 'x');")["error"] == "Primary key violation: '10' already exists."
+    run(table, "INSERT INTO t VALUES (1, 'again');")
+    assert rows(table, "SELECT name FROM t WHERE id = 10;") == [{"name": "a"}]
+
+
+def test_delete_frees_keys(table):
+    run(table, "DELETE FROM t WHERE name = 'b';")
+    run(table, "INSERT INTO t VALUES (2, 'new');")
+    assert table.route("INSERT INTO t VALUES (3, 'x');")["error"] == "Primary key violation: '3' already exists."
+
+
+def test_keys_survive_checkpoint_and_restart(table, db_name):
+    run(table, "UPDATE t SET id = 4 WHERE id = 3;")
+    run(table, "CHECKPOINT t;")
+    run(table, "INSERT INTO t VALUES (5, 'e');")
+    result = in_new_process(db_name, "INSERT INTO t VALUES (4, 'x');")
+    assert result == {"error": "Primary key violation: '4' already exists."}
+    assert "success" in in_new_process(db_name, "INSERT INTO t VALUES (3, 'x');")
+
+
+
+@pytest.mark.parametrize("meanwhile, left, freed", [
+    ("INSERT INTO t VALUES (4, 'a'), (5, 'z');", [2, 3, 5], [1, 4]),
+    ("UPDATE t SET name = 'a' WHERE id = 2;", [3], [1, 2]),
+])
+def test_delete_scan_does_not_hold_up_writes(table, db_name, monkeypatch, meanwhile, left, freed):
+    # The DELETE looks its keys up without the table lock; the rows it
+    # matches after a write logged meanwhile are deleted and their keys freed
+    scanning, go = threading.Event(), threading.Event()
+    scan = PrimaryKeyManager.matching_keys
+
+    def slow_scan(self, *args):
+        keys = scan(self, *args)
+        if not scanning.is_set():
+            scanning.set()
+            go.wait(10)
+        return keys
+
+    monkeypatch.setattr(PrimaryKeyManager, "matching_keys", slow_scan)
+    deleter = Parser()
+    run(deleter, f"USE {db_name};")
+    results = []
+    thread = threading.Thread(target=lambda: results.append(deleter.route("DELETE FROM t WHERE name = 'a';")))
+    thread.start()
+    try:
+        assert scanning.wait(10)
+        run(table, meanwhile)
+        assert not go.is_set() and thread.is_alive()
+    finally:
+        go.set()
+        thread.join()
+        deleter.close()
+    assert "success" in results[0]
+    assert rows(table, "SELECT id FROM t;") == [{"id": key} for key in left]
+    run(table, "INSERT INTO t VALUES " + ", ".join(f"({key}, 'x')" for key in freed) + ";")
+    assert "already exists" in table.route(f"INSERT INTO t VALUES ({left[-1]}, 'q');")["error"]
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from server.client import Connection, QueryError
+from server.protocol import (COMPLETE, HEADER, MAX_MESSAGE, QUERY, ROW_BATCH, ROW_DESCRIPTION, BatchEncoder,
+                             BinarySession, FrameBuffer, ProtocolError, decode_batch, decode_description,
+                             encode_description, frame)
+from helpers import async_server, run, threaded_server
+
+
+def test_frame_layout():
+    assert frame(QUERY, b"SELECT 1") == b"Q\x00\x00\x00\x08SELECT 1"
+    assert frame(COMPLETE) == b"C\x00\x00\x00\x00"
+
+
+def test_frame_buffer_waits_for_whole_frames():
+    data = frame(QUERY, b"abc") + frame(COMPLETE, b"{}") + frame(ROW_BATCH, b"x" * 10)
+    frames = FrameBuffer()
+    received = []
+    for i in range(len(data)):
+        frames.feed(data[i:i + 1])
+        message = frames.next_frame()
+        while message is not None:
+            received.append(message)
+            message = frames.next_frame()
+    assert received == [(QUERY, b"abc"), (COMPLETE, b"{}"), (ROW_BATCH, b"x" * 10)]
+    assert len(frames) == 0
+
+
+def test_frame_buffer_lines_then_frames():
+    frames = FrameBuffer()
+    frames.feed(b"welcome\n" + frame(QUERY, b"q")[:3])
+    assert frames.read_line() == b"welcome"
+    assert frames.next_frame() is None
+    frames.feed(frame(QUERY, b"q")[3:])
+    assert frames.next_frame() == (QUERY, b"q")
+
+
+def test_frame_buffer_rejects_oversized_message():
+    frames = FrameBuffer()
+    frames.feed(HEADER.pack(QUERY, MAX_MESSAGE + 1))
+    with pytest.raises(ProtocolError):
+        frames.next_frame()
+
+
+def test_batch_round_trip():
+    description = [("id", "INT"), ("score", "FLOAT"), ("name", "TEXT"), ("ok", "BOOL")]
+    rows = [(1, 1.5, "a", True), (None, None, None, None), (-2 ** 63, -0.25, "żółw", False), (7, 2.0, "", True)]
+    assert decode_description(encode_description(description)) == description
+    payload = BatchEncoder(description).encode(rows)
+    assert decode_batch(payload, [col_type for _, col_type in description]) == rows
+    assert decode_batch(BatchEncoder(description).encode([]), ["INT", "FLOAT", "TEXT", "BOOL"]) == []
+
+
+def test_session_sends_rows_in_batches(session):
+    run(session, "CREATE TABLE t (id INT, name TEXT);")
+    run(session, "INSERT INTO t VALUES " + ", ".join(f"({i}, 'n{i}')" for i in range(5)) + ";")
+    sent = []
+    binary = BinarySession(session, sent.append, batch_rows=2)
+    binary.run("SELECT * FROM t")
+    frames = FrameBuffer()
+    frames.feed(b"".join(sent) + binary.take())
+    messages = []
+    while (message := frames.next_frame()) is not None:
+        messages.append(message)
+    assert [kind for kind, _ in messages] == [ROW_DESCRIPTION, ROW_BATCH, ROW_BATCH, ROW_BATCH, COMPLETE]
+    description = decode_description(messages[0][1])
+    assert description == [("id", "INT"), ("name", "TEXT")]
+    rows = [row for _, payload in messages[1:4] for row in decode_batch(payload, ["INT", "TEXT"])]
+    assert rows == [(i, f"n{i}") for i in range(5)]
+    assert json.loads(messages[-1][1])["rows"] == 5
+
+
+@pytest.fixture(params=["threaded", "asyncio"])
+def server(request):
+    with (threaded_server() if request.param == "threaded" else async_server()) as address:
+        yield address
+
+
+def test_binary_connection(server, db_name):
+    with Connection(*server, binary=True) as conn:
+        assert conn.execute(f"CREATE DATABASE {db_name}")["success"]
+        conn.execute(f"USE {db_name}")
+        conn.execute("CREATE TABLE t (id INT, score FLOAT)")
+        # Pipelined: the replies come back in order
+        for i in range(3):
+            conn.send(f"INSERT INTO t VALUES ({i}, {i / 2})")
+        for _ in range(3):
+            assert "success" in conn.execute()
+        assert list(conn.stream("SELECT * FROM t")) == [(0, 0.0), (1, 0.5), (2, 1.0)]
+        assert conn.description == [("id", "INT"), ("score", "FLOAT")]
+        with pytest.raises(QueryError):
+            list(conn.stream("SELECT * FROM nope"))
+        # A stream left unread is skipped past
+        rows = conn.stream("SELECT * FROM t")
+        next(rows)
+        rows.close()
+        assert conn.execute("SELECT COUNT(*) FROM t")["data"] == [{"COUNT(*)": 3}]
+
@@ -0,0 +1,79 @@
+import pytest
+
+from db_core.result_cache import ResultCache
+from helpers import rows, run
+
+QUERY = "SELECT id, v FROM t WHERE v > 0;"
+
+
+@pytest.fixture
+def cache():
+    cache = ResultCache.instance()
+    budget = cache.max_bytes
+    cache.configure(8 * 1024 * 1024)
+    yield cache
+    cache.configure(budget)
+    cache.clear()
+
+
+@pytest.fixture
+def table(session, cache):
+    run(session, "CREATE TABLE t (id INT PRIMARY KEY, v INT);")
+    run(session, "INSERT INTO t VALUES (1, 10), (2, 20), (3, 0);")
+    return session
+
+
+def hits(cache):
+    return cache.stats()["hits"]
+
+
+def test_repeated_select_is_a_hit(table, cache):
+    first = rows(table, QUERY)
+    before = hits(cache)
+    assert rows(table, "select id, v from t where v > 0;") == first
+    assert hits(cache) == before + 1
+    rows(table, QUERY.replace(";", " NOCACHE;"))
+    assert hits(cache) == before + 1
+
+
+@pytest.mark.parametrize("write, expected", [
+    ("INSERT INTO t VALUES (4, 40);", [(1, 10), (2, 20), (4, 40)]),
+    ("UPDATE t SET v = 5 WHERE id = 3;", [(1, 10), (2, 20), (3, 5)]),
+    ("DELETE FROM t WHERE id = 1;", [(2, 20)]),
+    ("COPY t FROM '{csv}' FORMAT CSV;", [(1, 10), (2, 20), (9, 90)]),
+])
+def test_write_invalidates(table, cache, tmp_path, write, expected):
+    csv = tmp_path / "rows.csv"
+    csv.write_text("9,90\n")
+    rows(table, QUERY)
+    before = hits(cache)
+    run(table, write.format(csv=csv))
+    assert [(row["id"], row["v"]) for row in rows(table, QUERY)] == expected
+    assert hits(cache) == before
+    rows(table, QUERY)
+    assert hits(cache) == before + 1
+
+
+def test_checkpoint_and_other_tables(table, cache):
+    run(table, "CREATE TABLE u (id INT);")
+    rows(table, QUERY)
+    rows(table, "SELECT * FROM u;")
+    run(table, "INSERT INTO u VALUES (1);")
+    before = hits(cache)
+    rows(table, QUERY)
+    assert hits(cache) == before + 1
+    assert rows(table, "SELECT * FROM u;") == [{"id": 1}]
+    run(table, "CHECKPOINT t;")
+    rows(table, QUERY)
+    assert hits(cache) == before + 1
+
+
+def test_join_invalidated_by_either_table(table, cache):
+    run(table, "CREATE TABLE u (tid INT, tag TEXT);")
+    run(table, "INSERT INTO u VALUES (1, 'a');")
+    join = "SELECT t.id, u.tag FROM t JOIN u ON t.id = u.tid;"
+    assert rows(table, join) == [{"t.id": 1, "u.tag": "a"}]
+    run(table, "INSERT INTO u VALUES (2, 'b');")
+    assert rows(table, join) == [{"t.id": 1, "u.tag": "a"}, {"t.id": 2, "u.tag": "b"}]
+    run(table, "DELETE FROM t WHERE id = 1;")
+    assert rows(table, join) == [{"t.id": 2, "u.tag": "b"}]
@@ -0,0 +1,46 @@
+from array import array
+
+from db_core.rows import ColumnBatch, as_dicts, projector
+from helpers import rows, run
+
+
+def test_projector():
+    row = (1, "a", 2.5)
+    assert projector(["id", "s", "f"], ["f", "id"])(row) == (2.5, 1)
+    assert projector(["id", "s", "f"], ["s"])(row) == ("a",)
+    assert projector(["id", "s", "f"], [])(row) == ()
+
+
+def test_as_dicts():
+    assert as_dicts(["id", "s"], [(1, "a"), (2, None)]) == [{"id": 1, "s": "a"}, {"id": 2, "s": None}]
+    assert as_dicts(["it's"], [(1,)]) == [{"it's": 1}]
+
+
+def test_column_batch():
+    batch = ColumnBatch([(1, 2.5, "a"), (None, 1.0, None), (3, None, "c")], [0, 1, 2], ["INT", "FLOAT", "TEXT"])
+    assert batch.size == 3
+    assert batch.values(0) == array("q", [1, 0, 3]) and batch.nulls(0) == b"\x00\x01\x00"
+    assert batch.present(1) == [2.5, 1.0]
+    assert batch.values(2) == ["a", None, "c"]
+    assert ColumnBatch([(1,), (2,)], [0], ["INT"]).nulls(0) is None
+
+
+def test_results_follow_the_select_list(session):
+    run(session, "CREATE TABLE t (id INT, s TEXT, f FLOAT);")
+    run(session, "INSERT INTO t VALUES (1, 'a', 0.5), (2, 'b', 1.5);")
+    assert rows(session, "SELECT f, id FROM t;") == [{"f": 0.5, "id": 1}, {"f": 1.5, "id": 2}]
+    session.stream_rows = True
+    result = run(session, "SELECT s, id FROM t WHERE f > 1;")
+    assert result["columns"] == [("s", "TEXT"), ("id", "INT")]
+    assert list(result["data"]) == [("b", 2)]
+
+
+def test_unknown_column_is_an_error(session):
+    run(session, "CREATE TABLE t (id INT, s TEXT);")
+    run(session, "CREATE TABLE u (id INT, n INT);")
+    run(session, "INSERT INTO t VALUES (1, 'a');")
+    run(session, "INSERT INTO u VALUES (1, 2);")
+    run(session, "CREATE TABLE p (id INT) PARTITION BY HASH (id) PARTITIONS 2;")
+    for sql in ("SELECT nope FROM p;", "SELECT id, nope FROM t;", "EXPLAIN SELECT nope FROM t;", "DECLARE c CURSOR FOR SELECT nope FROM t;",
+                "SELECT nope FROM t JOIN u ON t.id = u.id;"):
+        assert session.route(sql) == {"error": "Column 'nope' does not exist"}
@@ -0,0 +1,46 @@
+import pytest
+
+from server.client import Connection
+from helpers import async_server, threaded_server
+
+
+@pytest.fixture(params=["threaded", "asyncio"])
+def server(request):
+    with (threaded_server() if request.param == "threaded" else async_server()) as address:
+        yield address
+
+
+def test_pipelined_replies_come_back_in_order(server, db_name):
+    with Connection(*server) as conn:
+        conn.send(f"CREATE DATABASE {db_name}; USE {db_name}; CREATE TABLE t (id INT PRIMARY KEY);")
+        for _ in range(3):
+            assert "success" in conn.execute()
+        for i in range(50):
+            conn.send(f"INSERT INTO t VALUES ({i % 40})")
+        replies = [conn.execute() for _ in range(50)]
+        assert all("success" in reply for reply in replies[:40])
+        assert all("error" in reply for reply in replies[40:])
+        conn.send("SELECT COUNT(*) FROM t; SELECT id FROM t WHERE id = 39;")
+        assert conn.execute()["data"] == [{"COUNT(*)": 40}]
+        assert conn.execute()["data"] == [{"id": 39}]
+
+
+def test_statements_split_outside_strings(server, db_name):
+    with Connection(*server) as conn:
+        conn.send(f"CREATE DATABASE {db_name}; USE {db_name}; CREATE TABLE t (s TEXT); INSERT INTO t VALUES ('a;")
+        for _ in range(3):
+            assert "success" in conn.execute()
+        conn.send("b'); SELECT * FROM t")
+        assert "success" in conn.execute()
+        assert conn.execute()["data"] == [{"s": "a;b"}]
+
+
+def test_sessions_are_separate(server, db_name):
+    with Connection(*server) as first, Connection(*server) as second:
+        first.execute(f"CREATE DATABASE {db_name}")
+        first.execute(f"USE {db_name}")
+        first.execute("CREATE TABLE t (id INT)")
+        assert second.execute("SELECT * FROM t")["error"].startswith("No active database")
+        first.execute("INSERT INTO t VALUES (1)")
+        second.execute(f"USE {db_name}")
+        assert second.execute("SELECT * FROM t")["data"] == [{"id": 1}]
@@ -0,0 +1,78 @@
+import pytest
+
+from db_core.sql_lexer import SQLSyntaxError, split_statements, tokenize
+from db_core.sql_parser import Insert, Select, Update, parse
+from db_core.where_clause import Aggregate
+from helpers import rows, run
+
+
+def test_tokenize():
+    tokens = tokenize("SELECT a, t.b FROM t WHERE x >= -1.5e3 AND s = 'it''s' OR n IS NULL")
+    assert [(kind, value) for kind, value, _ in tokens] == [
+        ("word", "SELECT"), ("word", "a"), ("op", ","), ("word", "t.b"), ("word", "FROM"), ("word", "t"),
+        ("word", "WHERE"), ("word", "x"), ("op", ">="), ("literal", -1500.0), ("keyword", "AND"),
+        ("word", "s"), ("op", "="), ("literal", "it's"), ("keyword", "OR"), ("word", "n"),
+        ("keyword", "IS"), ("keyword", "NULL")]
+
+
+def test_parse_select():
+    statement = parse("select id, count(*) from t where id in (1, 2) group by id limit 5 offset 2;")
+    assert isinstance(statement, Select)
+    assert statement.table == "t" and statement.columns == ["id", Aggregate("COUNT(*)", "COUNT", None)]
+    assert statement.where.text == "id in ( 1 , 2 )"
+    assert (statement.group_by, statement.limit, statement.offset) == (["id"], 5, 2)
+
+
+def test_parse_insert_values():
+    statement = parse("INSERT INTO t VALUES (1, NULL, TRUE), (-2, 'x', false), (3.5, 'a;b', 'null')")
+    assert statement == Insert("t", [[1, None, True], [-2, "x", False], [3.5, "a;b", "null"]])
+
+
+def test_qualified_names_without_join():
+    statement = parse("SELECT t.id, SUM(t.n) FROM t WHERE t.id > 1 AND t.s = 't.x' GROUP BY t.id")
+    assert statement.columns == ["id", Aggregate("SUM(n)", "SUM", "n")]
+    assert (statement.where.text, statement.group_by) == ("id > 1 AND s = 't.x'", ["id"])
+    statement = parse("SELECT a.id, t.id FROM t AS a WHERE a.id = 1")
+    assert (statement.alias, statement.columns, statement.where.text) == ("a", ["id", "t.id"], "id = 1")
+
+
+def test_qualified_select(session):
+    run(session, "CREATE TABLE t (id INT, s TEXT);")
+    run(session, "INSERT INTO t VALUES (1, 'a'), (2, 'b');")
+    assert rows(session, "SELECT t.s FROM t WHERE t.id = 2;") == [{"s": "b"}]
+    assert rows(session, "SELECT x.id FROM t x WHERE x.s = 'a';") == [{"id": 1}]
+    assert session.route("SELECT * FROM t ORDER BY id;") == {"error": "Syntax error: ORDER BY is not supported"}
+
+
+def test_keywords_are_names_where_the_grammar_allows():
+    statement = parse("UPDATE t SET set = 1 WHERE index = 2")
+    assert isinstance(statement, Update)
+    assert (statement.column, statement.value, statement.where.text) == ("set", 1, "index = 2")
+
+
+def test_statements_are_parsed_once():
+    assert parse("SELECT * FROM t WHERE id = 1") is parse("  SELECT  *  FROM t WHERE id = 1 ")
+
+
+@pytest.mark.parametrize("sql, error", [
+    ("SELEC * FROM t", "Unsupported or invalid command"),
+    ("SELECT * FROM", "Expected a name but the statement ended"),
+    ("INSERT INTO t VALUES (1", "Expected ',' or ')' but the statement ended"),
+    ("SELECT * FROM t LIMIT -1", "LIMIT must be a non-negative integer"),
+    ("SELECT * FROM t WHERE s = 'x", "Unterminated string literal"),
+    ("SELECT * FROM t ORDER BY id", "ORDER BY is not supported"),
+    ("SELECT * FROM t WHERE id > 1 ORDER BY id LIMIT 2", "ORDER BY is not supported"),
+])
+def test_syntax_errors(sql, error):
+    with pytest.raises(SQLSyntaxError) as raised:
+        parse(sql)
+    assert str(raised.value) == error
+
+
+def test_syntax_error_result(session):
+    assert session.route("SELECT * FROM;") == {"error": "Syntax error: Expected a name but the statement ended"}
+
+
+def test_split_statements():
+    assert split_statements("INSERT INTO t VALUES ('a;b', \"c;\"); SELECT 1;  ;") == [
+        "INSERT INTO t VALUES ('a;b', \"c;\")", "SELECT 1"]
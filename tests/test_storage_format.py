@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from db_core.catalog import DATA_DIR
+from db_core.storage_manager import RowCodec
+from helpers import in_new_process, rows, run
+
+COLUMNS = [{"name": "id", "type": "INT"}, {"name": "f", "type": "FLOAT"},
+           {"name": "s", "type": "TEXT"}, {"name": "b", "type": "BOOL"}]
+ROWS = [(1, 1.5, "żółw", True), (2, None, None, None), (-2 ** 63, -0.25, "", False), (2 ** 63 - 1, 0.0, "x" * 500, True)]
+EXPECTED = [dict(zip(("id", "f", "s", "b"), row)) for row in ROWS]
+
+
+def test_codec_round_trip():
+    codec = RowCodec(COLUMNS)
+    heap = bytearray()
+    records = b""
+    for row in ROWS:
+        record, text = codec.encode(row, len(heap))
+        assert len(record) == codec.record_size
+        records += record
+        heap += text
+    assert codec.decode_many(records, bytes(heap)) == ROWS
+
+
+@pytest.fixture
+def table(session):
+    run(session, "CREATE TABLE t (id INT PRIMARY KEY, f FLOAT, s TEXT, b BOOL);")
+    values = ", ".join("(" + ", ".join("NULL" if v is None else repr(v) if isinstance(v, str) else str(v).upper()
+                                       for v in row) + ")" for row in ROWS)
+    run(session, f"INSERT INTO t VALUES {values};")
+    return session
+
+
+def test_values_survive_checkpoint_and_restart(table, db_name):
+    assert rows(table, "SELECT * FROM t;") == EXPECTED
+    run(table, "CHECKPOINT t;")
+    assert rows(table, "SELECT * FROM t NOCACHE;") == EXPECTED
+    assert in_new_process(db_name, "SELECT * FROM t;")["data"] == EXPECTED
+    files = {path.name for path in (DATA_DIR / db_name / "t").iterdir()}
+    assert {"data.pages", "data.strings"} <= files and "data.json" not in files
+
+
+def test_json_table_is_migrated(table, db_name):
+    # A table written by the JSON storage is converted the first time it
+    # is opened, and the original kept beside it
+    path = DATA_DIR / db_name / "t"
+    for name in ("data.pages", "data.strings", "data.zones", "log.wal", "pk.idx"):
+        (path / name).unlink(missing_ok=True)
+    (path / "log.wal").write_text("")
+    (path / "data.json").write_text(json.dumps([{"id": 5, "f": 2.5, "s": "old", "b": False}], indent=4))
+    assert in_new_process(db_name, "SELECT * FROM t;")["data"] == [{"id": 5, "f": 2.5, "s": "old", "b": False}]
+    assert (path / "data.json.migrated").exists() and not (path / "data.json").exists()
+
+
+def heap_bytes(db_name):
+    # What the string heap's generations take on disk
+    return sum(path.stat().st_size for path in (DATA_DIR / db_name / "h").glob("data*.strings*"))
+
+
+def test_string_heap_stays_bounded(session, db_name):
+    run(session, "CREATE TABLE h (id INT, n INT, s TEXT);")
+    run(session, "INSERT INTO h VALUES " + ", ".join(f"({i}, 0, '{'x' * 200}{i}')" for i in range(1000)) + ";")
+    run(session, "CHECKPOINT h;")
+    loaded = heap_bytes(db_name)
+    # Unchanged TEXT values keep their bytes
+    for n in range(1, 6):
+        run(session, f"UPDATE h SET n = {n} WHERE id >= 0;")
+        run(session, "CHECKPOINT h;")
+    assert heap_bytes(db_name) == loaded
+    # Replaced ones are dropped once they are most of the heap
+    for n in range(3):
+        run(session, f"UPDATE h SET s = '{'y' * 200}{n}' WHERE id < 500;")
+        run(session, "CHECKPOINT h;")
+    assert heap_bytes(db_name) < 2 * loaded
+    expected = [{"id": 0, "n": 5, "s": "y" * 200 + "2"}, {"id": 999, "n": 5, "s": "x" * 200 + "999"}]
+    assert rows(session, "SELECT * FROM h WHERE id = 0 OR id = 999 NOCACHE;") == expected
+    assert in_new_process(db_name, "SELECT * FROM h WHERE id = 0 OR id = 999;")["data"] == expected
+    run(session, "DELETE FROM h WHERE id >= 0;")
+    run(session, "CHECKPOINT h;")
+    assert heap_bytes(db_name) == 0
+    run(session, "INSERT INTO h VALUES (1, 1, 'again');")
+    run(session, "CHECKPOINT h;")
+    assert in_new_process(db_name, "SELECT s FROM h;")["data"] == [{"s": "again"}]
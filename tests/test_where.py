@@ -0,0 +1,60 @@
+import pytest
+
+from db_core.where_clause import WhereClause, WhereError
+from helpers import rows, run
+
+TYPES = {"id": "INT", "name": "TEXT", "score": "FLOAT"}
+ROWS = [(1, "ann", 1.5), (2, "bob", None), (3, "cy", 3.0), (4, None, 4.5)]
+
+
+def matching(text):
+    return [row[0] for row in WhereClause.compile(text, TYPES).filter(ROWS)]
+
+
+@pytest.mark.parametrize("text, ids", [
+    ("id = 2", [2]),
+    ("id != 2", [1, 3, 4]),
+    ("id >= 3", [3, 4]),
+    ("3 > id", [1, 2]),
+    ("id = 1 OR id = 3 AND name = 'bob'", [1]),
+    ("(id = 1 OR id = 3) AND name = 'cy'", [3]),
+    ("NOT id = 1 AND NOT (id = 2 OR id = 3)", [4]),
+    ("id IN (1, 4, 9)", [1, 4]),
+    ("id NOT IN (1, 4)", [2, 3]),
+    ("id NOT IN (1, NULL)", []),
+    ("id BETWEEN 2 AND 3", [2, 3]),
+    ("id NOT BETWEEN 2 AND 3", [1, 4]),
+    ("name LIKE '%n%'", [1]),
+    ("name LIKE '_o_'", [2]),
+    ("name NOT LIKE 'c%'", [1, 2]),
+    ("score IS NULL", [2]),
+    ("name IS NOT NULL AND score > 1", [1, 3]),
+    ("score = NULL", []),
+    ("NOT score > 2", [1]),
+    ("id = 2.0", [2]),
+])
+def test_where(text, ids):
+    assert matching(text) == ids
+
+
+@pytest.mark.parametrize("text", [
+    "id =",
+    "id = 1 AND",
+    "(id = 1",
+    "id IN ()",
+    "id BETWEEN 1",
+    "nope = 1",
+    "name IS 1",
+])
+def test_where_errors(text):
+    with pytest.raises(WhereError):
+        WhereClause.compile(text, TYPES)
+
+
+def test_where_in_statement(session):
+    run(session, "CREATE TABLE t (id INT, name TEXT);")
+    run(session, "INSERT INTO t VALUES (1, 'a;b'), (2, 'it''s'), (3, NULL);")
+    assert rows(session, "SELECT id FROM t WHERE name = 'a;b' OR name = 'it''s';") == [{"id": 1}, {"id": 2}]
+    assert rows(session, "SELECT id FROM t where name is null;") == [{"id": 3}]
+    assert session.route("SELECT * FROM t WHERE nope = 1;") == {
+        "error": "Invalid WHERE clause: Column 'nope' does not exist"}
@@ -0,0 +1,80 @@
+import pytest
+
+from db_core.catalog import DATA_DIR
+from db_core.stats import Stats
+from db_core.storage_manager import ZoneMap
+from db_core.where_clause import WhereClause
+from helpers import in_new_process, insert_range, rows, run
+
+COUNT = 60000
+
+
+def skipped(db_name, table):
+    return Stats.instance().table(db_name, table)["blocks_skipped"]
+
+
+def test_zone_map_bounds():
+    zones = ZoneMap(["n", "s"], ["INT", "TEXT"], block_pages=2)
+    zones.add(0, (5, "m"))
+    zones.add(1, (1, None))
+    zones.add(2, (9, "x" * 40))
+    assert zones.blocks[0] == [[1, 5, 0], ["m", "m", 1]]
+    assert zones.blocks[1][1][0] == "x" * 32
+    where = WhereClause.compile("n < 3", {"n": "INT", "s": "TEXT"})
+    assert zones.prune([(0, 4)], where) == ([(0, 2)], 1, 2)
+
+
+def create(session, compression=None):
+    run(session, "CREATE TABLE z (ts INT, s TEXT)" + (f" COMPRESSION {compression};" if compression else ";"))
+    insert_range(session, "z", COUNT, lambda i: f"({i}, 'row {i}')", batch=10000)
+    run(session, "CHECKPOINT z;")
+    return session
+
+
+@pytest.fixture
+def table(session):
+    return create(session)
+
+
+def test_blocks_are_skipped(table, db_name):
+    expected = [{"ts": i, "s": f"row {i}"} for i in range(100, 110)]
+    assert rows(table, "SELECT * FROM z WHERE ts >= 100 AND ts < 110 NOCACHE;") == expected
+    assert skipped(db_name, "z") > 0
+    plan = rows(table, "EXPLAIN SELECT * FROM z WHERE ts < 100;")
+    assert plan[1]["stage"] == "seq_scan" and "blocks by zone maps" in plan[1]["detail"]
+    assert in_new_process(db_name, "SELECT * FROM z WHERE ts >= 100 AND ts < 110;")["data"] == expected
+
+
+@pytest.mark.parametrize("compression", ["zlib", "lzma"])
+def test_compressed_segments(session, db_name, compression):
+    table = create(session, compression)
+    path = DATA_DIR / db_name / "z"
+    frozen = sorted(path.glob("*.z"))
+    assert frozen
+    # A change to a frozen segment thaws it, and the next checkpoint
+    # freezes it again
+    run(table, "UPDATE z SET s = 'changed' WHERE ts = 5;")
+    run(table, "DELETE FROM z WHERE ts = 6;")
+    run(table, "CHECKPOINT z;")
+    assert sorted(path.glob("*.z")) == frozen
+    assert rows(table, "SELECT * FROM z WHERE ts >= 4 AND ts < 8 NOCACHE;") == [
+        {"ts": 4, "s": "row 4"}, {"ts": 5, "s": "changed"}, {"ts": 7, "s": "row 7"}]
+    assert rows(table, "SELECT COUNT(*) FROM z NOCACHE;") == [{"COUNT(*)": COUNT - 1}]
+
+
+def test_lost_zone_map_is_rebuilt(table, db_name):
+    (DATA_DIR / db_name / "z" / "data.zones").unlink()
+    result = in_new_process(db_name, "EXPLAIN SELECT * FROM z WHERE ts < 100;")["data"]
+    assert "blocks by zone maps" in result[1]["detail"]
+
+
+def test_zones_narrow_when_rows_change(table, db_name):
+    # Each block's zone is recomputed once its rows are updated or deleted:
+    # only the first block still holds a row with ts > 0
+    run(table, "UPDATE z SET ts = 0 WHERE ts >= 100;")
+    run(table, "DELETE FROM z WHERE ts < 50;")
+    run(table, "CHECKPOINT z;")
+    plan = rows(table, "EXPLAIN SELECT * FROM z WHERE ts > 0;")
+    assert plan[1]["detail"].startswith("z: 1 of ")
+    assert rows(table, "SELECT COUNT(*) FROM z WHERE ts > 0 NOCACHE;") == [{"COUNT(*)": 50}]
+    assert in_new_process(db_name, "EXPLAIN SELECT * FROM z WHERE ts > 0;")["data"][1]["detail"] == plan[1]["detail"]